@@ -0,0 +1,84 @@
+"""Benchmark end-to-end pick throughput and latency with a timed mock loom.
+
+The mock loom weaves automatically, as fast as it can, with a realistic
+timing model: 9600 baud transmission in each direction and configurable
+shed open and close durations. Report the pick rate and the pick request
+latency seen by the loom: the time from the loom sending its =s pick
+request to receiving the resulting =C command.
+
+Run with: python benchmarks/bench_auto_weave.py
+"""
+
+import asyncio
+import dataclasses
+import math
+import pathlib
+import tempfile
+
+from seguin_loom_server.loom_server import LoomServer
+from seguin_loom_server.mock_loom import MockLoomTiming
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+DATADIR = pathlib.Path(__file__).parent.parent / "tests" / "data"
+
+# Duration of each run (sec)
+RUN_DURATION = 5
+
+# Shed open/close durations (sec) to benchmark
+SHED_DURATIONS = (0, 0.01, 0.1)
+
+# Number of times to repeat the picks of the test pattern.
+# The server sends no =C command when it advances to the next repeat,
+# so the loom waits for its pick request timeout; a long pattern
+# keeps that out of the measurement.
+NUM_PICK_REPEATS = 1000
+
+
+async def bench_auto_weave(shed_duration: float) -> None:
+    timing = MockLoomTiming(
+        shed_open_duration=shed_duration,
+        shed_close_duration=shed_duration,
+        auto_weave_rate=math.inf,
+    )
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    pattern = dataclasses.replace(pattern, picks=pattern.picks * NUM_PICK_REPEATS)
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+            mock_loom_timing=timing,
+        ) as loom_server:
+            await loom_server.add_pattern(pattern)
+            await loom_server.select_pattern(pattern.name)
+            mock_loom = loom_server.mock_loom
+            assert mock_loom is not None
+            # Ignore picks woven while selecting the pattern
+            mock_loom.pick_request_latency.reset()
+            num_picks_start = mock_loom.num_picks_woven
+            await asyncio.sleep(RUN_DURATION)
+            num_picks = mock_loom.num_picks_woven - num_picks_start
+            latency = mock_loom.pick_request_latency
+            print(
+                f"shed open/close {shed_duration * 1000:5.1f} ms: "
+                f"{num_picks / RUN_DURATION * 60:8.0f} picks/min; "
+                f"pick request latency median {latency.quantile(0.5) * 1000:.2f} ms, "
+                f"p99 {latency.quantile(0.99) * 1000:.2f} ms, "
+                f"max {latency.max * 1000:.2f} ms"
+            )
+
+
+async def amain() -> None:
+    for shed_duration in SHED_DURATIONS:
+        await bench_auto_weave(shed_duration)
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
@@ -0,0 +1,97 @@
+"""Benchmark parsing replies from the loom.
+
+Feed megabytes of synthetic =s/=c/=u traffic through an
+asyncio.StreamReader and compare the old parser (one readuntil per reply,
+then decode, strip and slice) to loom_protocol.read_messages
+(bulk reads, framed and parsed by loom_protocol.LoomProtocol).
+
+Run with: python benchmarks/bench_loom_protocol.py
+"""
+
+import asyncio
+import random
+import time
+
+from seguin_loom_server import loom_protocol
+from seguin_loom_server.loom_constants import TERMINATOR
+
+NUM_MEGABYTES = 4
+
+
+def make_synthetic_traffic(nbytes: int) -> tuple[bytes, int]:
+    """Make about nbytes of =s/=c/=u replies.
+
+    Return the data and the number of replies.
+    """
+    rng = random.Random(47)
+    replies: list[bytes] = []
+    size = 0
+    while size < nbytes:
+        match rng.randrange(4):
+            case 0 | 1:
+                reply = f"=s{rng.choice((1, 5, 9, 0xD)):x}"
+            case 2:
+                reply = f"=c{rng.randrange(1 << 24):08x}"
+            case 3:
+                reply = f"=u{rng.randrange(2)}"
+        replies.append(reply.encode() + TERMINATOR)
+        size += len(replies[-1])
+    return b"".join(replies), len(replies)
+
+
+def make_reader(data: bytes) -> asyncio.StreamReader:
+    reader = asyncio.StreamReader(limit=len(data) + 1)
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+async def parse_with_readuntil(reader: asyncio.StreamReader) -> int:
+    """Parse replies the old way; return the number of replies."""
+    num_replies = 0
+    while not reader.at_eof():
+        reply_bytes = await reader.readuntil(TERMINATOR)
+        reply = reply_bytes.decode().strip()
+        reply_char = reply[1]
+        reply_data = reply[2:]
+        match reply_char:
+            case "c":
+                pass
+            case "u":
+                _ = reply_data == "0"
+            case "s":
+                _ = int(reply_data, base=16)
+        num_replies += 1
+    return num_replies
+
+
+async def parse_with_protocol(reader: asyncio.StreamReader) -> int:
+    """Parse replies with LoomProtocol; return the number of replies."""
+    num_replies = 0
+    protocol = loom_protocol.LoomProtocol(loom_protocol.REPLY_PARSERS)
+    async for _ in loom_protocol.read_messages(reader, protocol):
+        num_replies += 1
+    return num_replies
+
+
+async def amain() -> None:
+    data, num_replies = make_synthetic_traffic(NUM_MEGABYTES * 1_000_000)
+    print(f"Parse {len(data) / 1e6:0.1f} MB: {num_replies} replies")
+    print(f"{'parser':<20} {'MB/s':>8} {'replies/s':>12}")
+    for name, parse_func in (
+        ("readuntil", parse_with_readuntil),
+        ("LoomProtocol", parse_with_protocol),
+    ):
+        reader = make_reader(data)
+        t0 = time.perf_counter()
+        num_parsed = await parse_func(reader)
+        duration = time.perf_counter() - t0
+        assert num_parsed == num_replies
+        print(
+            f"{name:<20} {len(data) / 1e6 / duration:8.2f} "
+            f"{num_replies / duration:12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
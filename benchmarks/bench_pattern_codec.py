@@ -0,0 +1,103 @@
+"""Benchmark the encoding used to save patterns in the pattern database.
+
+Compare the size and decoding time of the old JSON encoding
+(json.loads followed by ReducedPattern.from_dict)
+to the binary encoding in the pattern_codec module,
+for a large synthetic pattern.
+
+Run with: python benchmarks/bench_pattern_codec.py
+"""
+
+import dataclasses
+import json
+import random
+import time
+
+from seguin_loom_server.pattern_codec import decode_pattern, encode_pattern
+from seguin_loom_server.reduced_pattern import (
+    Pick,
+    ReducedPattern,
+    share_identical_picks,
+)
+
+NUM_PICKS = 50_000
+NUM_WARPS = 2_000
+NUM_SHAFTS = 24
+NUM_DISTINCT_SHAFT_WORDS = 500
+NUM_CALLS = 10
+
+
+def make_synthetic_pattern() -> ReducedPattern:
+    """Make a large pattern with many distinct picks."""
+    rng = random.Random(47)
+    color_table = [f"#{rng.randrange(0x1000000):06x}" for _ in range(20)]
+    shaft_words = [
+        rng.randrange(1, 1 << NUM_SHAFTS) for _ in range(NUM_DISTINCT_SHAFT_WORDS)
+    ]
+    picks = share_identical_picks(
+        Pick(
+            color=rng.randrange(len(color_table)),
+            shaft_word=rng.choice(shaft_words),
+            num_shafts=NUM_SHAFTS,
+        )
+        for _ in range(NUM_PICKS)
+    )
+    return ReducedPattern(
+        name="synthetic",
+        color_table=color_table,
+        warp_colors=[rng.randrange(len(color_table)) for _ in range(NUM_WARPS)],
+        threading=[rng.randrange(-1, NUM_SHAFTS) for _ in range(NUM_WARPS)],
+        picks=picks,
+    )
+
+
+def time_per_call(func, *args, **kwargs) -> float:  # type: ignore[no-untyped-def]
+    """Return the mean time per call of func (sec)."""
+    t0 = time.perf_counter()
+    for _ in range(NUM_CALLS):
+        func(*args, **kwargs)
+    return (time.perf_counter() - t0) / NUM_CALLS
+
+
+def decode_json(pattern_json: str) -> ReducedPattern:
+    return ReducedPattern.from_dict(json.loads(pattern_json))
+
+
+def main() -> None:
+    pattern = make_synthetic_pattern()
+    pattern_json = json.dumps(dataclasses.asdict(pattern))
+    binary_data = encode_pattern(pattern, compress=False)
+    compressed_data = encode_pattern(pattern, compress=True)
+    assert decode_pattern(compressed_data, name=pattern.name) == pattern
+
+    print(f"Pattern with {NUM_PICKS} picks, {NUM_WARPS} warps, {NUM_SHAFTS} shafts")
+    print(
+        f"{'encoding':<20} {'size (bytes)':>14} {'encode (ms)':>12} {'decode (ms)':>12}"
+    )
+    for name, size, encode_time, decode_time in (
+        (
+            "JSON",
+            len(pattern_json),
+            time_per_call(lambda: json.dumps(dataclasses.asdict(pattern))),
+            time_per_call(decode_json, pattern_json),
+        ),
+        (
+            "binary",
+            len(binary_data),
+            time_per_call(encode_pattern, pattern, compress=False),
+            time_per_call(decode_pattern, binary_data, name=pattern.name),
+        ),
+        (
+            "binary+zlib",
+            len(compressed_data),
+            time_per_call(encode_pattern, pattern, compress=True),
+            time_per_call(decode_pattern, compressed_data, name=pattern.name),
+        ),
+    ):
+        print(
+            f"{name:<20} {size:>14} {encode_time * 1000:12.1f} {decode_time * 1000:12.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
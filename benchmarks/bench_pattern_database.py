@@ -0,0 +1,111 @@
+"""Benchmark the per-call cost of PatternDatabase operations.
+
+Compare the cost of opening a new connection for every call
+(the way PatternDatabase used to work) to the cost of using
+the long-lived connection owned by PatternDatabase.
+Also compare the cost of getting a pattern with and without
+the pattern cache.
+
+Run with: python benchmarks/bench_pattern_database.py
+"""
+
+import asyncio
+import pathlib
+import tempfile
+import time
+
+import aiosqlite
+
+from seguin_loom_server.pattern_database import create_pattern_database
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+DATADIR = pathlib.Path(__file__).parent.parent / "tests" / "data"
+
+NUM_CALLS = 500
+
+
+async def update_pick_number_connect_per_call(
+    dbpath: pathlib.Path, pattern_name: str, pick_number: int
+) -> None:
+    """Update the pick number the old way: with a new connection."""
+    async with aiosqlite.connect(dbpath) as db:
+        await db.execute(
+            "update patterns "
+            "set pick_number = ?, repeat_number = ?, timestamp_sec = ?"
+            "where pattern_name = ?",
+            (pick_number, 1, time.time(), pattern_name),
+        )
+        await db.commit()
+
+
+async def get_pattern_names_connect_per_call(dbpath: pathlib.Path) -> list[str]:
+    """Get pattern names the old way: with a new connection."""
+    async with aiosqlite.connect(dbpath) as db:
+        async with db.execute(
+            "select pattern_name from patterns order by timestamp_sec asc, id asc"
+        ) as cursor:
+            rows = await cursor.fetchall()
+    return [row[0] for row in rows]
+
+
+def print_result(name: str, duration: float) -> None:
+    print(f"{name:<45} {duration / NUM_CALLS * 1e6:10.1f} µs/call")
+
+
+async def main() -> None:
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            await db.add_pattern(pattern)
+
+            t0 = time.perf_counter()
+            for i in range(NUM_CALLS):
+                await update_pick_number_connect_per_call(dbpath, pattern.name, i)
+            print_result(
+                "update_pick_number, connect per call", time.perf_counter() - t0
+            )
+
+            t0 = time.perf_counter()
+            for i in range(NUM_CALLS):
+                await db.update_pick_number(
+                    pattern_name=pattern.name, pick_number=i, repeat_number=1
+                )
+            print_result(
+                "update_pick_number, persistent connection", time.perf_counter() - t0
+            )
+
+            t0 = time.perf_counter()
+            for i in range(NUM_CALLS):
+                await get_pattern_names_connect_per_call(dbpath)
+            print_result(
+                "get_pattern_names, connect per call", time.perf_counter() - t0
+            )
+
+            t0 = time.perf_counter()
+            for i in range(NUM_CALLS):
+                await db.get_pattern_names()
+            print_result(
+                "get_pattern_names, persistent connection", time.perf_counter() - t0
+            )
+
+            t0 = time.perf_counter()
+            for i in range(NUM_CALLS):
+                db._clear_pattern_cache()
+                await db.get_pattern(pattern.name)
+            print_result("get_pattern, not cached", time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            for i in range(NUM_CALLS):
+                await db.get_pattern(pattern.name)
+            print_result("get_pattern, cached", time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""Benchmark pick request to serial write latency with the mock loom.
+
+Measure the time from the mock loom reporting that it wants a new pick
+(an =s reply with the cycle_complete bit set) until the mock loom
+receives the resulting =C command from the LoomServer.
+
+Also compare the cost of generating a pick command by string formatting
+to the cost of looking up the pre-encoded command.
+
+Run with: python benchmarks/bench_pick_latency.py
+"""
+
+import asyncio
+import pathlib
+import statistics
+import tempfile
+import time
+import timeit
+
+from seguin_loom_server.loom_constants import TERMINATOR
+from seguin_loom_server.loom_server import LoomServer
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+DATADIR = pathlib.Path(__file__).parent.parent / "tests" / "data"
+
+NUM_PICKS = 2000
+
+
+def bench_command_generation() -> None:
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    pattern.pick_number = 1
+    pick = pattern.get_current_pick()
+    num_calls = 100_000
+
+    def format_command() -> bytes:
+        return f"=C{pick.shaft_word:08x}".encode() + TERMINATOR
+
+    duration = min(timeit.repeat(format_command, number=num_calls, repeat=5))
+    print(f"{'format =C command':<40} {duration / num_calls * 1e9:10.1f} ns/call")
+    duration = min(timeit.repeat(pattern.get_pick_command, number=num_calls, repeat=5))
+    print(f"{'pre-encoded =C command':<40} {duration / num_calls * 1e9:10.1f} ns/call")
+
+
+async def bench_pick_latency() -> None:
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as loom_server:
+            await loom_server.add_pattern(pattern)
+            await loom_server.select_pattern(pattern.name)
+            mock_loom = loom_server.mock_loom
+            assert mock_loom is not None
+
+            # Find out when the mock loom receives the =C command
+            shafts_commanded = asyncio.Event()
+            report_shafts = mock_loom.report_shafts
+
+            async def report_shafts_and_notify() -> None:
+                shafts_commanded.set()
+                await report_shafts()
+
+            mock_loom.report_shafts = report_shafts_and_notify  # type: ignore
+
+            current_pattern = loom_server.current_pattern
+            assert current_pattern is not None
+            latencies = []
+            for _ in range(NUM_PICKS):
+                # The loom server sends no =C command when it advances
+                # to the next repeat, so avoid the end of the pattern.
+                if current_pattern.pick_number == len(current_pattern.picks):
+                    current_pattern.pick_number = 0
+                shafts_commanded.clear()
+                t0 = time.perf_counter()
+                mock_loom.weave_cycle_completed = True
+                await mock_loom.report_state()
+                await shafts_commanded.wait()
+                latencies.append(time.perf_counter() - t0)
+
+    latencies_us = [latency * 1e6 for latency in latencies]
+    quantiles = statistics.quantiles(latencies_us, n=100)
+    print(
+        f"{'=s pick request to =C write':<40} "
+        f"median {statistics.median(latencies_us):.1f} µs, "
+        f"p99 {quantiles[98]:.1f} µs, "
+        f"min {min(latencies_us):.1f} µs"
+    )
+
+
+if __name__ == "__main__":
+    bench_command_generation()
+    asyncio.run(bench_pick_latency())
@@ -0,0 +1,106 @@
+"""Benchmark reduced_pattern_from_pattern_data on large synthetic drafts.
+
+Compare the current algorithm, which computes a shaft word per pick
+using bitwise operations, to the original algorithm, which used
+sets of shafts and a list of bools per pick.
+
+Run with: python benchmarks/bench_reduced_pattern.py
+"""
+
+import random
+import time
+
+import dtx_to_wif
+
+from seguin_loom_server.reduced_pattern import reduced_pattern_from_pattern_data
+
+NUM_PICKS = 50_000
+NUM_ENDS = 2000
+NUM_SHAFTS = 32
+NUM_TREADLES = 40
+NUM_COLORS = 10
+
+
+def make_synthetic_draft(use_liftplan: bool, seed: int = 1) -> dtx_to_wif.PatternData:
+    """Make a random draft with a liftplan or tie-up and treadling."""
+    rnd = random.Random(seed)
+    shafts = range(1, NUM_SHAFTS + 1)
+
+    def random_shaft_set() -> set[int]:
+        return set(rnd.sample(shafts, rnd.randint(1, NUM_SHAFTS - 1)))
+
+    threading = {end: {rnd.choice(shafts)} for end in range(1, NUM_ENDS + 1)}
+    if use_liftplan:
+        tieup = {}
+        treadling = {}
+        liftplan = {pick: random_shaft_set() for pick in range(1, NUM_PICKS + 1)}
+    else:
+        treadles = range(1, NUM_TREADLES + 1)
+        tieup = {treadle: random_shaft_set() for treadle in treadles}
+        treadling = {
+            pick: set(rnd.sample(treadles, rnd.randint(1, 3)))
+            for pick in range(1, NUM_PICKS + 1)
+        }
+        liftplan = {}
+    color_table = {
+        i: (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256))
+        for i in range(1, NUM_COLORS + 1)
+    }
+    return dtx_to_wif.PatternData(
+        name="synthetic",
+        threading=threading,
+        tieup=tieup,
+        treadling=treadling,
+        liftplan=liftplan,
+        color_table=color_table,
+        color_range=(0, 255),
+        warp=dtx_to_wif.WarpWeftData(color=1),
+        weft=dtx_to_wif.WarpWeftData(color=2),
+        weft_colors={
+            pick: rnd.randint(1, NUM_COLORS) for pick in range(1, NUM_PICKS + 1)
+        },
+    )
+
+
+def original_are_shafts_up_list(data: dtx_to_wif.PatternData) -> list[list[bool]]:
+    """The core of the original algorithm, using sets of shafts."""
+    wefts_from1 = list(range(1, len(data.liftplan or data.treadling) + 1))
+    if data.liftplan:
+        shaft_sets = [data.liftplan[weft] - {0} for weft in wefts_from1]
+    else:
+        shaft_sets = []
+        for weft in wefts_from1:
+            treadle_set = data.treadling[weft] - {0}
+            shaft_sets.append(
+                set.union(*(data.tieup[treadle] for treadle in treadle_set)) - {0}
+            )
+    num_shafts = max(max(shaft_set) for shaft_set in shaft_sets if shaft_set)
+    shafts_from1 = list(range(1, num_shafts + 1))
+    return [[shaft in shaft_set for shaft in shafts_from1] for shaft_set in shaft_sets]
+
+
+def main() -> None:
+    for use_liftplan in (True, False):
+        draft_type = "liftplan" if use_liftplan else "tie-up and treadling"
+        data = make_synthetic_draft(use_liftplan=use_liftplan)
+
+        t0 = time.perf_counter()
+        are_shafts_up_list = original_are_shafts_up_list(data)
+        original_duration = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        reduced_pattern = reduced_pattern_from_pattern_data(name="synthetic", data=data)
+        duration = time.perf_counter() - t0
+
+        assert [
+            pick.are_shafts_up for pick in reduced_pattern.picks
+        ] == are_shafts_up_list
+        print(
+            f"{NUM_PICKS} picks, {NUM_SHAFTS} shafts, {draft_type}: "
+            f"original shaft computation {original_duration * 1000:.0f} ms; "
+            f"reduced_pattern_from_pattern_data {duration * 1000:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
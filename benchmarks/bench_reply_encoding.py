@@ -0,0 +1,95 @@
+"""Benchmark encoding replies to the client as JSON.
+
+Compare the old encoding (dataclasses.asdict followed by json.dumps,
+as done by websocket.send_json) to client_replies.reply_to_json,
+for a large synthetic pattern and for small replies.
+
+Run with: python benchmarks/bench_reply_encoding.py
+"""
+
+import dataclasses
+import json
+import random
+import time
+from typing import Any
+
+from seguin_loom_server import client_replies
+from seguin_loom_server.reduced_pattern import (
+    Pick,
+    ReducedPattern,
+    share_identical_picks,
+)
+
+NUM_PICKS = 50_000
+NUM_WARPS = 2_000
+NUM_SHAFTS = 24
+NUM_DISTINCT_SHAFT_WORDS = 500
+
+
+def make_synthetic_pattern() -> ReducedPattern:
+    """Make a large pattern with many distinct picks."""
+    rng = random.Random(47)
+    color_table = [f"#{rng.randrange(0x1000000):06x}" for _ in range(20)]
+    shaft_words = [
+        rng.randrange(1, 1 << NUM_SHAFTS) for _ in range(NUM_DISTINCT_SHAFT_WORDS)
+    ]
+    picks = share_identical_picks(
+        Pick(
+            color=rng.randrange(len(color_table)),
+            shaft_word=rng.choice(shaft_words),
+            num_shafts=NUM_SHAFTS,
+        )
+        for _ in range(NUM_PICKS)
+    )
+    return ReducedPattern(
+        name="synthetic",
+        color_table=color_table,
+        warp_colors=[rng.randrange(len(color_table)) for _ in range(NUM_WARPS)],
+        threading=[rng.randrange(-1, NUM_SHAFTS) for _ in range(NUM_WARPS)],
+        picks=picks,
+    )
+
+
+def encode_with_asdict(reply: Any) -> str:
+    """Encode a reply the old way."""
+    return json.dumps(
+        dataclasses.asdict(reply), separators=(",", ":"), ensure_ascii=False
+    )
+
+
+def time_per_call(func, reply: Any, num_calls: int) -> float:  # type: ignore[no-untyped-def]
+    """Return the mean time per call of func(reply) (sec)."""
+    t0 = time.perf_counter()
+    for _ in range(num_calls):
+        func(reply)
+    return (time.perf_counter() - t0) / num_calls
+
+
+def main() -> None:
+    pattern = make_synthetic_pattern()
+    # Fill the cache of the pattern's static JSON, as the first reply would
+    assert client_replies.reply_to_json(pattern) == encode_with_asdict(pattern)
+
+    print(f"{'reply':<40} {'asdict (µs)':>12} {'reply_to_json (µs)':>20}")
+    for name, reply, num_calls in (
+        (f"ReducedPattern, {NUM_PICKS} picks", pattern, 10),
+        (
+            "CurrentPickNumber",
+            client_replies.CurrentPickNumber(pick_number=47, repeat_number=2),
+            100_000,
+        ),
+        ("LoomState", client_replies.LoomState.from_state_word(0x05), 100_000),
+        ("WeaveDirection", client_replies.WeaveDirection(forward=True), 100_000),
+        (
+            "PatternNames, 25 names",
+            client_replies.PatternNames(names=[f"pattern {i}" for i in range(25)]),
+            100_000,
+        ),
+    ):
+        asdict_time = time_per_call(encode_with_asdict, reply, num_calls)
+        new_time = time_per_call(client_replies.reply_to_json, reply, num_calls)
+        print(f"{name:<40} {asdict_time * 1e6:12.1f} {new_time * 1e6:20.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare end-to-end pick throughput and latency of the in-memory
+mock loom with a mock loom connected through a pseudo-terminal.
+
+The pseudo-terminal mock loom is opened as a serial port,
+so the difference shows the cost of the real serial I/O code path
+(pyserial-asyncio and the tty driver). Both looms weave automatically
+as fast as possible, with no shed or transmission delays.
+
+Requires pseudo-terminal support (e.g. Linux or macOS).
+
+Run with: python benchmarks/bench_serial_path.py
+"""
+
+import asyncio
+import dataclasses
+import math
+import pathlib
+import tempfile
+
+from seguin_loom_server.loom_server import (
+    MOCK_PORT_NAME,
+    PTY_MOCK_PORT_NAME,
+    LoomServer,
+)
+from seguin_loom_server.mock_loom import MockLoomTiming
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+DATADIR = pathlib.Path(__file__).parent.parent / "tests" / "data"
+
+# Duration of each run (sec)
+RUN_DURATION = 5
+
+# Number of times to repeat the picks of the test pattern,
+# to avoid the loom's pick request timeout at the end of each repeat
+NUM_PICK_REPEATS = 1000
+
+
+async def bench_serial_path(serial_port: str) -> None:
+    timing = MockLoomTiming(
+        byte_duration=0,
+        shed_open_duration=0,
+        shed_close_duration=0,
+        auto_weave_rate=math.inf,
+    )
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    pattern = dataclasses.replace(pattern, picks=pattern.picks * NUM_PICK_REPEATS)
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port=serial_port,
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+            mock_loom_timing=timing,
+        ) as loom_server:
+            await loom_server.add_pattern(pattern)
+            await loom_server.select_pattern(pattern.name)
+            mock_loom = loom_server.mock_loom
+            assert mock_loom is not None
+            mock_loom.pick_request_latency.reset()
+            num_picks_start = mock_loom.num_picks_woven
+            await asyncio.sleep(RUN_DURATION)
+            num_picks = mock_loom.num_picks_woven - num_picks_start
+            latency = mock_loom.pick_request_latency
+            print(
+                f"{serial_port:<8} {num_picks / RUN_DURATION:8.0f} picks/sec; "
+                f"pick request latency median {latency.quantile(0.5) * 1e6:.0f} µs, "
+                f"p99 {latency.quantile(0.99) * 1e6:.0f} µs, "
+                f"max {latency.max * 1e6:.0f} µs"
+            )
+
+
+async def amain() -> None:
+    for serial_port in (MOCK_PORT_NAME, PTY_MOCK_PORT_NAME):
+        await bench_serial_path(serial_port)
+
+
+if __name__ == "__main__":
+    asyncio.run(amain())
@@ -0,0 +1,644 @@
+"""Load test a loom server with many simulated websocket clients.
+
+Run a real uvicorn server with a mock loom, in a separate process,
+and connect simulated clients to it, in stages of increasing size.
+Each client sends a random mix of jump_to_pick, goto_next_pick
+and select_pattern commands at random (exponentially distributed)
+intervals, occasionally uploads a pattern file, and occasionally
+disconnects and reconnects. Clients are not paced by the replies,
+so a slow server does not slow the load down.
+
+After each stage print one row:
+
+* clients: the number of simulated clients.
+* cmd/s, msg/s: commands sent and replies received per second,
+  by all clients together.
+* jump p50, p99: time from sending jump_to_pick to receiving the
+  CurrentPickNumber reply with the new pick and repeat numbers
+  (each command uses a unique repeat number) (ms).
+* lost: jump_to_pick commands and uploads whose reply did not arrive
+  within REPLY_TIMEOUT, e.g. because the server coalesced the reply
+  with a newer one, or another client moved the pick first.
+* upload p50, p99: time from sending a pattern file to receiving
+  the PatternNames reply that includes it (ms).
+* conn p99: time from opening a connection to the first reply (ms).
+* reconn: connections opened; drops: connections closed by the server
+  (e.g. because the client was not keeping up).
+* RSS: server resident set size at the end of the stage (MB).
+* lag p99, max: server event loop lag during the stage (ms), from
+  its /metrics; each is the upper edge of a histogram bucket.
+* gen cpu: CPU use of this load generator. If it is near 100%,
+  the load generator may be the bottleneck, rather than the server.
+
+Requires the websockets package (pip install websockets),
+which uvicorn also uses to serve websockets.
+
+Run with: python benchmarks/load_test.py --help
+"""
+
+import argparse
+import asyncio
+import contextlib
+import dataclasses
+import json
+import math
+import os
+import pathlib
+import random
+import socket
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Any
+
+from websockets.asyncio.client import ClientConnection, connect
+from websockets.exceptions import WebSocketException
+
+from seguin_loom_server.latency_stats import LatencyHistogram
+
+DATADIR = pathlib.Path(__file__).parent.parent / "tests" / "data"
+
+# Run the server in its own process, so the load generator
+# does not share its event loop. main.lifespan parses sys.argv
+# (the arguments of run_seguin_loom), so pass the port separately.
+SERVER_SCRIPT = """
+import os
+import uvicorn
+uvicorn.run(
+    "seguin_loom_server.main:app",
+    host="127.0.0.1",
+    port=int(os.environ["LOAD_TEST_PORT"]),
+    log_level="warning",
+)
+"""
+
+# Maximum time to wait for the server to start, and to stop (sec)
+SERVER_START_TIMEOUT = 30
+SERVER_STOP_TIMEOUT = 10
+
+# Maximum time to open a websocket connection (sec)
+CONNECT_TIMEOUT = 10
+
+# Delay before trying again, if a client could not connect (sec)
+CONNECT_RETRY_DELAY = 1
+
+# Maximum time to wait for the reply to a command (sec)
+REPLY_TIMEOUT = 10
+
+# Maximum pick number for jump_to_pick; the patterns in tests/data
+# have 6 picks
+MAX_JUMP_PICK_NUMBER = 6
+
+# Each client uses repeat numbers client index * REPEAT_NUMBER_STRIDE + n,
+# for n = 0, 1, ..., so the reply to each jump_to_pick can be identified
+REPEAT_NUMBER_STRIDE = 1_000_000
+
+# Start of the replies the clients look for, as encoded by the server
+CURRENT_PICK_NUMBER_PREFIX = '{"type":"CurrentPickNumber"'
+PATTERN_NAMES_PREFIX = '{"type":"PatternNames"'
+
+# Name of the Prometheus histogram of event loop lag
+LAG_METRIC_NAME = "seguin_event_loop_lag_seconds"
+
+# Relative frequency of the commands other than uploads
+COMMAND_WEIGHTS = {
+    "jump_to_pick": 2,
+    "goto_next_pick": 2,
+    "select_pattern": 1,
+}
+
+TABLE_HEADER = (
+    f"{'clients':>7} {'cmd/s':>7} {'msg/s':>8} {'jump p50':>8} {'jump p99':>8} "
+    f"{'lost':>5} {'upload p50':>10} {'upload p99':>10} {'conn p99':>8} "
+    f"{'reconn':>6} {'drops':>5} {'RSS MB':>7} {'lag p99':>7} {'lag max':>7} "
+    f"{'gen cpu':>7}"
+)
+
+
+@dataclasses.dataclass
+class LoadTestConfig:
+    """Configuration for a load test.
+
+    Intervals are the mean time between random events, per client,
+    in seconds; use math.inf to disable an event.
+
+    Parameters
+    ----------
+    client_counts : list[int]
+        Number of clients in each stage. Clients are added
+        at the start of each stage, so counts should increase.
+    stage_duration : float
+        Duration of each stage, after the warmup (sec).
+    warmup : float
+        Time between adding clients and starting to measure (sec).
+    command_interval : float
+        Mean interval between commands (including uploads).
+    upload_interval : float
+        Mean interval between uploading a pattern file.
+    reconnect_interval : float
+        Mean interval between disconnecting and reconnecting.
+    seed : int
+        Random number generator seed.
+    """
+
+    client_counts: list[int] = dataclasses.field(
+        default_factory=lambda: [10, 50, 100, 200, 400]
+    )
+    stage_duration: float = 20.0
+    warmup: float = 3.0
+    command_interval: float = 1.0
+    upload_interval: float = 120.0
+    reconnect_interval: float = 30.0
+    seed: int = 0
+
+
+@dataclasses.dataclass
+class StageStats:
+    """Measurements made by the clients during one stage."""
+
+    num_commands: int = 0
+    num_replies: int = 0
+    num_lost: int = 0
+    num_connects: int = 0
+    num_connect_failures: int = 0
+    num_server_closes: int = 0
+    jump_latency: LatencyHistogram = dataclasses.field(default_factory=LatencyHistogram)
+    upload_latency: LatencyHistogram = dataclasses.field(
+        default_factory=LatencyHistogram
+    )
+    connect_latency: LatencyHistogram = dataclasses.field(
+        default_factory=LatencyHistogram
+    )
+
+
+@dataclasses.dataclass
+class StageResult:
+    """Results of one stage.
+
+    Parameters
+    ----------
+    num_clients : int
+        Number of clients.
+    duration : float
+        Measured duration (sec).
+    stats : StageStats
+        Measurements made by the clients.
+    rss_bytes : int | None
+        Server resident set size at the end (bytes), or None if unknown.
+    lag_p99 : float
+        99th percentile of server event loop lag (sec); nan if unknown.
+    lag_max : float
+        Maximum server event loop lag (sec); nan if unknown.
+    cpu_fraction : float
+        CPU time used by the load generator / duration.
+    """
+
+    num_clients: int
+    duration: float
+    stats: StageStats
+    rss_bytes: int | None
+    lag_p99: float
+    lag_max: float
+    cpu_fraction: float
+
+    def format_row(self) -> str:
+        """Format the results as a row of a table with TABLE_HEADER."""
+        stats = self.stats
+        rss_str = "?" if self.rss_bytes is None else f"{self.rss_bytes / 1e6:.1f}"
+        return (
+            f"{self.num_clients:>7} "
+            f"{stats.num_commands / self.duration:>7.1f} "
+            f"{stats.num_replies / self.duration:>8.1f} "
+            f"{format_ms(stats.jump_latency.quantile(0.5)):>8} "
+            f"{format_ms(stats.jump_latency.quantile(0.99)):>8} "
+            f"{stats.num_lost:>5} "
+            f"{format_ms(stats.upload_latency.quantile(0.5)):>10} "
+            f"{format_ms(stats.upload_latency.quantile(0.99)):>10} "
+            f"{format_ms(stats.connect_latency.quantile(0.99)):>8} "
+            f"{stats.num_connects:>6} {stats.num_server_closes:>5} "
+            f"{rss_str:>7} "
+            f"{format_ms(self.lag_p99):>7} {format_ms(self.lag_max):>7} "
+            f"{self.cpu_fraction * 100:>6.0f}%"
+        )
+
+
+def format_ms(duration: float) -> str:
+    """Format a duration (sec) in ms, or "-" if nan."""
+    if math.isnan(duration):
+        return "-"
+    return f"{duration * 1000:.1f}"
+
+
+def get_free_port() -> int:
+    """Get a TCP port that is not in use."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def http_get(url: str) -> str:
+    """Get the contents of a URL, without blocking the event loop."""
+
+    def read_url() -> str:
+        with urllib.request.urlopen(url, timeout=REPLY_TIMEOUT) as response:
+            return response.read().decode()
+
+    return await asyncio.to_thread(read_url)
+
+
+async def get_rss_bytes(pid: int) -> int | None:
+    """Get the resident set size of a process (bytes), or None if unknown.
+
+    Uses ps, which is available on Linux and macOS.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ps",
+            "-o",
+            "rss=",
+            "-p",
+            str(pid),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        stdout, _ = await process.communicate()
+        return int(stdout) * 1024
+    except (OSError, ValueError):
+        return None
+
+
+async def get_lag_buckets(base_url: str) -> list[tuple[float, int]]:
+    """Get the server's event loop lag histogram.
+
+    Return a list of (upper bucket edge (sec), cumulative count).
+    """
+    metrics = await http_get(f"{base_url}/metrics")
+    buckets = []
+    prefix = f'{LAG_METRIC_NAME}_bucket{{le="'
+    for line in metrics.splitlines():
+        if line.startswith(prefix):
+            edge_str, count_str = line[len(prefix) :].split('"} ')
+            buckets.append((float(edge_str), int(count_str)))
+    return buckets
+
+
+def compute_lag_stats(
+    start_buckets: list[tuple[float, int]], end_buckets: list[tuple[float, int]]
+) -> tuple[float, float]:
+    """Compute (p99, max) of the lag measured between two histograms (sec).
+
+    Each is the upper edge of a bucket; nan if no measurements.
+    """
+    if not start_buckets or not end_buckets:
+        return (math.nan, math.nan)
+    counts = [
+        (edge, end_count - start_count)
+        for (edge, end_count), (_, start_count) in zip(end_buckets, start_buckets)
+    ]
+    total = counts[-1][1]
+    if total == 0:
+        return (math.nan, math.nan)
+    p99 = next(edge for edge, count in counts if count >= 0.99 * total)
+    lag_max = next(edge for edge, count in counts if count >= total)
+    return (p99, lag_max)
+
+
+def remove_older(send_times: dict[Any, float], expire_time: float) -> int:
+    """Remove items of a dict of send times that are older than expire_time.
+
+    Return the number removed.
+    """
+    expired_keys = [key for key, value in send_times.items() if value < expire_time]
+    for key in expired_keys:
+        del send_times[key]
+    return len(expired_keys)
+
+
+class LoadClient:
+    """A simulated client, which sends commands and reconnects forever.
+
+    Parameters
+    ----------
+    index : int
+        Client index, starting from 0.
+    load_test : LoadTest
+        The load test; measurements are recorded in its stats.
+    """
+
+    def __init__(self, index: int, load_test: "LoadTest") -> None:
+        self.index = index
+        self.load_test = load_test
+        self.config = load_test.config
+        self.rng = random.Random(f"{self.config.seed}-{index}")
+        # Number of jump_to_pick commands and uploads sent
+        self.num_jumps = 0
+        self.num_uploads = 0
+        # dict of (pick number, repeat number): jump_to_pick send time
+        self.pending_jumps: dict[tuple[int, int], float] = {}
+        # dict of pattern name: upload send time
+        self.pending_uploads: dict[str, float] = {}
+        self.is_disconnecting = False
+
+    async def run(self) -> None:
+        """Connect, send commands and reconnect, until cancelled."""
+        # Stagger the clients
+        await asyncio.sleep(self.rng.uniform(0, self.config.command_interval))
+        while True:
+            try:
+                await self.run_connection()
+            except (OSError, TimeoutError, WebSocketException):
+                self.load_test.stats.num_connect_failures += 1
+                await asyncio.sleep(CONNECT_RETRY_DELAY)
+
+    async def run_connection(self) -> None:
+        """Connect, then send commands until it is time to reconnect,
+        or the server closes the connection."""
+        self.is_disconnecting = False
+        start_time = time.monotonic()
+        async with connect(
+            self.load_test.websocket_url,
+            max_size=None,
+            open_timeout=CONNECT_TIMEOUT,
+            ping_interval=None,
+        ) as websocket:
+            self.load_test.stats.num_connects += 1
+            read_task = asyncio.create_task(self.read_loop(websocket, start_time))
+            try:
+                disconnect_time = start_time + self.rng.expovariate(
+                    1 / self.config.reconnect_interval
+                )
+                while True:
+                    await asyncio.sleep(
+                        self.rng.expovariate(1 / self.config.command_interval)
+                    )
+                    if read_task.done() or time.monotonic() > disconnect_time:
+                        break
+                    await self.send_command(websocket)
+                self.is_disconnecting = True
+            finally:
+                read_task.cancel()
+
+    async def send_command(self, websocket: ClientConnection) -> None:
+        """Send one randomly chosen command."""
+        self.expire_pending()
+        send_time = time.monotonic()
+        command: dict[str, Any]
+        if self.rng.random() < self.config.command_interval / (
+            self.config.upload_interval
+        ):
+            name, data = self.rng.choice(self.load_test.pattern_files)
+            path = pathlib.Path(name)
+            upload_name = f"{path.stem} c{self.index}-{self.num_uploads}{path.suffix}"
+            self.num_uploads += 1
+            self.pending_uploads[upload_name] = send_time
+            command = dict(type="file", name=upload_name, data=data)
+        else:
+            command_type = self.rng.choices(
+                list(COMMAND_WEIGHTS), weights=list(COMMAND_WEIGHTS.values())
+            )[0]
+            match command_type:
+                case "jump_to_pick":
+                    pick_number = self.rng.randint(1, MAX_JUMP_PICK_NUMBER)
+                    repeat_number = self.index * REPEAT_NUMBER_STRIDE + self.num_jumps
+                    self.num_jumps += 1
+                    self.pending_jumps[(pick_number, repeat_number)] = send_time
+                    command = dict(
+                        type=command_type,
+                        pick_number=pick_number,
+                        repeat_number=repeat_number,
+                    )
+                case "goto_next_pick":
+                    command = dict(type=command_type)
+                case "select_pattern":
+                    name = self.rng.choice(self.load_test.pattern_files)[0]
+                    command = dict(type=command_type, name=name)
+        await websocket.send(json.dumps(command))
+        self.load_test.stats.num_commands += 1
+
+    def expire_pending(self) -> None:
+        """Count and forget commands whose reply is overdue."""
+        expire_time = time.monotonic() - REPLY_TIMEOUT
+        self.load_test.stats.num_lost += remove_older(
+            self.pending_jumps, expire_time
+        ) + remove_older(self.pending_uploads, expire_time)
+
+    def record_reply(
+        self, histogram: LatencyHistogram, send_time: float, recv_time: float
+    ) -> None:
+        """Record the latency of a reply, or count it as lost if overdue."""
+        latency = recv_time - send_time
+        if latency > REPLY_TIMEOUT:
+            self.load_test.stats.num_lost += 1
+        else:
+            histogram.record(latency)
+
+    async def read_loop(self, websocket: ClientConnection, start_time: float) -> None:
+        """Read replies, and measure the latency of the ones we look for."""
+        is_first = True
+        try:
+            async for message in websocket:
+                recv_time = time.monotonic()
+                stats = self.load_test.stats
+                stats.num_replies += 1
+                if is_first:
+                    stats.connect_latency.record(recv_time - start_time)
+                    is_first = False
+                assert isinstance(message, str)
+                # Only decode the replies we look for, to save CPU time
+                if self.pending_jumps and message.startswith(
+                    CURRENT_PICK_NUMBER_PREFIX
+                ):
+                    reply = json.loads(message)
+                    send_time = self.pending_jumps.pop(
+                        (reply["pick_number"], reply["repeat_number"]), None
+                    )
+                    if send_time is not None:
+                        self.record_reply(stats.jump_latency, send_time, recv_time)
+                elif self.pending_uploads and message.startswith(PATTERN_NAMES_PREFIX):
+                    for name in json.loads(message)["names"]:
+                        send_time = self.pending_uploads.pop(name, None)
+                        if send_time is not None:
+                            self.record_reply(
+                                stats.upload_latency, send_time, recv_time
+                            )
+        except WebSocketException:
+            pass
+        if not self.is_disconnecting:
+            self.load_test.stats.num_server_closes += 1
+
+
+class LoadTest:
+    """Run a load test.
+
+    Parameters
+    ----------
+    config : LoadTestConfig
+        Configuration.
+    """
+
+    def __init__(self, config: LoadTestConfig) -> None:
+        self.config = config
+        self.port = get_free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.websocket_url = f"ws://127.0.0.1:{self.port}/ws"
+        # Name and contents of the pattern files the clients use
+        self.pattern_files = [
+            (path.name, path.read_text())
+            for path in sorted(DATADIR.glob("*"))
+            if path.suffix in {".wif", ".dtx"}
+        ]
+        self.stats = StageStats()
+        self.server_process: asyncio.subprocess.Process | None = None
+
+    async def run(self) -> list[StageResult]:
+        """Run the stages, printing the results of each one."""
+        results = []
+        client_tasks: list[asyncio.Task] = []
+        with tempfile.TemporaryDirectory() as tempdir:
+            log_path = pathlib.Path(tempdir) / "server.log"
+            try:
+                await self.start_server(
+                    db_path=pathlib.Path(tempdir) / "load_test.sqlite",
+                    log_path=log_path,
+                )
+                await self.upload_patterns()
+                print(TABLE_HEADER)
+                for num_clients in self.config.client_counts:
+                    while len(client_tasks) < num_clients:
+                        client = LoadClient(index=len(client_tasks), load_test=self)
+                        client_tasks.append(asyncio.create_task(client.run()))
+                    result = await self.run_stage(num_clients)
+                    print(result.format_row())
+                    results.append(result)
+            except Exception:
+                if log_path.exists():
+                    print(f"Server log:\n{log_path.read_text()}")
+                raise
+            finally:
+                for task in client_tasks:
+                    task.cancel()
+                await asyncio.gather(*client_tasks, return_exceptions=True)
+                await self.stop_server()
+        return results
+
+    async def run_stage(self, num_clients: int) -> StageResult:
+        """Measure for one stage, after the warmup."""
+        assert self.server_process is not None
+        await asyncio.sleep(self.config.warmup)
+        start_lag_buckets = await get_lag_buckets(self.base_url)
+        self.stats = stats = StageStats()
+        start_time = time.monotonic()
+        start_cpu_time = time.process_time()
+        await asyncio.sleep(self.config.stage_duration)
+        # Stop recording in this stage's stats
+        self.stats = StageStats()
+        duration = time.monotonic() - start_time
+        cpu_time = time.process_time() - start_cpu_time
+        end_lag_buckets = await get_lag_buckets(self.base_url)
+        lag_p99, lag_max = compute_lag_stats(start_lag_buckets, end_lag_buckets)
+        return StageResult(
+            num_clients=num_clients,
+            duration=duration,
+            stats=stats,
+            rss_bytes=await get_rss_bytes(self.server_process.pid),
+            lag_p99=lag_p99,
+            lag_max=lag_max,
+            cpu_fraction=cpu_time / duration,
+        )
+
+    async def start_server(self, db_path: pathlib.Path, log_path: pathlib.Path) -> None:
+        """Start the server and wait until it is serving requests.
+
+        Server output is written to log_path.
+        """
+        with open(log_path, "wb") as log_file:
+            self.server_process = await asyncio.create_subprocess_exec(
+                sys.executable,
+                "-c",
+                SERVER_SCRIPT,
+                "mock",
+                "--db-path",
+                str(db_path),
+                env=dict(os.environ, LOAD_TEST_PORT=str(self.port)),
+                stdout=log_file,
+                stderr=asyncio.subprocess.STDOUT,
+            )
+        async with asyncio.timeout(SERVER_START_TIMEOUT):
+            while True:
+                if self.server_process.returncode is not None:
+                    raise RuntimeError(
+                        f"Server failed with code {self.server_process.returncode}"
+                    )
+                with contextlib.suppress(OSError):
+                    await http_get(f"{self.base_url}/looms")
+                    return
+                await asyncio.sleep(0.1)
+
+    async def stop_server(self) -> None:
+        """Stop the server, if running."""
+        if self.server_process is None or self.server_process.returncode is not None:
+            return
+        self.server_process.terminate()
+        try:
+            async with asyncio.timeout(SERVER_STOP_TIMEOUT):
+                await self.server_process.wait()
+        except TimeoutError:
+            print("Server did not stop; killing it")
+            self.server_process.kill()
+            await self.server_process.wait()
+
+    async def upload_patterns(self) -> None:
+        """Upload the pattern files and select the first one,
+        so the clients have patterns to select and weave."""
+        names = {name for name, _ in self.pattern_files}
+        async with connect(
+            self.websocket_url, max_size=None, open_timeout=CONNECT_TIMEOUT
+        ) as websocket:
+            for name, data in self.pattern_files:
+                await websocket.send(
+                    json.dumps(dict(type="file", name=name, data=data))
+                )
+            async with asyncio.timeout(REPLY_TIMEOUT):
+                async for message in websocket:
+                    reply = json.loads(message)
+                    if reply["type"] == "PatternNames" and names <= set(reply["names"]):
+                        break
+            await websocket.send(
+                json.dumps(dict(type="select_pattern", name=self.pattern_files[0][0]))
+            )
+            async with asyncio.timeout(REPLY_TIMEOUT):
+                async for message in websocket:
+                    if json.loads(message)["type"] == "ReducedPattern":
+                        break
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load test a loom server with many simulated websocket clients."
+    )
+    defaults = LoadTestConfig()
+    parser.add_argument(
+        "--clients",
+        dest="client_counts",
+        type=int,
+        nargs="+",
+        default=defaults.client_counts,
+        help=f"number of clients in each stage; default={defaults.client_counts}",
+    )
+    for field in dataclasses.fields(LoadTestConfig):
+        if field.name == "client_counts":
+            continue
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(getattr(defaults, field.name)),
+            default=getattr(defaults, field.name),
+            help=f"see LoadTestConfig; default={getattr(defaults, field.name)}",
+        )
+    args = parser.parse_args()
+    config = LoadTestConfig(**vars(args))
+    asyncio.run(LoadTest(config).run())
+
+
+if __name__ == "__main__":
+    main()
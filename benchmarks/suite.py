@@ -0,0 +1,524 @@
+"""Benchmark suite for the whole pick pipeline, with saved baselines.
+
+Time parsing patterns (reduced_pattern_from_pattern_data) for each file
+in tests/data and for large synthetic drafts, ReducedPattern.from_dict,
+PatternDatabase add_pattern, get_pattern and update_pick_number
+in databases with 25, 1000 and 100,000 rows, encoding replies to clients
+(client_replies.reply_to_json), and end-to-end latency from the mock loom
+requesting a pick (an =s reply) to it receiving the =C command.
+
+For stable, repeatable results each benchmark is warmed up, then timed
+several times with garbage collection disabled; the reported time is the
+minimum over the repeats (the median, for the pick latency).
+This filters out most interference from other processes,
+but compare baselines made on the same computer.
+
+Save a baseline, make changes, then compare::
+
+    python benchmarks/suite.py run --save baseline.json
+    python benchmarks/suite.py compare baseline.json
+
+compare runs the suite (or reads a second saved file), prints
+the change for each benchmark, and exits with status 1 if any
+benchmark is slower than the baseline by more than --threshold.
+Specify --quick for fewer repeats, and benchmark names (or parts of them)
+to run a subset (compare runs the benchmarks in the baseline).
+
+Run with: python benchmarks/suite.py --help
+"""
+
+import argparse
+import asyncio
+import collections.abc
+import contextlib
+import dataclasses
+import datetime
+import gc
+import json
+import pathlib
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+from typing import Any
+
+from bench_reduced_pattern import make_synthetic_draft
+from bench_reply_encoding import make_synthetic_pattern
+
+from seguin_loom_server import client_replies
+from seguin_loom_server.loom_server import LoomServer
+from seguin_loom_server.pattern_codec import encode_pattern
+from seguin_loom_server.pattern_database import PatternDatabase
+from seguin_loom_server.reduced_pattern import (
+    ReducedPattern,
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+DATADIR = pathlib.Path(__file__).parent.parent / "tests" / "data"
+
+# Number of rows in the pattern databases
+DATABASE_SIZES = (25, 1000, 100_000)
+
+# Number of calls per repeat for the database benchmarks
+NUM_DATABASE_CALLS = 50
+
+# Number of picks for the pick latency benchmark, normal and --quick
+NUM_LATENCY_PICKS = 2000
+QUICK_NUM_LATENCY_PICKS = 500
+
+# Number of repeats for the other benchmarks, normal and --quick
+NUM_REPEATS = 7
+QUICK_NUM_REPEATS = 3
+
+# Default regression threshold (fraction)
+DEFAULT_THRESHOLD = 0.1
+
+
+class Selector:
+    """Select benchmarks by name.
+
+    Parameters
+    ----------
+    patterns : list[str]
+        Select a benchmark if any of these is a substring of its name.
+        If empty, select all benchmarks.
+    """
+
+    def __init__(self, patterns: list[str]) -> None:
+        self.patterns = patterns
+
+    def __call__(self, bench_name: str) -> bool:
+        return not self.patterns or any(
+            pattern in bench_name for pattern in self.patterns
+        )
+
+
+@contextlib.contextmanager
+def gc_disabled() -> collections.abc.Iterator[None]:
+    """Context manager that disables garbage collection."""
+    gc.collect()
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def time_sync(func: collections.abc.Callable[[], Any], num_repeats: int) -> float:
+    """Return the minimum time per call of func() (sec).
+
+    Each repeat calls func enough times to take at least 0.2 seconds.
+    """
+    timer = timeit.Timer(func)
+    # autorange also warms up
+    num_calls, _ = timer.autorange()
+    # timeit disables garbage collection while timing
+    return min(timer.repeat(repeat=num_repeats, number=num_calls)) / num_calls
+
+
+async def time_async(
+    func: collections.abc.Callable[[], collections.abc.Awaitable[Any]],
+    num_repeats: int,
+    num_calls: int,
+) -> float:
+    """Return the minimum time per call of await func() (sec)."""
+    await func()
+    durations = []
+    with gc_disabled():
+        for _ in range(num_repeats):
+            t0 = time.perf_counter()
+            for _ in range(num_calls):
+                await func()
+            durations.append((time.perf_counter() - t0) / num_calls)
+    return min(durations)
+
+
+def read_test_patterns() -> dict[str, Any]:
+    """Read the full patterns in DATADIR; return a dict of name: data."""
+    return {
+        path.name: read_full_pattern(path)
+        for path in sorted(DATADIR.iterdir())
+        if path.suffix in (".dtx", ".wif")
+    }
+
+
+def bench_parse(num_repeats: int, selected: Selector) -> dict[str, float]:
+    """Time reduced_pattern_from_pattern_data."""
+    results = {}
+    drafts = {f"parse/{name}": data for name, data in read_test_patterns().items()} | {
+        "parse/synthetic liftplan": None,
+        "parse/synthetic tie-up and treadling": None,
+    }
+    for bench_name, data in drafts.items():
+        if not selected(bench_name):
+            continue
+        if data is None:
+            data = make_synthetic_draft(use_liftplan="liftplan" in bench_name)
+        results[bench_name] = time_sync(
+            lambda: reduced_pattern_from_pattern_data(name="benchmark", data=data),
+            num_repeats=num_repeats,
+        )
+    return results
+
+
+def bench_from_dict(num_repeats: int, selected: Selector) -> dict[str, float]:
+    """Time ReducedPattern.from_dict."""
+    results = {}
+    pattern_path = next(DATADIR.glob("*.wif"))
+    small_pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    large_pattern = make_synthetic_pattern()
+    for bench_name, pattern in (
+        (f"from_dict/{len(small_pattern.picks)} picks", small_pattern),
+        (f"from_dict/{len(large_pattern.picks)} picks", large_pattern),
+    ):
+        if not selected(bench_name):
+            continue
+        datadict = json.loads(pattern.to_json())
+        results[bench_name] = time_sync(
+            lambda: ReducedPattern.from_dict(datadict), num_repeats=num_repeats
+        )
+    return results
+
+
+async def fill_database(db: PatternDatabase, num_rows: int) -> list[str]:
+    """Add num_rows copies of a test pattern to a database, quickly.
+
+    Return the pattern names.
+    """
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    pattern_data = encode_pattern(pattern)
+    names = [f"pattern {i}" for i in range(num_rows)]
+    # Older than patterns added later
+    timestamp = time.time() - num_rows
+    await db.db.executemany(
+        "insert into patterns "
+        "(pattern_name, pattern_data, pick_number, repeat_number, timestamp_sec) "
+        "values (?, ?, ?, ?, ?)",
+        [(name, pattern_data, 0, 1, timestamp + i) for i, name in enumerate(names)],
+    )
+    await db.db.commit()
+    return names
+
+
+async def bench_database(num_repeats: int, selected: Selector) -> dict[str, float]:
+    """Time PatternDatabase add_pattern, get_pattern and update_pick_number.
+
+    The pattern cache is disabled, so get_pattern reads the database.
+    """
+    results = {}
+    for num_rows in DATABASE_SIZES:
+        bench_names = [
+            f"database/{operation} {num_rows} rows"
+            for operation in ("add_pattern", "get_pattern", "update_pick_number")
+        ]
+        if not any(selected(bench_name) for bench_name in bench_names):
+            continue
+        with tempfile.TemporaryDirectory() as tempdir:
+            async with PatternDatabase(
+                dbpath=pathlib.Path(tempdir) / "database.sqlite",
+                max_pattern_cache_nbytes=0,
+            ) as db:
+                names = await fill_database(db, num_rows=num_rows)
+                middle_name = names[num_rows // 2]
+                new_pattern = await db.get_pattern(middle_name)
+                new_pattern.name = "new pattern"
+                pick_number = 0
+
+                async def add_pattern() -> None:
+                    await db.add_pattern(new_pattern)
+
+                async def get_pattern() -> None:
+                    await db.get_pattern(middle_name)
+
+                async def update_pick_number() -> None:
+                    nonlocal pick_number
+                    pick_number += 1
+                    await db.update_pick_number(
+                        middle_name, pick_number=pick_number, repeat_number=1
+                    )
+
+                for bench_name, func in zip(
+                    bench_names, (add_pattern, get_pattern, update_pick_number)
+                ):
+                    if selected(bench_name):
+                        results[bench_name] = await time_async(
+                            func,
+                            num_repeats=num_repeats,
+                            num_calls=NUM_DATABASE_CALLS,
+                        )
+    return results
+
+
+def bench_reply_encoding(num_repeats: int, selected: Selector) -> dict[str, float]:
+    """Time client_replies.reply_to_json."""
+    results = {}
+    pattern = make_synthetic_pattern()
+    for bench_name, reply in (
+        (f"reply_to_json/ReducedPattern {len(pattern.picks)} picks", pattern),
+        (
+            "reply_to_json/CurrentPickNumber",
+            client_replies.CurrentPickNumber(pick_number=47, repeat_number=2),
+        ),
+        ("reply_to_json/LoomState", client_replies.LoomState.from_state_word(0x05)),
+        (
+            "reply_to_json/PatternNames 25 names",
+            client_replies.PatternNames(names=[f"pattern {i}" for i in range(25)]),
+        ),
+    ):
+        if selected(bench_name):
+            results[bench_name] = time_sync(
+                lambda: client_replies.reply_to_json(reply), num_repeats=num_repeats
+            )
+    return results
+
+
+async def bench_pick_latency(num_picks: int, selected: Selector) -> dict[str, float]:
+    """Time from the mock loom requesting a pick to it getting the =C command.
+
+    Return the median.
+    """
+    bench_name = "pick_latency/median =s to =C"
+    if not selected(bench_name):
+        return {}
+    pattern_path = next(DATADIR.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.TemporaryDirectory() as tempdir:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(tempdir) / "database.sqlite",
+        ) as loom_server:
+            await loom_server.add_pattern(pattern)
+            await loom_server.select_pattern(pattern.name)
+            mock_loom = loom_server.mock_loom
+            assert mock_loom is not None
+            current_pattern = loom_server.current_pattern
+            assert current_pattern is not None
+
+            # Find out when the mock loom receives the =C command
+            shafts_commanded = asyncio.Event()
+            report_shafts = mock_loom.report_shafts
+
+            async def report_shafts_and_notify() -> None:
+                shafts_commanded.set()
+                await report_shafts()
+
+            mock_loom.report_shafts = report_shafts_and_notify  # type: ignore
+
+            async def weave_pick() -> float:
+                # The loom server sends no =C command when it advances
+                # to the next repeat, so avoid the end of the pattern.
+                if current_pattern.pick_number == len(current_pattern.picks):
+                    current_pattern.pick_number = 0
+                shafts_commanded.clear()
+                t0 = time.perf_counter()
+                mock_loom.weave_cycle_completed = True
+                await mock_loom.report_state()
+                await shafts_commanded.wait()
+                return time.perf_counter() - t0
+
+            # Warm up
+            for _ in range(10):
+                await weave_pick()
+            with gc_disabled():
+                latencies = [await weave_pick() for _ in range(num_picks)]
+    return {bench_name: statistics.median(latencies)}
+
+
+async def run_suite(quick: bool, selected: Selector) -> dict[str, float]:
+    """Run the benchmarks; return a dict of name: duration (sec)."""
+    num_repeats = QUICK_NUM_REPEATS if quick else NUM_REPEATS
+    num_latency_picks = QUICK_NUM_LATENCY_PICKS if quick else NUM_LATENCY_PICKS
+    results: dict[str, float] = {}
+    for bench_func in (bench_parse, bench_from_dict, bench_reply_encoding):
+        new_results = bench_func(num_repeats, selected)
+        print_results(new_results)
+        results.update(new_results)
+    new_results = await bench_database(num_repeats, selected)
+    print_results(new_results)
+    results.update(new_results)
+    new_results = await bench_pick_latency(num_latency_picks, selected)
+    print_results(new_results)
+    results.update(new_results)
+    return results
+
+
+def format_duration(duration: float) -> str:
+    """Format a duration (sec) in µs, with a precision suited to its size."""
+    duration_us = duration * 1e6
+    return f"{duration_us:.3f}" if duration_us < 10 else f"{duration_us:.1f}"
+
+
+def print_results(results: dict[str, float]) -> None:
+    for bench_name, duration in results.items():
+        print(f"{bench_name:<60} {format_duration(duration):>14} µs", flush=True)
+
+
+def save_results(path: pathlib.Path, results: dict[str, float], quick: bool) -> None:
+    """Save results, and information about the environment, as JSON."""
+    data = dict(
+        created=datetime.datetime.now().isoformat(timespec="seconds"),
+        python=platform.python_version(),
+        platform=platform.platform(),
+        machine=platform.machine(),
+        quick=quick,
+        results=results,
+    )
+    path.write_text(json.dumps(data, indent=2))
+    print(f"Saved {len(results)} results to {path}")
+
+
+def load_results(path: pathlib.Path) -> dict[str, float]:
+    """Load results saved by save_results."""
+    data = json.loads(path.read_text())
+    print(
+        f"{path}: created {data['created']}, Python {data['python']}, "
+        f"{data['platform']}"
+    )
+    return data["results"]
+
+
+@dataclasses.dataclass
+class Comparison:
+    """The change in one benchmark, relative to the baseline."""
+
+    bench_name: str
+    baseline: float
+    current: float
+
+    @property
+    def change(self) -> float:
+        """Fractional change: positive if slower than the baseline."""
+        return self.current / self.baseline - 1
+
+
+def compare_results(
+    baseline: dict[str, float], current: dict[str, float], threshold: float
+) -> list[Comparison]:
+    """Print the change in each benchmark and return the regressions.
+
+    Parameters
+    ----------
+    baseline : dict[str, float]
+        Baseline results: name: duration (sec).
+    current : dict[str, float]
+        Current results: name: duration (sec).
+    threshold : float
+        A benchmark whose duration increased by more than this
+        fraction is a regression.
+    """
+    regressions = []
+    print(f"{'benchmark':<60} {'baseline µs':>14} {'current µs':>14} {'change':>8}")
+    for bench_name in sorted(baseline.keys() | current.keys()):
+        if bench_name not in current:
+            print(
+                f"{bench_name:<60} {format_duration(baseline[bench_name]):>14} "
+                f"{'not run':>14}"
+            )
+            continue
+        if bench_name not in baseline:
+            print(
+                f"{bench_name:<60} {'not run':>14} "
+                f"{format_duration(current[bench_name]):>14}"
+            )
+            continue
+        comparison = Comparison(
+            bench_name=bench_name,
+            baseline=baseline[bench_name],
+            current=current[bench_name],
+        )
+        flag = ""
+        if comparison.change > threshold:
+            flag = "REGRESSION"
+            regressions.append(comparison)
+        elif comparison.change < -threshold:
+            flag = "improved"
+        print(
+            f"{bench_name:<60} {format_duration(comparison.baseline):>14} "
+            f"{format_duration(comparison.current):>14} "
+            f"{comparison.change:+8.1%} {flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pick pipeline and compare to saved baselines."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "--save", type=pathlib.Path, help="Save the results to this JSON file."
+    )
+    compare_parser = subparsers.add_parser(
+        "compare",
+        help="Compare results to a baseline; exit with status 1 on regressions.",
+    )
+    compare_parser.add_argument(
+        "baseline", type=pathlib.Path, help="Baseline results, from run --save."
+    )
+    compare_parser.add_argument(
+        "current",
+        type=pathlib.Path,
+        nargs="?",
+        help="Current results, from run --save. If omitted, run the benchmarks.",
+    )
+    compare_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Report a regression if a benchmark is slower by more than "
+        "this fraction.",
+    )
+    run_parser.add_argument(
+        "names",
+        nargs="*",
+        help="Only run benchmarks whose names contain one of these strings.",
+    )
+    for subparser in (run_parser, compare_parser):
+        subparser.add_argument(
+            "--quick", action="store_true", help="Use fewer repeats; less stable."
+        )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = asyncio.run(
+            run_suite(quick=args.quick, selected=Selector(args.names))
+        )
+        if args.save is not None:
+            save_results(args.save, results, quick=args.quick)
+        return
+
+    baseline = load_results(args.baseline)
+    if args.current is not None:
+        current = load_results(args.current)
+    else:
+        # Only run the benchmarks in the baseline
+        current = asyncio.run(
+            run_suite(quick=args.quick, selected=Selector(list(baseline.keys())))
+        )
+    regressions = compare_results(baseline, current, threshold=args.threshold)
+    if regressions:
+        print(
+            f"{len(regressions)} regression(s) of more than {args.threshold:.0%}: "
+            + ", ".join(comparison.bench_name for comparison in regressions)
+        )
+        sys.exit(1)
+    print(f"No regressions of more than {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+__all__ = [
+    "DEFAULT_MAX_SEND_QUEUE_SIZE",
+    "ClientConnection",
+    "CloseCode",
+    "close_websocket",
+]
+
+import asyncio
+import collections
+import dataclasses
+import enum
+import itertools
+import time
+import traceback
+
+from fastapi import WebSocket
+
+from .latency_stats import LatencyHistogram
+
+# Default maximum number of messages waiting to be sent to a client
+DEFAULT_MAX_SEND_QUEUE_SIZE = 1000
+
+# Source of client connection ID numbers, for diagnostics
+_client_ids = itertools.count(1)
+
+
+class CloseCode(enum.IntEnum):
+    """WebSocket close codes
+
+    A small subset of
+    https://www.rfc-editor.org/rfc/rfc6455.html#section-7.4
+    """
+
+    NORMAL = 1000
+    GOING_AWAY = 1001
+    POLICY_VIOLATION = 1008
+    ERROR = 1011
+    TRY_AGAIN_LATER = 1013
+
+
+async def close_websocket(
+    ws: WebSocket, code: CloseCode = CloseCode.NORMAL, reason: str = ""
+) -> None:
+    """Close a websocket using best effort and a short timeout."""
+    try:
+        async with asyncio.timeout(0.1):
+            await ws.close(code, reason)
+    except Exception as e:
+        print(f"Failed to close websocket: {e!r}")
+
+
+@dataclasses.dataclass(slots=True)
+class _QueuedMessage:
+    """A message in a ClientConnection's send queue."""
+
+    message: str
+    coalesce_key: str | None
+    # time.monotonic() when the message was queued
+    queued_time: float
+    # True if superseded by a newer message with the same coalesce_key
+    superseded: bool = False
+
+
+class ClientConnection:
+    """A websocket connection to one client, with its own send queue.
+
+    `send` queues a message and returns immediately; a writer task
+    sends queued messages to the client in order. Thus a slow or stalled
+    client cannot delay the caller, or other clients.
+
+    Messages may be sent with a coalesce key, such as the reply type
+    of a reply that reports the complete state of something.
+    If a message with the same coalesce key is still waiting to be sent,
+    that older message is dropped and the new one is queued
+    (after all other waiting messages). Messages with no coalesce key
+    are never dropped. Thus a slow client gets the latest state,
+    without a backlog of stale states.
+
+    If the send queue is full, the client is not keeping up:
+    the writer task is stopped and the connection should be closed
+    (by calling `close`). The client can then reconnect.
+
+    Must be constructed while an event loop is running.
+
+    Parameters
+    ----------
+    websocket : WebSocket
+        The websocket, which must already be accepted.
+    max_send_queue_size : int
+        Maximum number of messages waiting to be sent.
+    verbose : bool
+        If True, print diagnostic information to stdout.
+    send_latency : LatencyHistogram | None
+        If not None, record the time from queuing each message
+        to finishing sending it.
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        max_send_queue_size: int = DEFAULT_MAX_SEND_QUEUE_SIZE,
+        verbose: bool = False,
+        send_latency: LatencyHistogram | None = None,
+    ) -> None:
+        self.websocket = websocket
+        self.max_send_queue_size = max_send_queue_size
+        self.verbose = verbose
+        self.send_latency = send_latency
+        self.client_id = next(_client_ids)
+        # Queued messages, including superseded messages,
+        # which are skipped by the writer task. Superseded messages are
+        # purged when they outnumber the others, so the length is bounded.
+        self._send_queue: collections.deque[_QueuedMessage] = collections.deque()
+        self._num_superseded = 0
+        # dict of coalesce key: the queued message with that key
+        self._coalescible_messages: dict[str, _QueuedMessage] = {}
+        self._message_queued_event = asyncio.Event()
+        # Number of messages waiting to be sent (not superseded)
+        self.queue_depth = 0
+        # Close code and reason, set if the client could not keep up
+        # or the writer task failed
+        self.close_code = CloseCode.NORMAL
+        self.close_reason = ""
+        # Diagnostics: the number of messages sent,
+        # the number of messages dropped because they were superseded,
+        # the number of messages rejected because the queue was full,
+        # and the maximum queue depth seen.
+        self.num_sent = 0
+        self.num_coalesced = 0
+        self.num_rejected = 0
+        self.max_queue_depth = 0
+        self.write_task = asyncio.create_task(self._write_loop())
+
+    @property
+    def is_open(self) -> bool:
+        """Return True if the writer task is running."""
+        return not self.write_task.done()
+
+    def send(self, message: str, coalesce_key: str | None = None) -> bool:
+        """Queue a message to send to the client, without waiting.
+
+        Parameters
+        ----------
+        message : str
+            The message to send.
+        coalesce_key : str | None
+            If not None, and a message with the same coalesce key
+            is waiting to be sent, drop that older message.
+
+        Returns
+        -------
+        queued : bool
+            True if the message was queued, False if the connection
+            is closed or the send queue is full. If the send queue is full,
+            also stop the writer task.
+        """
+        if not self.is_open:
+            return False
+        if coalesce_key is not None:
+            superseded_message = self._coalescible_messages.pop(coalesce_key, None)
+            if superseded_message is not None:
+                superseded_message.superseded = True
+                self.queue_depth -= 1
+                self.num_coalesced += 1
+                self._num_superseded += 1
+                if self._num_superseded > self.queue_depth:
+                    self._purge_superseded()
+        if self.queue_depth >= self.max_send_queue_size:
+            print(
+                f"Client {self.client_id} is not keeping up: "
+                f"{self.queue_depth} messages waiting to be sent; "
+                "disconnecting it"
+            )
+            self.close_code = CloseCode.TRY_AGAIN_LATER
+            self.close_reason = "client is not keeping up"
+            self.num_rejected += 1
+            self.write_task.cancel()
+            return False
+        queued_message = _QueuedMessage(
+            message=message, coalesce_key=coalesce_key, queued_time=time.monotonic()
+        )
+        self._send_queue.append(queued_message)
+        if coalesce_key is not None:
+            self._coalescible_messages[coalesce_key] = queued_message
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        self._message_queued_event.set()
+        return True
+
+    async def close(self) -> None:
+        """Stop the writer task and close the websocket."""
+        self.write_task.cancel()
+        await asyncio.wait([self.write_task])
+        await close_websocket(
+            self.websocket, code=self.close_code, reason=self.close_reason
+        )
+
+    @property
+    def send_queue_length(self) -> int:
+        """Return the length of the send queue, including superseded
+        messages that have not yet been purged."""
+        return len(self._send_queue)
+
+    def _purge_superseded(self) -> None:
+        """Remove superseded messages from the send queue."""
+        self._send_queue = collections.deque(
+            queued_message
+            for queued_message in self._send_queue
+            if not queued_message.superseded
+        )
+        self._num_superseded = 0
+
+    async def _write_loop(self) -> None:
+        """Send queued messages to the client."""
+        try:
+            while True:
+                if not self._send_queue:
+                    self._message_queued_event.clear()
+                    await self._message_queued_event.wait()
+                    continue
+                queued_message = self._send_queue.popleft()
+                if queued_message.superseded:
+                    self._num_superseded -= 1
+                    continue
+                self.queue_depth -= 1
+                if queued_message.coalesce_key is not None:
+                    del self._coalescible_messages[queued_message.coalesce_key]
+                await self.websocket.send_text(queued_message.message)
+                self.num_sent += 1
+                if self.send_latency is not None:
+                    self.send_latency.record(
+                        time.monotonic() - queued_message.queued_time
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if self.verbose:
+                print(f"Failed to send to client {self.client_id}: {e!r}")
+                traceback.print_exc()
+            self.close_code = CloseCode.ERROR
+            self.close_reason = f"send failed: {e!r}"
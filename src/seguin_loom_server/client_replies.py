@@ -2,6 +2,44 @@ from __future__ import annotations
 
 import dataclasses
 import enum
+import json
+from typing import Any
+
+# Types of replies that report the complete state of something,
+# so a reply that has not yet been sent may be dropped
+# in favor of a newer reply of the same type.
+# Never include CommandProblem (each one is distinct)
+# or ReducedPattern (which is large, and sent only on request).
+COALESCIBLE_REPLY_TYPES = frozenset(
+    (
+        "CurrentPickNumber",
+        "LoomConnectionState",
+        "LoomState",
+        "PatternNames",
+        "WeaveDirection",
+    )
+)
+
+
+def reply_to_json(reply: Any) -> str:
+    """Encode a reply to the client as compact JSON.
+
+    Use the reply's ``to_json`` method, if it has one.
+    Otherwise encode a shallow dict of the reply's fields
+    (which must not include dataclasses), which is much faster
+    than calling `dataclasses.asdict` first.
+    """
+    to_json = getattr(reply, "to_json", None)
+    if to_json is not None:
+        return to_json()
+    reply_dict = {
+        field.name: getattr(reply, field.name) for field in dataclasses.fields(reply)
+    }
+    return json.dumps(reply_dict, separators=(",", ":"), ensure_ascii=False)
+
+
+def _bool_to_json(value: bool) -> str:
+    return "true" if value else "false"
 
 
 class ConnectionStateEnum(enum.IntEnum):
@@ -38,6 +76,12 @@ class CurrentPickNumber:
     pick_number: int
     repeat_number: int
 
+    def to_json(self) -> str:
+        return (
+            f'{{"type":"CurrentPickNumber","pick_number":{self.pick_number:d},'
+            f'"repeat_number":{self.repeat_number:d}}}'
+        )
+
 
 @dataclasses.dataclass
 class LoomConnectionState:
@@ -65,6 +109,13 @@ class LoomState:
     cycle_complete: bool
     error: bool
 
+    def to_json(self) -> str:
+        return (
+            f'{{"type":"LoomState","shed_closed":{_bool_to_json(self.shed_closed)},'
+            f'"cycle_complete":{_bool_to_json(self.cycle_complete)},'
+            f'"error":{_bool_to_json(self.error)}}}'
+        )
+
     @classmethod
     def from_state_word(cls, state_word: int) -> LoomState:
         """Construct a LoomState from the state value of the =s reply."""
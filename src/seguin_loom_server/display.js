@@ -114,7 +114,16 @@ Data for a pick
 class Pick {
     constructor(datadict) {
         this.color = datadict.color
-        this.are_shafts_up = datadict.are_shafts_up
+        this.shaft_word = datadict.shaft_word
+        this.num_shafts = datadict.num_shafts
+        // Unpack shaft_word into one bool per shaft.
+        // Use arithmetic because bitwise operators only handle 32 bits.
+        this.are_shafts_up = []
+        var word = this.shaft_word
+        for (let i = 0; i < this.num_shafts; ++i) {
+            this.are_shafts_up.push(word % 2 == 1)
+            word = Math.floor(word / 2)
+        }
     }
 }
 
@@ -145,7 +154,7 @@ The result might be a nice -- each assignment would be a single line.
 
 class LoomClient {
     constructor() {
-        this.ws = new WebSocket("ws")
+        this.ws = new WebSocket(WebSocketPath)
         this.weavingPattern = null
         this.weaveForward = true
         this.loomConnectionState = ConnectionStateEnum.disconnected
@@ -0,0 +1,163 @@
+from __future__ import annotations
+
+__all__ = ["LatencyHistogram", "LatencyStats"]
+
+import bisect
+import math
+from collections.abc import Iterable
+from typing import Any
+
+# Quantiles reported by LatencyHistogram.as_dict
+REPORTED_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """Histogram of durations, with logarithmically spaced buckets.
+
+    Recording a duration is cheap (a binary search and a few additions)
+    and memory use is fixed, so it is safe to record every event.
+    Quantiles are estimated as the upper edge of the bucket that
+    contains the quantile, so are accurate to within one bucket width.
+
+    Parameters
+    ----------
+    min_duration : float
+        Upper edge of the first bucket (sec).
+    max_duration : float
+        Durations larger than this go in the overflow bucket (sec).
+    buckets_per_decade : int
+        Number of buckets per factor of 10.
+    """
+
+    def __init__(
+        self,
+        min_duration: float = 1e-6,
+        max_duration: float = 100,
+        buckets_per_decade: int = 10,
+    ) -> None:
+        num_edges = (
+            round(buckets_per_decade * math.log10(max_duration / min_duration)) + 1
+        )
+        # Upper edges of the buckets; the last bucket (overflow) has no edge
+        self.bucket_edges = [
+            min_duration * 10 ** (i / buckets_per_decade) for i in range(num_edges)
+        ]
+        self.reset()
+
+    def reset(self) -> None:
+        """Forget all recorded durations."""
+        self.counts = [0] * (len(self.bucket_edges) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, duration: float) -> None:
+        """Record a duration (sec)."""
+        self.counts[bisect.bisect_left(self.bucket_edges, duration)] += 1
+        self.count += 1
+        self.sum += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+
+    @property
+    def mean(self) -> float:
+        """The mean duration (sec); nan if no durations recorded."""
+        return self.sum / self.count if self.count > 0 else math.nan
+
+    def quantile(self, q: float) -> float:
+        """Estimate the specified quantile (sec); nan if no durations.
+
+        Parameters
+        ----------
+        q : float
+            The quantile, e.g. 0.5 for the median and 0.99 for p99.
+        """
+        if self.count == 0:
+            return math.nan
+        threshold = q * self.count
+        cumulative_count = 0
+        for i, count in enumerate(self.counts):
+            cumulative_count += count
+            if cumulative_count >= threshold and cumulative_count > 0:
+                if i >= len(self.bucket_edges):
+                    return self.max
+                return min(self.bucket_edges[i], self.max)
+        return self.max
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return a summary as a dict (durations in seconds).
+
+        Includes count, sum, min, max, mean, quantiles
+        (p50, p90, p99, p99.9) and the non-empty buckets,
+        as a list of [upper edge, count]; the edge of the
+        overflow bucket is None.
+        """
+        if self.count == 0:
+            return dict(count=0)
+        result: dict[str, Any] = dict(
+            count=self.count,
+            sum=self.sum,
+            min=self.min,
+            max=self.max,
+            mean=self.mean,
+        )
+        for q in REPORTED_QUANTILES:
+            result[f"p{q * 100:g}"] = self.quantile(q)
+        result["buckets"] = [
+            [self.bucket_edges[i] if i < len(self.bucket_edges) else None, count]
+            for i, count in enumerate(self.counts)
+            if count > 0
+        ]
+        return result
+
+
+class LatencyStats:
+    """A set of named latency histograms.
+
+    Parameters
+    ----------
+    names : Iterable[str]
+        Histogram names, in display order.
+    """
+
+    def __init__(self, names: Iterable[str]) -> None:
+        self.histograms = {name: LatencyHistogram() for name in names}
+
+    def record(self, name: str, duration: float) -> None:
+        """Record a duration (sec) in the named histogram."""
+        self.histograms[name].record(duration)
+
+    def reset(self) -> None:
+        """Forget all recorded durations."""
+        for histogram in self.histograms.values():
+            histogram.reset()
+
+    @property
+    def count(self) -> int:
+        """The total number of durations recorded."""
+        return sum(histogram.count for histogram in self.histograms.values())
+
+    def as_dict(self) -> dict[str, dict[str, Any]]:
+        """Return a dict of name: histogram summary; see
+        `LatencyHistogram.as_dict`."""
+        return {name: hist.as_dict() for name, hist in self.histograms.items()}
+
+    def format_table(self) -> str:
+        """Format a summary as a table, with durations in µs."""
+        lines = [
+            f"{'stage':<16} {'count':>8} {'mean':>10} {'p50':>10} "
+            f"{'p99':>10} {'max':>10}"
+        ]
+        for name, hist in self.histograms.items():
+            if hist.count == 0:
+                lines.append(f"{name:<16} {0:>8}")
+                continue
+            lines.append(
+                f"{name:<16} {hist.count:>8} {hist.mean * 1e6:10.1f} "
+                f"{hist.quantile(0.5) * 1e6:10.1f} {hist.quantile(0.99) * 1e6:10.1f} "
+                f"{hist.max * 1e6:10.1f}"
+            )
+        return "\n".join(lines)
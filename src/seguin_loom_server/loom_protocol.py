@@ -0,0 +1,363 @@
+from __future__ import annotations
+
+__all__ = [
+    "COMMAND_PARSERS",
+    "MAX_CACHED_MESSAGES",
+    "MAX_MESSAGE_LENGTH",
+    "READ_SIZE",
+    "REPLY_PARSERS",
+    "DirectionCommand",
+    "DirectionReply",
+    "InvalidMessage",
+    "LoomProtocol",
+    "OobCommand",
+    "ShaftsCommand",
+    "ShaftsReply",
+    "StateCommand",
+    "StateReply",
+    "VersionCommand",
+    "VersionReply",
+    "read_messages",
+]
+
+import asyncio
+import collections
+import dataclasses
+import time
+from collections.abc import AsyncIterator, Callable, Mapping
+from typing import Any, TypeAlias
+
+from .loom_constants import TERMINATOR
+from .mock_streams import StreamReaderType
+
+# Maximum length of a message, excluding the terminator.
+# Real messages are much shorter; this limits the buffer size
+# if the loom sends garbage with no terminator.
+MAX_MESSAGE_LENGTH = 256
+
+# Maximum number of bytes to read at one time in `read_messages`
+READ_SIZE = 4096
+
+# Maximum number of parsed messages cached by LoomProtocol.
+# Messages are immutable, and a loom sends the same few
+# state and direction replies over and over.
+MAX_CACHED_MESSAGES = 1000
+
+_TERMINATOR_INT = TERMINATOR[0]
+_PREFIX_INT = ord("=")
+
+
+# Replies from the loom
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ShaftsReply:
+    """=c: the shafts that are raised, as a bit mask (bit 0 = shaft 1)."""
+
+    shaft_word: int
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class DirectionReply:
+    """=u: the weave direction (=u0 is forward, =u1 is backward)."""
+
+    weave_forward: bool
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class StateReply:
+    """=s: the loom state, as a bit mask.
+
+    See `client_replies.LoomState.from_state_word` for the bits.
+    """
+
+    state_word: int
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class VersionReply:
+    """=v: the loom's firmware version."""
+
+    version: str
+
+
+# Commands to the loom
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ShaftsCommand:
+    """=C: raise the specified shafts, as a bit mask (bit 0 = shaft 1)."""
+
+    shaft_word: int
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class DirectionCommand:
+    """=U: set the weave direction (=U0 is forward, =U1 is backward)."""
+
+    weave_forward: bool
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class VersionCommand:
+    """=V: request the firmware version."""
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class StateCommand:
+    """=Q: request the loom state."""
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class OobCommand:
+    """=#: out of band command, specific to the mock loom."""
+
+    command: str
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class InvalidMessage:
+    """A message that could not be parsed.
+
+    Parameters
+    ----------
+    message : str
+        The message, stripped of whitespace and the terminator.
+    reason : str
+        Why the message is invalid.
+    """
+
+    message: str
+    reason: str
+
+
+Message: TypeAlias = Any
+MessageParser: TypeAlias = Callable[[bytes], Message]
+
+
+def _parse_hex(data: bytes) -> int:
+    try:
+        return int(data, base=16)
+    except ValueError:
+        raise ValueError("data is not a hex value")
+
+
+def _make_direction_parser(
+    message_class: type[DirectionReply] | type[DirectionCommand],
+) -> MessageParser:
+    """Make a parser for a direction message, whose data is 0 or 1."""
+    messages = {
+        b"0": message_class(weave_forward=True),
+        b"1": message_class(weave_forward=False),
+    }
+
+    def parse_direction(data: bytes) -> Message:
+        message = messages.get(data)
+        if message is None:
+            raise ValueError("direction must be 0 or 1")
+        return message
+
+    return parse_direction
+
+
+# Dispatch tables of message code (the byte after "="): parser.
+# Each parser is called with the data after the code,
+# and returns a message or raises ValueError with the reason.
+# Messages with other codes are ignored.
+REPLY_PARSERS: dict[int, MessageParser] = {
+    ord("c"): lambda data: ShaftsReply(shaft_word=_parse_hex(data)),
+    ord("u"): _make_direction_parser(DirectionReply),
+    ord("s"): lambda data: StateReply(state_word=_parse_hex(data)),
+    ord("v"): lambda data: VersionReply(version=data.decode(errors="replace")),
+}
+
+COMMAND_PARSERS: dict[int, MessageParser] = {
+    ord("C"): lambda data: ShaftsCommand(shaft_word=_parse_hex(data)),
+    ord("U"): _make_direction_parser(DirectionCommand),
+    ord("V"): lambda data: VersionCommand(),
+    ord("Q"): lambda data: StateCommand(),
+    ord("#"): lambda data: OobCommand(command=data.decode(errors="replace")),
+}
+
+
+class LoomProtocol(asyncio.Protocol):
+    """Split a byte stream into loom messages and parse them.
+
+    Accepts data in arbitrary chunks: a chunk may contain
+    part of a message, or many messages. Messages are terminated
+    by `TERMINATOR` and have the form "=" + code + data;
+    leading and trailing whitespace is ignored.
+    Parsed messages are appended to `messages`.
+    Messages are split out of the buffered data using memoryview slices,
+    and parsed using a dispatch table of message code: parser.
+    Parsed messages are immutable, so they are cached by message bytes.
+
+    The same protocol works with any transport: use it directly
+    with a transport (e.g. serial_asyncio.create_serial_connection),
+    or feed it from a stream reader with `read_messages`
+    (which works with both serial and mock streams).
+
+    Parameters
+    ----------
+    parsers : Mapping[int, MessageParser]
+        Dispatch table of message code: parser;
+        use `REPLY_PARSERS` to read from a loom,
+        or `COMMAND_PARSERS` to read commands sent to a loom.
+    max_message_length : int
+        Maximum message length, excluding the terminator.
+        Longer messages are discarded and reported as InvalidMessage.
+    """
+
+    def __init__(
+        self,
+        parsers: Mapping[int, MessageParser],
+        max_message_length: int = MAX_MESSAGE_LENGTH,
+    ) -> None:
+        self.parsers = parsers
+        self.max_message_length = max_message_length
+        self.messages: collections.deque[Message] = collections.deque()
+        self.transport: asyncio.BaseTransport | None = None
+        self.eof = False
+        # time.monotonic() when data was last received
+        self.data_received_time = 0.0
+        # Diagnostics
+        self.num_bytes = 0
+        self.num_messages = 0
+        self.num_invalid = 0
+        self.num_ignored = 0
+        self._buffer = bytearray()
+        # Index in _buffer at which to search for the terminator;
+        # the data before it is known to contain no terminator.
+        self._search_start = 0
+        # True if discarding the rest of a message that was too long
+        self._discarding = False
+        # dict of unstripped message bytes: parsed message
+        self._message_cache: dict[bytes, Message] = {}
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = transport
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.eof_received()
+
+    def eof_received(self) -> bool | None:
+        """Handle end of file.
+
+        Report any unterminated data as an invalid message.
+        """
+        self.eof = True
+        if self._buffer and not self._discarding:
+            self._append_invalid(bytes(self._buffer), "no terminator")
+        self._buffer.clear()
+        self._search_start = 0
+        self._discarding = False
+        return None
+
+    def data_received(self, data: bytes) -> None:
+        """Parse the complete messages in data and buffer the rest."""
+        self.data_received_time = time.monotonic()
+        self.num_bytes += len(data)
+        buffer = self._buffer
+        buffer += data
+        end = buffer.find(_TERMINATOR_INT, self._search_start)
+        if end < 0:
+            if len(buffer) > self.max_message_length:
+                if not self._discarding:
+                    self._append_invalid(bytes(buffer), "too long")
+                    self._discarding = True
+                buffer.clear()
+            self._search_start = len(buffer)
+            return
+
+        start = 0
+        if self._discarding:
+            # Skip the rest of a message that was too long
+            self._discarding = False
+            start = end + 1
+            end = buffer.find(_TERMINATOR_INT, start)
+        messages = self.messages
+        message_cache = self._message_cache
+        with memoryview(buffer) as view:
+            while end >= 0:
+                if end - start > self.max_message_length:
+                    self._append_invalid(view[start:end].tobytes(), "too long")
+                else:
+                    frame = view[start:end].tobytes()
+                    message = message_cache.get(frame)
+                    if message is None:
+                        self._parse_frame(frame)
+                    else:
+                        self.num_messages += 1
+                        messages.append(message)
+                start = end + 1
+                end = buffer.find(_TERMINATOR_INT, start)
+        del buffer[:start]
+        self._search_start = len(buffer)
+
+    def _parse_frame(self, frame: bytes) -> None:
+        """Parse one message, without the terminator, and cache it."""
+        message_bytes = frame.strip()
+        if len(message_bytes) < 2:
+            self._append_invalid(message_bytes, "less than 2 chars")
+            return
+        if message_bytes[0] != _PREFIX_INT:
+            self._append_invalid(message_bytes, "no leading '='")
+            return
+        parser = self.parsers.get(message_bytes[1])
+        if parser is None:
+            self.num_ignored += 1
+            return
+        try:
+            message = parser(message_bytes[2:])
+        except ValueError as e:
+            self._append_invalid(message_bytes, str(e))
+            return
+        if len(self._message_cache) >= MAX_CACHED_MESSAGES:
+            self._message_cache.clear()
+        self._message_cache[frame] = message
+        self.num_messages += 1
+        self.messages.append(message)
+
+    def _append_invalid(self, message: bytes, reason: str) -> None:
+        self.num_invalid += 1
+        self.messages.append(
+            InvalidMessage(message=message.decode(errors="replace"), reason=reason)
+        )
+
+
+async def read_messages(
+    reader: StreamReaderType,
+    protocol: LoomProtocol,
+    read_size: int = READ_SIZE,
+    data_callback: Callable[[bytes], None] | None = None,
+) -> AsyncIterator[Message]:
+    """Read data from a stream, parse it, and yield the messages.
+
+    Reads as much data as is available (up to read_size bytes) at a time,
+    rather than one message at a time.
+    Stops at end of file.
+
+    Parameters
+    ----------
+    reader : StreamReaderType
+        The stream to read.
+    protocol : LoomProtocol
+        The protocol used to parse the data.
+    read_size : int
+        The maximum number of bytes to read at one time.
+    data_callback : Callable[[bytes], None] | None
+        If not None, call this with each chunk of data read,
+        before parsing it (e.g. to record the raw data).
+    """
+    while True:
+        data = await reader.read(read_size)
+        if data:
+            if data_callback is not None:
+                data_callback(data)
+            protocol.data_received(data)
+        else:
+            protocol.eof_received()
+        while protocol.messages:
+            yield protocol.messages.popleft()
+        if not data:
+            return
@@ -3,61 +3,154 @@ from __future__ import annotations
 __all__ = ["LoomServer", "DEFAULT_DATABASE_PATH"]
 
 import asyncio
+import collections
+import collections.abc
+import concurrent.futures
 import dataclasses
-import enum
-import io
+import functools
 import json
+import multiprocessing
 import pathlib
+import random
 import tempfile
+import time
 import traceback
 from types import SimpleNamespace, TracebackType
 from typing import Any, Type
 
-from dtx_to_wif import read_dtx, read_wif
 from fastapi import WebSocket, WebSocketDisconnect
 from serial_asyncio import open_serial_connection  # type: ignore
 
-from . import client_replies
+from . import client_replies, loom_protocol
+from .client_connection import ClientConnection, CloseCode, close_websocket
 from .client_replies import MessageSeverityEnum
+from .latency_stats import LatencyHistogram, LatencyStats
 from .loom_constants import BAUD_RATE, TERMINATOR
-from .mock_loom import MockLoom
+from .metrics import MetricsWriter
+from .mock_loom import MockLoom, MockLoomTiming
 from .mock_streams import StreamReaderType, StreamWriterType
-from .pattern_database import PatternDatabase
-from .reduced_pattern import Pick, ReducedPattern, reduced_pattern_from_pattern_data
+from .pattern_database import PatternDatabase, compute_file_digest
+from .pick_persister import PickPersister
+from .reduced_pattern import ReducedPattern, reduced_pattern_from_file_data
+from .session_recorder import RecordType, SessionRecorder
 
 # The maximum number of patterns that can be in the history
 MAX_PATTERNS = 25
 
-DEFAULT_DATABASE_PATH = pathlib.Path(tempfile.gettempdir()) / "pattern_database.sqlite"
+# The maximum size of an uploaded pattern file (characters)
+MAX_PATTERN_FILE_SIZE = 20_000_000
 
-MOCK_PORT_NAME = "mock"
+# The maximum number of processes used to read pattern files
+MAX_PATTERN_READ_WORKERS = 2
 
+# The maximum time to read a pattern file (sec)
+PATTERN_READ_TIMEOUT = 60
 
-class CloseCode(enum.IntEnum):
-    """WebSocket close codes
+# Interval between progress reports while reading a pattern file (sec)
+PATTERN_READ_PROGRESS_INTERVAL = 2
 
-    A small subset of
-    https://www.rfc-editor.org/rfc/rfc6455.html#section-7.4
-    """
+SUPPORTED_PATTERN_SUFFIXES = (".dtx", ".wif")
+
+DEFAULT_DATABASE_PATH = pathlib.Path(tempfile.gettempdir()) / "pattern_database.sqlite"
+
+MOCK_PORT_NAME = "mock"
 
-    NORMAL = 1000
-    GOING_AWAY = 1001
-    ERROR = 1011
+# Port name for a mock loom that communicates through a pseudo-terminal,
+# which exercises the serial I/O code
+PTY_MOCK_PORT_NAME = "mockpty"
+
+# Interval over which the pick rate is measured (sec)
+PICK_RATE_INTERVAL = 60
+
+# Delay before the first attempt to reconnect to the loom (sec).
+# The delay doubles after each failed attempt, up to RECONNECT_MAX_DELAY,
+# and each delay is randomly reduced by up to half (jitter).
+RECONNECT_INITIAL_DELAY = 0.5
+
+# Maximum delay between attempts to reconnect to the loom (sec)
+RECONNECT_MAX_DELAY = 30.0
+
+# Time to wait for the loom to acknowledge an =C command
+# by reporting the raised shafts with =c (sec)
+SHAFT_ECHO_TIMEOUT = 2.0
+
+# Maximum number of times to resend an unacknowledged =C command
+MAX_SHAFT_COMMAND_RETRIES = 2
+
+# Maximum number of unacknowledged =C commands to track
+MAX_UNACKNOWLEDGED_SHAFT_COMMANDS = 10
+
+# Names of the latency statistics recorded by LoomServer.
+# The first stages time handling a pick request from the loom
+# (an =s reply with the cycle complete bit set); each is timed
+# from the end of the previous stage:
+#
+# * read: from receiving the data to starting to handle the reply
+# * decode: decode the state word and report the loom state
+# * increment: increment the pick number
+# * write: write the =C command to the loom and drain
+# * report: report the new pick number (and schedule saving it)
+# * pick_request: from receiving the data to finishing the write;
+#   the time the loom waits for us
+#
+# The rest are recorded independently:
+#
+# * shaft_echo: from writing an =C command to reading
+#   the matching =c reply; the command to actuation latency
+# * db_update: save a pick number in the pattern database
+# * client_send: from queuing a reply for a client to sending it
+LATENCY_NAMES = (
+    "read",
+    "decode",
+    "increment",
+    "write",
+    "report",
+    "pick_request",
+    "shaft_echo",
+    "db_update",
+    "client_send",
+)
 
 
 class CommandError(Exception):
     pass
 
 
-async def close_websocket(
-    ws: WebSocket, code: CloseCode = CloseCode.NORMAL, reason: str = ""
-) -> None:
-    """Close a websocket using best effort and a short timeout."""
-    try:
-        async with asyncio.timeout(0.1):
-            await ws.close(code, reason)
-    except Exception as e:
-        print(f"Failed to close websocket: {e!r}")
+@dataclasses.dataclass(slots=True)
+class ShaftCommand:
+    """An =C command that the loom has not yet acknowledged."""
+
+    shaft_word: int
+    # The encoded command, including the terminator
+    command: bytes
+    # time.monotonic() when the command was (most recently) sent
+    sent_time: float
+    num_retries: int = 0
+
+
+def compute_reconnect_delay(
+    attempt: int,
+    initial_delay: float = RECONNECT_INITIAL_DELAY,
+    max_delay: float = RECONNECT_MAX_DELAY,
+) -> float:
+    """Compute the delay before an attempt to reconnect to the loom.
+
+    Uses exponential backoff with jitter: the nominal delay is
+    initial_delay * 2**attempt, limited to max_delay,
+    and the returned delay is a random value between half
+    the nominal delay and the nominal delay.
+
+    Parameters
+    ----------
+    attempt : int
+        The number of failed attempts so far (0 for the first attempt).
+    initial_delay : float
+        Nominal delay for the first attempt (sec).
+    max_delay : float
+        Maximum nominal delay (sec).
+    """
+    nominal_delay = min(initial_delay * 2 ** min(attempt, 32), max_delay)
+    return random.uniform(nominal_delay / 2, nominal_delay)
 
 
 class LoomServer:
@@ -66,11 +159,37 @@ class LoomServer:
     The preferred way to create and run a LoomServer is to call
     LoomServer.amain(...).
 
+    Any number of clients may connect. Every reply is sent to all
+    connected clients (other than the initial state, which is sent
+    only to the newly connected client), and commands are accepted
+    from any client. Each client has its own send queue
+    (see `ClientConnection`), so a slow client cannot delay
+    the loom or other clients.
+
+    If the connection to the loom is lost (for instance because
+    a USB serial adapter drops out), the server reconnects
+    with exponential backoff (see `compute_reconnect_delay`),
+    requests the loom state, and resends the current pick
+    if the loom had not finished weaving it.
+
+    The loom acknowledges each =C (raise shafts) command with an =c reply.
+    The server reports a problem if the raised shafts do not match
+    the command, and resends the command if it is not acknowledged
+    in time (see `handle_shafts_reply` and `retry_shaft_command`).
+    The first =c reply after connecting is ignored, since the loom
+    reports its raised shafts when the connection is made.
+
+    If session_path is specified, the server records the patterns
+    in the database, and all traffic with the loom and the clients,
+    with a `SessionRecorder`. Replay a recording with `session_replay`.
+
     Parameters
     ----------
     serial_port : str
         The name of the serial port, e.g. "/dev/tty0".
         If the name is "mock" then use a mock loom.
+        If the name is "mockpty" then use a mock loom connected
+        through a pseudo-terminal (see `PtyMockLoom`).
     reset_db : bool
         If True, delete the old database and create a new one.
         A rescue aid, in case the database gets corrupted.
@@ -79,6 +198,20 @@ class LoomServer:
     db_path : pathlib.Path
         Path to pattern database.
         Intended for unit tests, to avoid stomping on the real database.
+    mock_loom_timing : MockLoomTiming | None
+        Timing model for the mock loom; ignored unless serial_port
+        is "mock" or "mockpty". If None the mock loom replies instantly.
+        Intended for benchmarks and tests.
+    session_path : pathlib.Path | None
+        Path of the session file in which to record loom and client
+        traffic; None to not record.
+
+    Attributes
+    ----------
+    mock_loom_factory : Callable[..., MockLoom] | None
+        Callable that creates a mock loom, given arguments verbose
+        and timing; None if serial_port is not a mock port name.
+        Settable before the server is started, e.g. to replay a session.
     """
 
     def __init__(
@@ -87,30 +220,104 @@ class LoomServer:
         reset_db: bool,
         verbose: bool,
         db_path: pathlib.Path = DEFAULT_DATABASE_PATH,
+        mock_loom_timing: MockLoomTiming | None = None,
+        session_path: pathlib.Path | None = None,
     ) -> None:
         if verbose:
             print(
-                f"LoomServer({serial_port=!r}, {reset_db=!r}, {verbose=!r}, {db_path=!r})"
+                f"LoomServer({serial_port=!r}, {reset_db=!r}, {verbose=!r}, "
+                f"{db_path=!r}, {session_path=!r})"
             )
         self.serial_port = serial_port
-        self.websocket: WebSocket | None = None
+        # Connected clients
+        self.clients: set[ClientConnection] = set()
+        # Latency statistics; see LATENCY_NAMES
+        self.latency_stats = LatencyStats(LATENCY_NAMES)
+        # Counters for metrics; see add_metrics
+        self.num_picks_commanded = 0
+        # Event loop time of each pick commanded
+        # in the last PICK_RATE_INTERVAL seconds
+        self.recent_pick_times: collections.deque[float] = collections.deque()
+        # Number of replies from the loom, by reply type
+        self.num_loom_replies: collections.Counter[type] = collections.Counter()
+        self.num_loom_connections = 0
+        self.num_shaft_echo_mismatches = 0
+        self.num_shaft_command_retries = 0
+        self.num_shaft_command_failures = 0
+        # Messages sent, coalesced and rejected by disconnected clients
+        self.num_closed_client_messages_sent = 0
+        self.num_closed_client_messages_coalesced = 0
+        self.num_closed_client_messages_rejected = 0
+        # Largest send queue depth of any disconnected client
+        self.max_closed_client_queue_depth = 0
+        self.num_pattern_files_read = 0
+        self.pattern_file_size_total = 0
+        self.pattern_read_duration = LatencyHistogram(
+            min_duration=1e-3, max_duration=10 * PATTERN_READ_TIMEOUT
+        )
         self.pattern_db = PatternDatabase(db_path)
+        self.pick_persister = PickPersister(
+            self.pattern_db,
+            latency_histogram=self.latency_stats.histograms["db_update"],
+        )
         self.verbose = verbose
         self.db_path = db_path
         if reset_db:
             db_path.unlink(missing_ok=True)
         self.loom_connecting = False
         self.loom_disconnecting = False
-        self.client_connected = False
+        self.is_closing = False
+        # True if a pick was commanded and the loom has not yet
+        # requested the next pick, so the pick must be resent
+        # after reconnecting
+        self.pick_in_progress = False
+        self.reconnect_initial_delay = RECONNECT_INITIAL_DELAY
+        self.reconnect_max_delay = RECONNECT_MAX_DELAY
+        self.reconnect_task: asyncio.Future = asyncio.Future()
+        self.reconnect_task.set_result(None)
+        # =C commands the loom has not yet acknowledged, oldest first
+        self.unacknowledged_shaft_commands: collections.deque[ShaftCommand] = (
+            collections.deque(maxlen=MAX_UNACKNOWLEDGED_SHAFT_COMMANDS)
+        )
+        self.shaft_echo_timeout = SHAFT_ECHO_TIMEOUT
+        self.max_shaft_command_retries = MAX_SHAFT_COMMAND_RETRIES
+        self.shaft_echo_timer: asyncio.TimerHandle | None = None
+        # True if no =c reply has been read since the connection was made,
+        # so the next one is the loom reporting its shafts on connection,
+        # rather than acknowledging an =C command
+        self.awaiting_first_shafts_reply = False
+        self.retry_shaft_command_task: asyncio.Future = asyncio.Future()
+        self.retry_shaft_command_task.set_result(None)
         self.mock_loom: MockLoom | None = None
+        self.mock_loom_timing = mock_loom_timing
+        self.mock_loom_factory: collections.abc.Callable[..., MockLoom] | None = None
+        if serial_port == MOCK_PORT_NAME:
+            self.mock_loom_factory = MockLoom
+        elif serial_port == PTY_MOCK_PORT_NAME:
+            # Import here because pseudo-terminals are not supported on Windows
+            from .pty_mock_loom import PtyMockLoom
+
+            self.mock_loom_factory = PtyMockLoom
+        self.session_recorder: SessionRecorder | None = None
+        if session_path is not None:
+            self.session_recorder = SessionRecorder(session_path)
         self.loom_reader: StreamReaderType | None = None
         self.loom_writer: StreamWriterType | None = None
-        self.read_client_task: asyncio.Future = asyncio.Future()
         self.read_loom_task: asyncio.Future = asyncio.Future()
+        self.add_uploads_task: asyncio.Future = asyncio.Future()
+        # Queue of (file name, file data, file digest, read pattern task),
+        # in upload order
+        self.upload_queue: asyncio.Queue[tuple[str, str, str, asyncio.Task]] = (
+            asyncio.Queue()
+        )
+        # Process pool for reading pattern files; created when first needed
+        self.pattern_read_executor: concurrent.futures.ProcessPoolExecutor | None = None
         self.done_task: asyncio.Future = asyncio.Future()
         self.current_pattern: ReducedPattern | None = None
         self.weave_forward = True
         self.loom_error_flag = False
+        # The most recent state reported by the loom, if any
+        self.loom_state: client_replies.LoomState | None = None
         self.command_dispatch_table = dict(
             clear_pattern_names=self.cmd_clear_pattern_names,
             file=self.cmd_file,
@@ -123,37 +330,98 @@ class LoomServer:
 
     async def start(self) -> None:
         await self.pattern_db.init()
+        self.add_uploads_task = asyncio.create_task(self.add_uploads_loop())
         # Restore current pattern, if any
         names = await self.pattern_db.get_pattern_names()
         if len(names) > 0:
             await self.select_pattern(names[-1])
+        await self.record_patterns()
         await self.connect_to_loom()
 
-    async def close(
-        self, stop_read_loom: bool = True, stop_read_client: bool = True
-    ) -> None:
-        """Disconnect from client and loom and stop all tasks."""
+    async def close(self, stop_read_loom: bool = True) -> None:
+        """Disconnect from clients and loom and stop all tasks.
+
+        Also close the pattern database
+        and print the latency statistics, if any.
+        """
+        self.is_closing = True
+        self.reconnect_task.cancel()
+        self.clear_unacknowledged_shaft_commands()
+        for client in list(self.clients):
+            await client.close()
         if self.loom_writer is not None:
             if stop_read_loom:
                 self.read_loom_task.cancel()
-            if stop_read_client:
-                self.read_client_task.cancel()
             self.loom_writer.close()
         if self.mock_loom is not None:
             await self.mock_loom.close()
+        self.add_uploads_task.cancel()
+        while not self.upload_queue.empty():
+            _, _, _, read_task = self.upload_queue.get_nowait()
+            read_task.cancel()
+        self.stop_pattern_read_executor()
+        await self.pick_persister.close()
+        await self.pattern_db.close()
+        if self.session_recorder is not None:
+            await self.session_recorder.close()
+        if self.latency_stats.count > 0:
+            print(
+                f"Latency statistics for loom {self.serial_port!r} (µs):\n"
+                f"{self.latency_stats.format_table()}"
+            )
         if not self.done_task.done():
             self.done_task.set_result(None)
 
-    async def add_pattern(self, pattern: ReducedPattern) -> None:
+    async def record_patterns(self) -> None:
+        """Record the patterns in the database and the current pattern.
+
+        Thus a replay of the session can start in the same state.
+        A no-op if not recording.
+        """
+        if self.session_recorder is None:
+            return
+        for name in await self.pattern_db.get_pattern_names():
+            pattern = await self.pattern_db.get_pattern(name)
+            self.session_recorder.record(RecordType.PATTERN, pattern.to_json())
+        if self.current_pattern is not None:
+            self.session_recorder.record(
+                RecordType.CURRENT_PATTERN, self.current_pattern.name
+            )
+
+    async def add_pattern(self, pattern: ReducedPattern, file_digest: str = "") -> None:
         """Add a pattern to pattern database.
 
         Also purge the MAX_PATTERNS oldest entries (excluding
         the current pattern, if any) and report the new list
         of pattern names to the client.
+
+        If file_digest is not blank, also add the pattern
+        to the database's parse cache.
         """
-        await self.pattern_db.add_pattern(pattern=pattern, max_entries=MAX_PATTERNS)
+        # Save pending pick numbers first, so they cannot
+        # overwrite the reset pick number of a re-added pattern.
+        await self.pick_persister.flush()
+        await self.pattern_db.add_pattern(
+            pattern=pattern, max_entries=MAX_PATTERNS, file_digest=file_digest
+        )
         await self.report_pattern_names()
 
+    async def add_pattern_from_parse_cache(
+        self, file_digest: str, pattern_name: str
+    ) -> bool:
+        """Add a pattern from the database's parse cache, if present.
+
+        Like `add_pattern`, but the pattern need not be read.
+        Return True if the pattern was added, False if not in the cache.
+        """
+        await self.pick_persister.flush()
+        added = await self.pattern_db.add_pattern_from_parse_cache(
+            file_digest=file_digest, pattern_name=pattern_name, max_entries=MAX_PATTERNS
+        )
+        if added:
+            await self.report_pattern_names()
+        return added
+
     @property
     def loom_connected(self) -> bool:
         """Return True if connected to the loom."""
@@ -175,8 +443,10 @@ class LoomServer:
         try:
             self.loom_connecting = True
             await self.report_loom_connection_state()
-            if self.serial_port == MOCK_PORT_NAME:
-                self.mock_loom = MockLoom(verbose=self.verbose)
+            if self.mock_loom_factory is not None:
+                self.mock_loom = self.mock_loom_factory(
+                    verbose=self.verbose, timing=self.mock_loom_timing
+                )
                 self.loom_reader, self.loom_writer = (
                     await self.mock_loom.open_client_connection()
                 )
@@ -185,6 +455,12 @@ class LoomServer:
                     url=self.serial_port, baudrate=BAUD_RATE
                 )
             self.loom_connecting = False
+            self.awaiting_first_shafts_reply = True
+            self.num_loom_connections += 1
+            if self.session_recorder is not None:
+                self.session_recorder.record(
+                    RecordType.LOOM_CONNECTED, self.serial_port
+                )
             await self.report_loom_connection_state()
         except Exception as e:
             self.loom_connecting = False
@@ -195,9 +471,62 @@ class LoomServer:
 
         self.read_loom_task = asyncio.create_task(self.read_loom_loop())
 
+    @property
+    def loom_connection_state(self) -> client_replies.ConnectionStateEnum:
+        """Get the state of the connection to the loom."""
+        if self.loom_connecting:
+            return client_replies.ConnectionStateEnum.CONNECTING
+        elif self.loom_disconnecting:
+            return client_replies.ConnectionStateEnum.DISCONNECTING
+        elif self.loom_connected:
+            return client_replies.ConnectionStateEnum.CONNECTED
+        return client_replies.ConnectionStateEnum.DISCONNECTED
+
+    def get_status(self) -> dict[str, Any]:
+        """Get a summary of the state of this server, as a dict.
+
+        Intended for an overview of all looms, so it is brief:
+        it omits the pattern itself.
+        """
+        return dict(
+            serial_port=self.serial_port,
+            loom_connection_state=self.loom_connection_state.name.lower(),
+            loom_state=(
+                None
+                if self.loom_state is None
+                else dict(
+                    shed_closed=self.loom_state.shed_closed,
+                    cycle_complete=self.loom_state.cycle_complete,
+                    error=self.loom_state.error,
+                )
+            ),
+            weave_forward=self.weave_forward,
+            pattern_name=(
+                None if self.current_pattern is None else self.current_pattern.name
+            ),
+            pick_number=(
+                None
+                if self.current_pattern is None
+                else self.current_pattern.pick_number
+            ),
+            repeat_number=(
+                None
+                if self.current_pattern is None
+                else self.current_pattern.repeat_number
+            ),
+            num_clients=len(self.clients),
+        )
+
+    @property
+    def client_connected(self) -> bool:
+        """Return True if any client is connected."""
+        return bool(self.clients)
+
     async def run_client(self, websocket: WebSocket) -> None:
-        """Run a client connection, closing any existing connection.
+        """Run a client connection, until the client disconnects,
+        the client cannot keep up, or the server is closed.
 
+        Other clients may be connected at the same time.
         Also open a connection to the loom, if that was closed.
 
         Parameters
@@ -205,53 +534,205 @@ class LoomServer:
         websocket : WebSocket
             Connection to the client.
         """
-        if self.client_connected:
-            print("A client was already connected; closing that connection")
-            await self.disconnect_client()
         await websocket.accept()
-        self.websocket = websocket
-        self.read_client_task = asyncio.create_task(self.read_client_loop())
-        if not self.loom_connected:
-            try:
-                await self.connect_to_loom()
-            except Exception as e:
-                # Note: connect_to_loom already reported the
-                # (lack of) connection state, including the reason.
-                # But log it here.
-                print(f"run_client failed to reconnect to the loom: {e!r}")
-                traceback.print_exc()
-        await self.done_task
-
-    async def disconnect_client(self, cancel_read_client_loop: bool = True) -> None:
-        self.read_client_task.cancel()
-        websocket = self.websocket
-        self.websocket = None
-        if websocket is not None:
-            await close_websocket(
-                websocket, code=CloseCode.GOING_AWAY, reason="another client barged in"
+        client = ClientConnection(
+            websocket=websocket,
+            verbose=self.verbose,
+            send_latency=self.latency_stats.histograms["client_send"],
+        )
+        self.clients.add(client)
+        if self.session_recorder is not None:
+            self.session_recorder.record(
+                RecordType.CLIENT_CONNECTED, client_id=client.client_id
+            )
+        if self.verbose:
+            print(f"Client {client.client_id} connected; {len(self.clients)} clients")
+        read_client_task = asyncio.create_task(self.read_client_loop(client))
+        try:
+            if not self.loom_connected and self.reconnect_task.done():
+                try:
+                    await self.connect_to_loom()
+                except Exception as e:
+                    # Note: connect_to_loom already reported the
+                    # (lack of) connection state, including the reason.
+                    # But log it here.
+                    print(f"run_client failed to reconnect to the loom: {e!r}")
+                    traceback.print_exc()
+            await asyncio.wait(
+                [read_client_task, client.write_task, self.done_task],
+                return_when=asyncio.FIRST_COMPLETED,
             )
+        finally:
+            self.clients.discard(client)
+            if self.session_recorder is not None:
+                self.session_recorder.record(
+                    RecordType.CLIENT_DISCONNECTED, client_id=client.client_id
+                )
+            read_client_task.cancel()
+            await client.close()
+            self.num_closed_client_messages_sent += client.num_sent
+            self.num_closed_client_messages_coalesced += client.num_coalesced
+            self.num_closed_client_messages_rejected += client.num_rejected
+            self.max_closed_client_queue_depth = max(
+                self.max_closed_client_queue_depth, client.max_queue_depth
+            )
+            if self.verbose:
+                print(
+                    f"Client {client.client_id} disconnected; "
+                    f"{len(self.clients)} clients"
+                )
 
     async def disconnect_from_loom(self) -> None:
         """Disconnect from the loom. A no-op if already disconnected."""
 
-        if not self.loom_connected:
+        if self.loom_reader is None and self.loom_writer is None:
             return
         self.loom_disconnecting = True
         await self.report_loom_connection_state()
         try:
             if self.loom_writer is not None:
                 self.loom_writer.close()
-                self.loom_reader = None
-                self.loom_writer = None
+            if self.mock_loom is not None:
+                await self.mock_loom.close()
+            self.loom_reader = None
+            self.loom_writer = None
             self.mock_loom = None
+            self.clear_unacknowledged_shaft_commands()
         finally:
             self.loom_disconnecting = False
             await self.report_loom_connection_state()
 
-    async def command_pick(self, pick: Pick) -> None:
-        """Send an =C<shaft_word> pick command to the loom"""
-        shaft_word = sum(1 << i for i, isup in enumerate(pick.are_shafts_up) if isup)
-        await self.command_loom(f"=C{shaft_word:08x}")
+    async def command_pick(self) -> None:
+        """Send an =C<shaft_word> command for the current pick to the loom.
+
+        Uses the pre-encoded command cached by the pattern.
+        The command is tracked until the loom acknowledges it;
+        see `handle_shafts_reply`.
+        """
+        assert self.current_pattern is not None
+        pick_command = self.current_pattern.get_pick_command()
+        self.unacknowledged_shaft_commands.append(
+            ShaftCommand(
+                shaft_word=self.current_pattern.get_current_pick().shaft_word,
+                command=pick_command,
+                sent_time=time.monotonic(),
+            )
+        )
+        self.restart_shaft_echo_timer()
+        await self.write_to_loom(pick_command)
+        self.pick_in_progress = True
+        self.num_picks_commanded += 1
+        current_time = asyncio.get_running_loop().time()
+        self.recent_pick_times.append(current_time)
+        while self.recent_pick_times[0] < current_time - PICK_RATE_INTERVAL:
+            self.recent_pick_times.popleft()
+
+    async def handle_shafts_reply(self, shaft_word: int) -> None:
+        """Handle an =c reply: match it to an unacknowledged =C command.
+
+        The loom reports the raised shafts after each =C command.
+        If the shafts match an unacknowledged command, record
+        the round trip time, and forget that command and older ones.
+        If they match no unacknowledged command, report a problem.
+        A reply when no commands are unacknowledged is ignored.
+        So is the first reply after the connection is made, even if
+        it matches a command, because it is the loom reporting
+        its shafts on connection, and it may be read after the server
+        sent an =C command (e.g. resending the current pick
+        after reconnecting).
+        """
+        if self.awaiting_first_shafts_reply:
+            self.awaiting_first_shafts_reply = False
+            if self.verbose:
+                print(
+                    f"Ignoring shafts {shaft_word:08x} reported by the loom "
+                    "on connection"
+                )
+            return
+        commands = self.unacknowledged_shaft_commands
+        if not commands:
+            return
+        for num_acknowledged, command in enumerate(commands, start=1):
+            if command.shaft_word == shaft_word:
+                break
+        else:
+            self.num_shaft_echo_mismatches += 1
+            message = (
+                f"The loom raised shafts {shaft_word:08x}, "
+                f"but shafts {commands[-1].shaft_word:08x} were commanded"
+            )
+            print(message)
+            await self.report_command_problem(
+                message=message, severity=MessageSeverityEnum.WARNING
+            )
+            return
+        self.latency_stats.record("shaft_echo", time.monotonic() - command.sent_time)
+        for _ in range(num_acknowledged):
+            commands.popleft()
+        if not commands and self.shaft_echo_timer is not None:
+            self.shaft_echo_timer.cancel()
+            self.shaft_echo_timer = None
+
+    def restart_shaft_echo_timer(self) -> None:
+        """Start or restart the timer that waits for the loom to
+        acknowledge the most recent =C command."""
+        if self.shaft_echo_timer is not None:
+            self.shaft_echo_timer.cancel()
+        self.shaft_echo_timer = asyncio.get_running_loop().call_later(
+            self.shaft_echo_timeout, self._shaft_echo_timed_out
+        )
+
+    def clear_unacknowledged_shaft_commands(self) -> None:
+        """Forget unacknowledged =C commands and stop retrying them."""
+        self.unacknowledged_shaft_commands.clear()
+        if self.shaft_echo_timer is not None:
+            self.shaft_echo_timer.cancel()
+            self.shaft_echo_timer = None
+        self.retry_shaft_command_task.cancel()
+
+    def _shaft_echo_timed_out(self) -> None:
+        self.shaft_echo_timer = None
+        if self.unacknowledged_shaft_commands and self.retry_shaft_command_task.done():
+            self.retry_shaft_command_task = asyncio.create_task(
+                self.retry_shaft_command()
+            )
+
+    async def retry_shaft_command(self) -> None:
+        """Resend the most recent unacknowledged =C command.
+
+        Older unacknowledged commands are superseded, so forget them.
+        If the command has already been resent max_shaft_command_retries
+        times, give up and report a problem.
+        """
+        commands = self.unacknowledged_shaft_commands
+        if not commands:
+            return
+        command = commands[-1]
+        commands.clear()
+        if command.num_retries >= self.max_shaft_command_retries:
+            self.num_shaft_command_failures += 1
+            message = (
+                f"The loom did not acknowledge command {command.command!r} "
+                f"after {command.num_retries} retries"
+            )
+            print(message)
+            await self.report_command_problem(
+                message=message, severity=MessageSeverityEnum.ERROR
+            )
+            return
+        command.num_retries += 1
+        command.sent_time = time.monotonic()
+        commands.append(command)
+        self.num_shaft_command_retries += 1
+        print(
+            f"The loom did not acknowledge command {command.command!r}; "
+            f"resending it (retry {command.num_retries})"
+        )
+        self.restart_shaft_echo_timer()
+        try:
+            await self.write_to_loom(command.command)
+        except Exception as e:
+            print(f"Failed to resend command {command.command!r}: {e!r}")
 
     async def command_loom(self, cmd: str) -> None:
         """Send a command to the loom.
@@ -262,12 +743,23 @@ class LoomServer:
             The command to send, without a terminator.
             (This method will append the terminator).
         """
+        await self.write_to_loom(cmd.encode() + TERMINATOR)
+
+    async def write_to_loom(self, cmd_bytes: bytes) -> None:
+        """Write an encoded command to the loom.
+
+        Parameters
+        ----------
+        cmd_bytes : bytes
+            The command to send, including the terminator.
+        """
         if self.loom_writer is None or self.loom_writer.is_closing():
             raise RuntimeError("Cannot write to the loom: no connection.")
-        cmd_bytes = cmd.encode() + TERMINATOR
         if self.verbose:
             print(f"Sending command to loom: {cmd_bytes!r}")
         self.loom_writer.write(cmd_bytes)
+        if self.session_recorder is not None:
+            self.session_recorder.record(RecordType.LOOM_COMMAND, cmd_bytes)
         await self.loom_writer.drain()
 
     def increment_pick_number(self) -> int:
@@ -287,6 +779,7 @@ class LoomServer:
     async def cmd_clear_pattern_names(self, command: SimpleNamespace) -> None:
         # Clear the pattern database
         # Then add the current pattern (if any)
+        await self.pick_persister.flush()
         await self.pattern_db.clear_database()
         if self.current_pattern is not None:
             await self.add_pattern(self.current_pattern)
@@ -294,26 +787,38 @@ class LoomServer:
             await self.report_pattern_names()
 
     async def cmd_file(self, command: SimpleNamespace) -> None:
+        """Start reading a pattern file, without waiting for it.
+
+        Files are read in parallel (in a process pool, so reading
+        does not block the event loop), but patterns are added
+        to the database in the order in which they were uploaded.
+        Files that are in the database's parse cache are not read.
+        The file size limit applies to the UTF-8 encoded data.
+        """
         filename = command.name
         try:
             if self.verbose:
                 print(
                     f"Read weaving pattern {filename!r}: data={command.data[0:40]!r}...",
                 )
-            if filename.lower().endswith(".dtx"):
-                with io.StringIO(command.data) as dtx_file:
-                    pattern_data = read_dtx(dtx_file)
-            elif filename.lower().endswith(".wif"):
-                with io.StringIO(command.data) as wif_file:
-                    pattern_data = read_wif(wif_file)
-            else:
+            if not filename.lower().endswith(SUPPORTED_PATTERN_SUFFIXES):
                 raise CommandError(
                     f"Cannot load pattern {filename!r}: unsupported file type"
                 )
-            pattern = reduced_pattern_from_pattern_data(
-                name=command.name, data=pattern_data
+            if len(command.data.encode()) > MAX_PATTERN_FILE_SIZE:
+                raise CommandError(
+                    f"Cannot load pattern {filename!r}: "
+                    f"file is larger than {MAX_PATTERN_FILE_SIZE} bytes"
+                )
+            file_digest = compute_file_digest(filename=filename, data=command.data)
+            read_task = asyncio.create_task(
+                self.read_pattern_file(
+                    filename=filename, data=command.data, file_digest=file_digest
+                )
+            )
+            self.upload_queue.put_nowait(
+                (filename, command.data, file_digest, read_task)
             )
-            await self.add_pattern(pattern)
 
         except Exception as e:
             await self.report_command_problem(
@@ -321,6 +826,106 @@ class LoomServer:
                 severity=MessageSeverityEnum.WARNING,
             )
 
+    async def read_pattern_file(
+        self, filename: str, data: str, file_digest: str = ""
+    ) -> ReducedPattern | None:
+        """Read a pattern file in a separate process.
+
+        Report progress to the client (as an info-level CommandProblem)
+        if reading takes longer than PATTERN_READ_PROGRESS_INTERVAL.
+
+        Return None, without reading the file, if file_digest
+        is not blank and is in the database's parse cache.
+
+        Raises
+        ------
+        CommandError
+            If reading takes longer than PATTERN_READ_TIMEOUT.
+        """
+        if file_digest and await self.pattern_db.is_in_parse_cache(file_digest):
+            return None
+        if self.pattern_read_executor is None:
+            self.pattern_read_executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=MAX_PATTERN_READ_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        read_future = asyncio.get_running_loop().run_in_executor(
+            self.pattern_read_executor, reduced_pattern_from_file_data, filename, data
+        )
+        start_time = time.monotonic()
+        try:
+            async with asyncio.timeout(PATTERN_READ_TIMEOUT):
+                while True:
+                    done, _ = await asyncio.wait(
+                        [read_future], timeout=PATTERN_READ_PROGRESS_INTERVAL
+                    )
+                    if done:
+                        pattern = read_future.result()
+                        self.num_pattern_files_read += 1
+                        self.pattern_file_size_total += len(data)
+                        self.pattern_read_duration.record(time.monotonic() - start_time)
+                        return pattern
+                    duration = time.monotonic() - start_time
+                    await self.report_command_problem(
+                        message=f"Still reading pattern {filename!r} "
+                        f"after {duration:0.0f} seconds",
+                        severity=MessageSeverityEnum.INFO,
+                    )
+        except TimeoutError:
+            # The worker process may be stuck (some malformed files
+            # make the reader loop forever), so kill the workers.
+            # This also fails any other files being read.
+            self.stop_pattern_read_executor()
+            raise CommandError(f"Timed out after {PATTERN_READ_TIMEOUT} seconds")
+        finally:
+            read_future.cancel()
+
+    def stop_pattern_read_executor(self) -> None:
+        """Kill the pattern read worker processes, if any.
+
+        A new process pool will be created when next needed.
+        """
+        executor = self.pattern_read_executor
+        self.pattern_read_executor = None
+        if executor is None:
+            return
+        # Kill the workers, instead of waiting for them to finish,
+        # because a worker may be stuck. ProcessPoolExecutor has no
+        # public API for this (before Python 3.14).
+        processes = list(getattr(executor, "_processes", {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            process.kill()
+
+    async def add_uploads_loop(self) -> None:
+        """Add uploaded patterns to the database, in upload order."""
+        while True:
+            filename, data, file_digest, read_task = await self.upload_queue.get()
+            try:
+                pattern = await read_task
+                if pattern is None:
+                    if await self.add_pattern_from_parse_cache(
+                        file_digest=file_digest, pattern_name=filename
+                    ):
+                        continue
+                    # The entry was purged from the cache after it was
+                    # checked (which requires uploading more than
+                    # max_parse_cache_entries files at once), so read the file.
+                    pattern = await self.read_pattern_file(filename=filename, data=data)
+                    assert pattern is not None
+                await self.add_pattern(pattern, file_digest=file_digest)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if isinstance(e, CommandError):
+                    reason = str(e)
+                else:
+                    reason = repr(e)
+                await self.report_command_problem(
+                    message=f"Failed to read pattern {filename!r}: {reason}",
+                    severity=MessageSeverityEnum.WARNING,
+                )
+
     async def cmd_goto_next_pick(self, command: SimpleNamespace) -> None:
         if self.current_pattern is None:
             await self.report_command_problem(
@@ -332,8 +937,7 @@ class LoomServer:
         # Command a new pick, if there is one.
         new_pick_number = self.increment_pick_number()
         if new_pick_number > 0:
-            pick = self.current_pattern.get_current_pick()
-            await self.command_pick(pick)
+            await self.command_pick()
         await self.report_pick_number()
 
     async def cmd_jump_to_pick(self, command: SimpleNamespace) -> None:
@@ -350,8 +954,7 @@ class LoomServer:
                 f"> {len(self.current_pattern.picks)}"
             )
         if self.current_pattern.pick_number > 0:
-            pick = self.current_pattern.get_current_pick()
-            await self.command_pick(pick)
+            await self.command_pick()
         await self.report_pick_number()
 
     async def cmd_select_pattern(self, command: SimpleNamespace) -> None:
@@ -370,24 +973,47 @@ class LoomServer:
     async def cmd_oobcommand(self, command: SimpleNamespace) -> None:
         await self.command_loom(f"=#{command.command}")
 
-    async def reply_to_client(self, reply: Any) -> None:
-        """Send a reply to the client.
+    async def reply_to_client(
+        self, reply: Any, client: ClientConnection | None = None
+    ) -> None:
+        """Send a reply to all clients, or to one client.
+
+        The reply is encoded once and queued for each client,
+        without waiting for it to be sent. If the reply type is in
+        `client_replies.COALESCIBLE_REPLY_TYPES`, it replaces
+        any unsent reply of the same type.
 
         Parameters
         ----------
         reply : dataclasses.dataclass
             The reply as a dataclass. It should have a "type" field
-            whose value is a string.
+            whose value is a string. See `client_replies.reply_to_json`
+            for how it is encoded.
+        client : ClientConnection | None
+            The client to send the reply to. If None, send the reply
+            to all connected clients.
         """
-        if self.client_connected:
-            assert self.websocket is not None
-            reply_dict = dataclasses.asdict(reply)
+        clients = self.clients if client is None else {client}
+        if clients:
+            reply_json = client_replies.reply_to_json(reply)
+            if self.session_recorder is not None:
+                self.session_recorder.record(
+                    RecordType.CLIENT_REPLY,
+                    reply_json,
+                    client_id=0 if client is None else client.client_id,
+                )
             if self.verbose:
-                reply_str = str(reply_dict)
+                reply_str = reply_json
                 if len(reply_str) > 120:
                     reply_str = reply_str[0:120] + "..."
-                print(f"LoomServer reply to client: {reply_str}")
-            await self.websocket.send_json(reply_dict)
+                print(f"LoomServer reply to {len(clients)} client(s): {reply_str}")
+            coalesce_key = (
+                reply.type
+                if reply.type in client_replies.COALESCIBLE_REPLY_TYPES
+                else None
+            )
+            for client_to_send in clients:
+                client_to_send.send(reply_json, coalesce_key=coalesce_key)
         else:
             if self.verbose:
                 reply_str = str(reply)
@@ -400,23 +1026,21 @@ class LoomServer:
         reply = client_replies.CommandProblem(message=message, severity=severity)
         await self.reply_to_client(reply)
 
-    async def report_current_pattern(self) -> None:
-        """Report pattern to the client"""
+    async def report_current_pattern(
+        self, client: ClientConnection | None = None
+    ) -> None:
+        """Report pattern to the client(s); see `reply_to_client`."""
         if self.current_pattern is not None:
-            await self.reply_to_client(self.current_pattern)
+            await self.reply_to_client(self.current_pattern, client=client)
 
-    async def report_loom_connection_state(self, reason: str = "") -> None:
-        """Report LoomConnectionState to the client."""
-        if self.loom_connecting:
-            state = client_replies.ConnectionStateEnum.CONNECTING
-        elif self.loom_disconnecting:
-            state = client_replies.ConnectionStateEnum.DISCONNECTING
-        elif self.loom_connected:
-            state = client_replies.ConnectionStateEnum.CONNECTED
-        else:
-            state = client_replies.ConnectionStateEnum.DISCONNECTED
-        reply = client_replies.LoomConnectionState(state=state, reason=reason)
-        await self.reply_to_client(reply)
+    async def report_loom_connection_state(
+        self, reason: str = "", client: ClientConnection | None = None
+    ) -> None:
+        """Report LoomConnectionState to the client(s)."""
+        reply = client_replies.LoomConnectionState(
+            state=self.loom_connection_state, reason=reason
+        )
+        await self.reply_to_client(reply, client=client)
 
     async def report_loom_state(
         self,
@@ -424,19 +1048,28 @@ class LoomServer:
     ) -> None:
         """Report LoomState to the client."""
         reply = client_replies.LoomState.from_state_word(state_word)
+        self.loom_state = reply
         await self.reply_to_client(reply)
 
-    async def report_pattern_names(self) -> None:
-        """Report PatternNames to the client."""
+    async def report_pattern_names(
+        self, client: ClientConnection | None = None
+    ) -> None:
+        """Report PatternNames to the client(s)."""
+        # Pending pick numbers affect the order (via the timestamp)
+        await self.pick_persister.flush()
         names = await self.pattern_db.get_pattern_names()
         reply = client_replies.PatternNames(names=names)
-        await self.reply_to_client(reply)
+        await self.reply_to_client(reply, client=client)
 
-    async def report_pick_number(self) -> None:
-        """Report CurrentPickNumber to the client."""
+    async def report_pick_number(self, client: ClientConnection | None = None) -> None:
+        """Report CurrentPickNumber to the client(s).
+
+        Also schedule saving the pick and repeat numbers in the
+        pattern database (without waiting for that to happen).
+        """
         if self.current_pattern is None:
             return
-        await self.pattern_db.update_pick_number(
+        self.pick_persister.schedule(
             pattern_name=self.current_pattern.name,
             pick_number=self.current_pattern.pick_number,
             repeat_number=self.current_pattern.repeat_number,
@@ -445,14 +1078,18 @@ class LoomServer:
             pick_number=self.current_pattern.pick_number,
             repeat_number=self.current_pattern.repeat_number,
         )
-        await self.reply_to_client(reply)
+        await self.reply_to_client(reply, client=client)
 
-    async def report_weave_direction(self) -> None:
-        """Report WeaveDirection"""
+    async def report_weave_direction(
+        self, client: ClientConnection | None = None
+    ) -> None:
+        """Report WeaveDirection to the client(s)."""
         client_reply = client_replies.WeaveDirection(forward=self.weave_forward)
-        await self.reply_to_client(client_reply)
+        await self.reply_to_client(client_reply, client=client)
 
     async def select_pattern(self, name: str) -> None:
+        # Save the pick number of the current pattern before switching
+        await self.pick_persister.flush()
         try:
             pattern = await self.pattern_db.get_pattern(name)
         except LookupError:
@@ -461,26 +1098,29 @@ class LoomServer:
         await self.report_current_pattern()
         await self.report_pick_number()
 
-    async def read_client_loop(self) -> None:
-        """Read and process commands from the client."""
-        # report loom connection state
+    async def read_client_loop(self, client: ClientConnection) -> None:
+        """Read and process commands from one client."""
+        # report the current state to the new client
         # and (if connected) request loom status
         try:
-            self.client_connected = True
-            await self.report_loom_connection_state()
-            await self.report_pattern_names()
-            await self.report_weave_direction()
-            await self.report_current_pattern()
-            await self.report_pick_number()
+            await self.report_loom_connection_state(client=client)
+            await self.report_pattern_names(client=client)
+            await self.report_weave_direction(client=client)
+            await self.report_current_pattern(client=client)
+            await self.report_pick_number(client=client)
             if self.loom_connected:
                 # request loom status
                 await self.command_loom("=Q")
-            else:
+            elif self.reconnect_task.done():
                 await self.connect_to_loom()
-            while self.client_connected:
-                assert self.websocket is not None
+            while True:
                 try:
-                    data = await self.websocket.receive_json()
+                    text = await client.websocket.receive_text()
+                    if self.session_recorder is not None:
+                        self.session_recorder.record(
+                            RecordType.CLIENT_COMMAND, text, client_id=client.client_id
+                        )
+                    data = json.loads(text)
                 except json.JSONDecodeError:
                     print("Ingoring invalid command: not json-encoded")
 
@@ -546,67 +1186,52 @@ class LoomServer:
                 severity=MessageSeverityEnum.ERROR,
             )
             traceback.print_exc()
-            self.client_connected = False
-            if self.websocket is not None:
-                await close_websocket(
-                    self.websocket, code=CloseCode.ERROR, reason=repr(e)
-                )
+            await close_websocket(
+                client.websocket, code=CloseCode.ERROR, reason=repr(e)
+            )
 
     async def read_loom_loop(self) -> None:
-        """Read and process replies from the loom."""
+        """Read and process replies from the loom.
+
+        Reads all available data at once and parses it with
+        `loom_protocol.LoomProtocol`, so a burst of replies
+        is handled without one read per reply.
+
+        If the connection is lost (other than by calling
+        `disconnect_from_loom` or `connect_to_loom`), disconnect
+        and start reconnecting; see `reconnect_loop`.
+        """
+        loom_reader = self.loom_reader
         try:
-            if self.loom_reader is None:
+            if loom_reader is None:
                 raise RuntimeError("No loom reader")
-            while True:
-                reply_bytes = await self.loom_reader.readuntil(TERMINATOR)
+            protocol = loom_protocol.LoomProtocol(loom_protocol.REPLY_PARSERS)
+            data_callback = (
+                None
+                if self.session_recorder is None
+                else functools.partial(
+                    self.session_recorder.record, RecordType.LOOM_DATA
+                )
+            )
+            async for reply in loom_protocol.read_messages(
+                loom_reader, protocol, data_callback=data_callback
+            ):
                 if self.verbose:
-                    print(f"Read loom reply: {reply_bytes!r}")
-                if not reply_bytes:
-                    return
-                reply = reply_bytes.decode().strip()
-                if len(reply) < 2:
-                    message = f"Ignoring invalid reply from the loom {reply!r}: less than 2 chars"
-                    print(message)
-                    await self.report_command_problem(
-                        message=message,
-                        severity=MessageSeverityEnum.WARNING,
-                    )
-                    continue
-                if reply[0] != "=":
-                    message = f"Ignoring invalid reply from the loom {reply!r}: no leading '='"
-                    print(message)
-                    await self.report_command_problem(
-                        message=message,
-                        severity=MessageSeverityEnum.WARNING,
-                    )
-                    continue
-                reply_char = reply[1]
-                reply_data = reply[2:]
-                match reply_char:
-                    case "c":
+                    print(f"Read loom reply: {reply}")
+                self.num_loom_replies[type(reply)] += 1
+                match reply:
+                    case loom_protocol.ShaftsReply():
                         # Actual shafts that are up
-                        pass
-                    case "u":
+                        await self.handle_shafts_reply(reply.shaft_word)
+                    case loom_protocol.DirectionReply():
                         # Weave direction
                         # The loom expects a new pick, as a result
-                        if reply_data == "0":
-                            self.weave_forward = True
-                        elif reply_data == "1":
-                            self.weave_forward = False
-                        else:
-                            message = (
-                                f"Ignoring invalid direction reply from loom {reply!r}: "
-                                "direction must be 0 or 1"
-                            )
-                            print(message)
-                            await self.report_command_problem(
-                                message=message, severity=MessageSeverityEnum.WARNING
-                            )
-                            continue
+                        self.weave_forward = reply.weave_forward
                         await self.report_weave_direction()
-                    case "s":
+                    case loom_protocol.StateReply():
                         # Loom status (may include a request for the next pick)
-                        state_word = int(reply_data, base=16)
+                        start_time = time.monotonic()
+                        state_word = reply.state_word
                         await self.report_loom_state(state_word)
 
                         # Check for error flag
@@ -617,16 +1242,41 @@ class LoomServer:
                                 print(f"Loom error flag changed to {error_flag}")
 
                         pick_wanted = bool(state_word & 0x4)
+                        if pick_wanted:
+                            self.pick_in_progress = False
                         if pick_wanted and self.current_pattern is not None:
                             # Command a new pick, if there is one.
+                            decoded_time = time.monotonic()
                             new_pick_number = self.increment_pick_number()
+                            incremented_time = time.monotonic()
                             if new_pick_number > 0:
-                                pick = self.current_pattern.get_current_pick()
-                                await self.command_pick(pick)
+                                await self.command_pick()
+                            written_time = time.monotonic()
                             await self.report_pick_number()
+                            self.record_pick_latency(
+                                data_received_time=protocol.data_received_time,
+                                start_time=start_time,
+                                decoded_time=decoded_time,
+                                incremented_time=incremented_time,
+                                written_time=(
+                                    written_time if new_pick_number > 0 else None
+                                ),
+                                reported_time=time.monotonic(),
+                            )
+                    case loom_protocol.InvalidMessage():
+                        message = (
+                            f"Ignoring invalid reply from the loom {reply.message!r}: "
+                            f"{reply.reason}"
+                        )
+                        print(message)
+                        await self.report_command_problem(
+                            message=message,
+                            severity=MessageSeverityEnum.WARNING,
+                        )
 
+            reason = "the loom closed the connection"
         except asyncio.CancelledError:
-            pass
+            return
         except Exception as e:
             message = f"Server stopped listening to the loom: {e!r}"
             print(message)
@@ -635,7 +1285,241 @@ class LoomServer:
                 severity=MessageSeverityEnum.ERROR,
             )
             traceback.print_exc()
-            await self.disconnect_from_loom()
+            reason = repr(e)
+        if self.is_closing or self.loom_reader is not loom_reader:
+            # Intentionally disconnected
+            return
+        print(f"Lost the connection to the loom: {reason}")
+        if self.session_recorder is not None:
+            self.session_recorder.record(RecordType.LOOM_DISCONNECTED, reason)
+        await self.disconnect_from_loom()
+        if not self.reconnect_task.done():
+            return
+        self.reconnect_task = asyncio.create_task(
+            self.reconnect_loop(reason=f"Lost connection: {reason}")
+        )
+
+    async def reconnect_loop(self, reason: str) -> None:
+        """Reconnect to the loom, retrying with exponential backoff.
+
+        Report progress with LoomConnectionState. Once connected,
+        request the loom state, and resend the current pick
+        if the loom had not finished weaving it.
+
+        Parameters
+        ----------
+        reason : str
+            Why the connection was lost, for the first report.
+        """
+        attempt = 0
+        while not self.is_closing:
+            delay = compute_reconnect_delay(
+                attempt,
+                initial_delay=self.reconnect_initial_delay,
+                max_delay=self.reconnect_max_delay,
+            )
+            await self.report_loom_connection_state(
+                reason=f"{reason}; reconnecting in {delay:0.1f} seconds"
+            )
+            await asyncio.sleep(delay)
+            attempt += 1
+            try:
+                await self.connect_to_loom()
+                await self.command_loom("=Q")
+                if (
+                    self.pick_in_progress
+                    and self.current_pattern is not None
+                    and self.current_pattern.pick_number > 0
+                ):
+                    await self.command_pick()
+            except Exception as e:
+                # connect_to_loom reports connection failures to the clients
+                reason = f"Reconnection attempt {attempt} failed: {e!r}"
+                print(reason)
+                continue
+            if self.loom_connected:
+                if self.verbose:
+                    print(f"Reconnected to the loom after {attempt} attempt(s)")
+                return
+            reason = f"Lost connection again after reconnection attempt {attempt}"
+
+    @property
+    def picks_per_minute(self) -> float:
+        """The number of picks commanded in the last PICK_RATE_INTERVAL
+        seconds, scaled to picks per minute."""
+        current_time = asyncio.get_running_loop().time()
+        while (
+            self.recent_pick_times
+            and self.recent_pick_times[0] < current_time - PICK_RATE_INTERVAL
+        ):
+            self.recent_pick_times.popleft()
+        return len(self.recent_pick_times) * 60 / PICK_RATE_INTERVAL
+
+    def add_metrics(self, writer: MetricsWriter, labels: dict[str, str]) -> None:
+        """Add metrics for this loom to a MetricsWriter.
+
+        Parameters
+        ----------
+        writer : MetricsWriter
+            The metrics writer.
+        labels : dict[str, str]
+            Labels that identify this loom, e.g. {"loom": "1"}.
+        """
+        writer.add_counter(
+            "picks_commanded_total",
+            "Number of =C pick commands sent to the loom.",
+            self.num_picks_commanded,
+            labels,
+        )
+        writer.add_gauge(
+            "picks_per_minute",
+            f"Picks commanded in the last {PICK_RATE_INTERVAL} seconds, "
+            "as picks per minute.",
+            self.picks_per_minute,
+            labels,
+        )
+        writer.add_gauge(
+            "loom_connected",
+            "1 if connected to the loom, else 0.",
+            int(self.loom_connected),
+            labels,
+        )
+        writer.add_counter(
+            "loom_reconnects_total",
+            "Number of times the server reconnected to the loom.",
+            max(self.num_loom_connections - 1, 0),
+            labels,
+        )
+        for reply_type, num_replies in self.num_loom_replies.items():
+            writer.add_counter(
+                "loom_replies_total",
+                "Number of replies read from the loom, by type.",
+                num_replies,
+                dict(labels, reply_type=reply_type.__name__),
+            )
+        writer.add_counter(
+            "loom_invalid_replies_total",
+            "Number of invalid replies read from the loom.",
+            self.num_loom_replies[loom_protocol.InvalidMessage],
+            labels,
+        )
+        writer.add_counter(
+            "shaft_echo_mismatches_total",
+            "Number of =c replies that matched no unacknowledged =C command.",
+            self.num_shaft_echo_mismatches,
+            labels,
+        )
+        writer.add_counter(
+            "shaft_command_retries_total",
+            "Number of =C commands resent because the loom did not acknowledge them.",
+            self.num_shaft_command_retries,
+            labels,
+        )
+        writer.add_counter(
+            "shaft_command_failures_total",
+            "Number of =C commands the loom never acknowledged, despite retries.",
+            self.num_shaft_command_failures,
+            labels,
+        )
+        writer.add_gauge(
+            "clients", "Number of connected clients.", len(self.clients), labels
+        )
+        writer.add_counter(
+            "client_messages_sent_total",
+            "Number of messages sent to clients.",
+            self.num_closed_client_messages_sent
+            + sum(client.num_sent for client in self.clients),
+            labels,
+        )
+        for reason, num_dropped in (
+            (
+                "coalesced",
+                self.num_closed_client_messages_coalesced
+                + sum(client.num_coalesced for client in self.clients),
+            ),
+            (
+                "queue_full",
+                self.num_closed_client_messages_rejected
+                + sum(client.num_rejected for client in self.clients),
+            ),
+        ):
+            writer.add_counter(
+                "client_messages_dropped_total",
+                "Number of messages to clients that were not sent, by reason.",
+                num_dropped,
+                dict(labels, reason=reason),
+            )
+        writer.add_gauge(
+            "client_send_queue_depth",
+            "Number of messages waiting to be sent to the client "
+            "that is furthest behind.",
+            max((client.queue_depth for client in self.clients), default=0),
+            labels,
+        )
+        writer.add_gauge(
+            "client_send_queue_max_depth",
+            "Largest number of messages that have waited to be sent to any client.",
+            max(
+                [self.max_closed_client_queue_depth]
+                + [client.max_queue_depth for client in self.clients]
+            ),
+            labels,
+        )
+        for name, histogram in self.latency_stats.histograms.items():
+            writer.add_histogram(
+                "latency_seconds",
+                "Duration of each stage of handling a pick request, "
+                "and of other latency-sensitive operations.",
+                histogram,
+                dict(labels, stage=name),
+            )
+        for name, histogram in self.pattern_db.latency_stats.histograms.items():
+            writer.add_histogram(
+                "db_operation_seconds",
+                "Duration of pattern database operations.",
+                histogram,
+                dict(labels, operation=name),
+            )
+        writer.add_histogram(
+            "pattern_read_seconds",
+            "Time to read an uploaded pattern file.",
+            self.pattern_read_duration,
+            labels,
+        )
+        writer.add_summary(
+            "pattern_file_size_chars",
+            "Size of uploaded pattern files that were read.",
+            count=self.num_pattern_files_read,
+            sum=self.pattern_file_size_total,
+            labels=labels,
+        )
+
+    def record_pick_latency(
+        self,
+        data_received_time: float,
+        start_time: float,
+        decoded_time: float,
+        incremented_time: float,
+        written_time: float | None,
+        reported_time: float,
+    ) -> None:
+        """Record the latency of each stage of handling a pick request.
+
+        All times are from time.monotonic(). See LATENCY_NAMES
+        for the stages. written_time is None if no pick was commanded
+        (because the pattern advanced to the next repeat),
+        in which case the write and pick_request stages are not recorded.
+        """
+        record = self.latency_stats.record
+        record("read", start_time - data_received_time)
+        record("decode", decoded_time - start_time)
+        record("increment", incremented_time - decoded_time)
+        if written_time is None:
+            record("report", reported_time - incremented_time)
+        else:
+            record("write", written_time - incremented_time)
+            record("report", reported_time - written_time)
+            record("pick_request", written_time - data_received_time)
 
     async def __aenter__(self) -> LoomServer:
         await self.start()
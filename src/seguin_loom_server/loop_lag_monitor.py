@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+__all__ = [
+    "DEFAULT_LOOP_LAG_INTERVAL",
+    "DEFAULT_MAX_SLOW_CALLBACKS",
+    "DEFAULT_SLOW_CALLBACK_THRESHOLD",
+    "LoopLagMonitor",
+    "SlowCallback",
+]
+
+import asyncio
+import collections
+import dataclasses
+import sys
+import threading
+import time
+import traceback
+from typing import Any
+
+from .latency_stats import LatencyHistogram
+
+# Default interval between event loop lag measurements (sec)
+DEFAULT_LOOP_LAG_INTERVAL = 0.1
+
+# Default duration the event loop must be unresponsive
+# for the stack to be captured (sec)
+DEFAULT_SLOW_CALLBACK_THRESHOLD = 0.1
+
+# Default number of slow callbacks to remember
+DEFAULT_MAX_SLOW_CALLBACKS = 20
+
+# Maximum number of stack frames to capture (the innermost)
+MAX_STACK_FRAMES = 30
+
+
+@dataclasses.dataclass
+class SlowCallback:
+    """A period when the event loop was unresponsive.
+
+    Parameters
+    ----------
+    timestamp : float
+        Approximately when the event loop stopped responding (unix sec).
+    duration : float
+        How long the event loop was unresponsive (sec).
+    task_name : str | None
+        Name and coroutine of the task that was running when the stack
+        was captured, or None if the loop was not running a task
+        (e.g. it was running a plain callback).
+    stack : list[str]
+        The event loop thread's stack when the event loop had been
+        unresponsive for the threshold, innermost call last,
+        formatted by `traceback.StackSummary.format`.
+    """
+
+    timestamp: float
+    duration: float
+    task_name: str | None
+    stack: list[str]
+
+    def format(self) -> str:
+        """Format as a message for the log."""
+        return (
+            f"Event loop blocked for {self.duration:0.3f} seconds "
+            f"in task {self.task_name}; stack:\n" + "".join(self.stack)
+        )
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop runs scheduled callbacks,
+    and find out what blocked it.
+
+    A task repeatedly sleeps for `interval` and records how much
+    longer than that the sleep took. Lag means some callback
+    ran for a long time without yielding, delaying everything else
+    (including replies to the loom).
+
+    To find the culprit, a watchdog thread repeatedly schedules
+    a callback in the event loop, using call_soon_threadsafe.
+    If that callback has not run after `slow_callback_threshold`,
+    the watchdog captures the stack of the event loop thread and
+    the current task, which show what the event loop is busy doing.
+    Once the event loop responds, the result is printed and saved
+    (as a `SlowCallback`) in `slow_callbacks`. The watchdog checks
+    every `slow_callback_threshold` / 4, so periods of less than
+    1.5 * `slow_callback_threshold` may be missed.
+
+    Must be constructed while an event loop is running,
+    in the thread that runs the event loop.
+
+    Parameters
+    ----------
+    interval : float
+        Interval between measurements (sec).
+    slow_callback_threshold : float
+        Capture the stack if the event loop is unresponsive
+        for longer than this (sec).
+    max_slow_callbacks : int
+        Number of slow callbacks to remember (the most recent).
+
+    Attributes
+    ----------
+    lag_histogram : LatencyHistogram
+        Lag measurements.
+    slow_callbacks : collections.deque[SlowCallback]
+        The most recent slow callbacks, oldest first.
+    num_slow_callbacks : int
+        The total number of slow callbacks, including forgotten ones.
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_LOOP_LAG_INTERVAL,
+        slow_callback_threshold: float = DEFAULT_SLOW_CALLBACK_THRESHOLD,
+        max_slow_callbacks: int = DEFAULT_MAX_SLOW_CALLBACKS,
+    ) -> None:
+        self.interval = interval
+        self.slow_callback_threshold = slow_callback_threshold
+        self.lag_histogram = LatencyHistogram()
+        self.slow_callbacks: collections.deque[SlowCallback] = collections.deque(
+            maxlen=max_slow_callbacks
+        )
+        self.num_slow_callbacks = 0
+        self.loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        # Watchdog state, shared by the watchdog thread and the event loop
+        # and protected by _lock: the time.monotonic() and time.time()
+        # when the pending probe was scheduled (None if no probe pending),
+        # and the slow callback captured while waiting for it, if any.
+        self._lock = threading.Lock()
+        self._probe_time: float | None = None
+        self._probe_timestamp = 0.0
+        self._slow_callback: SlowCallback | None = None
+        self._stop_event = threading.Event()
+        self.monitor_task = asyncio.create_task(self._monitor_loop())
+        self._watchdog_thread = threading.Thread(
+            target=self._watchdog_loop, name="LoopLagMonitor watchdog", daemon=True
+        )
+        self._watchdog_thread.start()
+
+    async def close(self) -> None:
+        """Stop monitoring."""
+        self._stop_event.set()
+        self.monitor_task.cancel()
+        await asyncio.wait([self.monitor_task])
+        await asyncio.to_thread(self._watchdog_thread.join)
+
+    def as_dict(self) -> dict[str, Any]:
+        """Return a summary as a dict (durations in seconds).
+
+        Includes the lag histogram (see `LatencyHistogram.as_dict`),
+        the slow callback threshold, the total number of slow callbacks,
+        and the most recent slow callbacks (newest first).
+        """
+        return dict(
+            lag=self.lag_histogram.as_dict(),
+            slow_callback_threshold=self.slow_callback_threshold,
+            num_slow_callbacks=self.num_slow_callbacks,
+            slow_callbacks=[
+                dataclasses.asdict(slow_callback)
+                for slow_callback in reversed(self.slow_callbacks)
+            ],
+        )
+
+    async def _monitor_loop(self) -> None:
+        while True:
+            start_time = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - start_time - self.interval
+            self.lag_histogram.record(max(lag, 0))
+
+    def _watchdog_loop(self) -> None:
+        """Schedule probes and capture the stack if one is late.
+
+        Runs in the watchdog thread.
+        """
+        check_interval = self.slow_callback_threshold / 4
+        while not self._stop_event.wait(check_interval):
+            with self._lock:
+                if self._probe_time is None:
+                    self._probe_time = time.monotonic()
+                    self._probe_timestamp = time.time()
+                    try:
+                        self.loop.call_soon_threadsafe(self._probe_callback)
+                    except RuntimeError:
+                        # The event loop is closed
+                        return
+                elif (
+                    self._slow_callback is None
+                    and time.monotonic() - self._probe_time
+                    > self.slow_callback_threshold
+                ):
+                    self._slow_callback = self._capture()
+
+    def _capture(self) -> SlowCallback:
+        """Capture what the event loop thread is doing.
+
+        Runs in the watchdog thread.
+        """
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = (
+            []
+            if frame is None
+            else traceback.extract_stack(frame, limit=MAX_STACK_FRAMES).format()
+        )
+        task = asyncio.current_task(self.loop)
+        task_name = None
+        if task is not None:
+            coro = task.get_coro()
+            task_name = f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+        return SlowCallback(
+            timestamp=self._probe_timestamp,
+            duration=0,
+            task_name=task_name,
+            stack=stack,
+        )
+
+    def _probe_callback(self) -> None:
+        """Record the slow callback, if the probe was late.
+
+        Runs in the event loop.
+        """
+        with self._lock:
+            assert self._probe_time is not None
+            duration = time.monotonic() - self._probe_time
+            slow_callback = self._slow_callback
+            self._probe_time = None
+            self._slow_callback = None
+        if slow_callback is not None:
+            slow_callback.duration = duration
+            self.slow_callbacks.append(slow_callback)
+            self.num_slow_callbacks += 1
+            print(slow_callback.format())
@@ -1,27 +1,49 @@
 import argparse
+import contextlib
+import html
 import pathlib
 import pkgutil
 from contextlib import asynccontextmanager
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator
 
 import uvicorn
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, HTTPException, WebSocket
 from fastapi.responses import HTMLResponse, Response
 
-from .loom_server import DEFAULT_DATABASE_PATH, LoomServer
+from .client_connection import CloseCode
+from .loom_server import (
+    DEFAULT_DATABASE_PATH,
+    MOCK_PORT_NAME,
+    PTY_MOCK_PORT_NAME,
+    LoomServer,
+)
+from .loop_lag_monitor import LoopLagMonitor
+from .metrics import PROMETHEUS_CONTENT_TYPE, MetricsWriter
 
+# ID of the loom served by the "/" and "/ws" routes
+DEFAULT_LOOM_ID = 1
+
+# dict of loom ID: LoomServer, one per serial port.
+# Loom IDs start at 1, in the order the serial ports were specified.
 # Avoid warnings about no event loop in unit tests
 # by constructing when the server starts
-loom_server: LoomServer | None = None
+loom_servers: dict[int, LoomServer] = {}
+
+# Event loop lag monitor, shared by all looms; created when the server starts
+loop_lag_monitor: LoopLagMonitor | None = None
 
 
 def create_argument_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
     parser.add_argument(
-        "serial_port",
-        help="Serial port connected to the loom, "
+        "serial_ports",
+        nargs="+",
+        metavar="serial_port",
+        help="Serial port connected to each loom, "
         "typically of the form /dev/tty... "
-        "Specify 'mock' to run a mock (simulated) loom",
+        "Specify 'mock' to run a mock (simulated) loom, "
+        "or 'mockpty' to run a mock loom connected through a pseudo-terminal. "
+        "Looms are numbered from 1, in the order specified.",
     )
     parser.add_argument(
         "-r",
@@ -40,19 +62,71 @@ def create_argument_parser() -> argparse.ArgumentParser:
         default=DEFAULT_DATABASE_PATH,
         type=pathlib.Path,
         help="Path for pattern database. "
+        "Each loom other than loom 1 has its own database, "
+        "whose name has suffix _loom<id> (see get_loom_db_path). "
         "Settable so unit tests can avoid changing the real database.",
     )
+    parser.add_argument(
+        "--record-session",
+        type=pathlib.Path,
+        help="Record traffic with the loom and clients in this file, "
+        "for replay with python -m seguin_loom_server.session_replay. "
+        "Full files are rotated (renamed with suffix .1, .2, ...). "
+        "Each loom other than loom 1 has its own file, named like the databases.",
+    )
     return parser
 
 
+def get_loom_db_path(db_path: pathlib.Path, loom_id: int) -> pathlib.Path:
+    """Get the path of the pattern database for the specified loom.
+
+    Loom 1 uses db_path, so a server with one loom
+    keeps using the same database as before multiple looms were supported.
+    Other looms append _loom<id> to the stem of db_path, e.g.
+    pattern_database_loom2.sqlite.
+    """
+    if loom_id == DEFAULT_LOOM_ID:
+        return db_path
+    return db_path.with_stem(f"{db_path.stem}_loom{loom_id}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, FastAPI]:
-    global loom_server
+    global loop_lag_monitor
     parser = create_argument_parser()
     args = parser.parse_args()
+    real_serial_ports = [
+        port
+        for port in args.serial_ports
+        if port not in (MOCK_PORT_NAME, PTY_MOCK_PORT_NAME)
+    ]
+    if len(set(real_serial_ports)) != len(real_serial_ports):
+        raise ValueError(f"Serial ports {args.serial_ports} must be unique")
 
-    async with LoomServer(**vars(args)) as loom_server:
-        yield
+    async with contextlib.AsyncExitStack() as stack:
+        try:
+            loop_lag_monitor = LoopLagMonitor()
+            stack.push_async_callback(loop_lag_monitor.close)
+            for loom_id, serial_port in enumerate(
+                args.serial_ports, start=DEFAULT_LOOM_ID
+            ):
+                loom_servers[loom_id] = await stack.enter_async_context(
+                    LoomServer(
+                        serial_port=serial_port,
+                        reset_db=args.reset_db,
+                        verbose=args.verbose,
+                        db_path=get_loom_db_path(args.db_path, loom_id),
+                        session_path=(
+                            None
+                            if args.record_session is None
+                            else get_loom_db_path(args.record_session, loom_id)
+                        ),
+                    )
+                )
+            yield
+        finally:
+            loom_servers.clear()
+            loop_lag_monitor = None
 
 
 app = FastAPI(lifespan=lifespan)
@@ -65,25 +139,129 @@ def get_file(filename: str) -> str:
     return bindata.decode()
 
 
-@app.get("/")
-async def get() -> HTMLResponse:
+def get_loom_server(loom_id: int) -> LoomServer:
+    """Get the LoomServer for the specified loom.
+
+    Raises
+    ------
+    HTTPException
+        If there is no such loom.
+    """
+    loom_server = loom_servers.get(loom_id)
+    if loom_server is None:
+        raise HTTPException(status_code=404, detail=f"No loom {loom_id}")
+    return loom_server
+
+
+def get_display_html(loom_id: int, websocket_path: str) -> str:
+    """Get the loom control page for the specified loom.
+
+    Parameters
+    ----------
+    loom_id : int
+        Loom ID.
+    websocket_path : str
+        Path of the loom's websocket, relative to the page.
+    """
+    loom_server = get_loom_server(loom_id)
+
     display_html_template = get_file("display.html_template")
 
     display_css = get_file("display.css")
 
     display_js = get_file("display.js")
 
-    assert loom_server is not None
     is_mock = loom_server.mock_loom is not None
     display_debug_controls = "block" if is_mock else "none"
 
-    display_html = display_html_template.format(
+    return display_html_template.format(
         display_css=display_css,
         display_js=display_js,
         display_debug_controls=display_debug_controls,
+        websocket_path=websocket_path,
     )
 
-    return HTMLResponse(display_html)
+
+@app.get("/")
+async def get() -> HTMLResponse:
+    """Get the control page for the only loom,
+    or a list of looms if there is more than one."""
+    if len(loom_servers) <= 1:
+        return HTMLResponse(
+            get_display_html(loom_id=DEFAULT_LOOM_ID, websocket_path="ws")
+        )
+
+    loom_items = "\n".join(
+        f'<li><a href="loom/{loom_id}">Loom {loom_id}</a>: '
+        f"{html.escape(loom_server.serial_port)}</li>"
+        for loom_id, loom_server in loom_servers.items()
+    )
+    return HTMLResponse(
+        "<!DOCTYPE html>\n<html>\n<head><title>Looms</title></head>\n"
+        f"<body>\n<ul>\n{loom_items}\n</ul>\n</body>\n</html>"
+    )
+
+
+@app.get("/loom/{loom_id}")
+async def get_loom(loom_id: int) -> HTMLResponse:
+    """Get the control page for the specified loom."""
+    return HTMLResponse(
+        get_display_html(loom_id=loom_id, websocket_path=f"../ws/{loom_id}")
+    )
+
+
+@app.get("/looms")
+async def get_looms() -> list[dict[str, Any]]:
+    """Get the status of every loom; see LoomServer.get_status."""
+    return [
+        dict(loom_id=loom_id, **loom_server.get_status())
+        for loom_id, loom_server in loom_servers.items()
+    ]
+
+
+@app.get("/loom/{loom_id}/latency")
+async def get_loom_latency(loom_id: int) -> dict[str, dict[str, Any]]:
+    """Get latency statistics for the specified loom (durations in sec).
+
+    See loom_server.LATENCY_NAMES for what is measured.
+    """
+    return get_loom_server(loom_id).latency_stats.as_dict()
+
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    """Get metrics for all looms, in the Prometheus text format.
+
+    Each loom's metrics have a "loom" label with the loom ID.
+    """
+    writer = MetricsWriter()
+    for loom_id, loom_server in loom_servers.items():
+        loom_server.add_metrics(writer, labels=dict(loom=str(loom_id)))
+    if loop_lag_monitor is not None:
+        writer.add_histogram(
+            "event_loop_lag_seconds",
+            "How late the event loop ran a scheduled callback.",
+            loop_lag_monitor.lag_histogram,
+        )
+        writer.add_counter(
+            "event_loop_slow_callbacks_total",
+            "Number of times the event loop was unresponsive "
+            "for longer than the slow callback threshold.",
+            loop_lag_monitor.num_slow_callbacks,
+        )
+    return Response(content=writer.render(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+@app.get("/event_loop")
+async def get_event_loop() -> dict[str, Any]:
+    """Get event loop lag statistics and the most recent slow callbacks,
+    with the stack of each (durations in sec).
+
+    See LoopLagMonitor.as_dict for details.
+    """
+    if loop_lag_monitor is None:
+        raise HTTPException(status_code=404, detail="Not monitoring the event loop")
+    return loop_lag_monitor.as_dict()
 
 
 @app.get("/favicon.ico", include_in_schema=False)
@@ -97,8 +275,17 @@ async def favicon():
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket) -> None:
-    global loom_server
-    assert loom_server is not None
+    await loom_websocket_endpoint(websocket=websocket, loom_id=DEFAULT_LOOM_ID)
+
+
+@app.websocket("/ws/{loom_id}")
+async def loom_websocket_endpoint(websocket: WebSocket, loom_id: int) -> None:
+    loom_server = loom_servers.get(loom_id)
+    if loom_server is None:
+        await websocket.close(
+            code=CloseCode.POLICY_VIOLATION, reason=f"No loom {loom_id}"
+        )
+        return
     await loom_server.run_client(websocket=websocket)
 
 
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+__all__ = ["PROMETHEUS_CONTENT_TYPE", "MetricsWriter"]
+
+import dataclasses
+
+from .latency_stats import LatencyHistogram
+
+# Content type of the Prometheus text exposition format
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@dataclasses.dataclass
+class _Metric:
+    """A metric: its type, help string, and sample lines."""
+
+    metric_type: str
+    help: str
+    samples: list[str] = dataclasses.field(default_factory=list)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    """Format labels as {name="value",...}, or "" if no labels."""
+    if not labels:
+        return ""
+    label_strs = []
+    for name, value in labels.items():
+        escaped_value = (
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        )
+        label_strs.append(f'{name}="{escaped_value}"')
+    return "{" + ",".join(label_strs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return f"{value:.9g}"
+
+
+class MetricsWriter:
+    """Collect metrics and format them in the Prometheus text format.
+
+    Metrics are gathered when the metrics are requested,
+    from values the server maintains anyway (plain counters
+    and histograms), so collecting metrics costs nothing
+    between requests.
+
+    Samples of the same metric (e.g. one per loom, distinguished
+    by a label) are grouped together, as the format requires.
+
+    Parameters
+    ----------
+    prefix : str
+        Prefix for every metric name.
+    """
+
+    def __init__(self, prefix: str = "seguin_") -> None:
+        self.prefix = prefix
+        # dict of full metric name: metric
+        self._metrics: dict[str, _Metric] = {}
+
+    def add_counter(
+        self,
+        name: str,
+        help: str,
+        value: float,
+        labels: dict[str, str] | None = None,
+    ) -> None:
+        """Add a sample of a counter. By convention name ends in _total."""
+        self._add_sample("counter", name, help, value, labels or {})
+
+    def add_gauge(
+        self,
+        name: str,
+        help: str,
+        value: float,
+        labels: dict[str, str] | None = None,
+    ) -> None:
+        """Add a sample of a gauge."""
+        self._add_sample("gauge", name, help, value, labels or {})
+
+    def add_summary(
+        self,
+        name: str,
+        help: str,
+        count: int,
+        sum: float,
+        labels: dict[str, str] | None = None,
+    ) -> None:
+        """Add a summary with no quantiles: just a count and a sum."""
+        labels = labels or {}
+        metric = self._get_metric("summary", name, help)
+        label_str = _format_labels(labels)
+        full_name = self.prefix + name
+        metric.samples.append(f"{full_name}_sum{label_str} {_format_value(sum)}")
+        metric.samples.append(f"{full_name}_count{label_str} {count}")
+
+    def add_histogram(
+        self,
+        name: str,
+        help: str,
+        histogram: LatencyHistogram,
+        labels: dict[str, str] | None = None,
+    ) -> None:
+        """Add a histogram. By convention name ends in _seconds."""
+        labels = labels or {}
+        metric = self._get_metric("histogram", name, help)
+        full_name = self.prefix + name
+        cumulative_count = 0
+        for edge, count in zip(histogram.bucket_edges, histogram.counts):
+            cumulative_count += count
+            label_str = _format_labels(dict(labels, le=_format_value(edge)))
+            metric.samples.append(f"{full_name}_bucket{label_str} {cumulative_count}")
+        label_str = _format_labels(dict(labels, le="+Inf"))
+        metric.samples.append(f"{full_name}_bucket{label_str} {histogram.count}")
+        label_str = _format_labels(labels)
+        metric.samples.append(
+            f"{full_name}_sum{label_str} {_format_value(histogram.sum)}"
+        )
+        metric.samples.append(f"{full_name}_count{label_str} {histogram.count}")
+
+    def render(self) -> str:
+        """Format all metrics in the Prometheus text format."""
+        lines = []
+        for full_name, metric in self._metrics.items():
+            lines.append(f"# HELP {full_name} {metric.help}")
+            lines.append(f"# TYPE {full_name} {metric.metric_type}")
+            lines += metric.samples
+        return "\n".join(lines) + "\n"
+
+    def _add_sample(
+        self,
+        metric_type: str,
+        name: str,
+        help: str,
+        value: float,
+        labels: dict[str, str],
+    ) -> None:
+        metric = self._get_metric(metric_type, name, help)
+        metric.samples.append(
+            f"{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}"
+        )
+
+    def _get_metric(self, metric_type: str, name: str, help: str) -> _Metric:
+        """Get the metric with the specified name, creating it if new.
+
+        Raises
+        ------
+        ValueError
+            If the metric exists with a different type.
+        """
+        full_name = self.prefix + name
+        metric = self._metrics.get(full_name)
+        if metric is None:
+            metric = _Metric(metric_type=metric_type, help=help)
+            self._metrics[full_name] = metric
+        elif metric.metric_type != metric_type:
+            raise ValueError(
+                f"Metric {full_name} is a {metric.metric_type}, not a {metric_type}"
+            )
+        return metric
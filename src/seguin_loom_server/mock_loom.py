@@ -1,12 +1,15 @@
 from __future__ import annotations
 
-__all__ = ["MockLoom"]
+__all__ = ["MockLoom", "MockLoomTiming"]
 
 import asyncio
+import dataclasses
 from types import TracebackType
-from typing import Type
+from typing import Self, Type
 
-from .loom_constants import TERMINATOR
+from . import loom_protocol
+from .latency_stats import LatencyHistogram
+from .loom_constants import BAUD_RATE, TERMINATOR
 from .mock_streams import (
     MockStreamReader,
     MockStreamWriter,
@@ -17,6 +20,54 @@ from .mock_streams import (
 
 DIRECTION_NAMES = {True: "weave", False: "unweave"}
 
+# Number of bits sent per byte on the serial line:
+# 1 start bit, 8 data bits and 1 stop bit
+BITS_PER_BYTE = 10
+
+
+@dataclasses.dataclass
+class MockLoomTiming:
+    """Timing model for MockLoom.
+
+    Parameters
+    ----------
+    byte_duration : float
+        Time to transmit one byte between the loom and the server (sec),
+        in either direction. Defaults to the time at `BAUD_RATE`.
+    shed_open_duration : float
+        Time to raise the shafts after receiving a =C command (sec).
+        The loom reports the raised shafts (=c) after this delay.
+    shed_close_duration : float
+        Time to close the shed after weaving a pick (sec),
+        before requesting the next pick. Only used for auto-weave.
+    auto_weave_rate : float | None
+        Picks per minute to weave automatically; None to not weave
+        automatically (the default), or math.inf to weave as fast as
+        the shed and the server allow.
+    pick_request_timeout : float
+        Time to wait for the shafts to be raised after requesting a pick,
+        before requesting it again (sec); must be longer than
+        shed_open_duration. Only used for auto-weave. The server
+        does not send a =C command when it advances to the next repeat.
+
+    Raises
+    ------
+    ValueError
+        If auto_weave_rate is not None and not positive.
+    """
+
+    byte_duration: float = BITS_PER_BYTE / BAUD_RATE
+    shed_open_duration: float = 0.1
+    shed_close_duration: float = 0.1
+    auto_weave_rate: float | None = None
+    pick_request_timeout: float = 0.5
+
+    def __post_init__(self) -> None:
+        if self.auto_weave_rate is not None and self.auto_weave_rate <= 0:
+            raise ValueError(
+                f"auto_weave_rate={self.auto_weave_rate} must be None or positive"
+            )
+
 
 class MockLoom:
     """Simulate a Seguin dobby loom.
@@ -25,6 +76,9 @@ class MockLoom:
     ----------
     verbose : bool
         If True, print diagnostics to stdout.
+    timing : MockLoomTiming | None
+        Timing model. If None (the default) the loom replies
+        instantly and only weaves when asked to by an oob command.
 
     The user controls this loom by:
 
@@ -34,8 +88,11 @@ class MockLoom:
     * Write commands to the command writer.
     """
 
-    def __init__(self, verbose: bool = True) -> None:
+    def __init__(
+        self, verbose: bool = True, timing: MockLoomTiming | None = None
+    ) -> None:
         self.verbose = verbose
+        self.timing = timing
         self.weave_forward = True
         self.reply_writer: StreamWriterType | None = None
         self.command_reader: StreamReaderType | None = None
@@ -43,19 +100,41 @@ class MockLoom:
         self.error_flag = False
         self.shaft_word = 0
         self.weave_cycle_completed = False
+        # Event loop time when the current pick was requested,
+        # or None if no pick request is pending
+        self.pick_request_time: float | None = None
+        # Time from requesting a pick to receiving the =C command,
+        # as seen by the loom (including transmission time)
+        self.pick_request_latency = LatencyHistogram()
+        self.num_picks_woven = 0
+        # Set when the loom has raised the shafts for a pick
+        self.shafts_raised_event = asyncio.Event()
+        self.auto_weave_task: asyncio.Future = asyncio.Future()
+        self.auto_weave_task.set_result(None)
         self.start_task = asyncio.create_task(self.start())
 
-    async def start(self) -> None:
-        self.command_reader, self.reply_writer = open_mock_connection(
-            terminator=TERMINATOR
+    async def create_streams(self) -> tuple[StreamReaderType, StreamWriterType]:
+        """Create the command reader and reply writer.
+
+        Subclasses may override this to communicate in some other way.
+        """
+        return open_mock_connection(
+            terminator=TERMINATOR,
+            byte_duration=0 if self.timing is None else self.timing.byte_duration,
         )
+
+    async def start(self) -> None:
+        self.command_reader, self.reply_writer = await self.create_streams()
         self.read_commands_task = asyncio.create_task(self.handle_commands_loop())
         await self.report_state()
         await self.report_direction()
         await self.report_shafts()
+        if self.timing is not None and self.timing.auto_weave_rate is not None:
+            self.auto_weave_task = asyncio.create_task(self.auto_weave_loop())
 
     async def close(self) -> None:
         self.read_commands_task.cancel()
+        self.auto_weave_task.cancel()
         if self.reply_writer is not None:
             self.reply_writer.close()
             await self.reply_writer.wait_closed()
@@ -92,69 +171,57 @@ class MockLoom:
         )
 
     async def handle_commands_loop(self) -> None:
-        while self.connected():
-            assert self.command_reader is not None  # make mypy happy
-            cmdbytes = await self.command_reader.readuntil(TERMINATOR)
-            if not cmdbytes:
-                break
-            cmd = cmdbytes.decode().rstrip()
+        if not self.connected():
+            return
+        assert self.command_reader is not None  # make mypy happy
+        protocol = loom_protocol.LoomProtocol(loom_protocol.COMMAND_PARSERS)
+        async for cmd in loom_protocol.read_messages(self.command_reader, protocol):
             if self.verbose:
-                print(f"MockLoom: process client command {cmd!r}")
-            if not cmd:
-                return
-            if cmd[0:1] != "=":
-                print(f"MockLoom: invalid command {cmd!r}: must begin with '='")
-                return
-            if len(cmd) < 2:
-                print(
-                    f"MockLoom: invalid command {cmd!r}: must be at least 2 characters"
-                )
-                return
-            cmd_char = cmd[1]
-            cmd_data = cmd[2:]
-            match cmd_char:
-                case "C":
+                print(f"MockLoom: process client command {cmd}")
+            match cmd:
+                case loom_protocol.InvalidMessage():
+                    print(f"MockLoom: invalid command {cmd.message!r}: {cmd.reason}")
+                    return
+                case loom_protocol.ShaftsCommand():
                     # Specify which shafts to raise as a hex value
-                    try:
-                        self.shaft_word = int(cmd_data, base=16)
-                    except Exception:
-                        print(
-                            f"MockLoom: invalid command {cmd!r}: data after =C not a hex value"
+                    if self.pick_request_time is not None:
+                        self.pick_request_latency.record(
+                            asyncio.get_running_loop().time() - self.pick_request_time
                         )
-                        return
+                        self.pick_request_time = None
+                    self.shaft_word = cmd.shaft_word
                     if self.verbose:
                         print(f"MockLoom: raise shafts {self.shaft_word:08x}")
                     self.weave_cycle_completed = False
+                    if self.timing is not None:
+                        await asyncio.sleep(self.timing.shed_open_duration)
                     await self.report_shafts()
-                case "U":
+                    self.shafts_raised_event.set()
+                case loom_protocol.DirectionCommand():
                     # Client commands unweave on/off
                     # (as opposed to the user pushing the button on the loom,
                     # in which case the loom changes it and reports it
                     # to the client).
-                    if cmd_data == "0":
-                        self.weave_forward = True
-                        if self.verbose:
-                            print("MockLoom: weave forward, commanded by software")
-                    elif cmd_data == "1":
-                        self.weave_forward = False
-                        if self.verbose:
-                            print("MockLoom: weave backwards, commanded by software")
-                    else:
-                        print(f"MockLoom: invalid command {cmd!r}: arg nmust be 0 or 1")
-                        return
+                    self.weave_forward = cmd.weave_forward
+                    if self.verbose:
+                        print(
+                            "MockLoom: weave "
+                            f"{'forward' if self.weave_forward else 'backwards'}, "
+                            "commanded by software"
+                        )
                     await self.report_direction()
-                case "V":
+                case loom_protocol.VersionCommand():
                     if self.verbose:
                         print("MockLoom: get version")
                     await self.reply("=v001")
-                case "Q":
+                case loom_protocol.StateCommand():
                     if self.verbose:
                         print("MockLoom: get state")
                     await self.report_state()
-                case "#":
+                case loom_protocol.OobCommand():
                     # Out of band command specific to the mock loom.
                     # Cast to lowercase becase uppercase is default on iOS.
-                    match cmd_data.lower():
+                    match cmd.command.lower():
                         case "d":
                             self.weave_forward = not self.weave_forward
                             await self.report_direction()
@@ -173,8 +240,7 @@ class MockLoom:
                         case "n":
                             if self.verbose:
                                 print("MockLoom: oob request next pick")
-                            self.weave_cycle_completed = True
-                            await self.report_state()
+                            await self.request_next_pick()
                         case "q":
                             if self.verbose:
                                 print("MockLoom: oob quit command")
@@ -182,7 +248,48 @@ class MockLoom:
                                 self.reply_writer.close()
                             self.done_task.set_result(None)
                         case _:
-                            print(f"MockLoom: unrecognized oob command: {cmd_data!r}")
+                            print(
+                                f"MockLoom: unrecognized oob command: {cmd.command!r}"
+                            )
+            if not self.connected():
+                return
+
+    async def auto_weave_loop(self) -> None:
+        """Weave picks at the rate specified by the timing model.
+
+        Each cycle: request the next pick, wait for the shafts to be raised,
+        weave the pick, then close the shed. Request the pick again
+        if no =C command arrives within the pick request timeout.
+        """
+        assert self.timing is not None
+        assert self.timing.auto_weave_rate is not None
+        pick_interval = 60 / self.timing.auto_weave_rate
+        while self.connected():
+            self.shafts_raised_event.clear()
+            cycle_start_time = asyncio.get_running_loop().time()
+            await self.request_next_pick()
+            try:
+                async with asyncio.timeout(self.timing.pick_request_timeout):
+                    await self.shafts_raised_event.wait()
+            except TimeoutError:
+                continue
+            self.num_picks_woven += 1
+            # Throw the shuttle, leaving time to close the shed
+            weave_duration = (
+                cycle_start_time
+                + pick_interval
+                - self.timing.shed_close_duration
+                - asyncio.get_running_loop().time()
+            )
+            if weave_duration > 0:
+                await asyncio.sleep(weave_duration)
+            await asyncio.sleep(self.timing.shed_close_duration)
+
+    async def request_next_pick(self) -> None:
+        """Report that the weave cycle is complete; request the next pick."""
+        self.weave_cycle_completed = True
+        self.pick_request_time = asyncio.get_running_loop().time()
+        await self.report_state()
 
     async def reply(self, reply: str) -> None:
         """Issue the specified reply, which should not be terminated"""
@@ -207,8 +314,8 @@ class MockLoom:
             bitmask += 8
         await self.reply(f"=s{bitmask:01x}")
 
-    async def __aenter__(self) -> MockLoom:
-        await self.start()
+    async def __aenter__(self) -> Self:
+        await self.start_task
         return self
 
     async def __aexit__(
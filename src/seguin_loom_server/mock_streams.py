@@ -17,12 +17,26 @@ DEFAULT_TERMINATOR = b"\n"
 
 
 class StreamData:
-    """Data contained in a mock stream."""
+    """Data contained in a mock stream.
 
-    def __init__(self) -> None:
+    Parameters
+    ----------
+    byte_duration : float
+        Time to transmit one byte (sec). If > 0, simulate
+        a serial line: written data becomes readable once it
+        has been transmitted, one byte after another.
+    """
+
+    def __init__(self, byte_duration: float = 0) -> None:
         self.closed_event = asyncio.Event()
         self.data_available_event = asyncio.Event()
         self.queue: Deque[bytes] = collections.deque()
+        self.byte_duration = byte_duration
+        # Event loop time at which each item in queue is fully transmitted;
+        # only used if byte_duration > 0
+        self.arrival_times: Deque[float] = collections.deque()
+        # Event loop time at which the last data written is fully transmitted
+        self.transmit_end_time = 0.0
 
     def _is_closed(self):
         """Return true if this stream has been closed."""
@@ -38,20 +52,26 @@ class BaseMockStream:
         Stream data to use; if None create new.
     terminator : bytes
         Required terminator.
+    byte_duration : float
+        Time to transmit one byte (sec), if sd is None;
+        see `StreamData`.
     """
 
     def __init__(
-        self, sd: StreamData | None = None, terminator: bytes = DEFAULT_TERMINATOR
+        self,
+        sd: StreamData | None = None,
+        terminator: bytes = DEFAULT_TERMINATOR,
+        byte_duration: float = 0,
     ):
         if sd is None:
-            sd = StreamData()
+            sd = StreamData(byte_duration=byte_duration)
         self.sd = sd
         self.terminator = terminator
         self.sibling_sd: weakref.ProxyType[StreamData] | None = None
 
 
 class MockStreamReader(BaseMockStream):
-    """Minimal mock stream reader that only supports line-oriented data.
+    """Minimal mock stream reader for line-oriented data.
 
     Parameters
     ----------
@@ -68,13 +88,47 @@ class MockStreamReader(BaseMockStream):
     def at_eof(self) -> bool:
         return not self.sd.queue and self.sd._is_closed()
 
-    async def readline(self) -> bytes:
-        while not self.sd.queue:
-            if self.sd._is_closed():
-                return b""
+    async def read(self, n: int = -1) -> bytes:
+        """Read up to n bytes (all available data if n < 0).
+
+        Unlike asyncio.StreamReader.read, n < 0 does not wait
+        for end of file. Like asyncio.StreamReader.read,
+        wait for data if none is available, and return b""
+        at end of file.
+        """
+        if not await self._wait_for_data():
+            return b""
+        queue = self.sd.queue
+        arrival_times = self.sd.arrival_times
+        current_time = asyncio.get_running_loop().time() if arrival_times else 0
+        chunks: list[bytes] = []
+        nbytes = 0
+        while queue and (n < 0 or nbytes < n):
+            arrival_time: float | None = None
+            if arrival_times:
+                # Only return data that has been transmitted
+                if chunks and arrival_times[0] > current_time:
+                    break
+                arrival_time = arrival_times.popleft()
+            data = queue.popleft()
+            if n >= 0 and nbytes + len(data) > n:
+                nkeep = n - nbytes
+                queue.appendleft(data[nkeep:])
+                if arrival_time is not None:
+                    arrival_times.appendleft(arrival_time)
+                data = data[:nkeep]
+            chunks.append(data)
+            nbytes += len(data)
+        if not queue:
             self.sd.data_available_event.clear()
-            await self.sd.data_available_event.wait()
+        return b"".join(chunks)
+
+    async def readline(self) -> bytes:
+        if not await self._wait_for_data():
+            return b""
         data = self.sd.queue.popleft()
+        if self.sd.arrival_times:
+            self.sd.arrival_times.popleft()
         if not self.sd.queue:
             self.sd.data_available_event.clear()
         return data
@@ -90,6 +144,23 @@ class MockStreamReader(BaseMockStream):
     def create_writer(self) -> MockStreamWriter:
         return MockStreamWriter(sd=self.sd, terminator=self.terminator)
 
+    async def _wait_for_data(self) -> bool:
+        """Wait for data to be available (and transmitted,
+        if simulating a serial line).
+
+        Return True if data is available, False if at end of file.
+        """
+        while not self.sd.queue:
+            if self.sd._is_closed():
+                return False
+            self.sd.data_available_event.clear()
+            await self.sd.data_available_event.wait()
+        if self.sd.arrival_times:
+            delay = self.sd.arrival_times[0] - asyncio.get_running_loop().time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        return True
+
 
 class MockStreamWriter(BaseMockStream):
     """Minimal mock stream writer that only allows writing terminated data.
@@ -107,9 +178,12 @@ class MockStreamWriter(BaseMockStream):
     """
 
     def close(self) -> None:
+        # Set data_available_event as well, to wake waiting readers
         self.sd.closed_event.set()
+        self.sd.data_available_event.set()
         if self.sibling_sd and not self.sibling_sd._is_closed():
             self.sibling_sd.closed_event.set()
+            self.sibling_sd.data_available_event.set()
 
     def is_closing(self) -> bool:
         return self.sd._is_closed()
@@ -130,6 +204,12 @@ class MockStreamWriter(BaseMockStream):
         if self.is_closing():
             return
         self.sd.queue.append(data)
+        if self.sd.byte_duration > 0:
+            start_time = max(
+                asyncio.get_running_loop().time(), self.sd.transmit_end_time
+            )
+            self.sd.transmit_end_time = start_time + len(data) * self.sd.byte_duration
+            self.sd.arrival_times.append(self.sd.transmit_end_time)
 
     def _set_sibling_data(self, reader: MockStreamReader) -> None:
         self.sibling_sd = weakref.proxy(reader.sd)
@@ -144,13 +224,22 @@ StreamWriterType: TypeAlias = asyncio.StreamWriter | MockStreamWriter
 
 def open_mock_connection(
     terminator=DEFAULT_TERMINATOR,
+    byte_duration: float = 0,
 ) -> tuple[MockStreamReader, MockStreamWriter]:
     """Create a mock stream reader, writer pair.
 
     To create a stream that writes to the returned reader,
     call reader.create_writer, and similarly for the returned writer.
+
+    Parameters
+    ----------
+    terminator : bytes
+        Required terminator.
+    byte_duration : float
+        Time to transmit one byte (sec) in each direction.
+        If 0 (the default) data is available as soon as it is written.
     """
-    reader = MockStreamReader(terminator=terminator)
-    writer = MockStreamWriter(terminator=terminator)
+    reader = MockStreamReader(terminator=terminator, byte_duration=byte_duration)
+    writer = MockStreamWriter(terminator=terminator, byte_duration=byte_duration)
     writer._set_sibling_data(reader=reader)
     return (reader, writer)
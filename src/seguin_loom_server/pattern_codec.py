@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+__all__ = ["FORMAT_VERSION", "decode_pattern", "encode_pattern"]
+
+import array
+import struct
+import sys
+import zlib
+
+from .reduced_pattern import Pick, ReducedPattern
+
+# Magic bytes at the start of every encoded pattern
+MAGIC = b"SLRP"
+
+# Version of the encoding; increment when the encoding changes
+FORMAT_VERSION = 1
+
+# Header flag: the payload is zlib-compressed
+FLAG_ZLIB = 0x01
+
+# Header: magic, format version, flags
+_HEADER = struct.Struct("<4sBB")
+
+# Length of an integer array or string
+_LENGTH = struct.Struct("<I")
+
+# Array type codes, in order of preference (smallest first)
+_SIGNED_TYPECODES = ("b", "h", "i", "q")
+_UNSIGNED_TYPECODES = ("B", "H", "I", "Q")
+
+
+def encode_pattern(pattern: ReducedPattern, compress: bool = True) -> bytes:
+    """Encode a ReducedPattern in a compact binary format.
+
+    The name, pick_number and repeat_number are not encoded;
+    the pattern database saves those separately.
+
+    The format is a header (magic bytes, format version, and flags),
+    followed by the payload, which may be zlib-compressed.
+    The payload contains:
+
+    * The color table, as a count followed by length-prefixed
+      utf-8 strings.
+    * The warp colors and threading, as integer arrays.
+    * The number of shafts, followed by the shaft word and color
+      of each pick, as integer arrays.
+
+    Each integer array is a type code (as used by the array module),
+    an element count, and the little-endian elements,
+    using the smallest type that holds all the values.
+
+    Parameters
+    ----------
+    pattern : ReducedPattern
+        The pattern to encode.
+    compress : bool
+        Compress the payload with zlib?
+        Ignored if compression does not make the payload smaller.
+
+    Raises
+    ------
+    ValueError
+        If the picks do not all have the same number of shafts,
+        or a value cannot be encoded.
+    """
+    num_shafts_set = {pick.num_shafts for pick in pattern.picks}
+    if len(num_shafts_set) > 1:
+        raise ValueError(f"Picks have different numbers of shafts: {num_shafts_set}")
+    num_shafts = num_shafts_set.pop() if num_shafts_set else 0
+
+    chunks: list[bytes] = [_LENGTH.pack(len(pattern.color_table))]
+    for color in pattern.color_table:
+        chunks.append(_encode_str(color))
+    chunks.append(_encode_ints(pattern.warp_colors))
+    chunks.append(_encode_ints(pattern.threading))
+    chunks.append(_LENGTH.pack(num_shafts))
+    chunks.append(_encode_ints([pick.shaft_word for pick in pattern.picks]))
+    chunks.append(_encode_ints([pick.color for pick in pattern.picks]))
+    payload = b"".join(chunks)
+
+    flags = 0
+    if compress:
+        compressed_payload = zlib.compress(payload)
+        if len(compressed_payload) < len(payload):
+            payload = compressed_payload
+            flags |= FLAG_ZLIB
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, flags) + payload
+
+
+def decode_pattern(data: bytes, name: str) -> ReducedPattern:
+    """Decode a ReducedPattern encoded by `encode_pattern`.
+
+    Identical picks are shared (are the same object).
+
+    Parameters
+    ----------
+    data : bytes
+        The encoded pattern.
+    name : str
+        The name of the pattern.
+
+    Raises
+    ------
+    ValueError
+        If the data is not a validly encoded pattern
+        or has an unsupported format version.
+    """
+    if len(data) < _HEADER.size:
+        raise ValueError("Encoded pattern is too short")
+    magic, version, flags = _HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"Encoded pattern has the wrong magic bytes: {magic!r}")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported encoded pattern {version=}")
+    payload = memoryview(data)[_HEADER.size :]
+    if flags & FLAG_ZLIB:
+        try:
+            payload = memoryview(zlib.decompress(payload))
+        except zlib.error as e:
+            raise ValueError(f"Could not decompress encoded pattern: {e}")
+
+    try:
+        num_colors, offset = _decode_length(payload, 0)
+        color_table = []
+        for _ in range(num_colors):
+            color_str, offset = _decode_str(payload, offset)
+            color_table.append(color_str)
+        warp_colors, offset = _decode_ints(payload, offset)
+        threading, offset = _decode_ints(payload, offset)
+        num_shafts, offset = _decode_length(payload, offset)
+        shaft_words, offset = _decode_ints(payload, offset)
+        pick_colors, offset = _decode_ints(payload, offset)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"Encoded pattern is corrupt: {e}")
+    if offset != len(payload):
+        raise ValueError(f"Encoded pattern has {len(payload) - offset} extra bytes")
+    if len(shaft_words) != len(pick_colors):
+        raise ValueError(f"{len(shaft_words)=} != {len(pick_colors)=}")
+
+    # Construct each distinct pick only once
+    pick_keys = list(zip(shaft_words, pick_colors))
+    distinct_picks = {
+        (shaft_word, color): Pick(
+            color=color, shaft_word=shaft_word, num_shafts=num_shafts
+        )
+        for shaft_word, color in set(pick_keys)
+    }
+    picks = [distinct_picks[key] for key in pick_keys]
+
+    return ReducedPattern(
+        name=name,
+        color_table=color_table,
+        warp_colors=warp_colors,
+        threading=threading,
+        picks=picks,
+    )
+
+
+def _encode_str(value: str) -> bytes:
+    """Encode a str as a length followed by utf-8 bytes."""
+    encoded_value = value.encode()
+    return _LENGTH.pack(len(encoded_value)) + encoded_value
+
+
+def _encode_ints(values: list[int]) -> bytes:
+    """Encode a list of ints as a type code, count, and values."""
+    typecodes = _SIGNED_TYPECODES if values and min(values) < 0 else _UNSIGNED_TYPECODES
+    for typecode in typecodes:
+        try:
+            int_array = array.array(typecode, values)
+            break
+        except OverflowError:
+            continue
+    else:
+        raise ValueError("Cannot encode values: too large")
+    if sys.byteorder != "little":
+        int_array.byteswap()
+    return typecode.encode() + _LENGTH.pack(len(int_array)) + int_array.tobytes()
+
+
+def _decode_length(payload: memoryview, offset: int) -> tuple[int, int]:
+    """Decode a length. Return the length and the new offset."""
+    (length,) = _LENGTH.unpack_from(payload, offset)
+    return length, offset + _LENGTH.size
+
+
+def _decode_str(payload: memoryview, offset: int) -> tuple[str, int]:
+    """Decode a str encoded by _encode_str.
+
+    Return the str and the new offset.
+    """
+    length, offset = _decode_length(payload, offset)
+    end = offset + length
+    if end > len(payload):
+        raise struct.error("string extends past the end of the data")
+    return bytes(payload[offset:end]).decode(), end
+
+
+def _decode_ints(payload: memoryview, offset: int) -> tuple[list[int], int]:
+    """Decode a list of ints encoded by _encode_ints.
+
+    Return the list and the new offset.
+    """
+    typecode = chr(payload[offset])
+    if typecode not in _SIGNED_TYPECODES and typecode not in _UNSIGNED_TYPECODES:
+        raise struct.error(f"invalid array type code {typecode!r}")
+    count, offset = _decode_length(payload, offset + 1)
+    int_array = array.array(typecode)
+    end = offset + count * int_array.itemsize
+    if end > len(payload):
+        raise struct.error("array extends past the end of the data")
+    int_array.frombytes(payload[offset:end])
+    if sys.byteorder != "little":
+        int_array.byteswap()
+    return int_array.tolist(), end
@@ -1,37 +1,295 @@
-import dataclasses
+from __future__ import annotations
+
+import asyncio
+import collections
+import copy
+import hashlib
 import json
 import pathlib
+import sys
 import time
+import traceback
+from types import TracebackType
+from typing import Type
 
 import aiosqlite
 
+from .latency_stats import LatencyStats
+from .pattern_codec import decode_pattern, encode_pattern
 from .reduced_pattern import ReducedPattern
 
+# Version of the database schema, saved as sqlite's user_version.
+# Version 0 saved patterns as JSON; version 1 saves them
+# in the binary format of the pattern_codec module.
+DATABASE_VERSION = 1
+
+# Default maximum number of entries in the parse cache
+DEFAULT_MAX_PARSE_CACHE_ENTRIES = 100
+
+# Default maximum approximate memory used by the pattern cache (bytes)
+DEFAULT_MAX_PATTERN_CACHE_NBYTES = 50_000_000
+
+# Operations whose durations are recorded in PatternDatabase.latency_stats
+DATABASE_OPERATIONS = (
+    "add_pattern",
+    "add_pattern_from_parse_cache",
+    "get_pattern",
+    "get_pattern_names",
+    "update_pick_number",
+)
+
+
+def compute_file_digest(filename: str, data: str) -> str:
+    """Compute a digest of the contents of a pattern file.
+
+    The file type (suffix) is included, because the same contents
+    would be parsed differently as a different type of file.
+    """
+    suffix = pathlib.PurePath(filename).suffix.lower()
+    hasher = hashlib.sha256(suffix.encode())
+    hasher.update(data.encode())
+    return hasher.hexdigest()
+
+
+def estimate_pattern_nbytes(pattern: ReducedPattern) -> int:
+    """Estimate the memory used by a decoded ReducedPattern (bytes).
+
+    The estimate is approximate: it counts the lists, the color strings,
+    each distinct pick once (since identical picks are shared),
+    and the cached loom commands and JSON encoding, if computed
+    (see `ReducedPattern.fill_caches`), but not small ints,
+    which Python shares.
+    """
+    nbytes = sys.getsizeof(pattern)
+    for list_field in (
+        pattern.color_table,
+        pattern.warp_colors,
+        pattern.threading,
+        pattern.picks,
+    ):
+        nbytes += sys.getsizeof(list_field)
+    nbytes += sum(sys.getsizeof(color) for color in pattern.color_table)
+    distinct_pick_ids = {id(pick) for pick in pattern.picks}
+    if pattern.picks:
+        nbytes += len(distinct_pick_ids) * sys.getsizeof(pattern.picks[0])
+    pick_commands = pattern._pick_commands
+    if pick_commands is not None:
+        nbytes += sys.getsizeof(pick_commands)
+        nbytes += sum(
+            sys.getsizeof(command)
+            for command in {id(command): command for command in pick_commands}.values()
+        )
+    if pattern._static_json is not None:
+        nbytes += sys.getsizeof(pattern._static_json)
+    return nbytes
+
 
 class PatternDatabase:
+    """Database of recently used patterns.
+
+    Owns a single long-lived connection to the sqlite database,
+    which is opened by `init` and closed by `close`.
+    All methods other than `init` and `close` require an open connection.
+
+    Patterns are saved in the compact binary format of the
+    pattern_codec module. Databases that saved patterns as JSON
+    are migrated when opened.
+
+    Also contains a parse cache of reduced patterns, keyed by a digest
+    of the uploaded file (see `compute_file_digest`), so a file that is
+    uploaded again need not be parsed again. The parse cache is limited
+    to `max_parse_cache_entries`; the least recently used entries
+    are purged.
+
+    Also contains an in-memory LRU cache of decoded patterns, keyed by
+    pattern name, so selecting a recently used pattern need not read
+    the database. The cache is limited to approximately
+    `max_pattern_cache_nbytes` of memory (see `estimate_pattern_nbytes`);
+    the least recently used patterns are evicted. Patterns are kept
+    in the cache until replaced, purged, or the database is cleared,
+    and their pick and repeat numbers are kept current
+    by `update_pick_number`.
+
+    Parameters
+    ----------
+    dbpath : pathlib.Path
+        Path to the sqlite database file.
+    max_parse_cache_entries : int
+        Maximum number of entries in the parse cache.
+    max_pattern_cache_nbytes : int
+        Maximum approximate memory used by the pattern cache (bytes).
+        A pattern larger than this is not cached.
+    """
+
     FIELDS_STR = ", ".join(
         (
             "id integer primary key",
             "pattern_name text",
-            "pattern_json text",
+            "pattern_data blob",
             "pick_number integer",
             "repeat_number integer",
             "timestamp_sec real",
         )
     )
 
-    def __init__(self, dbpath: pathlib.Path) -> None:
+    PARSE_CACHE_FIELDS_STR = ", ".join(
+        (
+            "file_digest text primary key",
+            "pattern_data blob",
+            "timestamp_sec real",
+        )
+    )
+
+    def __init__(
+        self,
+        dbpath: pathlib.Path,
+        max_parse_cache_entries: int = DEFAULT_MAX_PARSE_CACHE_ENTRIES,
+        max_pattern_cache_nbytes: int = DEFAULT_MAX_PATTERN_CACHE_NBYTES,
+    ) -> None:
         self.dbpath = dbpath
+        self.max_parse_cache_entries = max_parse_cache_entries
+        self.max_pattern_cache_nbytes = max_pattern_cache_nbytes
+        self._db: aiosqlite.Connection | None = None
+        # All operations share one connection, so hold this lock
+        # for each sequence of statements that ends with a commit,
+        # to keep another operation from committing part of it
+        self._write_lock = asyncio.Lock()
+        # Number of patterns added from the parse cache, for diagnostics
+        self.num_parse_cache_hits = 0
+        # LRU cache of pattern_name: (decoded pattern, estimated nbytes),
+        # in order of least recently used first.
+        self._pattern_cache: collections.OrderedDict[
+            str, tuple[ReducedPattern, int]
+        ] = collections.OrderedDict()
+        self.pattern_cache_nbytes = 0
+        # Number of pattern cache hits and misses, for diagnostics
+        self.num_pattern_cache_hits = 0
+        self.num_pattern_cache_misses = 0
+        # Duration of each operation; see DATABASE_OPERATIONS
+        self.latency_stats = LatencyStats(DATABASE_OPERATIONS)
+
+    @property
+    def db(self) -> aiosqlite.Connection:
+        """Get the database connection.
+
+        Raises
+        ------
+        RuntimeError
+            If the connection is not open.
+        """
+        if self._db is None:
+            raise RuntimeError("Pattern database is not open; call init first")
+        return self._db
+
+    @property
+    def is_open(self) -> bool:
+        """Return True if the database connection is open."""
+        return self._db is not None
 
     async def init(self) -> None:
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(f"create table if not exists patterns ({self.FIELDS_STR})")
-            await db.commit()
+        """Open the database connection and create the tables, if needed.
+
+        A no-op if the connection is already open.
+        """
+        if self._db is not None:
+            return
+        self._db = await aiosqlite.connect(self.dbpath)
+        self._db.row_factory = aiosqlite.Row
+        async with self._db.execute("pragma user_version") as cursor:
+            row = await cursor.fetchone()
+        if row is None or row[0] < DATABASE_VERSION:
+            # Migrate in a single transaction, so that if the migration
+            # is interrupted, the database is left in the old format.
+            # sqlite3 only begins transactions implicitly before
+            # data modification statements, not before alter table.
+            await self._db.execute("begin")
+            try:
+                for table_name, fields_str in (
+                    ("patterns", self.FIELDS_STR),
+                    ("parse_cache", self.PARSE_CACHE_FIELDS_STR),
+                ):
+                    await self._migrate_json_table(
+                        table_name=table_name, fields_str=fields_str
+                    )
+            except BaseException:
+                await self._db.rollback()
+                await self._db.close()
+                self._db = None
+                raise
+        await self._db.execute(
+            f"create table if not exists patterns ({self.FIELDS_STR})"
+        )
+        await self._db.execute(
+            f"create table if not exists parse_cache ({self.PARSE_CACHE_FIELDS_STR})"
+        )
+        await self._db.execute(f"pragma user_version = {DATABASE_VERSION}")
+        await self._db.commit()
+
+    async def _migrate_json_table(self, table_name: str, fields_str: str) -> None:
+        """Convert a table that saves patterns as JSON to the binary format.
+
+        A no-op if the table does not exist or has no pattern_json column,
+        and there is no table {table_name}_json left by an interrupted
+        migration (made before migrations ran in a single transaction),
+        which is resumed. Rows that cannot be converted are dropped.
+        Does not commit.
+        """
+        old_table_name = f"{table_name}_json"
+        async with self.db.execute(f"pragma table_info({table_name})") as cursor:
+            column_names = [row["name"] for row in await cursor.fetchall()]
+        if "pattern_json" in column_names:
+            print(f"Converting table {table_name} of {self.dbpath} to binary format")
+            await self.db.execute(
+                f"alter table {table_name} rename to {old_table_name}"
+            )
+        else:
+            async with self.db.execute(
+                "select 1 from sqlite_master where type = 'table' and name = ?",
+                (old_table_name,),
+            ) as cursor:
+                if await cursor.fetchone() is None:
+                    return
+            print(
+                f"Resuming conversion of table {table_name} of {self.dbpath} "
+                "to binary format"
+            )
+        await self.db.execute(f"create table if not exists {table_name} ({fields_str})")
+        async with self.db.execute(f"select * from {old_table_name}") as cursor:
+            rows = await cursor.fetchall()
+        for row in rows:
+            values = dict(row)
+            pattern_json = values.pop("pattern_json")
+            try:
+                pattern_dict = json.loads(pattern_json)
+                values["pattern_data"] = encode_pattern(
+                    ReducedPattern.from_dict(pattern_dict)
+                )
+            except Exception as e:
+                print(f"Dropping unreadable row {values} from {table_name}: {e!r}")
+                traceback.print_exc()
+                continue
+            names_str = ", ".join(values.keys())
+            values_str = ", ".join("?" for _ in values)
+            await self.db.execute(
+                f"insert or replace into {table_name} ({names_str}) "
+                f"values ({values_str})",
+                tuple(values.values()),
+            )
+        await self.db.execute(f"drop table {old_table_name}")
+
+    async def close(self) -> None:
+        """Close the database connection. A no-op if already closed."""
+        db = self._db
+        self._db = None
+        self._clear_pattern_cache()
+        if db is not None:
+            await db.close()
 
     async def add_pattern(
         self,
         pattern: ReducedPattern,
         max_entries: int = 0,
+        file_digest: str = "",
     ) -> None:
         """Add a new pattern to the database.
 
@@ -52,80 +310,205 @@ class PatternDatabase:
             and a value of 1 is silently changed to 2,
             so the most recent pattern (which is the current pattern)
             and the new one are both kept.
+        file_digest : str
+            Digest of the file from which the pattern was read,
+            from `compute_file_digest`. If not blank, also add
+            the pattern to the parse cache.
         """
-
-        pattern_json = json.dumps(dataclasses.asdict(pattern))
+        start_time = time.monotonic()
+        pattern_data = encode_pattern(pattern)
         current_time = time.time()
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(
+        async with self._write_lock:
+            self._evict_from_pattern_cache(pattern.name)
+            await self.db.execute(
                 "delete from patterns where pattern_name = ?", (pattern.name,)
             )
-            # If limiting the number of entries, make sure to allow
-            # at least two, to save the most recent pattern,
-            # since it is likely to be the current pattern.
-            if max_entries > 0:
-                max_entries = max(max_entries, 2)
-            await db.execute(
+            await self.db.execute(
                 "insert into patterns "
-                "(pattern_name, pattern_json, pick_number, repeat_number, timestamp_sec) "
-                "values (?, ?, ?, ?, ?)",
-                (pattern.name, pattern_json, 0, 1, current_time),
+                "(pattern_name, pattern_data, pick_number, repeat_number, "
+                "timestamp_sec) values (?, ?, ?, ?, ?)",
+                (pattern.name, pattern_data, 0, 1, current_time),
             )
-            await db.commit()
+            if file_digest:
+                await self.db.execute(
+                    "insert or replace into parse_cache "
+                    "(file_digest, pattern_data, timestamp_sec) values (?, ?, ?)",
+                    (file_digest, pattern_data, current_time),
+                )
+                await self._purge_parse_cache()
+            await self.db.commit()
+            await self._purge_patterns(max_entries)
+        self.latency_stats.record("add_pattern", time.monotonic() - start_time)
 
-            pattern_names = await self.get_pattern_names()
-            names_to_delete = pattern_names[0:-max_entries]
+    async def add_pattern_from_parse_cache(
+        self, file_digest: str, pattern_name: str, max_entries: int = 0
+    ) -> bool:
+        """Add a pattern from the parse cache, if present.
 
-            if len(names_to_delete) > 0:
-                # Purge old patterns
-                for pattern_name in names_to_delete:
-                    await db.execute(
-                        "delete from patterns where pattern_name = ?", (pattern_name,)
-                    )
-                await db.commit()
+        Copies the cached pattern, without decoding it.
+
+        Parameters
+        ----------
+        file_digest : str
+            Digest of the file from which the pattern was read,
+            from `compute_file_digest`.
+        pattern_name : str
+            Name of the pattern. This need not match the name
+            of the pattern in the parse cache.
+        max_entries : int
+            Maximum number of patterns to keep; see `add_pattern`.
+
+        Returns
+        -------
+        added : bool
+            True if the pattern was found in the parse cache and added.
+        """
+        start_time = time.monotonic()
+        current_time = time.time()
+        async with self._write_lock:
+            cursor = await self.db.execute(
+                "update parse_cache set timestamp_sec = ? where file_digest = ?",
+                (current_time, file_digest),
+            )
+            if cursor.rowcount == 0:
+                # End the (empty) transaction the update began,
+                # so it is not left open on the shared connection
+                await self.db.commit()
+                return False
+            self._evict_from_pattern_cache(pattern_name)
+            await self.db.execute(
+                "delete from patterns where pattern_name = ?", (pattern_name,)
+            )
+            await self.db.execute(
+                "insert into patterns "
+                "(pattern_name, pattern_data, pick_number, repeat_number, "
+                "timestamp_sec) select ?, pattern_data, 0, 1, ? "
+                "from parse_cache where file_digest = ?",
+                (pattern_name, current_time, file_digest),
+            )
+            await self.db.commit()
+            await self._purge_patterns(max_entries)
+        self.num_parse_cache_hits += 1
+        self.latency_stats.record(
+            "add_pattern_from_parse_cache", time.monotonic() - start_time
+        )
+        return True
+
+    async def is_in_parse_cache(self, file_digest: str) -> bool:
+        """Return True if the parse cache has an entry for this digest."""
+        async with self.db.execute(
+            "select 1 from parse_cache where file_digest = ?", (file_digest,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row is not None
+
+    async def _purge_parse_cache(self) -> None:
+        """Purge the least recently used parse cache entries.
+
+        Does not commit.
+        """
+        await self.db.execute(
+            "delete from parse_cache where file_digest not in "
+            "(select file_digest from parse_cache "
+            "order by timestamp_sec desc limit ?)",
+            (self.max_parse_cache_entries,),
+        )
+
+    async def _purge_patterns(self, max_entries: int) -> None:
+        """Purge the oldest patterns, leaving at most max_entries.
+
+        See `add_pattern` for details. Call with _write_lock held.
+        """
+        # If limiting the number of entries, make sure to allow
+        # at least two, to save the most recent pattern,
+        # since it is likely to be the current pattern.
+        if max_entries > 0:
+            max_entries = max(max_entries, 2)
+
+        pattern_names = await self.get_pattern_names()
+        names_to_delete = pattern_names[0:-max_entries]
+
+        if len(names_to_delete) > 0:
+            # Purge old patterns
+            for pattern_name in names_to_delete:
+                self._evict_from_pattern_cache(pattern_name)
+            await self.db.executemany(
+                "delete from patterns where pattern_name = ?",
+                [(pattern_name,) for pattern_name in names_to_delete],
+            )
+            await self.db.commit()
 
     async def clear_database(self) -> None:
         """Remove all patterns from the database."""
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute("delete from patterns")
-            await db.commit()
+        async with self._write_lock:
+            self._clear_pattern_cache()
+            await self.db.execute("delete from patterns")
+            await self.db.commit()
 
     async def get_pattern(self, pattern_name: str) -> ReducedPattern:
-        async with aiosqlite.connect(self.dbpath) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "select * from patterns where pattern_name = ?", (pattern_name,)
-            ) as cursor:
-                row = await cursor.fetchone()
+        """Get the specified pattern.
+
+        Return a copy of the cached pattern, if cached,
+        else read the pattern from the database and cache it.
+        The returned pattern shares its (unmodifiable) lists and picks,
+        and its cached pick commands and JSON encoding, with the cached
+        pattern, but its pick and repeat numbers may be changed freely.
+
+        Raises
+        ------
+        LookupError
+            If the pattern is not found.
+        """
+        start_time = time.monotonic()
+        cache_entry = self._pattern_cache.get(pattern_name)
+        if cache_entry is not None:
+            self._pattern_cache.move_to_end(pattern_name)
+            self.num_pattern_cache_hits += 1
+            self.latency_stats.record("get_pattern", time.monotonic() - start_time)
+            return copy.copy(cache_entry[0])
+
+        self.num_pattern_cache_misses += 1
+        async with self.db.execute(
+            "select * from patterns where pattern_name = ?", (pattern_name,)
+        ) as cursor:
+            row = await cursor.fetchone()
         if row is None:
             raise LookupError(f"{pattern_name} not found")
-        pattern_dict = json.loads(row["pattern_json"])
-        pattern = ReducedPattern.from_dict(pattern_dict)
+        pattern = decode_pattern(row["pattern_data"], name=row["pattern_name"])
         pattern.pick_number = row["pick_number"]
         pattern.repeat_number = row["repeat_number"]
-        return pattern
+        self._add_to_pattern_cache(pattern)
+        self.latency_stats.record("get_pattern", time.monotonic() - start_time)
+        return copy.copy(pattern)
 
     async def get_pattern_names(self) -> list[str]:
-        async with aiosqlite.connect(self.dbpath) as db:
-            async with db.execute(
-                "select pattern_name from patterns order by timestamp_sec asc, id asc"
-            ) as cursor:
-                rows = await cursor.fetchall()
+        start_time = time.monotonic()
+        async with self.db.execute(
+            "select pattern_name from patterns order by timestamp_sec asc, id asc"
+        ) as cursor:
+            rows = await cursor.fetchall()
 
+        self.latency_stats.record("get_pattern_names", time.monotonic() - start_time)
         return [row[0] for row in rows]
 
     async def update_pick_number(
         self, pattern_name: str, pick_number: int, repeat_number: int
     ) -> None:
         """Update the pick and repeat numbers for the specified pattern."""
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(
+        start_time = time.monotonic()
+        async with self._write_lock:
+            await self.db.execute(
                 "update patterns "
                 "set pick_number = ?, repeat_number = ?, timestamp_sec = ?"
                 "where pattern_name = ?",
                 (pick_number, repeat_number, time.time(), pattern_name),
             )
-            await db.commit()
+            await self.db.commit()
+        cache_entry = self._pattern_cache.get(pattern_name)
+        if cache_entry is not None:
+            cache_entry[0].pick_number = pick_number
+            cache_entry[0].repeat_number = repeat_number
+        self.latency_stats.record("update_pick_number", time.monotonic() - start_time)
 
     async def set_timestamp(self, pattern_name: str, timestamp: float) -> None:
         """Set the timestamp for the specified pattern.
@@ -137,12 +520,55 @@ class PatternDatabase:
         timestamp : float
             Timestamp in unix seconds, e.g. from time.time()
         """
-        async with aiosqlite.connect(self.dbpath) as db:
-            await db.execute(
+        async with self._write_lock:
+            await self.db.execute(
                 "update patterns set timestamp_sec = ? where pattern_name = ?",
                 (timestamp, pattern_name),
             )
-            await db.commit()
+            await self.db.commit()
+
+    def _add_to_pattern_cache(self, pattern: ReducedPattern) -> None:
+        """Add a pattern to the pattern cache, evicting old patterns
+        as needed to stay within max_pattern_cache_nbytes.
+
+        The pattern's cached pick commands and JSON encoding are computed
+        first, so the copies returned by `get_pattern` share them.
+
+        A no-op if the pattern is larger than max_pattern_cache_nbytes.
+        """
+        self._evict_from_pattern_cache(pattern.name)
+        pattern.fill_caches()
+        nbytes = estimate_pattern_nbytes(pattern)
+        if nbytes > self.max_pattern_cache_nbytes:
+            return
+        while self.pattern_cache_nbytes + nbytes > self.max_pattern_cache_nbytes:
+            _, (_, evicted_nbytes) = self._pattern_cache.popitem(last=False)
+            self.pattern_cache_nbytes -= evicted_nbytes
+        self._pattern_cache[pattern.name] = (pattern, nbytes)
+        self.pattern_cache_nbytes += nbytes
+
+    def _evict_from_pattern_cache(self, pattern_name: str) -> None:
+        """Remove a pattern from the pattern cache, if present."""
+        cache_entry = self._pattern_cache.pop(pattern_name, None)
+        if cache_entry is not None:
+            self.pattern_cache_nbytes -= cache_entry[1]
+
+    def _clear_pattern_cache(self) -> None:
+        """Remove all patterns from the pattern cache."""
+        self._pattern_cache.clear()
+        self.pattern_cache_nbytes = 0
+
+    async def __aenter__(self) -> PatternDatabase:
+        await self.init()
+        return self
+
+    async def __aexit__(
+        self,
+        type: Type[BaseException] | None,
+        value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.close()
 
 
 async def create_pattern_database(dbpath: pathlib.Path) -> PatternDatabase:
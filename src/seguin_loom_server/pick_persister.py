@@ -0,0 +1,101 @@
+from __future__ import annotations
+
+__all__ = ["DEFAULT_FLUSH_INTERVAL", "PickPersister"]
+
+import asyncio
+import time
+import traceback
+
+from .latency_stats import LatencyHistogram
+from .pattern_database import PatternDatabase
+
+# Default interval between the first unsaved update and saving it (sec)
+DEFAULT_FLUSH_INTERVAL = 0.5
+
+
+class PickPersister:
+    """Save pick and repeat numbers to a pattern database, write-behind.
+
+    `schedule` records the new values and returns immediately,
+    so the caller is never blocked by the database.
+    Updates are coalesced (only the most recent values for each pattern
+    are saved), and written `flush_interval` seconds after the first
+    unsaved update, or when `flush` or `close` is called.
+
+    Parameters
+    ----------
+    pattern_db : PatternDatabase
+        The pattern database.
+    flush_interval : float
+        Maximum time (sec) an update waits before being saved.
+    latency_histogram : LatencyHistogram | None
+        If not None, record the duration of each database update.
+    """
+
+    def __init__(
+        self,
+        pattern_db: PatternDatabase,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        latency_histogram: LatencyHistogram | None = None,
+    ) -> None:
+        self.pattern_db = pattern_db
+        self.flush_interval = flush_interval
+        self.latency_histogram = latency_histogram
+        # dict of pattern_name: (pick_number, repeat_number)
+        self.pending_updates: dict[str, tuple[int, int]] = {}
+        self.flush_lock = asyncio.Lock()
+        self.flush_timer_task: asyncio.Future = asyncio.Future()
+        self.flush_timer_task.set_result(None)
+        # Number of updates scheduled and written, for diagnostics
+        self.num_scheduled = 0
+        self.num_written = 0
+
+    @property
+    def has_pending_updates(self) -> bool:
+        return bool(self.pending_updates)
+
+    def schedule(self, pattern_name: str, pick_number: int, repeat_number: int) -> None:
+        """Schedule saving the pick and repeat numbers for a pattern.
+
+        Replaces any unsaved values for that pattern.
+        """
+        self.pending_updates[pattern_name] = (pick_number, repeat_number)
+        self.num_scheduled += 1
+        if self.flush_timer_task.done():
+            self.flush_timer_task = asyncio.create_task(self._flush_after_delay())
+
+    async def flush(self) -> None:
+        """Save all pending updates now."""
+        async with self.flush_lock:
+            updates = self.pending_updates
+            self.pending_updates = {}
+            for pattern_name, (pick_number, repeat_number) in updates.items():
+                try:
+                    start_time = time.monotonic()
+                    await self.pattern_db.update_pick_number(
+                        pattern_name=pattern_name,
+                        pick_number=pick_number,
+                        repeat_number=repeat_number,
+                    )
+                    if self.latency_histogram is not None:
+                        self.latency_histogram.record(time.monotonic() - start_time)
+                    self.num_written += 1
+                except Exception as e:
+                    print(f"Failed to save pick number for {pattern_name!r}: {e!r}")
+                    traceback.print_exc()
+
+    async def close(self) -> None:
+        """Stop the flush timer and save all pending updates.
+
+        If the flush timer has started flushing, that flush finishes
+        (see `_flush_after_delay`) before the remaining updates are saved.
+        """
+        self.flush_timer_task.cancel()
+        if self.pattern_db.is_open:
+            await self.flush()
+
+    async def _flush_after_delay(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        # Shield the flush, so that cancelling this task (e.g. in `close`)
+        # does not lose the updates the flush has taken from pending_updates
+        await asyncio.shield(self.flush())
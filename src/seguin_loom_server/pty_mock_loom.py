@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+__all__ = ["PtyMockLoom"]
+
+import asyncio
+import os
+import tty
+
+from serial_asyncio import open_serial_connection  # type: ignore
+
+from .loom_constants import BAUD_RATE
+from .mock_loom import MockLoom, MockLoomTiming
+from .mock_streams import StreamReaderType, StreamWriterType
+
+
+class PtyMockLoom(MockLoom):
+    """A mock loom that communicates through a pseudo-terminal.
+
+    The loom reads commands from and writes replies to the controller
+    side of a pseudo-terminal. Connect to the loom by opening the device
+    side, `serial_port`, as a serial port (e.g. by specifying it as the
+    serial port of a LoomServer). Unlike `MockLoom`, this exercises
+    the real serial I/O code path (pyserial-asyncio and the tty driver).
+
+    Only available on systems that support pseudo-terminals,
+    such as Linux and macOS.
+
+    Parameters
+    ----------
+    verbose : bool
+        If True, print diagnostics to stdout.
+    timing : MockLoomTiming | None
+        Timing model; see `MockLoom`. timing.byte_duration is ignored:
+        data moves as fast as the pseudo-terminal allows.
+
+    Attributes
+    ----------
+    serial_port : str
+        Path of the device side of the pseudo-terminal, e.g. "/dev/pts/3".
+    """
+
+    def __init__(
+        self, verbose: bool = True, timing: MockLoomTiming | None = None
+    ) -> None:
+        self.controller_fd, self.device_fd = os.openpty()
+        # Disable echo and line editing before anything is written,
+        # else the loom would read its own replies
+        tty.setraw(self.device_fd)
+        self.serial_port = os.ttyname(self.device_fd)
+        self.read_transport: asyncio.ReadTransport | None = None
+        super().__init__(verbose=verbose, timing=timing)
+
+    async def create_streams(self) -> tuple[StreamReaderType, StreamWriterType]:
+        """Create streams that read from and write to the controller side
+        of the pseudo-terminal.
+
+        Each transport closes its own file descriptor,
+        so give each a duplicate of controller_fd.
+        """
+        loop = asyncio.get_running_loop()
+        command_reader = asyncio.StreamReader()
+        self.read_transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(command_reader),
+            os.fdopen(os.dup(self.controller_fd), "rb", buffering=0),
+        )
+        # StreamReaderProtocol (rather than the bare flow control protocol)
+        # supports StreamWriter.wait_closed
+        write_transport, write_protocol = await loop.connect_write_pipe(
+            lambda: asyncio.StreamReaderProtocol(asyncio.StreamReader()),
+            os.fdopen(os.dup(self.controller_fd), "wb", buffering=0),
+        )
+        reply_writer = asyncio.StreamWriter(
+            write_transport, write_protocol, command_reader, loop
+        )
+        return command_reader, reply_writer
+
+    async def open_client_connection(self) -> tuple[StreamReaderType, StreamWriterType]:
+        """Open a serial connection to the pseudo-terminal device."""
+        await self.start_task
+        return await open_serial_connection(url=self.serial_port, baudrate=BAUD_RATE)
+
+    async def close(self) -> None:
+        await super().close()
+        if self.read_transport is not None:
+            self.read_transport.close()
+            self.read_transport = None
+        for fd in (self.controller_fd, self.device_fd):
+            if fd >= 0:
+                os.close(fd)
+        self.controller_fd = -1
+        self.device_fd = -1
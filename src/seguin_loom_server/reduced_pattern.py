@@ -3,17 +3,23 @@ from __future__ import annotations
 __all__ = [
     "Pick",
     "ReducedPattern",
+    "reduced_pattern_from_file_data",
     "reduced_pattern_from_pattern_data",
     "read_full_pattern",
+    "share_identical_picks",
 ]
 
-import copy
+import collections.abc
 import dataclasses
+import io
+import json
 import pathlib
 from typing import Any
 
 import dtx_to_wif
 
+from .loom_constants import TERMINATOR
+
 
 def pop_and_check_type_field(typename: str, datadict: dict[str, Any]) -> None:
     typestr = datadict.pop("type", typename)
@@ -21,27 +27,47 @@ def pop_and_check_type_field(typename: str, datadict: dict[str, Any]) -> None:
         raise TypeError(f"Wrong type: {typestr=!r} != {typename!r}")
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class Pick:
     """One pick of a pattern
 
+    Picks are immutable, so identical picks may be shared.
+
     Parameters
     ----------
     color: weft color, as an index into the color table
-    are_shafts_up: a list of bools, one per shaft;
-        True means the shaft is up, False means down
+    shaft_word: which shafts are up, as a bit mask;
+        bit 0 is shaft 1, and a set bit means the shaft is up
+    num_shafts: the number of shafts
     """
 
     color: int
-    are_shafts_up: list[bool]
+    shaft_word: int
+    num_shafts: int
+
+    @property
+    def are_shafts_up(self) -> list[bool]:
+        """Get a list of bools, one per shaft; True if the shaft is up."""
+        return [bool(self.shaft_word & (1 << i)) for i in range(self.num_shafts)]
+
+    @classmethod
+    def from_are_shafts_up(cls, color: int, are_shafts_up: list[bool]) -> Pick:
+        """Construct a Pick from a list of bools, one per shaft."""
+        shaft_word = sum(1 << i for i, isup in enumerate(are_shafts_up) if isup)
+        return cls(color=color, shaft_word=shaft_word, num_shafts=len(are_shafts_up))
 
     @classmethod
     def from_dict(cls, datadict: dict[str, Any]) -> Pick:
         """Construct a Pick from a dict representation.
 
         The "type" field is optional, but checked if present.
+        Also accepts the old representation, which has field
+        "are_shafts_up" instead of "shaft_word" and "num_shafts".
         """
+        datadict = datadict.copy()
         pop_and_check_type_field("Pick", datadict)
+        if "are_shafts_up" in datadict:
+            return cls.from_are_shafts_up(**datadict)
         return cls(**datadict)
 
 
@@ -54,6 +80,13 @@ class ReducedPattern:
 
     Picks are accessed by pick number, which is 1-based.
     0 indicates that nothing has been woven.
+
+    The encoded loom command for each pick, and the JSON encoding
+    of all fields other than pick_number and repeat_number (see `to_json`),
+    are computed when first needed (or by `fill_caches`) and cached,
+    until a field other than pick_number or repeat_number is set.
+    A shallow copy (copy.copy) shares the cached data. Do not modify
+    the list fields in place; assign new lists.
     """
 
     type: str = dataclasses.field(init=False, default="ReducedPattern")
@@ -65,16 +98,36 @@ class ReducedPattern:
     pick_number: int = 0
     repeat_number: int = 1
 
+    # Fields that can be set without invalidating cached data
+    _POSITION_FIELDS = frozenset(("pick_number", "repeat_number"))
+
+    def __post_init__(self) -> None:
+        self._pick_commands: list[bytes] | None = None
+        self._static_json: str | None = None
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        super().__setattr__(name, value)
+        if name not in self._POSITION_FIELDS and not name.startswith("_"):
+            self._pick_commands = None
+            self._static_json = None
+
     @classmethod
     def from_dict(cls, datadict: dict[str, Any]) -> ReducedPattern:
         """Construct a ReducedPattern from a dict.
 
         The "type" field is optional, but checked if present.
         """
-        # Make a copy, so the caller doesn't see the picks field change
-        datadict = copy.deepcopy(datadict)
+        # Make a shallow copy, so the caller doesn't see fields change.
+        # The list fields are copied, so the caller's lists are not shared;
+        # this is much faster than a deep copy.
+        datadict = datadict.copy()
+        for field_name in ("color_table", "warp_colors", "threading"):
+            if field_name in datadict:
+                datadict[field_name] = list(datadict[field_name])
         pop_and_check_type_field(typename="ReducedPattern", datadict=datadict)
-        datadict["picks"] = [Pick.from_dict(pickdict) for pickdict in datadict["picks"]]
+        datadict["picks"] = share_identical_picks(
+            Pick.from_dict(pickdict) for pickdict in datadict["picks"]
+        )
         return cls(**datadict)
 
     def increment_pick_number(self, weave_forward: bool) -> int:
@@ -117,6 +170,81 @@ class ReducedPattern:
             raise IndexError(f"{pick_number=} < 1 or > {len(self.picks)}")
         return self.picks[pick_number - 1]
 
+    def get_pick_command(self, pick_number: int | None = None) -> bytes:
+        """Get the encoded loom command for a pick, e.g. b"=C00000005\\r".
+
+        Parameters
+        ----------
+        pick_number : int | None
+            The pick number, or None for the current pick.
+
+        Raises
+        ------
+        IndexError
+            If current pick number < 1 or > len(self.picks)
+        """
+        if pick_number is None:
+            pick_number = self.pick_number
+        if pick_number < 1 or pick_number > len(self.picks):
+            raise IndexError(f"{pick_number=} < 1 or > {len(self.picks)}")
+        if self._pick_commands is None or len(self._pick_commands) != len(self.picks):
+            self._pick_commands = self._make_pick_commands()
+        return self._pick_commands[pick_number - 1]
+
+    def _make_pick_commands(self) -> list[bytes]:
+        """Make the encoded loom command for each pick."""
+        # Shared picks share the same command
+        commands: dict[Pick, bytes] = {}
+        for pick in self.picks:
+            if pick not in commands:
+                commands[pick] = f"=C{pick.shaft_word:08x}".encode() + TERMINATOR
+        return [commands[pick] for pick in self.picks]
+
+    def fill_caches(self) -> None:
+        """Compute the cached pick commands and JSON encoding now,
+        if not already cached, so that shallow copies share them."""
+        if self._pick_commands is None or len(self._pick_commands) != len(self.picks):
+            self._pick_commands = self._make_pick_commands()
+        if self._static_json is None:
+            self._static_json = self._make_static_json()
+
+    def to_json(self) -> str:
+        """Encode the pattern as compact JSON.
+
+        The result matches ``json.dumps(dataclasses.asdict(self))``
+        (with compact separators), but is much faster to compute,
+        because the encoding of every field other than pick_number
+        and repeat_number is cached.
+        """
+        if self._static_json is None:
+            self._static_json = self._make_static_json()
+        return (
+            f'{self._static_json},"pick_number":{self.pick_number:d},'
+            f'"repeat_number":{self.repeat_number:d}}}'
+        )
+
+    def _make_static_json(self) -> str:
+        """Make the JSON encoding of all fields other than pick_number
+        and repeat_number, without the final closing brace."""
+        static_dict = dict(
+            type=self.type,
+            name=self.name,
+            color_table=self.color_table,
+            warp_colors=self.warp_colors,
+            threading=self.threading,
+        )
+        static_json = json.dumps(static_dict, separators=(",", ":"), ensure_ascii=False)
+        # Identical picks share the same encoding
+        pick_jsons: dict[Pick, str] = {}
+        for pick in self.picks:
+            if pick not in pick_jsons:
+                pick_jsons[pick] = (
+                    f'{{"color":{pick.color:d},"shaft_word":{pick.shaft_word:d},'
+                    f'"num_shafts":{pick.num_shafts:d}}}'
+                )
+        picks_json = ",".join(pick_jsons[pick] for pick in self.picks)
+        return f'{static_json[:-1]},"picks":[{picks_json}]'
+
     def set_current_pick_number(self, pick_number: int) -> None:
         """Set pick_number.
 
@@ -132,6 +260,29 @@ class ReducedPattern:
         self.pick_number = pick_number
 
 
+def share_identical_picks(picks: collections.abc.Iterable[Pick]) -> list[Pick]:
+    """Return a list of picks in which identical picks are the same object.
+
+    Most patterns have far fewer distinct picks than picks,
+    so this saves a lot of memory for long patterns.
+    """
+    shared_picks: dict[Pick, Pick] = {}
+    return [shared_picks.setdefault(pick, pick) for pick in picks]
+
+
+def _shaft_word(shafts: collections.abc.Iterable[int]) -> int:
+    """Return the shaft word for a collection of 1-based shafts.
+
+    Bit i of the shaft word is set if shaft i+1 is in the collection.
+    Shaft 0 (which means no shaft) is ignored.
+    """
+    shaft_word = 0
+    for shaft in shafts:
+        if shaft > 0:
+            shaft_word |= 1 << (shaft - 1)
+    return shaft_word
+
+
 def _smallest_shaft(shafts: set[int]) -> int:
     """Return the smallest non-zero shaft from a set of shafts.
 
@@ -199,40 +350,48 @@ def reduced_pattern_from_pattern_data(
         data.weft_colors.get(weft, default_weft_color) - 1 for weft in wefts_from1
     ]
 
+    # Compute the shaft word (bit mask of raised shafts) for each pick
+    # using bitwise operations, rather than sets of shafts.
     if data.liftplan:
-        shaft_sets = list(data.liftplan.get(weft, {}) - {0} for weft in wefts_from1)  # type: ignore
+        liftplan = data.liftplan
+        shaft_words = [_shaft_word(liftplan.get(weft, ())) for weft in wefts_from1]
     else:
-        shaft_sets = []
+        # Tie-up times treadling: the shaft word for a pick is the
+        # bitwise or of the shaft words of its treadles.
+        treadle_words = {
+            treadle: _shaft_word(shaft_set) for treadle, shaft_set in data.tieup.items()
+        }
+        treadling = data.treadling
+        shaft_words = []
         for weft in wefts_from1:
-            treadle_set = data.treadling.get(weft, {}) - {0}  # type: ignore
-            shaft_sets.append(
-                set.union(*(data.tieup[treadle] for treadle in treadle_set)) - {0}
-            )
-    if len(shaft_sets) != len(weft_colors):
-        raise RuntimeError(
-            f"{len(shaft_sets)=} != {len(weft_colors)=}\n{shaft_sets=}\n{weft_colors=}"
-        )
-    try:
-        num_shafts = max(max(shaft_set) for shaft_set in shaft_sets if shaft_set)
-    except (ValueError, TypeError):
+            shaft_word = 0
+            for treadle in treadling.get(weft, ()):
+                shaft_word |= treadle_words.get(treadle, 0)
+            shaft_words.append(shaft_word)
+    if len(shaft_words) != len(weft_colors):
+        raise RuntimeError(f"{len(shaft_words)=} != {len(weft_colors)=}")
+    all_raised_shafts_word = 0
+    for shaft_word in shaft_words:
+        all_raised_shafts_word |= shaft_word
+    if all_raised_shafts_word == 0:
         raise RuntimeError("No shafts are raised")
+    num_shafts = all_raised_shafts_word.bit_length()
     threading = [
         _smallest_shaft(data.threading.get(warp, {0})) - 1 for warp in warps_from1
     ]
-    shafts_from1 = list(range(1, num_shafts + 1))
-    if data.is_rising_shed:
-        are_shafts_up_list = [
-            [shaft in shaft_set for shaft in shafts_from1] for shaft_set in shaft_sets
-        ]
-    else:
-        are_shafts_up_list = [
-            [shaft not in shaft_set for shaft in shafts_from1]
-            for shaft_set in shaft_sets
-        ]
-    picks = [
-        Pick(are_shafts_up=are_shafts_up, color=weft_color)
-        for are_shafts_up, weft_color in zip(are_shafts_up_list, weft_colors)
-    ]
+    if not data.is_rising_shed:
+        all_shafts_mask = (1 << num_shafts) - 1
+        shaft_words = [shaft_word ^ all_shafts_mask for shaft_word in shaft_words]
+
+    # Construct each distinct pick only once
+    distinct_picks: dict[tuple[int, int], Pick] = {}
+    picks = []
+    for shaft_word, weft_color in zip(shaft_words, weft_colors):
+        pick = distinct_picks.get((shaft_word, weft_color))
+        if pick is None:
+            pick = Pick(color=weft_color, shaft_word=shaft_word, num_shafts=num_shafts)
+            distinct_picks[(shaft_word, weft_color)] = pick
+        picks.append(pick)
 
     result = ReducedPattern(
         color_table=color_strs,
@@ -244,6 +403,36 @@ def reduced_pattern_from_pattern_data(
     return result
 
 
+def reduced_pattern_from_file_data(name: str, data: str) -> ReducedPattern:
+    """Read the contents of a .wif or .dtx file and reduce it.
+
+    This is a plain function (with picklable arguments and result),
+    so it can be run in a separate process.
+
+    Parameters
+    ----------
+    name : str
+        The file name. The file type is determined by the suffix,
+        which must be .wif or .dtx (case blind).
+    data : str
+        The contents of the file.
+
+    Raises
+    ------
+    ValueError
+        If the file type is not supported.
+    """
+    readfunc = {
+        ".wif": dtx_to_wif.read_wif,
+        ".dtx": dtx_to_wif.read_dtx,
+    }.get(pathlib.PurePath(name).suffix.lower())
+    if readfunc is None:
+        raise ValueError(f"Unsupported file type for {name!r}")
+    with io.StringIO(data) as f:
+        pattern_data = readfunc(f)
+    return reduced_pattern_from_pattern_data(name=name, data=pattern_data)
+
+
 def read_full_pattern(path: pathlib.Path) -> dtx_to_wif.PatternData:
     readfunc = {
         ".wif": dtx_to_wif.read_wif,
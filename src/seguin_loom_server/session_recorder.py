@@ -0,0 +1,373 @@
+from __future__ import annotations
+
+__all__ = [
+    "DEFAULT_BACKUP_COUNT",
+    "DEFAULT_FLUSH_INTERVAL",
+    "DEFAULT_MAX_BUFFER_NBYTES",
+    "DEFAULT_MAX_FILE_NBYTES",
+    "FORMAT_VERSION",
+    "RecordType",
+    "SessionRecord",
+    "SessionRecorder",
+    "get_session_paths",
+    "read_session_file",
+]
+
+import asyncio
+import collections.abc
+import dataclasses
+import enum
+import pathlib
+import struct
+import time
+import traceback
+from typing import BinaryIO
+
+# Magic bytes at the start of every session file
+MAGIC = b"SLSR"
+
+# Version of the file format; increment when the format changes
+FORMAT_VERSION = 1
+
+# File header: magic, format version, session start time (unix sec)
+_HEADER = struct.Struct("<4sBd")
+
+# Record header: timestamp (unix sec), record type, client ID, data length
+_RECORD_HEADER = struct.Struct("<dBII")
+
+# Default maximum size of a session file (bytes)
+DEFAULT_MAX_FILE_NBYTES = 20_000_000
+
+# Default number of rotated session files to keep
+DEFAULT_BACKUP_COUNT = 5
+
+# Default interval between the first unwritten record and writing it (sec)
+DEFAULT_FLUSH_INTERVAL = 0.5
+
+# Default maximum size of the records waiting to be written (bytes).
+# Larger than the largest pattern file a client may upload.
+DEFAULT_MAX_BUFFER_NBYTES = 50_000_000
+
+
+class RecordType(enum.IntEnum):
+    """The type of a session record, which determines its data."""
+
+    # A pattern in the database when recording started: the pattern as JSON
+    PATTERN = 1
+    # The current pattern when recording started: the pattern name
+    CURRENT_PATTERN = 2
+    # Connected to the loom: the serial port name
+    LOOM_CONNECTED = 3
+    # Lost the connection to the loom: the reason
+    LOOM_DISCONNECTED = 4
+    # A command written to the loom, including the terminator
+    LOOM_COMMAND = 5
+    # Data read from the loom, as read (not split into replies)
+    LOOM_DATA = 6
+    # A client connected: no data
+    CLIENT_CONNECTED = 7
+    # A client disconnected: no data
+    CLIENT_DISCONNECTED = 8
+    # A command from a client: the text of the command (JSON)
+    CLIENT_COMMAND = 9
+    # A reply to one client, or to all clients if client_id is 0: the JSON
+    CLIENT_REPLY = 10
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class SessionRecord:
+    """One record read from a session file.
+
+    Parameters
+    ----------
+    timestamp : float
+        When the record was recorded (unix sec).
+    record_type : RecordType
+        The type of record.
+    client_id : int
+        The client ID (`ClientConnection.client_id`) of client records;
+        0 for a reply to all clients, and for loom records.
+    data : bytes
+        The data; see `RecordType`.
+    """
+
+    timestamp: float
+    record_type: RecordType
+    client_id: int
+    data: bytes
+
+
+def _get_backup_path(path: pathlib.Path, index: int) -> pathlib.Path:
+    return path.with_name(f"{path.name}.{index}")
+
+
+def _read_header(f: BinaryIO, path: pathlib.Path) -> float:
+    """Read and check the header of a session file.
+
+    Return the session start time (unix sec).
+    """
+    header = f.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise ValueError(f"{path} is not a session file: too short")
+    magic, version, session_start_time = _HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a session file: {magic=!r} != {MAGIC!r}")
+    if version != FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has unsupported format version {version}; "
+            f"expected {FORMAT_VERSION}"
+        )
+    return session_start_time
+
+
+def get_session_paths(path: pathlib.Path) -> list[pathlib.Path]:
+    """Get the files of the session recorded in path, oldest first.
+
+    These are path and those of its rotated backups (path.1, path.2, ...)
+    that were recorded in the same session.
+
+    Raises
+    ------
+    ValueError
+        If path is not a session file.
+    """
+    with open(path, "rb") as f:
+        session_start_time = _read_header(f, path)
+    paths = [path]
+    index = 1
+    while True:
+        backup_path = _get_backup_path(path, index)
+        try:
+            with open(backup_path, "rb") as f:
+                if _read_header(f, backup_path) != session_start_time:
+                    break
+        except (OSError, ValueError):
+            break
+        paths.append(backup_path)
+        index += 1
+    return paths[::-1]
+
+
+def read_session_file(
+    path: pathlib.Path,
+) -> collections.abc.Iterator[SessionRecord]:
+    """Read the records in a session file.
+
+    A truncated final record (e.g. if the server was killed
+    while writing it) is ignored.
+
+    Raises
+    ------
+    ValueError
+        If path is not a session file.
+    """
+    with open(path, "rb") as f:
+        _read_header(f, path)
+        while True:
+            record_header = f.read(_RECORD_HEADER.size)
+            if not record_header:
+                return
+            if len(record_header) == _RECORD_HEADER.size:
+                timestamp, record_type, client_id, data_nbytes = _RECORD_HEADER.unpack(
+                    record_header
+                )
+                data = f.read(data_nbytes)
+                if len(data) == data_nbytes:
+                    yield SessionRecord(
+                        timestamp=timestamp,
+                        record_type=RecordType(record_type),
+                        client_id=client_id,
+                        data=data,
+                    )
+                    continue
+            print(f"Ignoring truncated record at the end of {path}")
+            return
+
+
+class SessionRecorder:
+    """Record loom and client traffic in compact binary session files.
+
+    `record` encodes a record and returns immediately, so the caller
+    is never blocked by the disk. Records are written write-behind,
+    in a worker thread, `flush_interval` seconds after the first
+    unwritten record, or when `flush` or `close` is called.
+    If more than max_buffer_nbytes of records are waiting to be written,
+    new records are dropped (and counted in num_dropped).
+
+    Files are rotated in the manner of logging.handlers.RotatingFileHandler:
+    when writing a record would make the file larger than max_file_nbytes,
+    path is renamed path.1, path.1 is renamed path.2, etc., keeping
+    at most backup_count old files. An existing file is rotated when
+    recording starts, so each recording starts in a new file.
+    Use `get_session_paths` to find the files of a recording,
+    and `read_session_file` to read them.
+
+    Each file is a header (magic bytes, format version, and session start
+    time as a float64 in unix seconds), followed by records.
+    Each record is a header (timestamp as a float64 in unix seconds,
+    `RecordType` as a uint8, client ID as a uint32 and data length
+    as a uint32), followed by the data. All values are little-endian.
+
+    Parameters
+    ----------
+    path : pathlib.Path
+        Path of the session file.
+    max_file_nbytes : int
+        Maximum size of a session file (bytes); 0 for no limit.
+        A file may be larger if it contains a single larger record.
+    backup_count : int
+        Maximum number of rotated files to keep.
+    flush_interval : float
+        Maximum time (sec) a record waits before being written.
+    max_buffer_nbytes : int
+        Maximum size of the records waiting to be written (bytes).
+    """
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        max_file_nbytes: int = DEFAULT_MAX_FILE_NBYTES,
+        backup_count: int = DEFAULT_BACKUP_COUNT,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        max_buffer_nbytes: int = DEFAULT_MAX_BUFFER_NBYTES,
+    ) -> None:
+        self.path = path
+        self.max_file_nbytes = max_file_nbytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.max_buffer_nbytes = max_buffer_nbytes
+        self.session_start_time = time.time()
+        # Records waiting to be written: (record header, data)
+        self._buffer: list[tuple[bytes, bytes]] = []
+        self._buffer_nbytes = 0
+        # The open session file, and its size;
+        # only accessed by the worker thread (via flush)
+        self._file: BinaryIO | None = None
+        self._file_nbytes = 0
+        self.is_closed = False
+        self.flush_lock = asyncio.Lock()
+        self.flush_timer_task: asyncio.Future = asyncio.Future()
+        self.flush_timer_task.set_result(None)
+        # Number of records recorded, dropped and written, for diagnostics
+        self.num_recorded = 0
+        self.num_dropped = 0
+        self.num_written = 0
+
+    def record(
+        self, record_type: RecordType, data: bytes | str = b"", client_id: int = 0
+    ) -> None:
+        """Record an event, without waiting for it to be written.
+
+        Parameters
+        ----------
+        record_type : RecordType
+            The type of record.
+        data : bytes | str
+            The data; see `RecordType`. A str is encoded as utf-8.
+        client_id : int
+            The client ID, for client records.
+        """
+        if self.is_closed:
+            return
+        if isinstance(data, str):
+            data = data.encode()
+        nbytes = _RECORD_HEADER.size + len(data)
+        if self._buffer_nbytes + nbytes > self.max_buffer_nbytes:
+            if self.num_dropped == 0:
+                print(
+                    f"Session recorder for {self.path} is not keeping up: "
+                    f"{self._buffer_nbytes} bytes waiting to be written; "
+                    "dropping records"
+                )
+            self.num_dropped += 1
+            return
+        self._buffer.append(
+            (
+                _RECORD_HEADER.pack(time.time(), record_type, client_id, len(data)),
+                data,
+            )
+        )
+        self._buffer_nbytes += nbytes
+        self.num_recorded += 1
+        if self.flush_timer_task.done():
+            self.flush_timer_task = asyncio.create_task(self._flush_after_delay())
+
+    async def flush(self) -> None:
+        """Write all waiting records now."""
+        async with self.flush_lock:
+            records = self._buffer
+            self._buffer = []
+            self._buffer_nbytes = 0
+            if not records:
+                return
+            try:
+                await asyncio.to_thread(self._write, records)
+            except Exception as e:
+                print(f"Failed to write session records to {self.path}: {e!r}")
+                traceback.print_exc()
+
+    async def close(self) -> None:
+        """Stop recording, write all waiting records, and close the file.
+
+        If the flush timer has started flushing, that flush finishes
+        (see `_flush_after_delay`) before the remaining records are written.
+        """
+        self.is_closed = True
+        self.flush_timer_task.cancel()
+        await self.flush()
+        async with self.flush_lock:
+            if self._file is not None:
+                await asyncio.to_thread(self._file.close)
+                self._file = None
+
+    async def _flush_after_delay(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        # Shield the flush, so that cancelling this task (e.g. in `close`)
+        # does not release flush_lock while the worker thread is writing
+        await asyncio.shield(self.flush())
+
+    def _write(self, records: list[tuple[bytes, bytes]]) -> None:
+        """Write records, rotating the file as needed.
+
+        Runs in a worker thread.
+        """
+        if self._file is None:
+            if self.path.exists():
+                self._rotate()
+            self._open()
+        assert self._file is not None
+        for record_header, data in records:
+            nbytes = len(record_header) + len(data)
+            if (
+                self.max_file_nbytes > 0
+                and self._file_nbytes > _HEADER.size
+                and self._file_nbytes + nbytes > self.max_file_nbytes
+            ):
+                self._file.close()
+                self._rotate()
+                self._open()
+            self._file.write(record_header)
+            self._file.write(data)
+            self._file_nbytes += nbytes
+            self.num_written += 1
+        self._file.flush()
+
+    def _open(self) -> None:
+        """Open a new session file and write the header."""
+        self._file = open(self.path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, self.session_start_time))
+        self._file_nbytes = _HEADER.size
+
+    def _rotate(self) -> None:
+        """Rename path to path.1, path.1 to path.2, etc.
+
+        Delete the oldest file, if there would be more than backup_count.
+        """
+        for index in range(self.backup_count - 1, 0, -1):
+            backup_path = _get_backup_path(self.path, index)
+            if backup_path.exists():
+                backup_path.replace(_get_backup_path(self.path, index + 1))
+        if self.backup_count > 0:
+            self.path.replace(_get_backup_path(self.path, 1))
+        else:
+            self.path.unlink()
@@ -0,0 +1,436 @@
+from __future__ import annotations
+
+__all__ = [
+    "ReplayMockLoom",
+    "ReplayReport",
+    "ReplayWebSocket",
+    "run_replay",
+]
+
+import argparse
+import asyncio
+import collections.abc
+import contextlib
+import dataclasses
+import functools
+import json
+import pathlib
+import sys
+import tempfile
+import time
+
+from fastapi import WebSocketDisconnect
+
+from .loom_constants import TERMINATOR
+from .loom_protocol import READ_SIZE
+from .loom_server import MOCK_PORT_NAME, LoomServer
+from .mock_loom import MockLoom, MockLoomTiming
+from .reduced_pattern import ReducedPattern
+from .session_recorder import (
+    RecordType,
+    SessionRecord,
+    get_session_paths,
+    read_session_file,
+)
+from .virtual_clock import VirtualClockEventLoop, track_aiosqlite_operations
+
+# Maximum time to wait for the server to reconnect to the loom,
+# at the time the recorded server reconnected (sec)
+RECONNECT_TIMEOUT = 60
+
+# Maximum time to wait for the server to send the loom commands
+# recorded before a record from the loom or a client (sec)
+LOOM_COMMAND_TIMEOUT = 1
+
+# Interval between checks for loom commands from the server (sec)
+LOOM_COMMAND_POLL_INTERVAL = 0.0001
+
+# Time to let the server finish handling the last record (sec)
+SETTLE_DURATION = 1
+
+# Record types that are input to the server
+INPUT_RECORD_TYPES = frozenset(
+    (
+        RecordType.LOOM_DISCONNECTED,
+        RecordType.LOOM_DATA,
+        RecordType.CLIENT_CONNECTED,
+        RecordType.CLIENT_DISCONNECTED,
+        RecordType.CLIENT_COMMAND,
+    )
+)
+
+
+class ReplayMockLoom(MockLoom):
+    """A mock loom that only sends the data it is given.
+
+    Unlike `MockLoom`, it does not report its state when it starts,
+    and ignores commands, other than saving them.
+    Send replies by writing them to reply_writer.
+
+    Parameters
+    ----------
+    verbose : bool
+        If True, print diagnostics to stdout.
+    timing : MockLoomTiming | None
+        Timing model; only timing.byte_duration is used.
+    command_data : bytearray | None
+        Buffer to which to append the data of commands received.
+        If None, create a new buffer.
+    """
+
+    def __init__(
+        self,
+        verbose: bool = True,
+        timing: MockLoomTiming | None = None,
+        command_data: bytearray | None = None,
+    ) -> None:
+        self.command_data = bytearray() if command_data is None else command_data
+        super().__init__(verbose=verbose, timing=timing)
+
+    async def start(self) -> None:
+        self.command_reader, self.reply_writer = await self.create_streams()
+        self.read_commands_task = asyncio.create_task(self.handle_commands_loop())
+
+    async def handle_commands_loop(self) -> None:
+        assert self.command_reader is not None
+        while True:
+            data = await self.command_reader.read(READ_SIZE)
+            if not data:
+                return
+            self.command_data += data
+
+
+class ReplayWebSocket:
+    """A stand-in for a client's websocket, for `LoomServer.run_client`.
+
+    Feed it commands with `send_command`; the server receives them.
+    Replies from the server are counted, and the most recent is saved.
+    """
+
+    def __init__(self) -> None:
+        # Commands to be received by the server; None to disconnect
+        self.commands: asyncio.Queue[str | None] = asyncio.Queue()
+        self.num_replies = 0
+        self.last_reply = ""
+
+    def send_command(self, text: str) -> None:
+        """Send a command (JSON text) to the server."""
+        self.commands.put_nowait(text)
+
+    def disconnect(self) -> None:
+        """Disconnect, after the server receives the commands already sent."""
+        self.commands.put_nowait(None)
+
+    async def accept(self) -> None:
+        pass
+
+    async def receive_text(self) -> str:
+        text = await self.commands.get()
+        if text is None:
+            # Keep raising, in case of another read
+            self.commands.put_nowait(None)
+            raise WebSocketDisconnect()
+        return text
+
+    async def send_text(self, text: str) -> None:
+        self.num_replies += 1
+        self.last_reply = text
+
+    async def close(self, code: int = 1000, reason: str | None = None) -> None:
+        pass
+
+
+def _split_loom_commands(data: bytes | bytearray) -> list[bytes]:
+    """Split loom command data into commands, without terminators."""
+    return bytes(data).split(TERMINATOR)[:-1]
+
+
+@dataclasses.dataclass
+class ReplayReport:
+    """Results of replaying a session.
+
+    Loom commands are compared command by command. Counts of client replies
+    are informational: the server may coalesce replies differently.
+    """
+
+    num_records: int = 0
+    # Time from the first to the last record (sec)
+    recorded_duration: float = 0
+    # Time to replay the session (sec)
+    real_duration: float = 0
+    num_loom_commands: int = 0
+    num_replayed_loom_commands: int = 0
+    # Index and recorded and replayed values of the first loom command
+    # that differed, or None if the commands match
+    first_loom_command_mismatch: tuple[int, bytes | None, bytes | None] | None = None
+    # Number of replies to clients; a reply to all clients
+    # counts once for each connected client
+    num_client_replies: int = 0
+    num_replayed_client_replies: int = 0
+    # Number of records of data from the loom that could not be sent,
+    # because the server was not connected to the loom at the time
+    num_dropped_loom_data: int = 0
+    # Number of client records for unknown clients
+    num_unknown_client_records: int = 0
+    # The server's latency statistics, formatted as a table
+    latency_table: str = ""
+
+    @property
+    def loom_commands_match(self) -> bool:
+        return self.first_loom_command_mismatch is None
+
+    def format(self) -> str:
+        """Format the report as text."""
+        lines = [
+            f"Replayed {self.num_records} records, spanning "
+            f"{self.recorded_duration:.1f} seconds, "
+            f"in {self.real_duration:.1f} seconds",
+            f"Loom commands: {self.num_loom_commands} recorded, "
+            f"{self.num_replayed_loom_commands} replayed",
+        ]
+        if self.first_loom_command_mismatch is not None:
+            index, recorded, replayed = self.first_loom_command_mismatch
+            lines.append(
+                f"Loom command {index} differs: "
+                f"recorded {recorded!r}, replayed {replayed!r}"
+            )
+        else:
+            lines.append("Loom commands match")
+        lines += [
+            f"Client replies: {self.num_client_replies} recorded, "
+            f"{self.num_replayed_client_replies} replayed",
+            f"Dropped loom data records: {self.num_dropped_loom_data}; "
+            f"unknown client records: {self.num_unknown_client_records}",
+        ]
+        if self.latency_table:
+            lines += ["Latency statistics (µs):", self.latency_table]
+        return "\n".join(lines)
+
+
+async def _replay(
+    records: list[SessionRecord],
+    speed: float,
+    db_path: pathlib.Path,
+    verbose: bool,
+) -> ReplayReport:
+    loop = asyncio.get_running_loop()
+    report = ReplayReport(num_records=len(records))
+    if not records:
+        return report
+    first_timestamp = records[0].timestamp
+    report.recorded_duration = records[-1].timestamp - first_timestamp
+    recorded_command_data = bytearray()
+    command_data = bytearray()
+    server = LoomServer(
+        serial_port=MOCK_PORT_NAME, reset_db=True, verbose=verbose, db_path=db_path
+    )
+    server.mock_loom_factory = functools.partial(
+        ReplayMockLoom, command_data=command_data
+    )
+    websockets: dict[int, ReplayWebSocket] = {}
+    all_websockets: list[ReplayWebSocket] = []
+    client_tasks: list[asyncio.Task] = []
+    num_loom_connections = 0
+    async with server:
+        # Event loop time corresponding to first_timestamp
+        start_time = loop.time()
+        for record in records:
+            delay = (record.timestamp - first_timestamp) / speed - (
+                loop.time() - start_time
+            )
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if record.record_type in INPUT_RECORD_TYPES and len(command_data) < len(
+                recorded_command_data
+            ):
+                # Preserve cause and effect: the recorded server sent
+                # these commands before it got this input
+                wait_start_time = loop.time()
+                with contextlib.suppress(TimeoutError):
+                    async with asyncio.timeout(LOOM_COMMAND_TIMEOUT):
+                        while len(command_data) < len(recorded_command_data):
+                            await asyncio.sleep(LOOM_COMMAND_POLL_INTERVAL)
+                # Keep the recorded intervals between later records
+                start_time += loop.time() - wait_start_time
+            match record.record_type:
+                case RecordType.PATTERN:
+                    pattern = ReducedPattern.from_dict(json.loads(record.data))
+                    await server.add_pattern(pattern)
+                    await server.pattern_db.update_pick_number(
+                        pattern_name=pattern.name,
+                        pick_number=pattern.pick_number,
+                        repeat_number=pattern.repeat_number,
+                    )
+                case RecordType.CURRENT_PATTERN:
+                    await server.select_pattern(record.data.decode())
+                case RecordType.LOOM_CONNECTED:
+                    # The server reconnects by itself, but perhaps
+                    # not as quickly as the recorded server did
+                    num_loom_connections += 1
+                    wait_start_time = loop.time()
+                    async with asyncio.timeout(RECONNECT_TIMEOUT):
+                        while not (
+                            server.loom_connected
+                            and server.num_loom_connections >= num_loom_connections
+                        ):
+                            await asyncio.sleep(0.001)
+                    # Keep the recorded intervals between later records
+                    start_time += loop.time() - wait_start_time
+                case RecordType.LOOM_DISCONNECTED:
+                    mock_loom = server.mock_loom
+                    if mock_loom is not None and mock_loom.reply_writer is not None:
+                        mock_loom.reply_writer.close()
+                case RecordType.LOOM_COMMAND:
+                    recorded_command_data += record.data
+                case RecordType.LOOM_DATA:
+                    mock_loom = server.mock_loom
+                    if mock_loom is None or not mock_loom.connected():
+                        report.num_dropped_loom_data += 1
+                        continue
+                    assert mock_loom.reply_writer is not None
+                    mock_loom.reply_writer.write(record.data)
+                    await mock_loom.reply_writer.drain()
+                case RecordType.CLIENT_CONNECTED:
+                    websocket = ReplayWebSocket()
+                    websockets[record.client_id] = websocket
+                    all_websockets.append(websocket)
+                    client_tasks.append(
+                        asyncio.create_task(
+                            server.run_client(websocket)  # type: ignore[arg-type]
+                        )
+                    )
+                case RecordType.CLIENT_DISCONNECTED:
+                    websocket_to_close = websockets.pop(record.client_id, None)
+                    if websocket_to_close is None:
+                        report.num_unknown_client_records += 1
+                        continue
+                    websocket_to_close.disconnect()
+                case RecordType.CLIENT_COMMAND:
+                    websocket_to_use = websockets.get(record.client_id)
+                    if websocket_to_use is None:
+                        report.num_unknown_client_records += 1
+                        continue
+                    websocket_to_use.send_command(record.data.decode())
+                case RecordType.CLIENT_REPLY:
+                    report.num_client_replies += (
+                        len(websockets) if record.client_id == 0 else 1
+                    )
+
+        await asyncio.sleep(SETTLE_DURATION)
+        for websocket in websockets.values():
+            websocket.disconnect()
+        if client_tasks:
+            await asyncio.wait(client_tasks, timeout=SETTLE_DURATION)
+        report.latency_table = server.latency_stats.format_table()
+
+    recorded_commands = _split_loom_commands(recorded_command_data)
+    replayed_commands = _split_loom_commands(command_data)
+    report.num_loom_commands = len(recorded_commands)
+    report.num_replayed_loom_commands = len(replayed_commands)
+    for index in range(max(len(recorded_commands), len(replayed_commands))):
+        recorded = recorded_commands[index] if index < len(recorded_commands) else None
+        replayed = replayed_commands[index] if index < len(replayed_commands) else None
+        if recorded != replayed:
+            report.first_loom_command_mismatch = (index, recorded, replayed)
+            break
+    report.num_replayed_client_replies = sum(
+        websocket.num_replies for websocket in all_websockets
+    )
+    return report
+
+
+def run_replay(
+    paths: collections.abc.Iterable[pathlib.Path],
+    speed: float | None = 1,
+    verbose: bool = False,
+) -> ReplayReport:
+    """Replay a recorded session with a LoomServer and a `ReplayMockLoom`.
+
+    Start with an empty pattern database, add the recorded patterns,
+    then send the recorded loom data and client commands
+    to the server, with the recorded timing (scaled by speed).
+    Compare the loom commands the server sends to the recorded commands.
+
+    Must not be called from a running event loop, because it runs
+    its own event loop.
+
+    Parameters
+    ----------
+    paths : collections.abc.Iterable[pathlib.Path]
+        Session files to replay, in order; see `get_session_paths`.
+    speed : float | None
+        Replay speed, relative to the recorded speed
+        (e.g. 1 to replay in real time). If None, replay as fast as
+        possible, using a virtual clock (see `VirtualClockEventLoop`),
+        which preserves the recorded timing as seen by the server.
+    verbose : bool
+        If True, the server prints diagnostics to stdout.
+
+    Raises
+    ------
+    ValueError
+        If speed is not None and not positive.
+    """
+    if speed is not None and speed <= 0:
+        raise ValueError(f"{speed=} must be None or positive")
+    records = [record for path in paths for record in read_session_file(path)]
+    start_time = time.monotonic()
+    with contextlib.ExitStack() as stack:
+        tempdir = stack.enter_context(tempfile.TemporaryDirectory())
+        db_path = pathlib.Path(tempdir) / "session_replay.sqlite"
+        loop_factory = None if speed is not None else VirtualClockEventLoop
+        runner = stack.enter_context(asyncio.Runner(loop_factory=loop_factory))
+        loop = runner.get_loop()
+        if isinstance(loop, VirtualClockEventLoop):
+            stack.enter_context(track_aiosqlite_operations(loop))
+        report = runner.run(
+            _replay(
+                records=records,
+                speed=1 if speed is None else speed,
+                db_path=db_path,
+                verbose=verbose,
+            )
+        )
+    report.real_duration = time.monotonic() - start_time
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay a session recorded by the loom server "
+        "(see run_seguin_loom --record-session)."
+    )
+    parser.add_argument(
+        "path",
+        type=pathlib.Path,
+        help="Session file. Its rotated files from the same session "
+        "(path.1, path.2, ...) are replayed first.",
+    )
+    speed_group = parser.add_mutually_exclusive_group()
+    speed_group.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="Replay speed, relative to the recorded speed; default=1",
+    )
+    speed_group.add_argument(
+        "--max-speed",
+        action="store_true",
+        help="Replay as fast as possible, on a virtual clock.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Print server diagnostics."
+    )
+    args = parser.parse_args()
+    report = run_replay(
+        get_session_paths(args.path),
+        speed=None if args.max_speed else args.speed,
+        verbose=args.verbose,
+    )
+    print(report.format())
+    if not report.loom_commands_match:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+__all__ = [
+    "SoakCheckpoint",
+    "SoakConfig",
+    "SoakReport",
+    "create_soak_pattern",
+    "run_soak_simulation",
+]
+
+import argparse
+import asyncio
+import collections.abc
+import contextlib
+import dataclasses
+import gc
+import math
+import os
+import pathlib
+import random
+import sys
+import tempfile
+import time
+
+from .loom_server import MOCK_PORT_NAME, LoomServer
+from .mock_loom import MockLoomTiming
+from .reduced_pattern import Pick, ReducedPattern
+from .virtual_clock import VirtualClockEventLoop, track_aiosqlite_operations
+
+# Maximum number of bookkeeping errors to describe in the report
+# (all of them are counted)
+MAX_REPORTED_ERRORS = 10
+
+# Interval between checks for the next checkpoint (virtual sec)
+CHECKPOINT_POLL_INTERVAL = 60
+
+SOAK_PATTERN_NAME = "soak test pattern"
+
+
+@dataclasses.dataclass
+class SoakConfig:
+    """Configuration for a soak simulation.
+
+    Intervals are the mean time between random events,
+    in virtual seconds; use math.inf to disable an event.
+
+    Parameters
+    ----------
+    num_picks : int
+        Number of picks to weave (each direction counts).
+    seed : int
+        Random number generator seed.
+    num_pattern_picks : int
+        Number of picks in the (randomly generated) pattern.
+    num_shafts : int
+        Number of shafts in the pattern.
+    picks_per_minute : float
+        Weaving rate of the mock loom.
+    reversal_interval : float
+        Mean interval between weave direction reversals.
+    error_toggle_interval : float
+        Mean interval between toggling the loom's error flag.
+    disconnect_interval : float
+        Mean interval between losing the connection to the loom.
+    num_checkpoints : int
+        Number of times to measure resource use, evenly spaced in picks,
+        ending after the last pick. The first checkpoint (after weaving
+        for a while, to fill caches) is the baseline for growth.
+    """
+
+    num_picks: int = 100_000
+    seed: int = 0
+    num_pattern_picks: int = 500
+    num_shafts: int = 24
+    picks_per_minute: float = 30.0
+    reversal_interval: float = 3600.0
+    error_toggle_interval: float = 2 * 3600.0
+    disconnect_interval: float = 3 * 3600.0
+    num_checkpoints: int = 10
+
+
+@dataclasses.dataclass
+class SoakCheckpoint:
+    """Resource use at one point in a soak simulation.
+
+    Parameters
+    ----------
+    num_picks : int
+        Number of picks woven so far.
+    virtual_time : float
+        Virtual time (sec).
+    cpu_time : float
+        Process CPU time (sec).
+    num_objects : int
+        Number of objects tracked by the garbage collector,
+        after collecting garbage.
+    rss_bytes : int | None
+        Resident set size (bytes), or None if unknown.
+    db_nbytes : int
+        Size of the database files (bytes).
+    num_tasks : int
+        Number of asyncio tasks that are not done.
+    num_queued : int
+        Total number of items in the server's queues: unacknowledged
+        =C commands, unsaved pick numbers, recent pick times,
+        pattern uploads and messages waiting to be sent to clients.
+    """
+
+    num_picks: int
+    virtual_time: float
+    cpu_time: float
+    num_objects: int
+    rss_bytes: int | None
+    db_nbytes: int
+    num_tasks: int
+    num_queued: int
+
+
+@dataclasses.dataclass
+class SoakReport:
+    """Results of a soak simulation.
+
+    Growth is measured from the first checkpoint to the last,
+    so one-time costs (e.g. filling caches) are excluded.
+    """
+
+    config: SoakConfig
+    checkpoints: list[SoakCheckpoint] = dataclasses.field(default_factory=list)
+    num_reversals: int = 0
+    num_error_toggles: int = 0
+    num_disconnects: int = 0
+    num_loom_connections: int = 0
+    num_shaft_echo_mismatches: int = 0
+    num_shaft_command_failures: int = 0
+    # Number of times the pick or repeat number did not match
+    # an independent model of the pattern position
+    num_bookkeeping_errors: int = 0
+    # Descriptions of the first MAX_REPORTED_ERRORS errors
+    errors: list[str] = dataclasses.field(default_factory=list)
+    real_duration: float = 0
+
+    @property
+    def cpu_time_per_pick(self) -> float:
+        """Mean CPU time per pick (sec), between first and last checkpoint."""
+        first, last = self.checkpoints[0], self.checkpoints[-1]
+        return (last.cpu_time - first.cpu_time) / max(
+            last.num_picks - first.num_picks, 1
+        )
+
+    @property
+    def object_growth(self) -> int:
+        """Growth in the number of objects."""
+        return self.checkpoints[-1].num_objects - self.checkpoints[0].num_objects
+
+    @property
+    def rss_growth(self) -> int | None:
+        """Growth in resident set size (bytes), or None if unknown."""
+        first, last = self.checkpoints[0], self.checkpoints[-1]
+        if first.rss_bytes is None or last.rss_bytes is None:
+            return None
+        return last.rss_bytes - first.rss_bytes
+
+    @property
+    def db_growth(self) -> int:
+        """Growth in database size (bytes)."""
+        return self.checkpoints[-1].db_nbytes - self.checkpoints[0].db_nbytes
+
+    @property
+    def task_growth(self) -> int:
+        """Growth in the number of asyncio tasks."""
+        return self.checkpoints[-1].num_tasks - self.checkpoints[0].num_tasks
+
+    @property
+    def max_num_queued(self) -> int:
+        """Largest number of items in the server's queues at any checkpoint."""
+        return max(checkpoint.num_queued for checkpoint in self.checkpoints)
+
+    @property
+    def picks_per_second(self) -> float:
+        """Number of picks woven per second of real time."""
+        return self.checkpoints[-1].num_picks / max(self.real_duration, 1e-9)
+
+    def format(self) -> str:
+        """Format the report as text."""
+        lines = [
+            f"{'picks':>10} {'days':>8} {'cpu sec':>8} {'objects':>9} "
+            f"{'RSS MB':>8} {'DB kB':>8} {'tasks':>6} {'queued':>6}"
+        ]
+        for checkpoint in self.checkpoints:
+            rss_str = (
+                "?"
+                if checkpoint.rss_bytes is None
+                else f"{checkpoint.rss_bytes / 1e6:.1f}"
+            )
+            lines.append(
+                f"{checkpoint.num_picks:>10} "
+                f"{checkpoint.virtual_time / 86400:>8.2f} "
+                f"{checkpoint.cpu_time:>8.1f} {checkpoint.num_objects:>9} "
+                f"{rss_str:>8} {checkpoint.db_nbytes / 1e3:>8.1f} "
+                f"{checkpoint.num_tasks:>6} {checkpoint.num_queued:>6}"
+            )
+        rss_growth = self.rss_growth
+        rss_growth_str = "?" if rss_growth is None else f"{rss_growth / 1e6:.1f} MB"
+        lines += [
+            f"Simulated {self.checkpoints[-1].virtual_time / 86400:.2f} days "
+            f"in {self.real_duration:.1f} seconds "
+            f"({self.picks_per_second:.0f} picks/second)",
+            f"CPU time per pick: {self.cpu_time_per_pick * 1e6:.1f} µs",
+            f"Growth: {self.object_growth} objects, RSS {rss_growth_str}, "
+            f"DB {self.db_growth / 1e3:.1f} kB, {self.task_growth} tasks; "
+            f"at most {self.max_num_queued} items queued",
+            f"Events: {self.num_reversals} reversals, "
+            f"{self.num_error_toggles} error toggles, "
+            f"{self.num_disconnects} disconnects, "
+            f"{self.num_loom_connections} loom connections",
+            f"Problems: {self.num_bookkeeping_errors} bookkeeping errors, "
+            f"{self.num_shaft_echo_mismatches} shaft echo mismatches, "
+            f"{self.num_shaft_command_failures} shaft command failures",
+        ]
+        lines += self.errors
+        return "\n".join(lines)
+
+
+def create_soak_pattern(
+    num_picks: int, num_shafts: int, rng: random.Random
+) -> ReducedPattern:
+    """Create a random pattern."""
+    num_ends = 4 * num_shafts
+    return ReducedPattern(
+        name=SOAK_PATTERN_NAME,
+        color_table=["#000000", "#ffffff"],
+        warp_colors=[0] * num_ends,
+        threading=[i % num_shafts for i in range(num_ends)],
+        picks=[
+            Pick(
+                color=i % 2,
+                shaft_word=rng.getrandbits(num_shafts),
+                num_shafts=num_shafts,
+            )
+            for i in range(num_picks)
+        ],
+    )
+
+
+def get_rss_bytes() -> int | None:
+    """Get the resident set size (bytes), or None if unknown.
+
+    Only supported on Linux.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def get_db_nbytes(db_path: pathlib.Path) -> int:
+    """Get the total size of the database files (bytes)."""
+    return sum(
+        path.stat().st_size
+        for path in (
+            db_path,
+            db_path.with_name(db_path.name + "-journal"),
+            db_path.with_name(db_path.name + "-wal"),
+        )
+        if path.exists()
+    )
+
+
+async def _random_event_loop(
+    interval: float,
+    rng: random.Random,
+    event: collections.abc.Callable[[], collections.abc.Awaitable[bool]],
+) -> None:
+    """Call event at random intervals, with the specified mean."""
+    if math.isinf(interval):
+        return
+    while True:
+        await asyncio.sleep(rng.expovariate(1 / interval))
+        await event()
+
+
+async def _soak(config: SoakConfig, db_path: pathlib.Path) -> SoakReport:
+    loop = asyncio.get_running_loop()
+    assert isinstance(loop, VirtualClockEventLoop)
+    report = SoakReport(config=config)
+    rng = random.Random(config.seed)
+    pattern = create_soak_pattern(
+        num_picks=config.num_pattern_picks, num_shafts=config.num_shafts, rng=rng
+    )
+    # Number of positions in one repeat, including pick 0
+    num_positions = len(pattern.picks) + 1
+    timing = MockLoomTiming(auto_weave_rate=config.picks_per_minute)
+
+    async with LoomServer(
+        serial_port=MOCK_PORT_NAME,
+        reset_db=True,
+        verbose=False,
+        db_path=db_path,
+        mock_loom_timing=timing,
+    ) as server:
+        # The database is discarded, so do not wait for each write
+        # to reach the disk; this more than doubles the speed
+        await server.pattern_db.db.execute("pragma synchronous = off")
+        await server.add_pattern(pattern)
+        await server.select_pattern(pattern.name)
+
+        # Check the pick and repeat numbers after every increment
+        # against the position in a sequence of all picks of all repeats,
+        # where pick 0 of repeat 1 is position 0.
+        expected_position = 0
+        num_picks = 0
+        increment_pick_number = server.increment_pick_number
+
+        def checked_increment_pick_number() -> int:
+            nonlocal expected_position, num_picks
+            expected_position += 1 if server.weave_forward else -1
+            num_picks += 1
+            pick_number = increment_pick_number()
+            current_pattern = server.current_pattern
+            assert current_pattern is not None
+            repeat_index, expected_pick_number = divmod(
+                expected_position, num_positions
+            )
+            expected = (expected_pick_number, repeat_index + 1)
+            actual = (current_pattern.pick_number, current_pattern.repeat_number)
+            if actual != expected or pick_number != actual[0]:
+                report.num_bookkeeping_errors += 1
+                if len(report.errors) < MAX_REPORTED_ERRORS:
+                    report.errors.append(
+                        f"After {num_picks} picks: (pick, repeat) = {actual}; "
+                        f"expected {expected}"
+                    )
+                # Resynchronize, to avoid reporting one error many times
+                expected_position = (
+                    current_pattern.repeat_number - 1
+                ) * num_positions + current_pattern.pick_number
+            return pick_number
+
+        server.increment_pick_number = checked_increment_pick_number  # type: ignore
+
+        async def reverse() -> bool:
+            if not server.loom_connected:
+                return False
+            await server.command_loom("=#d")
+            report.num_reversals += 1
+            return True
+
+        async def toggle_error() -> bool:
+            if not server.loom_connected:
+                return False
+            await server.command_loom("=#e")
+            report.num_error_toggles += 1
+            return True
+
+        async def disconnect() -> bool:
+            mock_loom = server.mock_loom
+            if mock_loom is None or mock_loom.reply_writer is None:
+                return False
+            mock_loom.reply_writer.close()
+            report.num_disconnects += 1
+            return True
+
+        def get_num_queued() -> int:
+            return (
+                len(server.unacknowledged_shaft_commands)
+                + len(server.pick_persister.pending_updates)
+                + len(server.recent_pick_times)
+                + server.upload_queue.qsize()
+                + sum(client.queue_depth for client in server.clients)
+            )
+
+        def add_checkpoint() -> None:
+            gc.collect()
+            report.checkpoints.append(
+                SoakCheckpoint(
+                    num_picks=num_picks,
+                    virtual_time=loop.time(),
+                    cpu_time=time.process_time(),
+                    num_objects=len(gc.get_objects()),
+                    rss_bytes=get_rss_bytes(),
+                    db_nbytes=get_db_nbytes(db_path),
+                    num_tasks=sum(not task.done() for task in asyncio.all_tasks()),
+                    num_queued=get_num_queued(),
+                )
+            )
+
+        event_tasks = [
+            asyncio.create_task(_random_event_loop(interval, rng, event))
+            for interval, event in (
+                (config.reversal_interval, reverse),
+                (config.error_toggle_interval, toggle_error),
+                (config.disconnect_interval, disconnect),
+            )
+        ]
+        try:
+            num_checkpoints = max(config.num_checkpoints, 2)
+            for i in range(1, num_checkpoints + 1):
+                checkpoint_num_picks = config.num_picks * i // num_checkpoints
+                while num_picks < checkpoint_num_picks:
+                    await asyncio.sleep(CHECKPOINT_POLL_INTERVAL)
+                add_checkpoint()
+        finally:
+            for task in event_tasks:
+                task.cancel()
+
+        # Check that the final pick and repeat numbers were saved
+        current_pattern = server.current_pattern
+        assert current_pattern is not None
+        await server.pick_persister.flush()
+        async with server.pattern_db.db.execute(
+            "select pick_number, repeat_number from patterns where pattern_name = ?",
+            (pattern.name,),
+        ) as cursor:
+            row = await cursor.fetchone()
+        expected = (current_pattern.pick_number, current_pattern.repeat_number)
+        if row is None or tuple(row) != expected:
+            report.num_bookkeeping_errors += 1
+            report.errors.append(
+                f"Saved (pick, repeat) = {None if row is None else tuple(row)}; "
+                f"expected {expected}"
+            )
+
+        report.num_loom_connections = server.num_loom_connections
+        report.num_shaft_echo_mismatches = server.num_shaft_echo_mismatches
+        report.num_shaft_command_failures = server.num_shaft_command_failures
+    return report
+
+
+def run_soak_simulation(
+    config: SoakConfig, db_path: pathlib.Path | None = None
+) -> SoakReport:
+    """Run a LoomServer and an auto-weaving MockLoom on a virtual clock.
+
+    The mock loom has a realistic timing model, and the connection
+    is randomly lost and the weave direction and loom error flag randomly
+    toggled, as specified by config. Check the pick and repeat numbers
+    after every pick, and measure resource use at checkpoints.
+
+    Must not be called from a running event loop, because it runs
+    its own (virtual clock) event loop.
+
+    The simulation weaves a few thousand picks per second of real time,
+    so a million picks (about a month of weaving at 30 picks per minute)
+    take several minutes. This rate is limited by the real server code
+    it exercises: each pick takes a few dozen event loop iterations
+    and a database write in aiosqlite's thread.
+
+    Parameters
+    ----------
+    config : SoakConfig
+        Configuration.
+    db_path : pathlib.Path | None
+        Path of the pattern database, which is reset.
+        If None, use a temporary file.
+    """
+    start_time = time.monotonic()
+    with contextlib.ExitStack() as stack:
+        if db_path is None:
+            tempdir = stack.enter_context(tempfile.TemporaryDirectory())
+            db_path = pathlib.Path(tempdir) / "soak_simulation.sqlite"
+        runner = stack.enter_context(asyncio.Runner(loop_factory=VirtualClockEventLoop))
+        loop = runner.get_loop()
+        assert isinstance(loop, VirtualClockEventLoop)
+        stack.enter_context(track_aiosqlite_operations(loop))
+        report = runner.run(_soak(config=config, db_path=db_path))
+    report.real_duration = time.monotonic() - start_time
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Weave a long time on a virtual clock; "
+        "check bookkeeping and resource use."
+    )
+    defaults = SoakConfig()
+    for field in dataclasses.fields(SoakConfig):
+        parser.add_argument(
+            f"--{field.name.replace('_', '-')}",
+            type=type(getattr(defaults, field.name)),
+            default=getattr(defaults, field.name),
+            help=f"see SoakConfig; default={getattr(defaults, field.name)}",
+        )
+    args = parser.parse_args()
+    report = run_soak_simulation(SoakConfig(**vars(args)))
+    print(report.format())
+    if report.num_bookkeeping_errors > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-__all__ = ["create_test_client"]
+__all__ = ["create_test_client", "read_initial_server_state"]
 
 import collections.abc
 import contextlib
@@ -34,9 +34,12 @@ def create_test_client(
     db_path: pathlib.Path | str | None = None,
     expected_pattern_names: collections.abc.Iterable[str] = (),
     expected_current_pattern: ReducedPattern | None = None,
+    num_looms: int = 1,
 ) -> collections.abc.Generator[tuple[TestClient, WebSocketType], None]:
     """Create a test server, client, websocket. Return (client, websocket).
 
+    The websocket is connected to loom 1.
+
     Parameters
     ----------
     read_initial_state : bool
@@ -56,10 +59,12 @@ def create_test_client(
     expected_current_pattern : ReducedPattern | None
         Expected_current_pattern. Specify if and only if db_path is not None
         and you expect the database to contain any patterns.
+    num_looms : int
+        The number of mock looms.
     """
     expected_pattern_names = list(expected_pattern_names)
     with tempfile.NamedTemporaryFile() as f:
-        argv = ["testutils", "mock", "--verbose"]
+        argv = ["testutils"] + ["mock"] * num_looms + ["--verbose"]
         if reset_db:
             argv.append("--reset-db")
         if db_path is None:
@@ -72,64 +77,11 @@ def create_test_client(
             with client.websocket_connect("/ws") as websocket:
 
                 if read_initial_state:
-                    seen_types: set[str] = set()
-                    expected_types = {
-                        "LoomConnectionState",
-                        "LoomState",
-                        "PatternNames",
-                        "WeaveDirection",
-                    }
-                    if expected_current_pattern:
-                        expected_types |= {"ReducedPattern", "CurrentPickNumber"}
-                    good_connection_states = {
-                        ConnectionStateEnum.CONNECTING,
-                        ConnectionStateEnum.CONNECTED,
-                    }
-                    while True:
-                        reply_dict = receive_dict(websocket)
-                        reply = SimpleNamespace(**reply_dict)
-                        match reply.type:
-                            case "LoomConnectionState":
-                                if reply.state not in good_connection_states:
-                                    raise AssertionError(
-                                        f"Unexpected state in {reply=}; "
-                                        f"should be in {good_connection_states}"
-                                    )
-                                elif reply.state != ConnectionStateEnum.CONNECTED:
-                                    continue
-                            case "LoomState":
-                                assert reply.shed_closed
-                                assert not reply.cycle_complete
-                                assert not reply.error
-                            case "PatternNames":
-                                assert reply.names == expected_pattern_names
-                            case "ReducedPattern":
-                                if not expected_pattern_names:
-                                    raise AssertionError(
-                                        f"Unexpected message type {reply.type} "
-                                        "because expected_current_pattern is None"
-                                    )
-
-                                assert reply.name == expected_pattern_names[-1]
-                            case "CurrentPickNumber":
-                                assert expected_current_pattern is not None
-                                assert (
-                                    reply.pick_number
-                                    == expected_current_pattern.pick_number
-                                )
-                                assert (
-                                    reply.repeat_number
-                                    == expected_current_pattern.repeat_number
-                                )
-                            case "WeaveDirection":
-                                assert reply.forward
-                            case _:
-                                raise AssertionError(
-                                    f"Unexpected message type {reply.type}"
-                                )
-                        seen_types.add(reply.type)
-                        if seen_types == expected_types:
-                            break
+                    read_initial_server_state(
+                        websocket=websocket,
+                        expected_pattern_names=expected_pattern_names,
+                        expected_current_pattern=expected_current_pattern,
+                    )
 
                 expected_names: list[str] = []
                 for path in upload_patterns:
@@ -141,6 +93,74 @@ def create_test_client(
                 yield (client, websocket)
 
 
+def read_initial_server_state(
+    websocket: WebSocketType,
+    expected_pattern_names: list[str],
+    expected_current_pattern: ReducedPattern | None = None,
+) -> None:
+    """Read and check the replies the server sends to a new client.
+
+    Parameters
+    ----------
+    websocket : WebSocketType
+        The newly connected websocket.
+    expected_pattern_names : list[str]
+        Expected pattern names.
+    expected_current_pattern : ReducedPattern | None
+        Expected current pattern, if any.
+    """
+    seen_types: set[str] = set()
+    expected_types = {
+        "LoomConnectionState",
+        "LoomState",
+        "PatternNames",
+        "WeaveDirection",
+    }
+    if expected_current_pattern:
+        expected_types |= {"ReducedPattern", "CurrentPickNumber"}
+    good_connection_states = {
+        ConnectionStateEnum.CONNECTING,
+        ConnectionStateEnum.CONNECTED,
+    }
+    while True:
+        reply_dict = receive_dict(websocket)
+        reply = SimpleNamespace(**reply_dict)
+        match reply.type:
+            case "LoomConnectionState":
+                if reply.state not in good_connection_states:
+                    raise AssertionError(
+                        f"Unexpected state in {reply=}; "
+                        f"should be in {good_connection_states}"
+                    )
+                elif reply.state != ConnectionStateEnum.CONNECTED:
+                    continue
+            case "LoomState":
+                assert reply.shed_closed
+                assert not reply.cycle_complete
+                assert not reply.error
+            case "PatternNames":
+                assert reply.names == expected_pattern_names
+            case "ReducedPattern":
+                if not expected_pattern_names:
+                    raise AssertionError(
+                        f"Unexpected message type {reply.type} "
+                        "because expected_current_pattern is None"
+                    )
+
+                assert reply.name == expected_pattern_names[-1]
+            case "CurrentPickNumber":
+                assert expected_current_pattern is not None
+                assert reply.pick_number == expected_current_pattern.pick_number
+                assert reply.repeat_number == expected_current_pattern.repeat_number
+            case "WeaveDirection":
+                assert reply.forward
+            case _:
+                raise AssertionError(f"Unexpected message type {reply.type}")
+        seen_types.add(reply.type)
+        if seen_types == expected_types:
+            break
+
+
 def upload_pattern(websocket: WebSocketType, filepath: pathlib.Path) -> None:
     with open(filepath, "r") as f:
         data = f.read()
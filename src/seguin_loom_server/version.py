@@ -0,0 +1,3 @@
+# Generated by setuptools_scm
+__all__ = ["__version__"]
+__version__ = "0.1.dev8+g9a387f497.d20261016"
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+__all__ = ["VirtualClockEventLoop", "track_aiosqlite_operations"]
+
+import asyncio
+import collections.abc
+import concurrent.futures
+import contextlib
+import selectors
+from typing import TypeVar, TypeVarTuple
+
+import aiosqlite
+
+_T = TypeVar("_T")
+_Ts = TypeVarTuple("_Ts")
+
+
+class _VirtualClockSelector(selectors.DefaultSelector):
+    """Selector that advances a virtual clock instead of waiting.
+
+    Parameters
+    ----------
+    loop : VirtualClockEventLoop
+        The event loop whose clock to advance.
+    """
+
+    def __init__(self, loop: VirtualClockEventLoop) -> None:
+        super().__init__()
+        self.loop = loop
+
+    def select(self, timeout: float | None = None) -> list:
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None or self.loop.num_external_operations > 0:
+            # Wait in real time: for an external operation to finish,
+            # or (if nothing is scheduled) for any I/O at all.
+            return super().select(None)
+        # Nothing to do until the next scheduled callback: skip ahead
+        self.loop.virtual_time += timeout
+        return []
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """Event loop with a virtual clock, for fast deterministic simulations.
+
+    The clock starts at 0 and only advances when the loop is idle,
+    at which point it jumps to the time of the next scheduled callback.
+    So `asyncio.sleep`, `asyncio.timeout` and `loop.call_later`
+    take no real time, and code that only waits on those runs
+    as fast as the CPU allows, in a reproducible order.
+
+    Code that waits for work done in other threads or processes
+    must wrap each such operation in `external_operation`, else the clock
+    may jump ahead while the work is in progress. `run_in_executor`
+    (and thus `asyncio.to_thread`) does this automatically;
+    use `track_aiosqlite_operations` for aiosqlite.
+
+    Use with `asyncio.Runner(loop_factory=VirtualClockEventLoop)`.
+    """
+
+    def __init__(self) -> None:
+        self.virtual_time = 0.0
+        self.num_external_operations = 0
+        super().__init__(selector=_VirtualClockSelector(self))
+
+    def time(self) -> float:
+        return self.virtual_time
+
+    def run_in_executor(
+        self,
+        executor: concurrent.futures.Executor | None,
+        func: collections.abc.Callable[[*_Ts], _T],
+        *args: *_Ts,
+    ) -> asyncio.Future[_T]:
+        """Run func in an executor, as an external operation."""
+        future = super().run_in_executor(executor, func, *args)
+        self.num_external_operations += 1
+        future.add_done_callback(self._external_operation_done)
+        return future
+
+    def _external_operation_done(self, future: asyncio.Future) -> None:
+        self.num_external_operations -= 1
+
+    @contextlib.contextmanager
+    def external_operation(self) -> collections.abc.Iterator[None]:
+        """Context manager that stops the clock while an operation
+        in another thread is in progress."""
+        self.num_external_operations += 1
+        try:
+            yield
+        finally:
+            self.num_external_operations -= 1
+
+
+@contextlib.contextmanager
+def track_aiosqlite_operations(
+    loop: VirtualClockEventLoop,
+) -> collections.abc.Iterator[None]:
+    """Stop the virtual clock while aiosqlite is working in its thread.
+
+    Relies on the fact that aiosqlite runs every operation
+    through Connection._execute.
+    """
+    execute = aiosqlite.Connection._execute
+
+    async def tracked_execute(self, fn, *args, **kwargs):  # type: ignore
+        with loop.external_operation():
+            return await execute(self, fn, *args, **kwargs)
+
+    aiosqlite.Connection._execute = tracked_execute  # type: ignore[method-assign]
+    try:
+        yield
+    finally:
+        aiosqlite.Connection._execute = execute  # type: ignore[method-assign]
@@ -0,0 +1,142 @@
+import asyncio
+
+from seguin_loom_server.client_connection import ClientConnection, CloseCode
+
+
+class MockWebSocket:
+    """A minimal websocket that records sent messages.
+
+    Sending blocks while `not_stalled_event` is clear.
+    """
+
+    def __init__(self) -> None:
+        self.sent_messages: list[str] = []
+        self.close_args: tuple[int, str] | None = None
+        self.not_stalled_event = asyncio.Event()
+        self.not_stalled_event.set()
+
+    async def send_text(self, message: str) -> None:
+        await self.not_stalled_event.wait()
+        self.sent_messages.append(message)
+
+    async def close(self, code: int, reason: str) -> None:
+        self.close_args = (code, reason)
+
+
+async def test_send() -> None:
+    websocket = MockWebSocket()
+    connection = ClientConnection(websocket=websocket)  # type: ignore[arg-type]
+    messages = [f"message {i}" for i in range(10)]
+    for message in messages:
+        assert connection.send(message)
+    await asyncio.sleep(0.01)
+    assert websocket.sent_messages == messages
+    assert connection.num_sent == len(messages)
+    assert connection.is_open
+
+    await connection.close()
+    assert not connection.is_open
+    assert not connection.send("too late")
+    assert websocket.close_args == (CloseCode.NORMAL, "")
+
+
+async def test_stalled_client() -> None:
+    websocket = MockWebSocket()
+    websocket.not_stalled_event.clear()
+    max_send_queue_size = 5
+    connection = ClientConnection(
+        websocket=websocket,  # type: ignore[arg-type]
+        max_send_queue_size=max_send_queue_size,
+    )
+    await asyncio.sleep(0)
+    # The writer task holds one message while stalled
+    for i in range(max_send_queue_size + 1):
+        assert connection.send(f"message {i}")
+        await asyncio.sleep(0)
+
+    # The queue is full, so the client is cut off
+    assert not connection.send("one too many")
+    await asyncio.sleep(0)
+    assert not connection.is_open
+    assert websocket.sent_messages == []
+
+    await connection.close()
+    assert websocket.close_args is not None
+    assert websocket.close_args[0] == CloseCode.TRY_AGAIN_LATER
+
+
+async def test_send_fails() -> None:
+    websocket = MockWebSocket()
+
+    async def failing_send_text(message: str) -> None:
+        raise RuntimeError("connection lost")
+
+    websocket.send_text = failing_send_text  # type: ignore[method-assign]
+    connection = ClientConnection(websocket=websocket)  # type: ignore[arg-type]
+    assert connection.send("message")
+    await asyncio.wait_for(connection.write_task, timeout=1)
+    assert not connection.is_open
+    assert connection.close_code == CloseCode.ERROR
+
+
+async def test_coalesce() -> None:
+    websocket = MockWebSocket()
+    websocket.not_stalled_event.clear()
+    connection = ClientConnection(
+        websocket=websocket,  # type: ignore[arg-type]
+        max_send_queue_size=4,
+    )
+    # The writer task holds the first message while stalled
+    assert connection.send("first")
+    await asyncio.sleep(0)
+    assert connection.queue_depth == 0
+
+    # Many superseded messages do not fill the queue
+    for i in range(10):
+        assert connection.send(f"pick {i}", coalesce_key="pick")
+        assert connection.send(f"state {i}", coalesce_key="state")
+        if i == 5:
+            assert connection.send("problem")
+    assert connection.queue_depth == 3
+    assert connection.num_coalesced == 18
+    assert connection.max_queue_depth == 3
+
+    websocket.not_stalled_event.set()
+    await asyncio.sleep(0.01)
+    # Messages that were never superseded are all sent, and the latest
+    # of each coalesced message is sent after all messages queued earlier
+    assert websocket.sent_messages == ["first", "problem", "pick 9", "state 9"]
+    assert connection.queue_depth == 0
+    assert connection.num_sent == 4
+
+    # Once a message is sent, a new message with the same key is queued
+    assert connection.send("pick 10", coalesce_key="pick")
+    await asyncio.sleep(0.01)
+    assert websocket.sent_messages[-1] == "pick 10"
+    assert connection.num_coalesced == 18
+    await connection.close()
+
+
+async def test_coalesce_stalled_client() -> None:
+    # A stalled client that is only sent coalescible messages
+    # must not accumulate superseded messages
+    websocket = MockWebSocket()
+    websocket.not_stalled_event.clear()
+    connection = ClientConnection(
+        websocket=websocket,  # type: ignore[arg-type]
+        max_send_queue_size=10,
+    )
+    await asyncio.sleep(0)
+    for i in range(10_000):
+        assert connection.send(f"pick {i}", coalesce_key="pick")
+        assert connection.send(f"state {i}", coalesce_key="state")
+        assert connection.send_queue_length <= 2 * connection.queue_depth + 1
+    assert connection.is_open
+    assert connection.queue_depth <= 2
+    assert connection.send_queue_length <= 5
+
+    websocket.not_stalled_event.set()
+    await asyncio.sleep(0.01)
+    assert websocket.sent_messages[-2:] == ["pick 9999", "state 9999"]
+    assert connection.send_queue_length == 0
+    await connection.close()
@@ -0,0 +1,44 @@
+import dataclasses
+import json
+
+from seguin_loom_server import client_replies
+
+
+def test_reply_to_json() -> None:
+    for reply in (
+        client_replies.CommandProblem(
+            message='a "problem" — with non-ascii text',
+            severity=client_replies.MessageSeverityEnum.WARNING,
+        ),
+        client_replies.CurrentPickNumber(pick_number=0, repeat_number=1),
+        client_replies.CurrentPickNumber(pick_number=57, repeat_number=-3),
+        client_replies.LoomConnectionState(
+            state=client_replies.ConnectionStateEnum.CONNECTING, reason="why"
+        ),
+        client_replies.PatternNames(names=["a", "b", "c"]),
+        client_replies.PatternNames(names=[]),
+        client_replies.WeaveDirection(forward=True),
+        client_replies.WeaveDirection(forward=False),
+    ) + tuple(
+        client_replies.LoomState.from_state_word(state_word) for state_word in range(16)
+    ):
+        reply_json = client_replies.reply_to_json(reply)
+        expected_dict = dataclasses.asdict(reply)
+        assert json.loads(reply_json) == expected_dict
+        assert reply_json == json.dumps(
+            expected_dict, separators=(",", ":"), ensure_ascii=False
+        )
+
+
+def test_coalescible_reply_types() -> None:
+    for reply_class in (
+        client_replies.CurrentPickNumber,
+        client_replies.LoomConnectionState,
+        client_replies.LoomState,
+        client_replies.PatternNames,
+        client_replies.WeaveDirection,
+    ):
+        assert reply_class.__name__ in client_replies.COALESCIBLE_REPLY_TYPES
+    # These must never be dropped
+    for reply_type in ("CommandProblem", "ReducedPattern"):
+        assert reply_type not in client_replies.COALESCIBLE_REPLY_TYPES
@@ -0,0 +1,65 @@
+import math
+
+import pytest
+
+from seguin_loom_server.latency_stats import LatencyHistogram, LatencyStats
+
+
+def test_latency_histogram() -> None:
+    histogram = LatencyHistogram(
+        min_duration=1e-6, max_duration=1, buckets_per_decade=10
+    )
+    assert len(histogram.bucket_edges) == 61
+    assert histogram.bucket_edges[0] == pytest.approx(1e-6)
+    assert histogram.bucket_edges[-1] == pytest.approx(1)
+    assert histogram.count == 0
+    assert math.isnan(histogram.mean)
+    assert math.isnan(histogram.quantile(0.5))
+    assert histogram.as_dict() == dict(count=0)
+
+    # 90 durations of 10 µs, 9 of 1 ms, and 1 of 10 sec (overflow)
+    durations = [10e-6] * 90 + [1e-3] * 9 + [10]
+    for duration in durations:
+        histogram.record(duration)
+    assert histogram.count == len(durations)
+    assert histogram.sum == pytest.approx(sum(durations))
+    assert histogram.mean == pytest.approx(sum(durations) / len(durations))
+    assert histogram.min == 10e-6
+    assert histogram.max == 10
+    # Quantiles are accurate to one bucket width (a factor of 10**0.1)
+    assert histogram.quantile(0.5) == pytest.approx(10e-6, rel=0.26)
+    assert histogram.quantile(0.9) == pytest.approx(10e-6, rel=0.26)
+    assert histogram.quantile(0.95) == pytest.approx(1e-3, rel=0.26)
+    assert histogram.quantile(1) == 10
+
+    summary = histogram.as_dict()
+    assert summary["count"] == len(durations)
+    assert summary["p50"] == histogram.quantile(0.5)
+    assert summary["p99.9"] == 10
+    assert [count for _, count in summary["buckets"]] == [90, 9, 1]
+    assert summary["buckets"][-1][0] is None
+
+    histogram.reset()
+    assert histogram.count == 0
+    assert histogram.as_dict() == dict(count=0)
+
+
+def test_latency_stats() -> None:
+    names = ("a", "b")
+    stats = LatencyStats(names)
+    assert tuple(stats.histograms) == names
+    assert stats.count == 0
+    stats.record("a", 1e-3)
+    stats.record("a", 2e-3)
+    stats.record("b", 5e-3)
+    assert stats.count == 3
+    summary = stats.as_dict()
+    assert summary["a"]["count"] == 2
+    assert summary["b"]["count"] == 1
+    table_lines = stats.format_table().split("\n")
+    assert len(table_lines) == 3
+    assert table_lines[1].split()[0:2] == ["a", "2"]
+    with pytest.raises(KeyError):
+        stats.record("c", 1)
+    stats.reset()
+    assert stats.count == 0
@@ -0,0 +1,136 @@
+import random
+
+from seguin_loom_server import loom_protocol, mock_streams
+from seguin_loom_server.loom_constants import TERMINATOR
+
+REPLY_DATA = (
+    (b"=c0000002f", loom_protocol.ShaftsReply(shaft_word=0x2F)),
+    (b"=u0", loom_protocol.DirectionReply(weave_forward=True)),
+    (b"=u1", loom_protocol.DirectionReply(weave_forward=False)),
+    (b"=s5", loom_protocol.StateReply(state_word=0x5)),
+    (b" =s1d\n", loom_protocol.StateReply(state_word=0x1D)),
+    (b"=v001", loom_protocol.VersionReply(version="001")),
+    (b"", loom_protocol.InvalidMessage(message="", reason="less than 2 chars")),
+    (b"=", loom_protocol.InvalidMessage(message="=", reason="less than 2 chars")),
+    (b"xs1", loom_protocol.InvalidMessage(message="xs1", reason="no leading '='")),
+    (
+        b"=u2",
+        loom_protocol.InvalidMessage(message="=u2", reason="direction must be 0 or 1"),
+    ),
+    (
+        b"=sx",
+        loom_protocol.InvalidMessage(message="=sx", reason="data is not a hex value"),
+    ),
+)
+
+COMMAND_DATA = (
+    (b"=C0000ffff", loom_protocol.ShaftsCommand(shaft_word=0xFFFF)),
+    (b"=U0", loom_protocol.DirectionCommand(weave_forward=True)),
+    (b"=U1", loom_protocol.DirectionCommand(weave_forward=False)),
+    (b"=V", loom_protocol.VersionCommand()),
+    (b"=Q", loom_protocol.StateCommand()),
+    (b"=#n", loom_protocol.OobCommand(command="n")),
+)
+
+
+def parse_in_chunks(
+    parsers: dict, data: bytes, rng: random.Random
+) -> loom_protocol.LoomProtocol:
+    """Feed data to a new LoomProtocol in randomly sized chunks."""
+    protocol = loom_protocol.LoomProtocol(parsers)
+    i = 0
+    while i < len(data):
+        chunk_size = rng.randrange(1, 20)
+        protocol.data_received(data[i : i + chunk_size])
+        i += chunk_size
+    return protocol
+
+
+def test_parse_messages() -> None:
+    rng = random.Random(32)
+    for parsers, message_data in (
+        (loom_protocol.REPLY_PARSERS, REPLY_DATA),
+        (loom_protocol.COMMAND_PARSERS, COMMAND_DATA),
+    ):
+        expected_messages = [message for _, message in message_data] * 10
+        data = b"".join(raw + TERMINATOR for raw, _ in message_data) * 10
+
+        # All at once
+        protocol = loom_protocol.LoomProtocol(parsers)
+        protocol.data_received(data)
+        assert list(protocol.messages) == expected_messages
+        assert protocol.num_bytes == len(data)
+
+        # One byte at a time
+        protocol = loom_protocol.LoomProtocol(parsers)
+        for i in range(len(data)):
+            protocol.data_received(data[i : i + 1])
+        assert list(protocol.messages) == expected_messages
+
+        # In random chunks
+        for _ in range(5):
+            protocol = parse_in_chunks(parsers, data, rng)
+            assert list(protocol.messages) == expected_messages
+            num_invalid = sum(
+                isinstance(message, loom_protocol.InvalidMessage)
+                for message in expected_messages
+            )
+            assert protocol.num_invalid == num_invalid
+            assert protocol.num_messages == len(expected_messages) - num_invalid
+
+
+def test_ignored_and_invalid() -> None:
+    protocol = loom_protocol.LoomProtocol(
+        loom_protocol.REPLY_PARSERS, max_message_length=10
+    )
+    # Unknown codes are ignored
+    protocol.data_received(b"=z123\r=C0\r=s1\r")
+    assert list(protocol.messages) == [loom_protocol.StateReply(state_word=1)]
+    assert protocol.num_ignored == 2
+    protocol.messages.clear()
+
+    # Messages that are too long are discarded,
+    # whether or not the terminator has been seen
+    protocol.data_received(b"=s" + b"1" * 20 + b"\r=s2\r")
+    protocol.data_received(b"=s" + b"1" * 20)
+    protocol.data_received(b"\r=s4\r")
+    messages = list(protocol.messages)
+    assert len(messages) == 4
+    for i in (0, 2):
+        assert isinstance(messages[i], loom_protocol.InvalidMessage)
+        assert messages[i].reason == "too long"
+    assert messages[1] == loom_protocol.StateReply(state_word=2)
+    assert messages[3] == loom_protocol.StateReply(state_word=4)
+    protocol.messages.clear()
+
+    # Unterminated data is reported at end of file
+    protocol.data_received(b"=s1")
+    assert not protocol.messages
+    protocol.eof_received()
+    assert protocol.eof
+    assert list(protocol.messages) == [
+        loom_protocol.InvalidMessage(message="=s1", reason="no terminator")
+    ]
+
+
+async def test_read_messages() -> None:
+    writer = mock_streams.MockStreamWriter(terminator=TERMINATOR)
+    reader = writer.create_reader()
+    expected_messages = [message for _, message in REPLY_DATA]
+    for raw, _ in REPLY_DATA:
+        writer.write(raw + TERMINATOR)
+    await writer.drain()
+    writer.close()
+
+    protocol = loom_protocol.LoomProtocol(loom_protocol.REPLY_PARSERS)
+    chunks: list[bytes] = []
+    messages = [
+        message
+        async for message in loom_protocol.read_messages(
+            reader, protocol, read_size=7, data_callback=chunks.append
+        )
+    ]
+    assert messages == expected_messages
+    assert protocol.eof
+    assert b"".join(chunks) == b"".join(raw + TERMINATOR for raw, _ in REPLY_DATA)
+    assert max(len(chunk) for chunk in chunks) <= 7
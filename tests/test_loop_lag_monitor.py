@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from seguin_loom_server.loop_lag_monitor import LoopLagMonitor
+
+
+def block_event_loop(duration: float) -> None:
+    time.sleep(duration)
+
+
+async def blocking_task() -> None:
+    block_event_loop(0.3)
+
+
+async def test_loop_lag_monitor() -> None:
+    monitor = LoopLagMonitor(interval=0.01, slow_callback_threshold=0.1)
+    try:
+        # Callbacks that are not slow enough are not reported
+        await asyncio.sleep(0.05)
+        block_event_loop(0.01)
+        await asyncio.sleep(0.1)
+        assert monitor.num_slow_callbacks == 0
+        assert monitor.lag_histogram.count > 0
+
+        await asyncio.create_task(blocking_task(), name="blocker")
+        # Give the event loop time to run the watchdog's probe
+        await asyncio.sleep(0.05)
+        assert monitor.num_slow_callbacks == 1
+        slow_callback = monitor.slow_callbacks[0]
+        assert 0.15 < slow_callback.duration < 0.5
+        assert slow_callback.task_name == "blocker (blocking_task)"
+        assert "block_event_loop" in slow_callback.stack[-1]
+        assert "blocking_task" in slow_callback.stack[-2]
+        assert monitor.lag_histogram.max > 0.2
+
+        # A plain callback is not run in a task
+        asyncio.get_running_loop().call_soon(block_event_loop, 0.3)
+        await asyncio.sleep(0.05)
+        assert monitor.num_slow_callbacks == 2
+        assert monitor.slow_callbacks[1].task_name is None
+
+        summary = monitor.as_dict()
+        assert summary["lag"]["count"] == monitor.lag_histogram.count
+        assert summary["slow_callback_threshold"] == 0.1
+        assert summary["num_slow_callbacks"] == 2
+        # Newest first
+        assert [item["task_name"] for item in summary["slow_callbacks"]] == [
+            None,
+            "blocker (blocking_task)",
+        ]
+    finally:
+        await monitor.close()
+
+
+async def test_max_slow_callbacks() -> None:
+    monitor = LoopLagMonitor(slow_callback_threshold=0.04, max_slow_callbacks=2)
+    try:
+        for _ in range(3):
+            block_event_loop(0.1)
+            await asyncio.sleep(0.05)
+        assert monitor.num_slow_callbacks == 3
+        assert len(monitor.slow_callbacks) == 2
+    finally:
+        await monitor.close()
+    assert not monitor._watchdog_thread.is_alive()
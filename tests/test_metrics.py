@@ -0,0 +1,48 @@
+import pytest
+
+from seguin_loom_server.latency_stats import LatencyHistogram
+from seguin_loom_server.metrics import MetricsWriter
+
+
+def test_metrics_writer() -> None:
+    writer = MetricsWriter(prefix="test_")
+    writer.add_counter("things_total", "Number of things.", 3, dict(loom="1"))
+    writer.add_gauge("level", "A level.", 0.5)
+    writer.add_counter("things_total", "Number of things.", 4, dict(loom='a"b\\c'))
+    writer.add_summary("size_bytes", "Sizes.", count=2, sum=10, labels=dict(loom="1"))
+    histogram = LatencyHistogram(
+        min_duration=0.1, max_duration=10, buckets_per_decade=1
+    )
+    for duration in (0.05, 0.5, 5, 50):
+        histogram.record(duration)
+    writer.add_histogram("duration_seconds", "Durations.", histogram)
+    text = writer.render()
+    assert text.endswith("\n")
+    assert text.split("\n")[:-1] == [
+        "# HELP test_things_total Number of things.",
+        "# TYPE test_things_total counter",
+        'test_things_total{loom="1"} 3',
+        'test_things_total{loom="a\\"b\\\\c"} 4',
+        "# HELP test_level A level.",
+        "# TYPE test_level gauge",
+        "test_level 0.5",
+        "# HELP test_size_bytes Sizes.",
+        "# TYPE test_size_bytes summary",
+        'test_size_bytes_sum{loom="1"} 10',
+        'test_size_bytes_count{loom="1"} 2',
+        "# HELP test_duration_seconds Durations.",
+        "# TYPE test_duration_seconds histogram",
+        'test_duration_seconds_bucket{le="0.1"} 1',
+        'test_duration_seconds_bucket{le="1"} 2',
+        'test_duration_seconds_bucket{le="10"} 3',
+        'test_duration_seconds_bucket{le="+Inf"} 4',
+        "test_duration_seconds_sum 55.55",
+        "test_duration_seconds_count 4",
+    ]
+
+
+def test_metrics_writer_type_mismatch() -> None:
+    writer = MetricsWriter()
+    writer.add_counter("things_total", "Number of things.", 3)
+    with pytest.raises(ValueError):
+        writer.add_gauge("things_total", "Number of things.", 3)
@@ -1,8 +1,26 @@
 import asyncio
 import contextlib
+import math
+import pathlib
+import tempfile
+import time
+
+import pytest
 
 from seguin_loom_server.loom_constants import TERMINATOR
-from seguin_loom_server.mock_loom import MockLoom, StreamReaderType, StreamWriterType
+from seguin_loom_server.loom_server import LoomServer
+from seguin_loom_server.mock_loom import (
+    MockLoom,
+    MockLoomTiming,
+    StreamReaderType,
+    StreamWriterType,
+)
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+datadir = pathlib.Path(__file__).parent / "data"
 
 
 @contextlib.asynccontextmanager
@@ -109,3 +127,96 @@ async def test_oob_quit() -> None:
             await loom.done_task
         assert loom.reply_writer.is_closing()
         assert loom.command_reader.at_eof()
+
+
+async def test_timing() -> None:
+    timing = MockLoomTiming(byte_duration=0.001, shed_open_duration=0.05)
+    async with MockLoom(verbose=False, timing=timing) as loom:
+        reader, writer = await loom.open_client_connection()
+        for expected_reply in (b"=s1\r", b"=u0\r", b"=c00000000\r"):
+            reply = await read_reply(reader)
+            assert reply == expected_reply
+
+        command = b"=C00000003\r"
+        t0 = time.monotonic()
+        await write_command(writer, command)
+        reply = await read_reply(reader)
+        assert reply == b"=c00000003\r"
+        min_duration = (
+            len(command) + len(reply)
+        ) * timing.byte_duration + timing.shed_open_duration
+        assert time.monotonic() - t0 >= min_duration
+
+
+async def test_auto_weave() -> None:
+    timing = MockLoomTiming(
+        byte_duration=0,
+        shed_open_duration=0.01,
+        shed_close_duration=0.01,
+        auto_weave_rate=600,
+        pick_request_timeout=0.05,
+    )
+    async with MockLoom(verbose=False, timing=timing) as loom:
+        reader, writer = await loom.open_client_connection()
+        for expected_reply in (b"=s1\r", b"=u0\r", b"=c00000000\r"):
+            reply = await read_reply(reader)
+            assert reply == expected_reply
+
+        # Act as the server: reply to each pick request with a =C command
+        t0 = time.monotonic()
+        for i in range(1, 5):
+            reply = await read_reply(reader)
+            assert reply == b"=s5\r"
+            await write_command(writer, f"=C{i:08x}\r".encode())
+            reply = await read_reply(reader)
+            assert reply == f"=c{i:08x}\r".encode()
+        # 0.1 seconds per pick at 600 picks/minute
+        assert time.monotonic() - t0 >= 0.3
+        assert loom.num_picks_woven >= 3
+        assert loom.pick_request_latency.count == 4
+
+        # If the server does not reply, the loom requests the pick again
+        reply = await read_reply(reader)
+        assert reply == b"=s5\r"
+        reply = await read_reply(reader)
+        assert reply == b"=s5\r"
+
+
+def test_timing_invalid_rate() -> None:
+    for invalid_rate in (0, -1):
+        with pytest.raises(ValueError):
+            MockLoomTiming(auto_weave_rate=invalid_rate)
+
+
+async def test_auto_weave_with_server() -> None:
+    timing = MockLoomTiming(
+        byte_duration=0.0001,
+        shed_open_duration=0.001,
+        shed_close_duration=0.001,
+        auto_weave_rate=math.inf,
+        pick_request_timeout=0.05,
+    )
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+            mock_loom_timing=timing,
+        ) as server:
+            await server.add_pattern(pattern)
+            await server.select_pattern(pattern.name)
+            mock_loom = server.mock_loom
+            assert mock_loom is not None
+            assert mock_loom.timing == timing
+            # The server records the shaft echo latency after the mock loom
+            # reports the shafts, so wait for that too
+            shaft_echo_latency = server.latency_stats.histograms["shaft_echo"]
+            async with asyncio.timeout(2):
+                while mock_loom.num_picks_woven < 20 or shaft_echo_latency.count < 20:
+                    await asyncio.sleep(0.01)
+            assert server.num_picks_commanded >= 20
@@ -1,4 +1,5 @@
 import asyncio
+import time
 
 import pytest
 
@@ -144,3 +145,78 @@ class StreamClosedWatcher:
     async def do_wait_closed(self) -> None:
         await self.writer.wait_closed()
         self.wait_done = True
+
+
+async def test_read() -> None:
+    sibling_writer = mock_streams.MockStreamWriter(terminator=b"\r")
+    reader = sibling_writer.create_reader()
+    data_list = [data + b"\r" for data in TEST_BYTES]
+    for data in data_list:
+        sibling_writer.write(data)
+    await sibling_writer.drain()
+
+    # Read some data, splitting a message
+    nbytes = len(data_list[0]) + 3
+    all_data = b"".join(data_list)
+    read_data = await reader.read(nbytes)
+    assert read_data == all_data[:nbytes]
+    # Read the rest
+    read_data = await reader.read()
+    assert read_data == all_data[nbytes:]
+    assert len(reader.sd.queue) == 0
+
+    # read waits for data
+    read_task = asyncio.create_task(reader.read(100))
+    await asyncio.sleep(0)
+    assert not read_task.done()
+    sibling_writer.write(data_list[0])
+    await sibling_writer.drain()
+    assert await read_task == data_list[0]
+
+    # read returns b"" at end of file
+    sibling_writer.close()
+    assert await reader.read() == b""
+    assert reader.at_eof()
+
+
+async def test_byte_duration() -> None:
+    byte_duration = 0.002
+    reader, writer = mock_streams.open_mock_connection(byte_duration=byte_duration)
+    reply_reader = writer.create_reader()
+    command_writer = reader.create_writer()
+    for test_reader, test_writer in (
+        (reply_reader, writer),
+        (reader, command_writer),
+    ):
+        data_list = list(data_iterator(terminator=b"\n"))
+        t0 = time.monotonic()
+        for data in data_list:
+            test_writer.write(data)
+        await test_writer.drain()
+        for i, data in enumerate(data_list):
+            read_data = await test_reader.readline()
+            assert read_data == data
+            # Data is readable once all of it has been transmitted
+            nbytes = sum(len(data) for data in data_list[: i + 1])
+            assert time.monotonic() - t0 >= nbytes * byte_duration
+
+    # read only returns data that has been transmitted
+    writer.write(b"a\n")
+    writer.write(b"bc\n")
+    await writer.drain()
+    assert await reply_reader.read() == b"a\n"
+    assert await reply_reader.read() == b"bc\n"
+
+
+async def test_close_wakes_reader() -> None:
+    for use_sibling in (False, True):
+        reader, writer = mock_streams.open_mock_connection()
+        # Closing the writer also closes its sibling: the reader
+        test_reader = reader if use_sibling else writer.create_reader()
+        read_task = asyncio.create_task(test_reader.read())
+        await asyncio.sleep(0)
+        assert not read_task.done()
+        writer.close()
+        async with asyncio.timeout(1):
+            assert await read_task == b""
+        assert test_reader.at_eof()
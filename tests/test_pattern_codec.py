@@ -0,0 +1,105 @@
+import dataclasses
+import json
+import pathlib
+import zlib
+
+import pytest
+
+from seguin_loom_server.pattern_codec import (
+    FORMAT_VERSION,
+    decode_pattern,
+    encode_pattern,
+)
+from seguin_loom_server.reduced_pattern import (
+    Pick,
+    ReducedPattern,
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+datadir = pathlib.Path(__file__).parent / "data"
+
+all_pattern_paths = list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx"))
+
+
+def read_reduced_pattern(path: pathlib.Path) -> ReducedPattern:
+    full_pattern = read_full_pattern(path)
+    return reduced_pattern_from_pattern_data(name=path.name, data=full_pattern)
+
+
+def test_round_trip() -> None:
+    for path in all_pattern_paths:
+        pattern = read_reduced_pattern(path)
+        # pick_number and repeat_number are not encoded
+        pattern.pick_number = 5
+        pattern.repeat_number = 3
+        json_size = len(json.dumps(dataclasses.asdict(pattern)))
+        for compress in (False, True):
+            data = encode_pattern(pattern, compress=compress)
+            assert data.startswith(b"SLRP")
+            assert data[4] == FORMAT_VERSION
+            assert len(data) < json_size
+
+            decoded_pattern = decode_pattern(data, name="new name")
+            assert decoded_pattern.name == "new name"
+            assert decoded_pattern.pick_number == 0
+            assert decoded_pattern.repeat_number == 1
+            decoded_pattern.name = pattern.name
+            decoded_pattern.pick_number = pattern.pick_number
+            decoded_pattern.repeat_number = pattern.repeat_number
+            assert decoded_pattern == pattern
+
+            # Identical picks are shared
+            assert len({id(pick) for pick in decoded_pattern.picks}) == len(
+                set(decoded_pattern.picks)
+            )
+
+
+def test_value_ranges() -> None:
+    # Negative threading values, large colors, and 32 shafts
+    pattern = ReducedPattern(
+        name="ranges",
+        color_table=["#ffffff", "#000000", "red"],
+        warp_colors=[0, 300, 2],
+        threading=[-1, 0, 31],
+        picks=[
+            Pick(color=0, shaft_word=0xFFFFFFFF, num_shafts=32),
+            Pick(color=70000, shaft_word=0x1, num_shafts=32),
+        ],
+    )
+    decoded_pattern = decode_pattern(encode_pattern(pattern), name=pattern.name)
+    assert decoded_pattern == pattern
+
+    empty_pattern = ReducedPattern(
+        name="empty", color_table=[], warp_colors=[], threading=[], picks=[]
+    )
+    decoded_pattern = decode_pattern(
+        encode_pattern(empty_pattern), name=empty_pattern.name
+    )
+    assert decoded_pattern == empty_pattern
+
+
+def test_encode_errors() -> None:
+    pattern = read_reduced_pattern(all_pattern_paths[0])
+    pattern.picks = pattern.picks + [Pick(color=0, shaft_word=1, num_shafts=40)]
+    with pytest.raises(ValueError):
+        encode_pattern(pattern)
+
+
+def test_decode_errors() -> None:
+    pattern = read_reduced_pattern(all_pattern_paths[0])
+    data = encode_pattern(pattern, compress=False)
+    compressed_data = encode_pattern(pattern, compress=True)
+    for bad_data in (
+        b"",
+        data[0:5],
+        b"XXXX" + data[4:],
+        data[0:4] + bytes([FORMAT_VERSION + 1]) + data[5:],
+        data[:-1],
+        data + b"\0",
+        data[0:6] + b"\xff\xff\xff\xff" + data[10:],
+        compressed_data[0:6] + zlib.compress(b"not a pattern"),
+        compressed_data[0:-3],
+    ):
+        with pytest.raises(ValueError):
+            decode_pattern(bad_data, name=pattern.name)
@@ -1,10 +1,20 @@
+import asyncio
+import dataclasses
+import json
 import pathlib
+import sqlite3
 import tempfile
 import time
 
 import pytest
 
-from seguin_loom_server.pattern_database import create_pattern_database
+from seguin_loom_server.pattern_database import (
+    DATABASE_VERSION,
+    PatternDatabase,
+    compute_file_digest,
+    create_pattern_database,
+    estimate_pattern_nbytes,
+)
 from seguin_loom_server.reduced_pattern import (
     ReducedPattern,
     read_full_pattern,
@@ -24,146 +34,551 @@ def read_reduced_pattern(path: pathlib.Path) -> ReducedPattern:
 async def test_add_and_get_pattern() -> None:
     with tempfile.NamedTemporaryFile() as f:
         dbpath = pathlib.Path(f.name)
-        db = await create_pattern_database(dbpath)
-
-        assert len(all_pattern_paths) > 4
-        patternpath1 = all_pattern_paths[-2]
-        patternpath2 = all_pattern_paths[1]
+        async with await create_pattern_database(dbpath) as db:
+            assert len(all_pattern_paths) > 4
+            patternpath1 = all_pattern_paths[-2]
+            patternpath2 = all_pattern_paths[1]
 
-        pattern1 = read_reduced_pattern(patternpath1)
+            pattern1 = read_reduced_pattern(patternpath1)
 
-        # Check that adding a pattern ignores pick_number and repeat_number
-        pattern1.pick_number = 20
-        pattern1.repeat_number = 30
-        await db.add_pattern(pattern1)
-        pattern_names = await db.get_pattern_names()
-        assert pattern_names == [pattern1.name]
-        returned_pattern1 = await db.get_pattern(pattern1.name)
-        assert returned_pattern1.pick_number == 0
-        assert returned_pattern1.repeat_number == 1
-
-        # Check that the read pattern matches,
-        # other than pick_number and repeat_number
-        pattern1.pick_number = 0
-        pattern1.repeat_number = 1
-        assert pattern1 == returned_pattern1
-
-        # Adding another pattern puts it to the end of the name list
-        pattern2 = read_reduced_pattern(patternpath2)
-        await db.add_pattern(pattern2)
-        names = await db.get_pattern_names()
-        assert names == [pattern1.name, pattern2.name]
-
-        # Re-adding a pattern that is already present moves it
-        # to the end of the name list
-        await db.add_pattern(pattern1)
-        names = await db.get_pattern_names()
-        assert names == [pattern2.name, pattern1.name]
-
-        # Cannot get a pattern that does not exist
-        with pytest.raises(LookupError):
-            await db.get_pattern("no such pattern")
-
-        # Test purging old patterns while adding new ones
-        patternpath3 = all_pattern_paths[0]
-        pattern3 = read_reduced_pattern(patternpath3)
-        await db.add_pattern(pattern3, max_entries=2)
-        pattern_names = await db.get_pattern_names()
-        assert pattern_names == [pattern1.name, pattern3.name]
+            # Check that adding a pattern ignores pick_number and repeat_number
+            pattern1.pick_number = 20
+            pattern1.repeat_number = 30
+            await db.add_pattern(pattern1)
+            pattern_names = await db.get_pattern_names()
+            assert pattern_names == [pattern1.name]
+            returned_pattern1 = await db.get_pattern(pattern1.name)
+            assert returned_pattern1.pick_number == 0
+            assert returned_pattern1.repeat_number == 1
+
+            # Check that the read pattern matches,
+            # other than pick_number and repeat_number
+            pattern1.pick_number = 0
+            pattern1.repeat_number = 1
+            assert pattern1 == returned_pattern1
+
+            # Adding another pattern puts it to the end of the name list
+            pattern2 = read_reduced_pattern(patternpath2)
+            await db.add_pattern(pattern2)
+            names = await db.get_pattern_names()
+            assert names == [pattern1.name, pattern2.name]
+
+            # Re-adding a pattern that is already present moves it
+            # to the end of the name list
+            await db.add_pattern(pattern1)
+            names = await db.get_pattern_names()
+            assert names == [pattern2.name, pattern1.name]
+
+            # Cannot get a pattern that does not exist
+            with pytest.raises(LookupError):
+                await db.get_pattern("no such pattern")
+
+            # Test purging old patterns while adding new ones
+            patternpath3 = all_pattern_paths[0]
+            pattern3 = read_reduced_pattern(patternpath3)
+            await db.add_pattern(pattern3, max_entries=2)
+            pattern_names = await db.get_pattern_names()
+            assert pattern_names == [pattern1.name, pattern3.name]
 
-        # Adding pattern 3 again has no effect on what is purged
-        # because pattern 3 is first deleted, then re-added
-        patternpath3 = all_pattern_paths[0]
-        pattern3 = read_reduced_pattern(patternpath3)
-        await db.add_pattern(pattern3, max_entries=2)
-        pattern_names = await db.get_pattern_names()
-        assert pattern_names == [pattern1.name, pattern3.name]
+            # Adding pattern 3 again has no effect on what is purged
+            # because pattern 3 is first deleted, then re-added
+            patternpath3 = all_pattern_paths[0]
+            pattern3 = read_reduced_pattern(patternpath3)
+            await db.add_pattern(pattern3, max_entries=2)
+            pattern_names = await db.get_pattern_names()
+            assert pattern_names == [pattern1.name, pattern3.name]
 
-        # Update the timestamp for pattern 1, then add pattern 2 again.
-        # This should purge pattern 3.
-        # Also confirm that max_entries = 1 is changed to 2.
-        await db.set_timestamp(pattern1.name, timestamp=time.time())
-        await db.add_pattern(pattern2, max_entries=1)
-        pattern_names = await db.get_pattern_names()
-        assert pattern_names == [pattern1.name, pattern2.name]
+            # Update the timestamp for pattern 1, then add pattern 2 again.
+            # This should purge pattern 3.
+            # Also confirm that max_entries = 1 is changed to 2.
+            await db.set_timestamp(pattern1.name, timestamp=time.time())
+            await db.add_pattern(pattern2, max_entries=1)
+            pattern_names = await db.get_pattern_names()
+            assert pattern_names == [pattern1.name, pattern2.name]
 
 
 async def test_clear_database() -> None:
     with tempfile.NamedTemporaryFile() as f:
         dbpath = pathlib.Path(f.name)
-        db = await create_pattern_database(dbpath)
+        async with await create_pattern_database(dbpath) as db:
+            num_to_add = 3
+            for patternpath in all_pattern_paths[0:num_to_add]:
+                pattern = read_reduced_pattern(patternpath)
+                await db.add_pattern(pattern)
+                pattern_names = await db.get_pattern_names()
 
-        num_to_add = 3
-        for patternpath in all_pattern_paths[0:num_to_add]:
-            pattern = read_reduced_pattern(patternpath)
-            await db.add_pattern(pattern)
-            pattern_names = await db.get_pattern_names()
+            expected_pattern_names = [
+                patternpath.name for patternpath in all_pattern_paths[0:num_to_add]
+            ]
+            assert pattern_names == expected_pattern_names
 
-        expected_pattern_names = [
-            patternpath.name for patternpath in all_pattern_paths[0:num_to_add]
-        ]
-        assert pattern_names == expected_pattern_names
-
-        await db.clear_database()
-        pattern_names_after_clear = await db.get_pattern_names()
-        assert pattern_names_after_clear == []
+            await db.clear_database()
+            pattern_names_after_clear = await db.get_pattern_names()
+            assert pattern_names_after_clear == []
 
 
 async def test_create_database() -> None:
     with tempfile.NamedTemporaryFile() as f:
         dbpath = pathlib.Path(f.name)
-        db = await create_pattern_database(dbpath)
-        initial_pattern_names = await db.get_pattern_names()
-        assert initial_pattern_names == []
+        async with await create_pattern_database(dbpath) as db:
+            initial_pattern_names = await db.get_pattern_names()
+            assert initial_pattern_names == []
 
-        num_to_add = 3
-        for patternpath in all_pattern_paths[0:num_to_add]:
-            pattern = read_reduced_pattern(patternpath)
-            await db.add_pattern(pattern)
-            pattern_names = await db.get_pattern_names()
+            num_to_add = 3
+            for patternpath in all_pattern_paths[0:num_to_add]:
+                pattern = read_reduced_pattern(patternpath)
+                await db.add_pattern(pattern)
+                pattern_names = await db.get_pattern_names()
 
-        expected_pattern_names = [
-            patternpath.name for patternpath in all_pattern_paths[0:num_to_add]
-        ]
-        assert pattern_names == expected_pattern_names
+            expected_pattern_names = [
+                patternpath.name for patternpath in all_pattern_paths[0:num_to_add]
+            ]
+            assert pattern_names == expected_pattern_names
 
         # Test that a re-created database has the saved information
-        dbpath = pathlib.Path(f.name)
-        db = await create_pattern_database(dbpath)
-        initial_pattern_names = await db.get_pattern_names()
-        assert initial_pattern_names == expected_pattern_names
+        async with await create_pattern_database(dbpath) as db:
+            initial_pattern_names = await db.get_pattern_names()
+            assert initial_pattern_names == expected_pattern_names
 
 
 async def test_update_pick() -> None:
     with tempfile.NamedTemporaryFile() as f:
         dbpath = pathlib.Path(f.name)
-        db = await create_pattern_database(dbpath)
-        initial_pattern_names = await db.get_pattern_names()
-        assert initial_pattern_names == []
+        async with await create_pattern_database(dbpath) as db:
+            initial_pattern_names = await db.get_pattern_names()
+            assert initial_pattern_names == []
+
+            num_to_add = 3
+            for patternpath in all_pattern_paths[0:num_to_add]:
+                pattern = read_reduced_pattern(patternpath)
+                await db.add_pattern(pattern)
+                pattern_names = await db.get_pattern_names()
+
+            expected_pattern_names = [
+                patternpath.name for patternpath in all_pattern_paths[0:num_to_add]
+            ]
+            assert pattern_names == expected_pattern_names
+
+            for pattern_name, pick_number, repeat_number in (
+                (pattern_names[0], 50, -5),
+                (pattern_names[1], 3, 49),
+                (pattern_names[0], 0, 1),
+                (pattern_names[2], 15, 101),
+            ):
+                await db.update_pick_number(
+                    pattern_name=pattern_name,
+                    pick_number=pick_number,
+                    repeat_number=repeat_number,
+                )
+                pattern = await db.get_pattern(pattern_name)
+                assert pattern.name == pattern_name
+                assert pattern.pick_number == pick_number
+                assert pattern.repeat_number == repeat_number
+
+
+async def test_concurrent_transactions(monkeypatch: pytest.MonkeyPatch) -> None:
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:2]]
+            await db.add_pattern(patterns[0])
+
+            # Log the data modification statements and commits
+            log: list[str] = []
+            execute = db.db.execute
+            commit = db.db.commit
+
+            def logging_execute(sql: str, *args):  # type: ignore
+                if not sql.startswith("select"):
+                    log.append(sql)
+                return execute(sql, *args)
+
+            def logging_commit():  # type: ignore
+                log.append("commit")
+                return commit()
+
+            monkeypatch.setattr(db.db, "execute", logging_execute)
+            monkeypatch.setattr(db.db, "commit", logging_commit)
+
+            await asyncio.gather(
+                db.add_pattern(patterns[1], file_digest="a digest"),
+                db.update_pick_number(
+                    pattern_name=patterns[0].name, pick_number=3, repeat_number=2
+                ),
+                db.add_pattern_from_parse_cache(
+                    file_digest="a digest", pattern_name="copy"
+                ),
+            )
+            # Each transaction must be committed as a whole,
+            # without statements from another operation
+            transactions = "\n".join(log).split("\ncommit")
+            assert transactions[-1] == ""
+            transactions = [transaction.strip() for transaction in transactions[:-1]]
+            assert len(transactions) == 3
+            assert transactions[0].startswith("delete from patterns")
+            assert "insert or replace into parse_cache" in transactions[0]
+            assert "update patterns" not in transactions[0]
+            assert transactions[1].startswith("update patterns")
+            assert transactions[1].count("\n") == 0
+            assert transactions[2].startswith("update parse_cache")
+            assert "update patterns" not in transactions[2]
+            assert set(await db.get_pattern_names()) == {
+                patterns[0].name,
+                patterns[1].name,
+                "copy",
+            }
+
+
+async def test_parse_cache() -> None:
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            db.max_parse_cache_entries = 2
+            patternpath1, patternpath2, patternpath3 = all_pattern_paths[0:3]
+            digests = []
+            for patternpath in (patternpath1, patternpath2, patternpath3):
+                with open(patternpath, "r") as patternfile:
+                    data = patternfile.read()
+                digest = compute_file_digest(filename=patternpath.name, data=data)
+                # The file type is part of the digest
+                assert digest != compute_file_digest(filename="name.other", data=data)
+                assert digest == compute_file_digest(
+                    filename="other" + patternpath.suffix.upper(), data=data
+                )
+                digests.append(digest)
+            digest1, digest2, digest3 = digests
+
+            pattern1 = read_reduced_pattern(patternpath1)
+            assert not await db.is_in_parse_cache(digest1)
+            assert not await db.add_pattern_from_parse_cache(
+                file_digest=digest1, pattern_name="copy1"
+            )
+            # A miss does not leave a transaction open
+            assert not db.db.in_transaction
+            await db.add_pattern(pattern1, file_digest=digest1)
+            assert await db.is_in_parse_cache(digest1)
+
+            # Add the cached pattern under a new name
+            assert await db.add_pattern_from_parse_cache(
+                file_digest=digest1, pattern_name="copy1"
+            )
+            assert db.num_parse_cache_hits == 1
+            assert await db.get_pattern_names() == [pattern1.name, "copy1"]
+            copied_pattern = await db.get_pattern("copy1")
+            assert copied_pattern.name == "copy1"
+            copied_pattern.name = pattern1.name
+            assert copied_pattern == pattern1
+
+            # Clearing the database does not clear the parse cache
+            await db.clear_database()
+            assert await db.get_pattern_names() == []
+            assert await db.is_in_parse_cache(digest1)
+
+            # Purge the least recently used entries
+            await db.add_pattern(
+                read_reduced_pattern(patternpath2), file_digest=digest2
+            )
+            assert await db.add_pattern_from_parse_cache(
+                file_digest=digest1, pattern_name="copy1"
+            )
+            await db.add_pattern(
+                read_reduced_pattern(patternpath3), file_digest=digest3
+            )
+            assert await db.is_in_parse_cache(digest1)
+            assert not await db.is_in_parse_cache(digest2)
+            assert await db.is_in_parse_cache(digest3)
+
+        # The parse cache survives re-opening the database
+        async with await create_pattern_database(dbpath) as db:
+            assert await db.is_in_parse_cache(digest1)
+            assert await db.is_in_parse_cache(digest3)
 
-        num_to_add = 3
-        for patternpath in all_pattern_paths[0:num_to_add]:
-            pattern = read_reduced_pattern(patternpath)
-            await db.add_pattern(pattern)
-            pattern_names = await db.get_pattern_names()
 
-        expected_pattern_names = [
-            patternpath.name for patternpath in all_pattern_paths[0:num_to_add]
-        ]
-        assert pattern_names == expected_pattern_names
-
-        for pattern_name, pick_number, repeat_number in (
-            (pattern_names[0], 50, -5),
-            (pattern_names[1], 3, 49),
-            (pattern_names[0], 0, 1),
-            (pattern_names[2], 15, 101),
-        ):
+async def test_pattern_cache() -> None:
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:3]]
+            for pattern in patterns:
+                await db.add_pattern(pattern)
+            assert db.pattern_cache_nbytes == 0
+
+            # The first get is a miss; later gets are hits
+            for i in range(3):
+                returned_patterns = [
+                    await db.get_pattern(pattern.name) for pattern in patterns
+                ]
+                assert returned_patterns == patterns
+            assert db.num_pattern_cache_misses == len(patterns)
+            assert db.num_pattern_cache_hits == 2 * len(patterns)
+            nbytes_list = [
+                estimate_pattern_nbytes(pattern) for pattern in returned_patterns
+            ]
+            assert db.pattern_cache_nbytes == sum(nbytes_list)
+
+            # Changing a returned pattern's position does not change the cache
+            pattern_name = patterns[0].name
+            returned_pattern = await db.get_pattern(pattern_name)
+            returned_pattern.pick_number = 5
+            returned_pattern.repeat_number = 7
+            cached_pattern = await db.get_pattern(pattern_name)
+            assert cached_pattern is not returned_pattern
+            assert cached_pattern.pick_number == 0
+            assert cached_pattern.repeat_number == 1
+
+            # update_pick_number updates the cache
+            num_misses = db.num_pattern_cache_misses
             await db.update_pick_number(
-                pattern_name=pattern_name,
-                pick_number=pick_number,
-                repeat_number=repeat_number,
+                pattern_name=pattern_name, pick_number=5, repeat_number=7
+            )
+            cached_pattern = await db.get_pattern(pattern_name)
+            assert cached_pattern.pick_number == 5
+            assert cached_pattern.repeat_number == 7
+            assert db.num_pattern_cache_misses == num_misses
+
+            # Adding a pattern evicts the old version from the cache
+            await db.add_pattern(patterns[0])
+            returned_pattern = await db.get_pattern(pattern_name)
+            assert returned_pattern.pick_number == 0
+            assert returned_pattern.repeat_number == 1
+            assert db.num_pattern_cache_misses == num_misses + 1
+
+            # Purging patterns evicts them from the cache
+            await db.add_pattern(patterns[1], max_entries=2)
+            assert await db.get_pattern_names() == [patterns[0].name, patterns[1].name]
+            with pytest.raises(LookupError):
+                await db.get_pattern(patterns[2].name)
+
+            # Clearing the database clears the cache
+            await db.clear_database()
+            assert db.pattern_cache_nbytes == 0
+            with pytest.raises(LookupError):
+                await db.get_pattern(pattern_name)
+
+            # The least recently used patterns are evicted
+            # to stay within max_pattern_cache_nbytes
+            for pattern in patterns:
+                await db.add_pattern(pattern)
+            db.max_pattern_cache_nbytes = nbytes_list[1] + nbytes_list[2]
+            for pattern in patterns:
+                await db.get_pattern(pattern.name)
+            assert db.pattern_cache_nbytes <= db.max_pattern_cache_nbytes
+            num_misses = db.num_pattern_cache_misses
+            await db.get_pattern(patterns[2].name)
+            assert db.num_pattern_cache_misses == num_misses
+            await db.get_pattern(patterns[0].name)
+            assert db.num_pattern_cache_misses == num_misses + 1
+
+            # A pattern too large for the cache is not cached
+            db.max_pattern_cache_nbytes = 0
+            await db.get_pattern(patterns[1].name)
+            await db.get_pattern(patterns[1].name)
+            assert db.num_pattern_cache_misses == num_misses + 3
+
+
+async def test_pattern_cache_shares_encodings(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    num_encodes = 0
+    make_static_json = ReducedPattern._make_static_json
+
+    def counting_make_static_json(self: ReducedPattern) -> str:
+        nonlocal num_encodes
+        num_encodes += 1
+        return make_static_json(self)
+
+    monkeypatch.setattr(ReducedPattern, "_make_static_json", counting_make_static_json)
+
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            pattern = read_reduced_pattern(all_pattern_paths[0])
+            await db.add_pattern(pattern)
+            num_encodes = 0
+
+            # The pattern is encoded once, when it is cached,
+            # and the copies returned by get_pattern share the encoding
+            # and loom commands, even if their position changes
+            returned_patterns = []
+            for i in range(3):
+                returned_pattern = await db.get_pattern(pattern.name)
+                returned_pattern.pick_number = i + 1
+                assert json.loads(returned_pattern.to_json())["pick_number"] == i + 1
+                returned_patterns.append(returned_pattern)
+            assert num_encodes == 1
+            assert db.num_pattern_cache_misses == 1
+            pick_commands = returned_patterns[0]._pick_commands
+            assert pick_commands is not None
+            for returned_pattern in returned_patterns[1:]:
+                assert returned_pattern._pick_commands is pick_commands
+                assert returned_pattern._static_json is (
+                    returned_patterns[0]._static_json
+                )
+
+            # The cache size includes the encodings
+            assert db.pattern_cache_nbytes == estimate_pattern_nbytes(
+                returned_patterns[0]
             )
-            pattern = await db.get_pattern(pattern_name)
-            assert pattern.name == pattern_name
-            assert pattern.pick_number == pick_number
-            assert pattern.repeat_number == repeat_number
+            assert db.pattern_cache_nbytes > estimate_pattern_nbytes(pattern)
+
+
+def create_json_database(dbpath: pathlib.Path, patterns: list[ReducedPattern]) -> None:
+    """Make a database in the old format: user_version 0 and JSON patterns.
+
+    Pattern i has pick number i + 1 and repeat number i + 2.
+    Also add an unreadable pattern, and patterns[0] to the parse cache
+    with digest "a digest".
+    """
+    with sqlite3.connect(dbpath) as connection:
+        connection.execute(
+            "create table patterns (id integer primary key, pattern_name text, "
+            "pattern_json text, pick_number integer, repeat_number integer, "
+            "timestamp_sec real)"
+        )
+        connection.execute(
+            "create table parse_cache (file_digest text primary key, "
+            "pattern_json text, timestamp_sec real)"
+        )
+        for i, pattern in enumerate(patterns):
+            pattern_json = json.dumps(dataclasses.asdict(pattern))
+            connection.execute(
+                "insert into patterns (pattern_name, pattern_json, pick_number, "
+                "repeat_number, timestamp_sec) values (?, ?, ?, ?, ?)",
+                (pattern.name, pattern_json, i + 1, i + 2, time.time()),
+            )
+        connection.execute(
+            "insert into patterns (pattern_name, pattern_json, pick_number, "
+            "repeat_number, timestamp_sec) values (?, ?, ?, ?, ?)",
+            ("unreadable", "not json", 0, 1, time.time()),
+        )
+        connection.execute(
+            "insert into parse_cache (file_digest, pattern_json, timestamp_sec) "
+            "values (?, ?, ?)",
+            ("a digest", json.dumps(dataclasses.asdict(patterns[0])), time.time()),
+        )
+    connection.close()
+
+
+async def check_migrated_database(
+    dbpath: pathlib.Path, patterns: list[ReducedPattern]
+) -> None:
+    """Check a database made by create_json_database, after migration."""
+    async with await create_pattern_database(dbpath) as db:
+        async with db.db.execute("pragma user_version") as cursor:
+            row = await cursor.fetchone()
+        assert row is not None
+        assert row[0] == DATABASE_VERSION
+
+        # The unreadable pattern was dropped
+        pattern_names = await db.get_pattern_names()
+        assert pattern_names == [pattern.name for pattern in patterns]
+        for i, pattern in enumerate(patterns):
+            migrated_pattern = await db.get_pattern(pattern.name)
+            assert migrated_pattern.pick_number == i + 1
+            assert migrated_pattern.repeat_number == i + 2
+            migrated_pattern.pick_number = pattern.pick_number
+            migrated_pattern.repeat_number = pattern.repeat_number
+            assert migrated_pattern == pattern
+        assert await db.is_in_parse_cache("a digest")
+        async with db.db.execute(
+            "select name from sqlite_master where name like '%_json'"
+        ) as cursor:
+            assert await cursor.fetchall() == []
+
+
+async def test_migrate_json_database() -> None:
+    """Test opening a database that saves patterns as JSON."""
+    patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:3]]
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        create_json_database(dbpath, patterns)
+        for _ in range(2):
+            await check_migrated_database(dbpath, patterns)
+
+
+async def test_migrate_json_database_interrupted(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test that an interrupted migration leaves the old format intact."""
+    patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:3]]
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        create_json_database(dbpath, patterns)
+
+        # Fail after migrating the patterns table
+        migrate_json_table = PatternDatabase._migrate_json_table
+
+        async def failing_migrate_json_table(
+            self: PatternDatabase, table_name: str, fields_str: str
+        ) -> None:
+            if table_name == "parse_cache":
+                raise RuntimeError("simulated failure")
+            await migrate_json_table(self, table_name, fields_str)
+
+        with monkeypatch.context() as m:
+            m.setattr(
+                PatternDatabase, "_migrate_json_table", failing_migrate_json_table
+            )
+            db = PatternDatabase(dbpath)
+            with pytest.raises(RuntimeError):
+                await db.init()
+            assert not db.is_open
+
+        with sqlite3.connect(dbpath) as connection:
+            column_names = [
+                row[1] for row in connection.execute("pragma table_info(patterns)")
+            ]
+            assert "pattern_json" in column_names
+        connection.close()
+
+        await check_migrated_database(dbpath, patterns)
+
+
+async def test_resume_migrate_json_database() -> None:
+    """Test resuming a migration interrupted by an older version,
+    which left the old table renamed to <table>_json."""
+    patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:3]]
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        create_json_database(dbpath, patterns)
+        with sqlite3.connect(dbpath) as connection:
+            # Interrupted after creating the new patterns table
+            connection.execute("alter table patterns rename to patterns_json")
+            connection.execute(f"create table patterns ({PatternDatabase.FIELDS_STR})")
+            # Interrupted before creating the new parse_cache table
+            connection.execute("alter table parse_cache rename to parse_cache_json")
+        connection.close()
+
+        await check_migrated_database(dbpath, patterns)
+
+
+async def test_open_close() -> None:
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        db = PatternDatabase(dbpath)
+        assert not db.is_open
+        with pytest.raises(RuntimeError):
+            await db.get_pattern_names()
+
+        await db.init()
+        assert db.is_open
+        # init is a no-op if the connection is already open
+        connection = db.db
+        await db.init()
+        assert db.db is connection
+
+        pattern = read_reduced_pattern(all_pattern_paths[0])
+        await db.add_pattern(pattern)
+        await db.close()
+        assert not db.is_open
+        with pytest.raises(RuntimeError):
+            await db.get_pattern_names()
+        # close is a no-op if the connection is already closed
+        await db.close()
+
+        # The data survives closing and re-opening the connection
+        await db.init()
+        try:
+            assert await db.get_pattern_names() == [pattern.name]
+        finally:
+            await db.close()
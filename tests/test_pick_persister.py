@@ -0,0 +1,148 @@
+import asyncio
+import pathlib
+import tempfile
+
+import pytest
+
+from seguin_loom_server.pattern_database import (
+    PatternDatabase,
+    create_pattern_database,
+)
+from seguin_loom_server.pick_persister import PickPersister
+from seguin_loom_server.reduced_pattern import (
+    ReducedPattern,
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+datadir = pathlib.Path(__file__).parent / "data"
+
+all_pattern_paths = list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx"))
+
+
+def read_reduced_pattern(path: pathlib.Path) -> ReducedPattern:
+    full_pattern = read_full_pattern(path)
+    return reduced_pattern_from_pattern_data(name=path.name, data=full_pattern)
+
+
+async def test_coalesce_and_flush() -> None:
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:2]]
+            for pattern in patterns:
+                await db.add_pattern(pattern)
+
+            persister = PickPersister(pattern_db=db, flush_interval=10)
+            for pick_number in range(1, 11):
+                persister.schedule(
+                    pattern_name=patterns[0].name,
+                    pick_number=pick_number,
+                    repeat_number=2,
+                )
+            persister.schedule(
+                pattern_name=patterns[1].name, pick_number=5, repeat_number=-3
+            )
+            assert persister.has_pending_updates
+            assert persister.num_scheduled == 11
+
+            # Nothing is written until the persister is flushed
+            await asyncio.sleep(0.01)
+            pattern = await db.get_pattern(patterns[0].name)
+            assert (pattern.pick_number, pattern.repeat_number) == (0, 1)
+
+            # Only the most recent update for each pattern is written
+            await persister.flush()
+            assert not persister.has_pending_updates
+            assert persister.num_written == 2
+            pattern = await db.get_pattern(patterns[0].name)
+            assert (pattern.pick_number, pattern.repeat_number) == (10, 2)
+            pattern = await db.get_pattern(patterns[1].name)
+            assert (pattern.pick_number, pattern.repeat_number) == (5, -3)
+            await persister.close()
+
+
+async def test_flush_interval() -> None:
+    flush_interval = 0.1
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            pattern = read_reduced_pattern(all_pattern_paths[0])
+            await db.add_pattern(pattern)
+
+            persister = PickPersister(pattern_db=db, flush_interval=flush_interval)
+            persister.schedule(
+                pattern_name=pattern.name, pick_number=3, repeat_number=4
+            )
+            await asyncio.sleep(flush_interval * 3)
+            assert not persister.has_pending_updates
+            assert persister.num_written == 1
+            returned_pattern = await db.get_pattern(pattern.name)
+            assert returned_pattern.pick_number == 3
+            assert returned_pattern.repeat_number == 4
+            await persister.close()
+
+
+async def test_close_flushes() -> None:
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            pattern = read_reduced_pattern(all_pattern_paths[0])
+            await db.add_pattern(pattern)
+
+            persister = PickPersister(pattern_db=db, flush_interval=10)
+            persister.schedule(
+                pattern_name=pattern.name, pick_number=7, repeat_number=0
+            )
+            await persister.close()
+            assert not persister.has_pending_updates
+
+        # The saved values survive re-opening the database
+        async with await create_pattern_database(dbpath) as db:
+            returned_pattern = await db.get_pattern(pattern.name)
+            assert returned_pattern.pick_number == 7
+            assert returned_pattern.repeat_number == 0
+
+
+async def test_close_during_flush(monkeypatch: pytest.MonkeyPatch) -> None:
+    flush_interval = 0.01
+    update_duration = 0.05
+    update_pick_number = PatternDatabase.update_pick_number
+
+    async def slow_update_pick_number(
+        self: PatternDatabase, pattern_name: str, pick_number: int, repeat_number: int
+    ) -> None:
+        await asyncio.sleep(update_duration)
+        await update_pick_number(
+            self,
+            pattern_name=pattern_name,
+            pick_number=pick_number,
+            repeat_number=repeat_number,
+        )
+
+    monkeypatch.setattr(PatternDatabase, "update_pick_number", slow_update_pick_number)
+
+    with tempfile.NamedTemporaryFile() as f:
+        dbpath = pathlib.Path(f.name)
+        async with await create_pattern_database(dbpath) as db:
+            patterns = [read_reduced_pattern(path) for path in all_pattern_paths[0:2]]
+            for pattern in patterns:
+                await db.add_pattern(pattern)
+
+            persister = PickPersister(pattern_db=db, flush_interval=flush_interval)
+            for i, pattern in enumerate(patterns):
+                persister.schedule(
+                    pattern_name=pattern.name, pick_number=i + 3, repeat_number=i
+                )
+            # Close while the flush timer is saving the updates
+            await asyncio.sleep(flush_interval * 3)
+            assert not persister.has_pending_updates
+            assert persister.num_written == 0
+            await persister.close()
+            assert persister.num_written == 2
+
+        async with await create_pattern_database(dbpath) as db:
+            for i, pattern in enumerate(patterns):
+                returned_pattern = await db.get_pattern(pattern.name)
+                assert returned_pattern.pick_number == i + 3
+                assert returned_pattern.repeat_number == i
@@ -0,0 +1,145 @@
+import asyncio
+import math
+import os
+import pathlib
+import tempfile
+
+import pytest
+
+from seguin_loom_server.loom_constants import TERMINATOR
+from seguin_loom_server.loom_server import PTY_MOCK_PORT_NAME, LoomServer
+from seguin_loom_server.mock_loom import MockLoomTiming
+from seguin_loom_server.mock_streams import StreamReaderType
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(os, "openpty"), reason="pseudo-terminals not supported"
+)
+
+if hasattr(os, "openpty"):
+    from seguin_loom_server.pty_mock_loom import PtyMockLoom
+
+datadir = pathlib.Path(__file__).parent / "data"
+
+
+async def read_until_reply(reader: StreamReaderType, expected_reply: bytes) -> None:
+    """Read replies until the expected reply is seen.
+
+    Opening a serial port flushes pending input,
+    so replies sent before the port was opened may be lost.
+    """
+    async with asyncio.timeout(1):
+        while True:
+            reply = await reader.readuntil(TERMINATOR)
+            if reply == expected_reply:
+                return
+
+
+async def test_serial_connection() -> None:
+    async with PtyMockLoom(verbose=False) as loom:
+        assert loom.serial_port.startswith("/dev/")
+        reader, writer = await loom.open_client_connection()
+        try:
+            for shaft_word in (0x0, 0x5, 0xFFFFFFFF):
+                writer.write(f"=C{shaft_word:08x}".encode() + TERMINATOR)
+                await writer.drain()
+                await read_until_reply(reader, f"=c{shaft_word:08x}\r".encode())
+                assert loom.shaft_word == shaft_word
+
+            writer.write(b"=U0" + TERMINATOR)
+            await writer.drain()
+            await read_until_reply(reader, b"=u0\r")
+            assert loom.weave_forward
+
+            await loom.request_next_pick()
+            await read_until_reply(reader, b"=s5\r")
+        finally:
+            writer.close()
+
+
+async def test_loom_server() -> None:
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with PtyMockLoom(verbose=False) as loom:
+            # Specify the device path, as for a real loom
+            async with LoomServer(
+                serial_port=loom.serial_port,
+                reset_db=False,
+                verbose=False,
+                db_path=pathlib.Path(f.name),
+            ) as server:
+                assert server.mock_loom is None
+                await server.add_pattern(pattern)
+                await server.select_pattern(pattern.name)
+                current_pattern = server.current_pattern
+                assert current_pattern is not None
+                for pick_number in range(1, len(current_pattern.picks) + 1):
+                    await loom.request_next_pick()
+                    async with asyncio.timeout(1):
+                        while loom.weave_cycle_completed:
+                            await asyncio.sleep(0.001)
+                    assert current_pattern.pick_number == pick_number
+                    expected_shaft_word = current_pattern.get_current_pick().shaft_word
+                    assert loom.shaft_word == expected_shaft_word
+                async with asyncio.timeout(1):
+                    while server.unacknowledged_shaft_commands:
+                        await asyncio.sleep(0.001)
+
+
+async def test_mockpty_port_name() -> None:
+    timing = MockLoomTiming(
+        shed_open_duration=0.001,
+        shed_close_duration=0.001,
+        auto_weave_rate=math.inf,
+        pick_request_timeout=0.05,
+    )
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port=PTY_MOCK_PORT_NAME,
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+            mock_loom_timing=timing,
+        ) as server:
+            await server.add_pattern(pattern)
+            await server.select_pattern(pattern.name)
+            mock_loom = server.mock_loom
+            assert isinstance(mock_loom, PtyMockLoom)
+            async with asyncio.timeout(2):
+                while mock_loom.num_picks_woven < 20:
+                    await asyncio.sleep(0.01)
+            assert server.num_picks_commanded >= 20
+
+
+async def test_reconnect() -> None:
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port=PTY_MOCK_PORT_NAME,
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as server:
+            server.reconnect_initial_delay = 0.001
+            server.reconnect_max_delay = 0.01
+            mock_loom = server.mock_loom
+            assert mock_loom is not None
+            # Closing the pseudo-terminal makes reading the serial port fail
+            await mock_loom.close()
+            async with asyncio.timeout(2):
+                while not (
+                    server.loom_connected
+                    and server.mock_loom is not mock_loom
+                    and server.reconnect_task.done()
+                ):
+                    await asyncio.sleep(0.001)
+            assert server.num_loom_connections == 2
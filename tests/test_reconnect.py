@@ -0,0 +1,297 @@
+import asyncio
+import pathlib
+import random
+import tempfile
+
+import pytest
+
+from seguin_loom_server import loom_server
+from seguin_loom_server.client_replies import (
+    ConnectionStateEnum,
+    MessageSeverityEnum,
+)
+from seguin_loom_server.loom_server import LoomServer, compute_reconnect_delay
+from seguin_loom_server.mock_loom import MockLoom
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+datadir = pathlib.Path(__file__).parent / "data"
+
+# Short reconnection delays (sec), to speed up the tests
+INITIAL_DELAY = 0.001
+MAX_DELAY = 0.01
+
+
+def test_compute_reconnect_delay() -> None:
+    for attempt in range(10):
+        nominal_delay = min(2**attempt, 30)
+        delays = [
+            compute_reconnect_delay(attempt, initial_delay=1, max_delay=30)
+            for _ in range(100)
+        ]
+        assert min(delays) >= nominal_delay / 2
+        assert max(delays) <= nominal_delay
+        # The delays should be jittered
+        assert len(set(delays)) > 1
+    # A huge number of attempts should not overflow
+    assert compute_reconnect_delay(10_000) <= loom_server.RECONNECT_MAX_DELAY
+
+
+async def wait_for_reconnect(server: LoomServer) -> None:
+    """Wait for the server to reconnect to the loom."""
+    async with asyncio.timeout(2):
+        while not (server.loom_connected and server.reconnect_task.done()):
+            await asyncio.sleep(0.001)
+
+
+async def request_pick(mock_loom: MockLoom) -> None:
+    """Make the mock loom request the next pick."""
+    mock_loom.weave_cycle_completed = True
+    await mock_loom.report_state()
+
+
+async def test_reconnect() -> None:
+    rng = random.Random(5)
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as server:
+            server.reconnect_initial_delay = INITIAL_DELAY
+            server.reconnect_max_delay = MAX_DELAY
+            await server.add_pattern(pattern)
+            await server.select_pattern(pattern.name)
+            current_pattern = server.current_pattern
+            assert current_pattern is not None
+            assert server.num_loom_connections == 1
+
+            num_disconnects = 0
+            for _ in range(50):
+                mock_loom = server.mock_loom
+                assert mock_loom is not None
+                if current_pattern.pick_number == len(current_pattern.picks):
+                    current_pattern.pick_number = 0
+                await request_pick(mock_loom)
+                # Wait for the mock loom to get the pick
+                async with asyncio.timeout(1):
+                    while mock_loom.weave_cycle_completed:
+                        await asyncio.sleep(0)
+                expected_shaft_word = current_pattern.get_current_pick().shaft_word
+                assert mock_loom.shaft_word == expected_shaft_word
+                assert server.pick_in_progress
+
+                # Randomly drop the connection while the loom is weaving
+                if rng.random() < 0.3:
+                    assert mock_loom.reply_writer is not None
+                    mock_loom.reply_writer.close()
+                    num_disconnects += 1
+                    await asyncio.sleep(0)
+                    await wait_for_reconnect(server)
+                    new_mock_loom = server.mock_loom
+                    assert new_mock_loom is not None
+                    assert new_mock_loom is not mock_loom
+                    # The server should resend the pick
+                    async with asyncio.timeout(1):
+                        while new_mock_loom.shaft_word != expected_shaft_word:
+                            await asyncio.sleep(0.001)
+                    assert server.pick_in_progress
+
+            assert num_disconnects > 5
+            assert server.num_loom_connections == num_disconnects + 1
+
+
+async def test_reconnect_shaft_echo() -> None:
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as server:
+            server.reconnect_initial_delay = INITIAL_DELAY
+            server.reconnect_max_delay = MAX_DELAY
+            await server.add_pattern(pattern)
+            await server.select_pattern(pattern.name)
+            current_pattern = server.current_pattern
+            assert current_pattern is not None
+            problems: list[tuple[str, MessageSeverityEnum]] = []
+
+            async def record_command_problem(
+                message: str, severity: MessageSeverityEnum
+            ) -> None:
+                problems.append((message, severity))
+
+            server.report_command_problem = record_command_problem  # type: ignore
+
+            for _ in range(5):
+                mock_loom = server.mock_loom
+                assert mock_loom is not None
+                await request_pick(mock_loom)
+                async with asyncio.timeout(1):
+                    while mock_loom.weave_cycle_completed:
+                        await asyncio.sleep(0)
+                    while server.unacknowledged_shaft_commands:
+                        await asyncio.sleep(0.001)
+                expected_shaft_word = current_pattern.get_current_pick().shaft_word
+                # A new mock loom reports that no shafts are raised
+                assert expected_shaft_word != 0
+
+                # Drop the connection while the loom is weaving the pick;
+                # the new mock loom reports shafts 0 on connection,
+                # which must not be mistaken for an echo of the resent pick
+                assert mock_loom.reply_writer is not None
+                mock_loom.reply_writer.close()
+                await asyncio.sleep(0)
+                await wait_for_reconnect(server)
+                new_mock_loom = server.mock_loom
+                assert new_mock_loom is not None
+                assert new_mock_loom is not mock_loom
+                async with asyncio.timeout(1):
+                    while new_mock_loom.shaft_word != expected_shaft_word:
+                        await asyncio.sleep(0.001)
+                    while server.unacknowledged_shaft_commands:
+                        await asyncio.sleep(0.001)
+
+            assert server.num_loom_connections == 6
+            assert server.num_shaft_echo_mismatches == 0
+            assert server.num_shaft_command_retries == 0
+            assert problems == []
+
+
+async def test_reconnect_shafts_match_pick() -> None:
+    # The loom reports its shafts on connection; if they happen to match
+    # the resent pick, that must not be taken as acknowledging the pick
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as server:
+            server.reconnect_initial_delay = INITIAL_DELAY
+            server.reconnect_max_delay = MAX_DELAY
+            server.shaft_echo_timeout = 0.02
+            await server.add_pattern(pattern)
+            await server.select_pattern(pattern.name)
+            current_pattern = server.current_pattern
+            assert current_pattern is not None
+
+            mock_loom = server.mock_loom
+            assert mock_loom is not None
+            await request_pick(mock_loom)
+            async with asyncio.timeout(1):
+                while mock_loom.weave_cycle_completed:
+                    await asyncio.sleep(0)
+                while server.unacknowledged_shaft_commands:
+                    await asyncio.sleep(0.001)
+            expected_shaft_word = current_pattern.get_current_pick().shaft_word
+
+            # Make the new mock loom start with the shafts of the current pick
+            # raised, and lose the resent pick, so it must be resent again
+            mock_loom_factory = server.mock_loom_factory
+            assert mock_loom_factory is not None
+            num_shafts_reports = 0
+
+            def create_mock_loom(**kwargs) -> MockLoom:  # type: ignore
+                new_mock_loom = mock_loom_factory(**kwargs)
+                new_mock_loom.shaft_word = expected_shaft_word
+                report_shafts = new_mock_loom.report_shafts
+
+                async def report_shafts_but_first_echo() -> None:
+                    nonlocal num_shafts_reports
+                    num_shafts_reports += 1
+                    if num_shafts_reports != 2:
+                        await report_shafts()
+
+                new_mock_loom.report_shafts = (  # type: ignore
+                    report_shafts_but_first_echo
+                )
+                return new_mock_loom
+
+            server.mock_loom_factory = create_mock_loom
+
+            assert mock_loom.reply_writer is not None
+            mock_loom.reply_writer.close()
+            await asyncio.sleep(0)
+            await wait_for_reconnect(server)
+            async with asyncio.timeout(1):
+                while num_shafts_reports < 3 or server.unacknowledged_shaft_commands:
+                    await asyncio.sleep(0.001)
+            assert server.num_shaft_command_retries == 1
+            assert server.num_shaft_echo_mismatches == 0
+            assert server.latency_stats.histograms["shaft_echo"].count == 2
+
+
+async def test_reconnect_failures(monkeypatch: pytest.MonkeyPatch) -> None:
+    num_failures = 3
+    num_calls = 0
+    open_client_connection = MockLoom.open_client_connection
+
+    async def flaky_open_client_connection(self: MockLoom):  # type: ignore
+        nonlocal num_calls
+        num_calls += 1
+        if 1 < num_calls <= num_failures + 1:
+            raise RuntimeError("Simulated connection failure")
+        return await open_client_connection(self)
+
+    monkeypatch.setattr(
+        MockLoom, "open_client_connection", flaky_open_client_connection
+    )
+
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as server:
+            server.reconnect_initial_delay = INITIAL_DELAY
+            server.reconnect_max_delay = MAX_DELAY
+            reported_states: list[tuple[ConnectionStateEnum, str]] = []
+            report_loom_connection_state = server.report_loom_connection_state
+
+            async def record_loom_connection_state(
+                reason: str = "", client=None  # type: ignore
+            ) -> None:
+                reported_states.append((server.loom_connection_state, reason))
+                await report_loom_connection_state(reason=reason, client=client)
+
+            server.report_loom_connection_state = (  # type: ignore
+                record_loom_connection_state
+            )
+
+            mock_loom = server.mock_loom
+            assert mock_loom is not None
+            assert mock_loom.reply_writer is not None
+            mock_loom.reply_writer.close()
+            await asyncio.sleep(0)
+            await wait_for_reconnect(server)
+            assert num_calls == num_failures + 2
+            assert server.num_loom_connections == 2
+            assert reported_states[-1] == (ConnectionStateEnum.CONNECTED, "")
+            retry_reasons = [
+                reason
+                for state, reason in reported_states
+                if state == ConnectionStateEnum.DISCONNECTED
+                and "reconnecting" in reason
+            ]
+            assert len(retry_reasons) == num_failures + 1
+            assert retry_reasons[0].startswith("Lost connection")
+            for i, reason in enumerate(retry_reasons[1:]):
+                assert reason.startswith(f"Reconnection attempt {i + 1} failed")
@@ -1,7 +1,9 @@
 import copy
 import dataclasses
+import json
 import pathlib
 
+import dtx_to_wif
 import pytest
 
 from seguin_loom_server.reduced_pattern import (
@@ -26,6 +28,32 @@ def shaft_set_from_reduced(
     }
 
 
+def reference_are_shafts_up_list(
+    full_pattern: dtx_to_wif.PatternData,
+) -> list[list[bool]]:
+    """Compute which shafts are up for each pick using sets of shafts.
+
+    This is the original, straightforward algorithm, for comparison.
+    """
+    wefts_from1 = range(1, len(full_pattern.liftplan or full_pattern.treadling) + 1)
+    if full_pattern.liftplan:
+        shaft_sets = [full_pattern.liftplan[weft] - {0} for weft in wefts_from1]
+    else:
+        shaft_sets = []
+        for weft in wefts_from1:
+            treadle_set = full_pattern.treadling[weft] - {0}
+            shaft_sets.append(
+                set.union(*(full_pattern.tieup[treadle] for treadle in treadle_set))
+                - {0}
+            )
+    num_shafts = max(max(shaft_set) for shaft_set in shaft_sets if shaft_set)
+    shafts_from1 = range(1, num_shafts + 1)
+    return [
+        [(shaft in shaft_set) == full_pattern.is_rising_shed for shaft in shafts_from1]
+        for shaft_set in shaft_sets
+    ]
+
+
 def test_basics() -> None:
     for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
         full_pattern = read_full_pattern(filepath)
@@ -70,6 +98,19 @@ def test_basics() -> None:
                 )
 
 
+def test_matches_reference_algorithm() -> None:
+    for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
+        full_pattern = read_full_pattern(filepath)
+        for is_rising_shed in (True, False):
+            full_pattern.is_rising_shed = is_rising_shed
+            reduced_pattern = reduced_pattern_from_pattern_data(
+                name=filepath.name, data=full_pattern
+            )
+            assert [
+                pick.are_shafts_up for pick in reduced_pattern.picks
+            ] == reference_are_shafts_up_list(full_pattern)
+
+
 def test_from_dict() -> None:
     for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
         full_pattern = read_full_pattern(filepath)
@@ -119,6 +160,120 @@ def test_from_dict() -> None:
             Pick.from_dict(pickdict_wrongtype)
 
 
+def test_pick_shaft_word() -> None:
+    for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
+        full_pattern = read_full_pattern(filepath)
+        reduced_pattern = reduced_pattern_from_pattern_data(
+            name=filepath.name, data=full_pattern
+        )
+        for pick in reduced_pattern.picks:
+            are_shafts_up = pick.are_shafts_up
+            assert len(are_shafts_up) == pick.num_shafts
+            assert pick.shaft_word == sum(
+                1 << i for i, is_up in enumerate(are_shafts_up) if is_up
+            )
+            assert (
+                Pick.from_are_shafts_up(color=pick.color, are_shafts_up=are_shafts_up)
+                == pick
+            )
+
+            # Test the old dict representation
+            pick_dict = dict(color=pick.color, are_shafts_up=are_shafts_up)
+            assert Pick.from_dict(pick_dict) == pick
+            pick_dict["type"] = "Pick"
+            assert Pick.from_dict(pick_dict) == pick
+            assert pick_dict["type"] == "Pick"
+
+        # Identical picks are shared
+        picks_by_value = {pick: pick for pick in reduced_pattern.picks}
+        for pick in reduced_pattern.picks:
+            assert picks_by_value[pick] is pick
+
+        # Picks are immutable
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            reduced_pattern.picks[0].shaft_word = 0  # type: ignore
+
+
+def test_get_pick_command() -> None:
+    for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
+        full_pattern = read_full_pattern(filepath)
+        reduced_pattern = reduced_pattern_from_pattern_data(
+            name=filepath.name, data=full_pattern
+        )
+        num_picks = len(reduced_pattern.picks)
+        for pick_number in range(1, num_picks + 1):
+            pick = reduced_pattern.picks[pick_number - 1]
+            expected_command = f"=C{pick.shaft_word:08x}\r".encode()
+            assert reduced_pattern.get_pick_command(pick_number) == expected_command
+            reduced_pattern.pick_number = pick_number
+            assert reduced_pattern.get_pick_command() == expected_command
+        for invalid_pick_number in (-1, 0, num_picks + 1):
+            with pytest.raises(IndexError):
+                reduced_pattern.get_pick_command(invalid_pick_number)
+
+        # Changing pick_number and repeat_number keeps the cache
+        pick_commands = reduced_pattern._pick_commands
+        assert pick_commands is not None
+        reduced_pattern.pick_number = 1
+        reduced_pattern.repeat_number = 5
+        assert reduced_pattern._pick_commands is pick_commands
+
+        # Changing the picks clears the cache
+        new_picks = list(reversed(reduced_pattern.picks))
+        reduced_pattern.picks = new_picks
+        assert reduced_pattern._pick_commands is None
+        assert reduced_pattern.get_pick_command(1) == pick_commands[-1]
+
+        # The cache is not part of the dict representation or equality
+        patterndict = dataclasses.asdict(reduced_pattern)
+        assert "_pick_commands" not in patterndict
+        assert ReducedPattern.from_dict(patterndict) == reduced_pattern
+
+
+def test_to_json() -> None:
+    for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
+        full_pattern = read_full_pattern(filepath)
+        reduced_pattern = reduced_pattern_from_pattern_data(
+            name=filepath.name, data=full_pattern
+        )
+        for pick_number, repeat_number in ((0, 1), (3, -2), (1, 17)):
+            reduced_pattern.pick_number = pick_number
+            reduced_pattern.repeat_number = repeat_number
+            pattern_json = reduced_pattern.to_json()
+            assert json.loads(pattern_json) == dataclasses.asdict(reduced_pattern)
+            assert pattern_json == json.dumps(
+                dataclasses.asdict(reduced_pattern), separators=(",", ":")
+            )
+
+        # Changing pick_number and repeat_number keeps the cache
+        static_json = reduced_pattern._static_json
+        assert static_json is not None
+        reduced_pattern.pick_number = 2
+        reduced_pattern.repeat_number = 3
+        assert reduced_pattern._static_json is static_json
+
+        # Changing any other field clears the cache
+        reduced_pattern.name = 'näme with "quotes"'
+        assert reduced_pattern._static_json is None
+        assert json.loads(reduced_pattern.to_json()) == dataclasses.asdict(
+            reduced_pattern
+        )
+
+
+def test_old_dict_representation() -> None:
+    for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
+        full_pattern = read_full_pattern(filepath)
+        reduced_pattern = reduced_pattern_from_pattern_data(
+            name=filepath.name, data=full_pattern
+        )
+        patterndict = dataclasses.asdict(reduced_pattern)
+        patterndict["picks"] = [
+            dict(color=pick.color, are_shafts_up=pick.are_shafts_up)
+            for pick in reduced_pattern.picks
+        ]
+        assert ReducedPattern.from_dict(patterndict) == reduced_pattern
+
+
 def test_color_table() -> None:
     for filepath in list(datadir.glob("*.wif")) + list(datadir.glob("*.dtx")):
         full_pattern = read_full_pattern(filepath)
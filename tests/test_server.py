@@ -2,14 +2,26 @@ import io
 import pathlib
 import random
 import tempfile
+import time
 
+import pytest
 from dtx_to_wif import read_dtx, read_wif
+from fastapi import WebSocketDisconnect
 
+from seguin_loom_server import loom_server, main
+from seguin_loom_server.client_replies import MessageSeverityEnum
+from seguin_loom_server.loop_lag_monitor import DEFAULT_LOOP_LAG_INTERVAL
 from seguin_loom_server.reduced_pattern import (
     ReducedPattern,
     reduced_pattern_from_pattern_data,
 )
-from seguin_loom_server.testutils import WebSocketType, create_test_client, receive_dict
+from seguin_loom_server.testutils import (
+    WebSocketType,
+    create_test_client,
+    read_initial_server_state,
+    receive_dict,
+    upload_pattern,
+)
 
 datadir = pathlib.Path(__file__).parent / "data"
 
@@ -123,6 +135,211 @@ def test_jump_to_pick() -> None:
                 )
 
 
+def test_metrics() -> None:
+    pattern_name = all_pattern_paths[2].name
+    num_picks = 5
+
+    with create_test_client(upload_patterns=all_pattern_paths[2:3]) as (
+        client,
+        websocket,
+    ):
+        select_pattern(websocket=websocket, pattern_name=pattern_name)
+        for _ in range(num_picks):
+            websocket.send_json(dict(type="oobcommand", command="n"))
+            reply_types = {receive_dict(websocket)["type"] for _ in range(2)}
+            assert reply_types == {"CurrentPickNumber", "LoomState"}
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        samples = dict(
+            line.rsplit(" ", 1)
+            for line in response.text.splitlines()
+            if not line.startswith("#")
+        )
+        assert samples['seguin_picks_commanded_total{loom="1"}'] == str(num_picks)
+        assert float(samples['seguin_picks_per_minute{loom="1"}']) == num_picks
+        assert samples['seguin_loom_connected{loom="1"}'] == "1"
+        assert samples['seguin_loom_reconnects_total{loom="1"}'] == "0"
+        assert samples['seguin_clients{loom="1"}'] == "1"
+        assert int(
+            samples['seguin_loom_replies_total{loom="1",reply_type="StateReply"}']
+        ) >= (num_picks)
+        assert samples['seguin_loom_invalid_replies_total{loom="1"}'] == "0"
+        assert int(samples['seguin_client_messages_sent_total{loom="1"}']) > 0
+        assert int(samples['seguin_client_send_queue_depth{loom="1"}']) >= 0
+        assert int(samples['seguin_client_send_queue_max_depth{loom="1"}']) > 0
+        assert samples[
+            'seguin_latency_seconds_count{loom="1",stage="pick_request"}'
+        ] == str(num_picks)
+        assert (
+            samples[
+                'seguin_db_operation_seconds_count{loom="1",operation="add_pattern"}'
+            ]
+            == "1"
+        )
+        assert samples['seguin_pattern_file_size_chars_count{loom="1"}'] == "1"
+        assert samples['seguin_pattern_read_seconds_count{loom="1"}'] == "1"
+        assert "seguin_event_loop_lag_seconds_count" in samples
+        assert "seguin_event_loop_slow_callbacks_total" in samples
+
+        # The lag monitor records its first sample after
+        # DEFAULT_LOOP_LAG_INTERVAL, so wait for it
+        for _ in range(100):
+            response = client.get("/event_loop")
+            assert response.status_code == 200
+            event_loop_dict = response.json()
+            if event_loop_dict["lag"]["count"] > 0:
+                break
+            time.sleep(DEFAULT_LOOP_LAG_INTERVAL / 10)
+        assert event_loop_dict["lag"]["count"] > 0
+        assert event_loop_dict["num_slow_callbacks"] >= len(
+            event_loop_dict["slow_callbacks"]
+        )
+
+
+def test_multiple_clients() -> None:
+    pattern_names = [path.name for path in all_pattern_paths[2:5]]
+    pattern_name = pattern_names[1]
+
+    with create_test_client(upload_patterns=all_pattern_paths[2:5]) as (
+        client,
+        websocket1,
+    ):
+        with client.websocket_connect("/ws") as websocket2:
+            # The new client gets the initial state, and every client
+            # gets the loom state requested for the new client
+            read_initial_server_state(
+                websocket=websocket2, expected_pattern_names=pattern_names
+            )
+            reply = receive_dict(websocket1)
+            assert reply["type"] == "LoomState"
+
+            with client.websocket_connect("/ws") as websocket3:
+                read_initial_server_state(
+                    websocket=websocket3, expected_pattern_names=pattern_names
+                )
+                all_websockets = (websocket1, websocket2, websocket3)
+                for websocket in all_websockets[0:2]:
+                    reply = receive_dict(websocket)
+                    assert reply["type"] == "LoomState"
+
+                # Replies to a command from any client go to all clients
+                websocket2.send_json(dict(type="select_pattern", name=pattern_name))
+                patterns = []
+                for websocket in all_websockets:
+                    reply = receive_dict(websocket)
+                    assert reply["type"] == "ReducedPattern"
+                    patterns.append(ReducedPattern.from_dict(reply))
+                    reply = receive_dict(websocket)
+                    assert reply == dict(
+                        type="CurrentPickNumber", pick_number=0, repeat_number=1
+                    )
+                assert patterns[0] == patterns[1] == patterns[2]
+
+                for pick_number, websocket_to_command in enumerate(
+                    (websocket3, websocket1, websocket2), start=1
+                ):
+                    websocket_to_command.send_json(dict(type="goto_next_pick"))
+                    for websocket in all_websockets:
+                        reply = receive_dict(websocket)
+                        assert reply == dict(
+                            type="CurrentPickNumber",
+                            pick_number=pick_number,
+                            repeat_number=1,
+                        )
+
+        # The remaining client still works after the others disconnect
+        websocket1.send_json(dict(type="goto_next_pick"))
+        reply = receive_dict(websocket1)
+        assert reply == dict(type="CurrentPickNumber", pick_number=4, repeat_number=1)
+
+
+def test_multiple_looms() -> None:
+    num_looms = 3
+    loom_ids = list(range(1, num_looms + 1))
+    # Each loom gets different patterns
+    pattern_paths_dict = {
+        loom_id: all_pattern_paths[loom_id : loom_id + 2] for loom_id in loom_ids
+    }
+
+    with create_test_client(
+        num_looms=num_looms, upload_patterns=pattern_paths_dict[1]
+    ) as (client, websocket1):
+        assert list(main.loom_servers.keys()) == loom_ids
+        db_paths = [
+            loom_server.pattern_db.dbpath for loom_server in main.loom_servers.values()
+        ]
+        assert len(set(db_paths)) == num_looms
+        try:
+            # The home page lists the looms
+            response = client.get("/")
+            assert response.status_code == 200
+            for loom_id in loom_ids:
+                assert f'href="loom/{loom_id}"' in response.text
+            for loom_id in loom_ids:
+                response = client.get(f"/loom/{loom_id}")
+                assert response.status_code == 200
+                assert f'"../ws/{loom_id}"' in response.text
+            response = client.get(f"/loom/{num_looms + 1}")
+            assert response.status_code == 404
+
+            with (
+                client.websocket_connect("/ws/2") as websocket2,
+                client.websocket_connect("/ws/3") as websocket3,
+            ):
+                websockets = {1: websocket1, 2: websocket2, 3: websocket3}
+                for loom_id in loom_ids[1:]:
+                    websocket = websockets[loom_id]
+                    read_initial_server_state(
+                        websocket=websocket, expected_pattern_names=[]
+                    )
+                    # Each loom has its own pattern history
+                    expected_names: list[str] = []
+                    for path in pattern_paths_dict[loom_id]:
+                        expected_names.append(path.name)
+                        upload_pattern(websocket, path)
+                        reply = receive_dict(websocket)
+                        assert reply == dict(type="PatternNames", names=expected_names)
+
+                # Each loom has its own current pattern and pick number,
+                # and replies go only to the clients of that loom
+                for loom_id in loom_ids:
+                    pattern_name = pattern_paths_dict[loom_id][0].name
+                    select_pattern(
+                        websocket=websockets[loom_id], pattern_name=pattern_name
+                    )
+                    for _ in range(loom_id):
+                        websockets[loom_id].send_json(dict(type="goto_next_pick"))
+                    for pick_number in range(1, loom_id + 1):
+                        reply = receive_dict(websockets[loom_id])
+                        assert reply == dict(
+                            type="CurrentPickNumber",
+                            pick_number=pick_number,
+                            repeat_number=1,
+                        )
+
+                response = client.get("/looms")
+                assert response.status_code == 200
+                statuses = response.json()
+                assert [status["loom_id"] for status in statuses] == loom_ids
+                for loom_id, status in zip(loom_ids, statuses):
+                    assert status["serial_port"] == "mock"
+                    assert status["loom_connection_state"] == "connected"
+                    assert status["pattern_name"] == pattern_paths_dict[loom_id][0].name
+                    assert status["pick_number"] == loom_id
+                    assert status["repeat_number"] == 1
+                    assert status["num_clients"] == 1
+
+            # A websocket for a nonexistent loom is rejected
+            with pytest.raises(WebSocketDisconnect):
+                with client.websocket_connect(f"/ws/{num_looms + 1}"):
+                    pass
+        finally:
+            for db_path in db_paths[1:]:
+                db_path.unlink(missing_ok=True)
+
+
 def test_oobcommand() -> None:
     pattern_name = all_pattern_paths[2].name
 
@@ -160,6 +377,16 @@ def test_oobcommand() -> None:
                 else:
                     raise AssertionError(f"Unexpected reply type in {reply=}")
 
+        # Each pick request should have been timed
+        response = client.get("/loom/1/latency")
+        assert response.status_code == 200
+        latency_stats = response.json()
+        num_picks_commanded = latency_stats["pick_request"]["count"]
+        assert num_picks_commanded > num_picks_in_pattern
+        assert latency_stats["read"]["count"] > num_picks_commanded
+        assert latency_stats["pick_request"]["max"] < 1
+        assert client.get("/loom/2/latency").status_code == 404
+
         websocket.send_json(dict(type="oobcommand", command="d"))
         reply = receive_dict(websocket)
         assert reply == dict(type="WeaveDirection", forward=False)
@@ -324,6 +551,136 @@ def test_upload() -> None:
         pass
 
 
+def test_upload_all_at_once() -> None:
+    with create_test_client() as (client, websocket):
+        # Send all the files before reading any replies,
+        # so the files are read in parallel.
+        for path in all_pattern_paths:
+            upload_pattern(websocket, path)
+
+        # Patterns are added in the order they were uploaded
+        expected_names: list[str] = []
+        for path in all_pattern_paths:
+            expected_names.append(path.name)
+            reply = receive_dict(websocket)
+            assert reply == dict(type="PatternNames", names=expected_names)
+
+
+def test_upload_same_file_again() -> None:
+    pattern_path = all_pattern_paths[0]
+    with open(pattern_path, "r") as f:
+        pattern_data = f.read()
+
+    with create_test_client() as (client, websocket):
+        pattern_db = main.loom_servers[main.DEFAULT_LOOM_ID].pattern_db
+        upload_pattern(websocket, pattern_path)
+        reply = receive_dict(websocket)
+        assert reply == dict(type="PatternNames", names=[pattern_path.name])
+        assert pattern_db.num_parse_cache_hits == 0
+
+        # Upload the same data under a different name;
+        # the pattern is copied from the parse cache
+        new_name = "copy" + pattern_path.suffix
+        websocket.send_json(dict(type="file", name=new_name, data=pattern_data))
+        reply = receive_dict(websocket)
+        assert reply == dict(type="PatternNames", names=[pattern_path.name, new_name])
+        assert pattern_db.num_parse_cache_hits == 1
+
+        original_pattern = select_pattern(websocket, pattern_path.name)
+        copied_pattern = select_pattern(websocket, new_name)
+        assert copied_pattern.name == new_name
+        copied_pattern.name = original_pattern.name
+        assert copied_pattern == original_pattern
+
+
+def test_upload_purged_from_parse_cache(monkeypatch: pytest.MonkeyPatch) -> None:
+    pattern_path = all_pattern_paths[0]
+    with open(pattern_path, "r") as f:
+        pattern_data = f.read()
+
+    async def purged_add_pattern_from_parse_cache(
+        self: loom_server.LoomServer, file_digest: str, pattern_name: str
+    ) -> bool:
+        # Simulate the entry being purged after it was found in the cache
+        return False
+
+    with create_test_client() as (client, websocket):
+        pattern_db = main.loom_servers[main.DEFAULT_LOOM_ID].pattern_db
+        upload_pattern(websocket, pattern_path)
+        reply = receive_dict(websocket)
+        assert reply == dict(type="PatternNames", names=[pattern_path.name])
+
+        # The file is read instead
+        monkeypatch.setattr(
+            loom_server.LoomServer,
+            "add_pattern_from_parse_cache",
+            purged_add_pattern_from_parse_cache,
+        )
+        new_name = "copy" + pattern_path.suffix
+        websocket.send_json(dict(type="file", name=new_name, data=pattern_data))
+        reply = receive_dict(websocket)
+        assert reply == dict(type="PatternNames", names=[pattern_path.name, new_name])
+        assert pattern_db.num_parse_cache_hits == 0
+
+        original_pattern = select_pattern(websocket, pattern_path.name)
+        copied_pattern = select_pattern(websocket, new_name)
+        copied_pattern.name = original_pattern.name
+        assert copied_pattern == original_pattern
+
+
+def test_upload_errors(monkeypatch: pytest.MonkeyPatch) -> None:
+    pattern_path = all_pattern_paths[0]
+    with open(pattern_path, "r") as f:
+        pattern_data = f.read()
+
+    with create_test_client() as (client, websocket):
+        for filename, data, expected_message_start in (
+            (
+                "unsupported.txt",
+                pattern_data,
+                "Failed to read pattern 'unsupported.txt'",
+            ),
+            (
+                "invalid.wif",
+                "[WIF]\nVersion=1.1\n",
+                "Failed to read pattern 'invalid.wif'",
+            ),
+        ):
+            websocket.send_json(dict(type="file", name=filename, data=data))
+            reply = receive_dict(websocket)
+            assert reply["type"] == "CommandProblem"
+            assert reply["message"].startswith(expected_message_start)
+            assert reply["severity"] == MessageSeverityEnum.WARNING
+
+        monkeypatch.setattr(loom_server, "MAX_PATTERN_FILE_SIZE", len(pattern_data) - 1)
+        upload_pattern(websocket, pattern_path)
+        reply = receive_dict(websocket)
+        assert reply["type"] == "CommandProblem"
+        assert "file is larger than" in reply["message"]
+
+        # The limit is in bytes, not characters
+        data = pattern_data + "; \u00e9\n"
+        monkeypatch.setattr(loom_server, "MAX_PATTERN_FILE_SIZE", len(data))
+        websocket.send_json(dict(type="file", name=pattern_path.name, data=data))
+        reply = receive_dict(websocket)
+        assert reply["type"] == "CommandProblem"
+        assert "file is larger than" in reply["message"]
+        monkeypatch.undo()
+
+        # Some malformed files make dtx_to_wif loop forever
+        monkeypatch.setattr(loom_server, "PATTERN_READ_TIMEOUT", 0.5)
+        websocket.send_json(dict(type="file", name="hangs.wif", data="no header"))
+        reply = receive_dict(websocket)
+        assert reply["type"] == "CommandProblem"
+        assert "Timed out" in reply["message"]
+        monkeypatch.undo()
+
+        # The server still works after these errors
+        upload_pattern(websocket, pattern_path)
+        reply = receive_dict(websocket)
+        assert reply == dict(type="PatternNames", names=[pattern_path.name])
+
+
 def test_weave_direction() -> None:
     # TO DO: expand this test to test commanding the same direction
     # multiple times in a row, once I know what mock loom ought to do.
@@ -0,0 +1,178 @@
+import asyncio
+import pathlib
+import tempfile
+import threading
+import time
+
+import pytest
+
+from seguin_loom_server.session_recorder import (
+    RecordType,
+    SessionRecorder,
+    get_session_paths,
+    read_session_file,
+)
+
+
+def read_records(path: pathlib.Path) -> list[tuple[RecordType, int, bytes]]:
+    """Read the records of a session (all its files), without timestamps."""
+    return [
+        (record.record_type, record.client_id, record.data)
+        for session_path in get_session_paths(path)
+        for record in read_session_file(session_path)
+    ]
+
+
+async def test_record_and_read() -> None:
+    expected_records = [
+        (RecordType.LOOM_CONNECTED, 0, b"mock"),
+        (RecordType.LOOM_DATA, 0, b"=s1\r=u0\r"),
+        (RecordType.CLIENT_CONNECTED, 3, b""),
+        (RecordType.CLIENT_COMMAND, 3, '{"type":"oobcommand","command":"é"}'.encode()),
+        (RecordType.LOOM_COMMAND, 0, b"=C00000005\r"),
+        (RecordType.CLIENT_REPLY, 0, b'{"type":"LoomState"}'),
+        (RecordType.CLIENT_DISCONNECTED, 3, b""),
+    ]
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir) / "session.bin"
+        recorder = SessionRecorder(path, flush_interval=0.01)
+        for record_type, client_id, data in expected_records[0:3]:
+            recorder.record(record_type, data, client_id=client_id)
+        # Wait for the flush timer to write the first records
+        await asyncio.sleep(0.1)
+        assert recorder.num_written == 3
+        for record_type, client_id, data in expected_records[3:]:
+            # Record strings as str, to check encoding
+            recorder.record(
+                record_type,
+                data.decode() if record_type == RecordType.CLIENT_COMMAND else data,
+                client_id=client_id,
+            )
+        await recorder.close()
+        assert recorder.num_recorded == len(expected_records)
+        assert recorder.num_written == len(expected_records)
+        assert recorder.num_dropped == 0
+        # Records after closing are ignored
+        recorder.record(RecordType.LOOM_DATA, b"=s5\r")
+        assert recorder.num_recorded == len(expected_records)
+
+        assert get_session_paths(path) == [path]
+        records = list(read_session_file(path))
+        assert [
+            (record.record_type, record.client_id, record.data) for record in records
+        ] == expected_records
+        timestamps = [record.timestamp for record in records]
+        assert timestamps == sorted(timestamps)
+        assert timestamps[-1] - timestamps[0] >= 0.1
+
+
+async def test_close_during_flush(monkeypatch: pytest.MonkeyPatch) -> None:
+    flush_interval = 0.01
+    write_duration = 0.05
+    write = SessionRecorder._write
+    lock = threading.Lock()
+    num_writing = 0
+    max_num_writing = 0
+
+    def slow_write(self: SessionRecorder, records: list[tuple[bytes, bytes]]) -> None:
+        nonlocal num_writing, max_num_writing
+        with lock:
+            num_writing += 1
+            max_num_writing = max(max_num_writing, num_writing)
+        time.sleep(write_duration)
+        write(self, records)
+        with lock:
+            num_writing -= 1
+
+    monkeypatch.setattr(SessionRecorder, "_write", slow_write)
+
+    expected_records = [
+        (RecordType.LOOM_DATA, 0, f"=s{i}\r".encode()) for i in range(6)
+    ]
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir) / "session.bin"
+        recorder = SessionRecorder(path, flush_interval=flush_interval)
+        for record_type, client_id, data in expected_records[0:3]:
+            recorder.record(record_type, data, client_id=client_id)
+        # Close while the flush timer is writing the first records
+        await asyncio.sleep(flush_interval * 3)
+        assert recorder.num_written == 0
+        for record_type, client_id, data in expected_records[3:]:
+            recorder.record(record_type, data, client_id=client_id)
+        await recorder.close()
+        assert max_num_writing == 1
+        assert recorder.num_written == len(expected_records)
+        assert read_records(path) == expected_records
+
+
+async def test_rotation() -> None:
+    num_records = 100
+    data = b"=s1\r" * 25
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir) / "session.bin"
+
+        # A previous session, which should be rotated but not replayed
+        old_recorder = SessionRecorder(path)
+        old_recorder.record(RecordType.LOOM_CONNECTED, b"old")
+        await old_recorder.close()
+
+        recorder = SessionRecorder(path, max_file_nbytes=1000, backup_count=3)
+        expected_records = []
+        for i in range(num_records):
+            recorder.record(RecordType.LOOM_DATA, data, client_id=i)
+            expected_records.append((RecordType.LOOM_DATA, i, data))
+            if i % 10 == 0:
+                await recorder.flush()
+        await recorder.close()
+
+        paths = get_session_paths(path)
+        assert paths == [path.with_name(f"session.bin.{i}") for i in (3, 2, 1)] + [path]
+        for session_path in paths:
+            assert session_path.stat().st_size <= 1000
+        assert sorted(pathlib.Path(tempdir).iterdir()) == sorted(paths)
+        # The oldest records were deleted
+        records = read_records(path)
+        assert 0 < len(records) < num_records
+        assert records == expected_records[-len(records) :]
+
+
+async def test_buffer_full() -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir) / "session.bin"
+        recorder = SessionRecorder(path, max_buffer_nbytes=100)
+        recorder.record(RecordType.LOOM_DATA, b"x" * 50)
+        recorder.record(RecordType.LOOM_DATA, b"y" * 50)
+        assert recorder.num_dropped == 1
+        await recorder.flush()
+        # There is room again
+        recorder.record(RecordType.LOOM_DATA, b"z" * 50)
+        await recorder.close()
+        assert recorder.num_dropped == 1
+        assert read_records(path) == [
+            (RecordType.LOOM_DATA, 0, b"x" * 50),
+            (RecordType.LOOM_DATA, 0, b"z" * 50),
+        ]
+
+
+async def test_truncated_file() -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir) / "session.bin"
+        recorder = SessionRecorder(path)
+        recorder.record(RecordType.LOOM_DATA, b"=s1\r")
+        recorder.record(RecordType.LOOM_DATA, b"=s5\r")
+        await recorder.close()
+        data = path.read_bytes()
+        for num_missing in (1, 5, 20):
+            path.write_bytes(data[:-num_missing])
+            assert read_records(path) == [(RecordType.LOOM_DATA, 0, b"=s1\r")]
+
+
+def test_invalid_file() -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+        path = pathlib.Path(tempdir) / "session.bin"
+        for data in (b"", b"SLSR", b"SLRP\x01" + bytes(8), b"SLSR\x63" + bytes(8)):
+            path.write_bytes(data)
+            with pytest.raises(ValueError):
+                list(read_session_file(path))
+            with pytest.raises(ValueError):
+                get_session_paths(path)
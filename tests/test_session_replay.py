@@ -0,0 +1,126 @@
+import asyncio
+import json
+import pathlib
+import tempfile
+
+import pytest
+
+from seguin_loom_server.loom_server import LoomServer
+from seguin_loom_server.mock_loom import MockLoom
+from seguin_loom_server.pattern_database import create_pattern_database
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+from seguin_loom_server.session_recorder import (
+    RecordType,
+    get_session_paths,
+    read_session_file,
+)
+from seguin_loom_server.session_replay import ReplayWebSocket, run_replay
+
+datadir = pathlib.Path(__file__).parent / "data"
+
+NUM_PICKS = 20
+
+
+async def weave_picks(server: LoomServer, num_picks: int) -> None:
+    for _ in range(num_picks):
+        mock_loom = server.mock_loom
+        assert mock_loom is not None
+        await mock_loom.request_next_pick()
+        await asyncio.sleep(0.005)
+
+
+async def wait_for_mock_loom(server: LoomServer, old_mock_loom: MockLoom) -> None:
+    async with asyncio.timeout(2):
+        while not (server.loom_connected and server.mock_loom is not old_mock_loom):
+            await asyncio.sleep(0.001)
+
+
+async def record_session(session_path: pathlib.Path, db_path: pathlib.Path) -> None:
+    """Record a session of weaving, with a client and a lost connection."""
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    # Start with a pattern in the database, at pick 3 of repeat 2
+    async with await create_pattern_database(db_path) as db:
+        await db.add_pattern(pattern)
+        await db.update_pick_number(pattern.name, pick_number=3, repeat_number=2)
+
+    async with LoomServer(
+        serial_port="mock",
+        reset_db=False,
+        verbose=False,
+        db_path=db_path,
+        session_path=session_path,
+    ) as server:
+        server.reconnect_initial_delay = 0.001
+        server.reconnect_max_delay = 0.01
+        websocket = ReplayWebSocket()
+        client_task = asyncio.create_task(
+            server.run_client(websocket)  # type: ignore[arg-type]
+        )
+        await weave_picks(server, NUM_PICKS)
+        for command in (
+            dict(type="weave_direction", forward=False),
+            dict(type="jump_to_pick", pick_number=2, repeat_number=5),
+            dict(type="goto_next_pick"),
+            dict(type="weave_direction", forward=True),
+        ):
+            websocket.send_command(json.dumps(command))
+            await asyncio.sleep(0.005)
+        await weave_picks(server, NUM_PICKS)
+
+        # Lose the connection to the loom
+        mock_loom = server.mock_loom
+        assert mock_loom is not None and mock_loom.reply_writer is not None
+        mock_loom.reply_writer.close()
+        await wait_for_mock_loom(server, mock_loom)
+        await weave_picks(server, NUM_PICKS)
+
+        websocket.disconnect()
+        await client_task
+        assert websocket.num_replies > 0
+
+
+def test_record_and_replay() -> None:
+    with tempfile.TemporaryDirectory() as tempdir:
+        session_path = pathlib.Path(tempdir) / "session.bin"
+        asyncio.run(
+            record_session(
+                session_path=session_path,
+                db_path=pathlib.Path(tempdir) / "database.sqlite",
+            )
+        )
+        paths = get_session_paths(session_path)
+        records = [record for path in paths for record in read_session_file(path)]
+        record_types = {record.record_type for record in records}
+        assert record_types == set(RecordType)
+        assert records[0].record_type == RecordType.PATTERN
+        pattern_dict = json.loads(records[0].data)
+        assert (pattern_dict["pick_number"], pattern_dict["repeat_number"]) == (3, 2)
+        num_loom_commands = sum(
+            record.data.count(b"\r")
+            for record in records
+            if record.record_type == RecordType.LOOM_COMMAND
+        )
+        assert num_loom_commands > NUM_PICKS * 2
+
+        for speed in (None, 2):
+            report = run_replay(paths, speed=speed)
+            assert report.loom_commands_match, report.format()
+            assert report.num_loom_commands == num_loom_commands
+            assert report.num_replayed_loom_commands == num_loom_commands
+            assert report.num_dropped_loom_data == 0
+            assert report.num_unknown_client_records == 0
+            assert report.num_replayed_client_replies > 0
+            if speed is not None:
+                assert report.real_duration > report.recorded_duration / speed
+
+
+def test_replay_invalid_speed() -> None:
+    for speed in (0, -1):
+        with pytest.raises(ValueError):
+            run_replay([], speed=speed)
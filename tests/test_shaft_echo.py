@@ -0,0 +1,152 @@
+import asyncio
+import contextlib
+import pathlib
+import tempfile
+from collections.abc import AsyncIterator
+
+from seguin_loom_server.client_replies import MessageSeverityEnum
+from seguin_loom_server.loom_server import LoomServer
+from seguin_loom_server.mock_loom import MockLoom
+from seguin_loom_server.reduced_pattern import (
+    read_full_pattern,
+    reduced_pattern_from_pattern_data,
+)
+
+datadir = pathlib.Path(__file__).parent / "data"
+
+# Short echo timeout (sec), to speed up the tests
+SHAFT_ECHO_TIMEOUT = 0.02
+
+
+@contextlib.asynccontextmanager
+async def create_loom_server() -> AsyncIterator[tuple[LoomServer, list]]:
+    """Create a LoomServer with a mock loom and a selected pattern.
+
+    Return the server and a list of reported (message, severity)
+    command problems.
+    """
+    pattern_path = next(datadir.glob("*.wif"))
+    pattern = reduced_pattern_from_pattern_data(
+        name=pattern_path.name, data=read_full_pattern(pattern_path)
+    )
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as f:
+        async with LoomServer(
+            serial_port="mock",
+            reset_db=False,
+            verbose=False,
+            db_path=pathlib.Path(f.name),
+        ) as server:
+            server.shaft_echo_timeout = SHAFT_ECHO_TIMEOUT
+            await server.add_pattern(pattern)
+            await server.select_pattern(pattern.name)
+            problems: list[tuple[str, MessageSeverityEnum]] = []
+
+            async def record_command_problem(
+                message: str, severity: MessageSeverityEnum
+            ) -> None:
+                problems.append((message, severity))
+
+            server.report_command_problem = record_command_problem  # type: ignore
+            yield server, problems
+
+
+async def request_pick(server: LoomServer) -> MockLoom:
+    """Make the mock loom request the next pick; wait for the =C command.
+
+    Return the mock loom.
+    """
+    mock_loom = server.mock_loom
+    assert mock_loom is not None
+    mock_loom.weave_cycle_completed = True
+    await mock_loom.report_state()
+    async with asyncio.timeout(1):
+        while mock_loom.weave_cycle_completed:
+            await asyncio.sleep(0)
+    return mock_loom
+
+
+async def wait_for_acknowledgement(server: LoomServer) -> None:
+    async with asyncio.timeout(1):
+        while server.unacknowledged_shaft_commands:
+            await asyncio.sleep(0.001)
+
+
+async def test_shaft_echo() -> None:
+    async with create_loom_server() as (server, problems):
+        histogram = server.latency_stats.histograms["shaft_echo"]
+        for i in range(5):
+            await request_pick(server)
+            await wait_for_acknowledgement(server)
+            assert histogram.count == i + 1
+        await asyncio.sleep(SHAFT_ECHO_TIMEOUT * 2)
+        assert server.num_shaft_echo_mismatches == 0
+        assert server.num_shaft_command_retries == 0
+        assert problems == []
+
+
+async def test_shaft_echo_mismatch() -> None:
+    async with create_loom_server() as (server, problems):
+        mock_loom = server.mock_loom
+        assert mock_loom is not None
+
+        async def report_wrong_shafts() -> None:
+            await mock_loom.reply(f"=c{mock_loom.shaft_word ^ 0x1:08x}")
+
+        mock_loom.report_shafts = report_wrong_shafts  # type: ignore
+        await request_pick(server)
+        async with asyncio.timeout(1):
+            while not problems:
+                await asyncio.sleep(0.001)
+        assert server.num_shaft_echo_mismatches == 1
+        message, severity = problems[0]
+        assert "raised shafts" in message
+        assert severity == MessageSeverityEnum.WARNING
+        assert len(server.unacknowledged_shaft_commands) == 1
+
+
+async def test_shaft_echo_retry() -> None:
+    async with create_loom_server() as (server, problems):
+        mock_loom = server.mock_loom
+        assert mock_loom is not None
+        report_shafts = mock_loom.report_shafts
+        num_commands = 0
+
+        async def report_shafts_after_retry() -> None:
+            # Simulate losing the first command
+            nonlocal num_commands
+            num_commands += 1
+            if num_commands > 1:
+                await report_shafts()
+
+        mock_loom.report_shafts = report_shafts_after_retry  # type: ignore
+        await request_pick(server)
+        await wait_for_acknowledgement(server)
+        assert num_commands == 2
+        assert server.num_shaft_command_retries == 1
+        assert server.num_shaft_command_failures == 0
+        assert server.latency_stats.histograms["shaft_echo"].count == 1
+        assert problems == []
+
+
+async def test_shaft_echo_failure() -> None:
+    async with create_loom_server() as (server, problems):
+        mock_loom = server.mock_loom
+        assert mock_loom is not None
+        num_commands = 0
+
+        async def report_nothing() -> None:
+            nonlocal num_commands
+            num_commands += 1
+
+        mock_loom.report_shafts = report_nothing  # type: ignore
+        await request_pick(server)
+        async with asyncio.timeout(1):
+            while not problems:
+                await asyncio.sleep(0.001)
+        assert num_commands == server.max_shaft_command_retries + 1
+        assert server.num_shaft_command_retries == server.max_shaft_command_retries
+        assert server.num_shaft_command_failures == 1
+        message, severity = problems[0]
+        assert "did not acknowledge" in message
+        assert severity == MessageSeverityEnum.ERROR
+        assert not server.unacknowledged_shaft_commands
@@ -0,0 +1,39 @@
+from seguin_loom_server.loom_server import PICK_RATE_INTERVAL
+from seguin_loom_server.soak_simulation import SoakConfig, run_soak_simulation
+
+
+def test_soak_simulation() -> None:
+    # Frequent events, to exercise them in a short run
+    config = SoakConfig(
+        num_picks=2000,
+        num_pattern_picks=50,
+        reversal_interval=600,
+        error_toggle_interval=600,
+        disconnect_interval=1200,
+        num_checkpoints=4,
+    )
+    report = run_soak_simulation(config)
+    assert report.num_bookkeeping_errors == 0, report.errors
+    assert len(report.checkpoints) == 4
+    assert report.checkpoints[-1].num_picks >= config.num_picks
+    # Virtual time passed at roughly the weaving rate (some picks are
+    # quicker, e.g. the loom does not wait to weave pick 0 between repeats)
+    woven_duration = config.num_picks * 60 / config.picks_per_minute
+    assert report.checkpoints[-1].virtual_time > woven_duration / 2
+    assert report.num_reversals > 0
+    assert report.num_error_toggles > 0
+    assert report.num_disconnects > 0
+    assert report.num_loom_connections == report.num_disconnects + 1
+    assert report.num_shaft_echo_mismatches == 0
+    assert report.num_shaft_command_failures == 0
+    # Growth is measured over the last 1500 picks,
+    # so a leak of even one object per pick would exceed these limits
+    assert report.db_growth == 0
+    assert report.object_growth < 500
+    rss_growth = report.rss_growth
+    assert rss_growth is None or rss_growth < 5_000_000
+    assert report.task_growth <= 2
+    # Mostly the times of the picks in the last PICK_RATE_INTERVAL
+    max_recent_picks = config.picks_per_minute * PICK_RATE_INTERVAL / 60
+    assert report.max_num_queued <= max_recent_picks + 10
+    assert report.cpu_time_per_pick > 0
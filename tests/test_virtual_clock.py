@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+from seguin_loom_server.virtual_clock import VirtualClockEventLoop
+
+
+def run_virtual(coro):  # type: ignore
+    with asyncio.Runner(loop_factory=VirtualClockEventLoop) as runner:
+        return runner.run(coro)
+
+
+def test_sleep() -> None:
+    async def sleep_a_long_time() -> float:
+        loop = asyncio.get_running_loop()
+        assert loop.time() == 0
+        for _ in range(1000):
+            await asyncio.sleep(3600)
+        return loop.time()
+
+    start_time = time.monotonic()
+    assert run_virtual(sleep_a_long_time()) == pytest.approx(3600 * 1000)
+    assert time.monotonic() - start_time < 1
+
+
+def test_order() -> None:
+    """Callbacks run in order of virtual time."""
+
+    async def sleep_and_record(delay: float, record: list[float]) -> None:
+        await asyncio.sleep(delay)
+        record.append(asyncio.get_running_loop().time())
+
+    async def run_sleepers() -> list[float]:
+        record: list[float] = []
+        delays = [5, 1, 3, 2, 4]
+        await asyncio.gather(*[sleep_and_record(delay, record) for delay in delays])
+        return record
+
+    assert run_virtual(run_sleepers()) == [1, 2, 3, 4, 5]
+
+
+def test_timeout() -> None:
+    async def time_out() -> float:
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(5):
+                await asyncio.sleep(100)
+        return asyncio.get_running_loop().time()
+
+    assert run_virtual(time_out()) == pytest.approx(5)
+
+
+def test_external_operation() -> None:
+    async def wait_for_thread() -> tuple[float, bool]:
+        loop = asyncio.get_running_loop()
+        assert isinstance(loop, VirtualClockEventLoop)
+        sleep_task = asyncio.create_task(asyncio.sleep(10))
+        with loop.external_operation():
+            await loop.run_in_executor(None, time.sleep, 0.1)
+        # The clock stopped while the thread was working
+        return loop.time(), sleep_task.done()
+
+    virtual_time, sleep_done = run_virtual(wait_for_thread())
+    assert virtual_time == 0
+    assert not sleep_done
+
+
+def test_run_in_executor() -> None:
+    """run_in_executor stops the clock, without external_operation."""
+
+    async def wait_for_executor() -> tuple[float, bool]:
+        loop = asyncio.get_running_loop()
+        assert isinstance(loop, VirtualClockEventLoop)
+        sleep_task = asyncio.create_task(asyncio.sleep(10))
+        await asyncio.to_thread(time.sleep, 0.1)
+        assert loop.num_external_operations == 0
+        return loop.time(), sleep_task.done()
+
+    virtual_time, sleep_done = run_virtual(wait_for_executor())
+    assert virtual_time == 0
+    assert not sleep_done